@@ -3,6 +3,9 @@ import logging
 import fnmatch
 import hashlib
 import os
+import sys
+import threading
+import Queue
 
 from dynamo.core.components.persistency import InventoryStore
 from dynamo.utils.interface.mysql import MySQL
@@ -20,6 +23,11 @@ class MySQLInventoryStore(InventoryStore):
 
         self._mysql = MySQL(config.db_params)
 
+        # Number of connections used to read blocks and replicas in load_data. 1 -> serial load.
+        self.load_concurrency = config.get('load_concurrency', 4)
+        # The dataset id space is split into load_concurrency x ranges_per_connection ranges.
+        self.ranges_per_connection = config.get('ranges_per_connection', 8)
+
         config_path = os.getenv('DYNAMO_SERVER_CONFIG', '/etc/dynamo/fom_config.json')
 
         self.fom_config = Configuration(config_path)
@@ -42,7 +50,7 @@ class MySQLInventoryStore(InventoryStore):
         return True
 
     def new_handle(self): #override
-        config = Configuration(db_params = self._mysql.config())
+        config = Configuration(db_params = self._mysql.config(), load_concurrency = self.load_concurrency, ranges_per_connection = self.ranges_per_connection)
         return MySQLInventoryStore(config)
 
     def get_partitions(self, conditions): #override
@@ -167,6 +175,28 @@ class MySQLInventoryStore(InventoryStore):
 
         return files
 
+    def get_files_for_blocks(self, blocks): #override
+        LOG.debug('Loading files for %d blocks', len(blocks))
+
+        block_files = {}
+        blocks_by_id = {}
+        for block in blocks:
+            block_files[block] = set()
+            if block.id != 0:
+                blocks_by_id[block.id] = block
+
+        if len(blocks_by_id) == 0:
+            return block_files
+
+        fields = ('block_id', 'id', 'size', 'name') + File.checksum_algorithms
+
+        for row in self._mysql.select_many('files', fields, 'block_id', blocks_by_id.keys()):
+            block = blocks_by_id[row[0]]
+            file_id, size, name = row[1:4]
+            block_files[block].add(File(name, block = block, size = size, checksum = row[4:], fid = file_id))
+
+        return block_files
+
     def get_file_id(self, lfn): #override
         LOG.debug('Loading file id for LFN %s', lfn)
 
@@ -195,8 +225,11 @@ class MySQLInventoryStore(InventoryStore):
         reuse_connection_orig = self._mysql.reuse_connection
         self._mysql.reuse_connection = True
 
+        load_start = time.time()
+
         ## Load groups
         LOG.info('Loading groups.')
+        start = time.time()
 
         if group_names is not None:
             # set up a temporary table to be joined with later queries
@@ -207,10 +240,11 @@ class MySQLInventoryStore(InventoryStore):
         id_group_map = {0: inventory.groups[None]}
         num = self._load_groups(inventory, id_group_map, groups_tmp)
 
-        LOG.info('Loaded %d groups.', num)
+        LOG.info('Loaded %d groups in %.1f seconds.', num, time.time() - start)
 
         ## Load sites
         LOG.info('Loading sites.')
+        start = time.time()
 
         if site_names is not None:
             # set up a temporary table to be joined with later queries
@@ -221,7 +255,7 @@ class MySQLInventoryStore(InventoryStore):
         id_site_map = {}
         num = self._load_sites(inventory, id_site_map, sites_tmp)
 
-        LOG.info('Loaded %d sites.', num)
+        LOG.info('Loaded %d sites in %.1f seconds.', num, time.time() - start)
 
         ## Load datasets
         LOG.info('Loading datasets.')
@@ -238,12 +272,20 @@ class MySQLInventoryStore(InventoryStore):
 
         LOG.info('Loaded %d datasets in %.1f seconds.', num, time.time() - start)
 
+        ## Split the dataset id space for parallel loading of blocks and replicas
+        if self.load_concurrency > 1 and groups_tmp is None and sites_tmp is None and datasets_tmp is None:
+            id_ranges = self._make_id_ranges(id_dataset_map)
+            LOG.info('Reading blocks and replicas in %d dataset id ranges over %d connections.', len(id_ranges), self.load_concurrency)
+        else:
+            # temporary tables are only visible to this connection
+            id_ranges = None
+
         ## Load blocks
         LOG.info('Loading blocks.')
         start = time.time()
 
         id_block_maps = {} # {dataset_id: {block_id: block}}
-        num = self._load_blocks(inventory, id_dataset_map, id_block_maps, datasets_tmp)
+        self._load_blocks(inventory, id_dataset_map, id_block_maps, datasets_tmp, id_ranges)
 
         num_blocks = sum(len(m) for m in id_block_maps.itervalues())
 
@@ -255,7 +297,7 @@ class MySQLInventoryStore(InventoryStore):
 
         self._load_replicas(
             inventory, id_group_map, id_site_map, id_dataset_map, id_block_maps,
-            groups_tmp, sites_tmp, datasets_tmp
+            groups_tmp, sites_tmp, datasets_tmp, id_ranges
         )
 
         num_dataset_replicas = 0
@@ -276,6 +318,8 @@ class MySQLInventoryStore(InventoryStore):
 
         self._mysql.reuse_connection = reuse_connection_orig
 
+        LOG.info('Inventory data loaded in %.1f seconds.', time.time() - load_start)
+
     def _load_groups(self, inventory, id_group_map, groups_tmp):
         for group in self._yield_groups(groups_tmp = groups_tmp):
             inventory.groups.add(group)
@@ -305,10 +349,10 @@ class MySQLInventoryStore(InventoryStore):
 
         return len(id_dataset_map)
 
-    def _load_blocks(self, inventory, id_dataset_map, id_block_maps, datasets_tmp):
+    def _load_blocks(self, inventory, id_dataset_map, id_block_maps, datasets_tmp, id_ranges = None):
         _dataset_id = 0
         dataset = None
-        for block in self._yield_blocks(id_dataset_map = id_dataset_map, datasets_tmp = datasets_tmp):
+        for block in self._yield_blocks(id_dataset_map = id_dataset_map, datasets_tmp = datasets_tmp, id_ranges = id_ranges):
             if block.dataset.id != _dataset_id:
                 dataset = block.dataset
                 _dataset_id = dataset.id
@@ -319,7 +363,7 @@ class MySQLInventoryStore(InventoryStore):
 
             id_block_map[block.id] = block
 
-    def _load_replicas(self, inventory, id_group_map, id_site_map, id_dataset_map, id_block_maps, groups_tmp, sites_tmp, datasets_tmp):
+    def _load_replicas(self, inventory, id_group_map, id_site_map, id_dataset_map, id_block_maps, groups_tmp, sites_tmp, datasets_tmp, id_ranges = None):
         sql = 'SELECT dr.`dataset_id`, dr.`site_id`, dr.`growing`, dr.`group_id`, br.`block_id`, br.`group_id`,'
         sql += ' br.`is_custodial`, UNIX_TIMESTAMP(br.`last_update`),'
         if BlockReplica._use_file_ids:
@@ -344,17 +388,23 @@ class MySQLInventoryStore(InventoryStore):
         if datasets_tmp is not None:
             sql += ' INNER JOIN `%s`.`%s` AS dt ON dt.`id` = dr.`dataset_id`' % (self._mysql.scratch_db, datasets_tmp)
 
-        sql += ' ORDER BY dr.`dataset_id`, dr.`site_id`, b.`id`'
+        order_by = ' ORDER BY dr.`dataset_id`, dr.`site_id`, b.`id`'
+
+        if id_ranges is None:
+            rows = self._mysql.xquery(sql + order_by)
+        else:
+            rows = self._xquery_ranges(sql, 'dr.`dataset_id`', order_by, id_ranges)
 
         # Blocks are left joined -> there will be (# sites) x (# blocks) x (# block files) entries per dataset
 
         _dataset_id = 0
         _site_id = 0
         _block_id = 0
+        block_replica_size = 0
         file_ids = []
         dataset_replica = None
         block_replica = None
-        for row in self._mysql.xquery(sql):
+        for row in rows:
             if BlockReplica._use_file_ids:
                 dataset_id, site_id, growing, d_group_id, block_id, b_group_id, b_is_custodial, b_last_update, b_is_complete, file_id, file_size = row
             else:
@@ -375,6 +425,17 @@ class MySQLInventoryStore(InventoryStore):
                 site = id_site_map[site_id]
 
             if dataset_replica is None or dataset is not dataset_replica.dataset or site is not dataset_replica.site:
+                if BlockReplica._use_file_ids and block_replica is not None:
+                    # closing the last block replica of the previous dataset replica
+                    # block replica sizes must be final before the dataset replica is added to the site partitions
+                    if not block_replica_complete:
+                        block_replica.size = block_replica_size
+                        block_replica.file_ids = file_ids
+
+                    block_replica_size = 0
+                    del file_ids[:]
+                    block_replica = None
+
                 if dataset_replica is not None:
                     # previous dataset_replica
                     # add to dataset and site after filling all block replicas
@@ -405,7 +466,7 @@ class MySQLInventoryStore(InventoryStore):
                     # closing the previous block replica
                     if not block_replica_complete:
                         block_replica.size = block_replica_size
-                        block_replica.file_ids = tuple(file_ids)
+                        block_replica.file_ids = file_ids
 
                     block_replica_size = 0
                     del file_ids[:]
@@ -438,13 +499,121 @@ class MySQLInventoryStore(InventoryStore):
 
         # one last bit
 
+        if BlockReplica._use_file_ids and block_replica is not None and not block_replica_complete:
+            block_replica.size = block_replica_size
+            block_replica.file_ids = file_ids
+
         if dataset_replica is not None:
             dataset_replica.dataset.replicas.add(dataset_replica)
             dataset_replica.site.add_dataset_replica(dataset_replica, add_block_replicas = True)
 
-        if BlockReplica._use_file_ids and block_replica is not None and not block_replica_complete:
-            block_replica.size = block_replica_size
-            block_replica.file_ids = tuple(file_ids)
+    def _make_id_ranges(self, id_dataset_map):
+        """
+        Split the dataset ids into ranges with approximately equal numbers of datasets.
+        @param id_dataset_map  {dataset_id: dataset}
+        @return List of (min, max+1) in increasing order.
+        """
+
+        dataset_ids = sorted(id_dataset_map.iterkeys())
+        if len(dataset_ids) == 0:
+            return []
+
+        num_ranges = min(self.load_concurrency * self.ranges_per_connection, len(dataset_ids))
+
+        bounds = [dataset_ids[len(dataset_ids) * i / num_ranges] for i in xrange(num_ranges)]
+        bounds.append(dataset_ids[-1] + 1)
+
+        return zip(bounds[:-1], bounds[1:])
+
+    def _xquery_ranges(self, sql, id_column, order_by, id_ranges):
+        """
+        Run a SELECT separately for each id range over load_concurrency connections in worker threads,
+        and yield the rows in the order of the ranges. Rows are therefore in the same order as in
+        xquery(sql + order_by) if the ordering is primarily by id_column. At most load_concurrency ranges
+        are read ahead of the range being yielded.
+        @param sql        SELECT statement without WHERE and ORDER BY clauses
+        @param id_column  Column to constrain
+        @param order_by   ORDER BY clause
+        @param id_ranges  List of (min, max+1) in increasing order
+        """
+
+        sql += ' WHERE %s >= %%s AND %s < %%s' % (id_column, id_column)
+        sql += order_by
+
+        # one queue of row chunks per range; None marks the end of the range
+        queues = [Queue.Queue() for _ in id_ranges]
+        # a slot is taken before a range is assigned and given back when the range is consumed
+        slots = threading.Semaphore(self.load_concurrency)
+        next_range = [0]
+        assign_lock = threading.Lock()
+        abort = threading.Event()
+
+        chunk_size = 10000
+
+        def read_ranges():
+            mysql = MySQL(self._mysql.config())
+            try:
+                while True:
+                    slots.acquire()
+                    if abort.is_set():
+                        return
+
+                    with assign_lock:
+                        irange = next_range[0]
+                        next_range[0] += 1
+
+                    if irange >= len(id_ranges):
+                        slots.release()
+                        return
+
+                    try:
+                        chunk = []
+                        for row in mysql.xquery(sql, *id_ranges[irange]):
+                            chunk.append(row)
+                            if len(chunk) == chunk_size:
+                                queues[irange].put(chunk)
+                                chunk = []
+                                if abort.is_set():
+                                    return
+    
+                        if len(chunk) != 0:
+                            queues[irange].put(chunk)
+    
+                        queues[irange].put(None)
+                    except:
+                        # pass the exception to the consumer
+                        queues[irange].put(sys.exc_info())
+                        return
+            finally:
+                mysql.close()
+
+        threads = [threading.Thread(target = read_ranges) for _ in xrange(self.load_concurrency)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            for queue in queues:
+                while True:
+                    chunk = queue.get()
+                    if chunk is None:
+                        break
+                    elif type(chunk) is tuple:
+                        raise chunk[0], chunk[1], chunk[2]
+
+                    for row in chunk:
+                        yield row
+
+                slots.release()
+
+        finally:
+            # normal exit or exception in the consumer: release the threads waiting for a slot
+            abort.set()
+            for _ in xrange(len(threads)):
+                slots.release()
+
+            for thread in threads:
+                thread.join()
 
     def _setup_constraints(self, table, names):
         tmp_table = table + '_load'
@@ -837,18 +1006,23 @@ class MySQLInventoryStore(InventoryStore):
 
             yield dataset
 
-    def _yield_blocks(self, id_dataset_map = None, datasets_tmp = None): #override
+    def _yield_blocks(self, id_dataset_map = None, datasets_tmp = None, id_ranges = None): #override
         sql = 'SELECT b.`id`, d.`id`, d.`name`, b.`name`, b.`size`, b.`num_files`, b.`is_open`, UNIX_TIMESTAMP(b.`last_update`) FROM `blocks` AS b'
         sql += ' INNER JOIN `datasets` AS d ON d.`id` = b.`dataset_id`'
 
         if datasets_tmp is not None:
             sql += ' INNER JOIN `%s`.`%s` AS t ON t.`id` = b.`dataset_id`' % (self._mysql.scratch_db, datasets_tmp)
 
-        sql += ' ORDER BY b.`dataset_id`'
+        order_by = ' ORDER BY b.`dataset_id`'
+
+        if id_ranges is None:
+            rows = self._mysql.xquery(sql + order_by)
+        else:
+            rows = self._xquery_ranges(sql, 'b.`dataset_id`', order_by, id_ranges)
 
         _dataset_id = 0
         dataset = None
-        for block_id, dataset_id, dataset_name, name, size, num_files, is_open, last_update in self._mysql.xquery(sql):
+        for block_id, dataset_id, dataset_name, name, size, num_files, is_open, last_update in rows:
             if dataset_id != _dataset_id:
                 _dataset_id = dataset_id
 
@@ -997,7 +1171,7 @@ class MySQLInventoryStore(InventoryStore):
                 if BlockReplica._use_file_ids and block_replica is not None:
                     if not block_replica_complete:
                         block_replica.size = block_replica_size
-                        block_replica.file_ids = tuple(file_ids)
+                        block_replica.file_ids = file_ids
 
                     yield block_replica
 
@@ -1032,7 +1206,7 @@ class MySQLInventoryStore(InventoryStore):
             # if true, we have one last one to yield
             if not block_replica_complete:
                 block_replica.size = block_replica_size
-                block_replica.file_ids = tuple(file_ids)
+                block_replica.file_ids = file_ids
 
             yield block_replica
             
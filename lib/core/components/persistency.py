@@ -19,7 +19,7 @@ class InventoryStore(object):
 
     def __init__(self, config):
         # We need to distinguish server-side storage with storage used by applications
-        # When using server-side applications, we never load files into memory (even as cache).
+        # On the server side, files are only loaded into memory through the block file cache.
         self.server_side = False
 
     def close(self):
@@ -86,6 +86,18 @@ class InventoryStore(object):
         
         raise NotImplementedError('get_files')
 
+    def get_files_for_blocks(self, blocks):
+        """
+        Return the sets of files belonging to multiple blocks. Implementations should load all files
+        with a small number of queries.
+
+        @param blocks  List of Block objects.
+
+        @return {block: set of files}
+        """
+
+        return dict((block, self.get_files(block)) for block in blocks)
+
     def get_file_id(self, lfn):
         """
         Return the id of a file with the given LFN.
@@ -0,0 +1,253 @@
+"""
+Memory-mapped image of the inventory content, from which application subprocesses materialize inventory
+objects on demand instead of working on the object graph inherited from the server. Forked children touch
+the reference counts of every inherited object they visit, which makes the kernel copy the pages and lets
+the memory of long-running children grow to the size of the server. Pages of the image file (placed on a
+tmpfs such as /dev/shm) are never written and stay shared among all readers.
+
+File layout (integers little endian):
+  header (magic, format versions, inventory version, number of datasets and sites, section positions)
+  objects frame: serialization records of groups, sites, and site partitions (with quotas)
+  dataset name column: (num_datasets + 1) offsets into the names section, datasets sorted by name
+  dataset record column: (num_datasets + 1) offsets into the records section
+  records: one frame per dataset with (dataset record, software version id, snapshot.pack_content or None)
+  site column: (num_sites + 1) offsets into the site dataset column
+  site dataset column: indices of the datasets with a replica at each site (sites in the order of the objects frame)
+"""
+
+import os
+import mmap
+import time
+import struct
+import logging
+
+import dynamo.dataformat.serialization as serialization
+from dynamo.dataformat import ObjectError
+import dynamo.core.snapshot as snapshot
+
+LOG = logging.getLogger(__name__)
+
+# Increment when the layout changes
+FORMAT_VERSION = 1
+
+_MAGIC = 'DYNI'
+# magic, image format version, serialization format version, inventory version, num datasets, num sites,
+# positions of objects frame, name column, record column, site column, site dataset column, end of file
+_HEADER = struct.Struct('<4sBBxxQQQQQQQQQ')
+_OFFSET = struct.Struct('<Q')
+_INDEX = struct.Struct('<I')
+
+SEC_GROUP, SEC_SITE, SEC_SITEPARTITION = range(3)
+
+def write(inventory, path, inventory_version):
+    """
+    Write the image of the inventory content to path. The file is written under a temporary name and
+    renamed at the end, so that readers never see a partial image.
+    @param inventory          ObjectRepository
+    @param path               Image file path
+    @param inventory_version  Version number of the content (for the readers to check the freshness)
+    """
+
+    start = time.time()
+
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+
+    try:
+        with open(tmp_path, 'wb') as output:
+            # placeholder; rewritten at the end
+            output.write('\0' * _HEADER.size)
+
+            names = sorted(name for name in inventory.datasets.iterkeys() if name is not None)
+            dataset_indices = dict((name, index) for index, name in enumerate(names))
+
+            objects = []
+            for group in inventory.groups.itervalues():
+                if group.name is not None:
+                    objects.append((SEC_GROUP, serialization.pack(group)))
+
+            sites = list(inventory.sites.itervalues())
+            for site in sites:
+                objects.append((SEC_SITE, serialization.pack(site)))
+
+            for site in sites:
+                for sitepartition in site.partitions.itervalues():
+                    if sitepartition.partition.subpartitions is None:
+                        objects.append((SEC_SITEPARTITION, serialization.pack(sitepartition)))
+
+            objects_pos = output.tell()
+            output.write(serialization.encode_frame(objects))
+
+            name_column_pos = output.tell()
+            _write_column(output, name_column_pos + _OFFSET.size * (len(names) + 1), names)
+            for name in names:
+                output.write(name)
+
+            records = []
+            for name in names:
+                dataset = inventory.datasets[name]
+                if len(dataset.blocks) == 0 and len(dataset.replicas) == 0:
+                    content = None
+                else:
+                    content = snapshot.pack_content(dataset)
+
+                records.append(serialization.encode_frame([(serialization.pack(dataset), dataset._software_version_id, content)]))
+
+            record_column_pos = output.tell()
+            _write_column(output, record_column_pos + _OFFSET.size * (len(records) + 1), records)
+            for record in records:
+                output.write(record)
+
+            del records
+
+            site_datasets = []
+            for site in sites:
+                site_datasets.append(sorted(dataset_indices[replica.dataset.name] for replica in site.dataset_replicas()))
+
+            site_column_pos = output.tell()
+            site_dataset_column_pos = site_column_pos + _OFFSET.size * (len(sites) + 1)
+            offset = site_dataset_column_pos
+            for indices in site_datasets:
+                output.write(_OFFSET.pack(offset))
+                offset += _INDEX.size * len(indices)
+            output.write(_OFFSET.pack(offset))
+
+            for indices in site_datasets:
+                output.write(struct.pack('<%dI' % len(indices), *indices))
+
+            end_pos = output.tell()
+
+            output.seek(0)
+            output.write(_HEADER.pack(_MAGIC, FORMAT_VERSION, serialization.FORMAT_VERSION, inventory_version, len(names), len(sites),
+                objects_pos, name_column_pos, record_column_pos, site_column_pos, site_dataset_column_pos, end_pos))
+
+        os.rename(tmp_path, path)
+
+    except:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+        raise
+
+    LOG.info('Wrote inventory image %s (version %d) in %.1f seconds.', path, inventory_version, time.time() - start)
+
+def _write_column(output, offset, entries):
+    """
+    Write the offsets of entries (strings) laid out contiguously from offset.
+    """
+
+    offsets = []
+    for entry in entries:
+        offsets.append(offset)
+        offset += len(entry)
+    offsets.append(offset)
+
+    output.write(struct.pack('<%dQ' % len(offsets), *offsets))
+
+
+class InventoryImage(object):
+    """
+    Read access to an image file. The file is mapped read-only; the objects are decoded from the mapped
+    pages on each call.
+    """
+
+    class NameColumn(object):
+        """
+        Sorted sequence of the dataset names (supports len, indexing, and bisect).
+        """
+
+        def __init__(self, image):
+            self._image = image
+
+        def __len__(self):
+            return self._image.num_datasets
+
+        def __getitem__(self, index):
+            if type(index) is slice:
+                return [self[i] for i in xrange(*index.indices(len(self)))]
+
+            if index < 0:
+                index += len(self)
+            if index < 0 or index >= len(self):
+                raise IndexError('Dataset index out of range')
+
+            return self._image._entry(self._image._name_column_pos, index)
+
+    def __init__(self, path):
+        """
+        @param path  Image file path
+        """
+
+        self.path = path
+
+        with open(path, 'rb') as source:
+            self._map = mmap.mmap(source.fileno(), 0, access = mmap.ACCESS_READ)
+
+        if len(self._map) < _HEADER.size:
+            raise ObjectError('Truncated inventory image %s' % path)
+
+        magic, version, serialization_version, self.version, self.num_datasets, self.num_sites, \
+            self._objects_pos, self._name_column_pos, self._record_column_pos, self._site_column_pos, \
+            self._site_dataset_column_pos, end_pos = _HEADER.unpack_from(self._map, 0)
+
+        if magic != _MAGIC:
+            raise ObjectError('Invalid inventory image %s' % path)
+        if version != FORMAT_VERSION or serialization_version != serialization.FORMAT_VERSION:
+            raise ObjectError('Inventory image format version %d.%d is not supported' % (version, serialization_version))
+        if end_pos != len(self._map):
+            raise ObjectError('Truncated inventory image %s' % path)
+
+        self.names = InventoryImage.NameColumn(self)
+
+    def close(self):
+        self._map.close()
+
+    def objects(self):
+        """
+        @return List of (section, record) for groups, sites, and site partitions
+        """
+
+        return serialization.decode_frame(self._map[self._objects_pos:self._name_column_pos])
+
+    def find(self, name):
+        """
+        @param name  Dataset name
+        @return Index of the dataset or -1 if not in the image.
+        """
+
+        lo = 0
+        hi = self.num_datasets
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.names[mid] < name:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo != self.num_datasets and self.names[lo] == name:
+            return lo
+        else:
+            return -1
+
+    def dataset(self, index):
+        """
+        @param index  Dataset index
+        @return (dataset record, software version id, content) where content is a snapshot.pack_content
+                return value or None
+        """
+
+        return serialization.decode_frame(self._entry(self._record_column_pos, index))[0]
+
+    def site_datasets(self, isite):
+        """
+        @param isite  Index of the site in the objects frame
+        @return Indices of the datasets with a replica at the site
+        """
+
+        begin, end = struct.unpack_from('<2Q', self._map, self._site_column_pos + _OFFSET.size * isite)
+        return struct.unpack_from('<%dI' % ((end - begin) / _INDEX.size), self._map, begin)
+
+    def _entry(self, column_pos, index):
+        begin, end = struct.unpack_from('<2Q', self._map, column_pos + _OFFSET.size * index)
+        return self._map[begin:end]
@@ -1,19 +1,389 @@
 import logging
 import re
+import fnmatch
+import bisect
 
 from dynamo.policy.condition import Condition
 from dynamo.policy.variables import replica_variables
 import dynamo.dataformat as df
+import dynamo.dataformat.serialization as serialization
 from dynamo.core.components.persistency import InventoryStore
+import dynamo.core.snapshot as snapshot
+import dynamo.core.image as imagefile
+from dynamo.core.statcube import InventoryStatCube
 
 LOG = logging.getLogger(__name__)
 
+def _parse_pattern(pattern):
+    """
+    @return (literal prefix of the pattern, match function of the full pattern or None if the pattern is prefix*)
+    """
+
+    prefix_len = len(pattern)
+    for wildcard in '*?[':
+        pos = pattern.find(wildcard)
+        if pos != -1 and pos < prefix_len:
+            prefix_len = pos
+
+    prefix = pattern[:prefix_len]
+
+    if pattern == prefix + '*':
+        # pure prefix search
+        match = None
+    else:
+        match = re.compile(fnmatch.translate(pattern)).match
+
+    return prefix, match
+
+def _match_sorted(names, prefix, match):
+    """
+    @param names   Sorted sequence of names
+    @param prefix  Names must start with this string
+    @param match   Match function for the names with the prefix, or None
+    @return List of matching names
+    """
+
+    # range of names starting with the prefix
+    if prefix:
+        start = bisect.bisect_left(names, prefix)
+        if ord(prefix[-1]) < 255:
+            end = bisect.bisect_left(names, prefix[:-1] + chr(ord(prefix[-1]) + 1), start)
+        else:
+            end = len(names)
+            while end > start and not names[end - 1].startswith(prefix):
+                end -= 1
+        candidates = names[start:end]
+    else:
+        candidates = names
+
+    if match is None:
+        return list(candidates)
+    else:
+        return [name for name in candidates if match(name)]
+
 class NameKeyDict(dict):
-    __slots__ = []
+    """
+    Dict of objects keyed by name, with a sorted index of the names for wildcard searches. The index is
+    built by build_index() (or at the first search) and kept up to date by the modifications: new names
+    are collected and merged into the sorted list in batches, and removed names are dropped lazily.
+    Forked processes (web server children) inherit the index ready for use.
+    """
+
+    __slots__ = ['_names', '_new_names', '_num_removed']
+
+    # Merge the new names into the index when this many have been collected
+    MERGE_THRESHOLD = 1000
 
     def add(self, obj):
         self[obj.name] = obj
 
+    def __setitem__(self, key, value):
+        if key not in self and key is not None:
+            try:
+                self._new_names.append(key)
+            except AttributeError:
+                pass
+            else:
+                if len(self._new_names) > NameKeyDict.MERGE_THRESHOLD:
+                    self._merge_index()
+
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._removed()
+
+    def pop(self, key, *default):
+        if key in self:
+            value = dict.pop(self, key)
+            self._removed()
+            return value
+        else:
+            return dict.pop(self, key, *default)
+
+    def clear(self):
+        dict.clear(self)
+        self._drop_index()
+
+    # Bulk modifications drop the index, to be rebuilt at the next search
+
+    def popitem(self):
+        self._drop_index()
+        return dict.popitem(self)
+
+    def update(self, *args, **kwd):
+        self._drop_index()
+        dict.update(self, *args, **kwd)
+
+    def setdefault(self, key, default = None):
+        self._drop_index()
+        return dict.setdefault(self, key, default)
+
+    def build_index(self):
+        """
+        (Re)build the sorted name index.
+        """
+
+        self._names = sorted(key for key in self.iterkeys() if key is not None)
+        self._new_names = []
+        self._num_removed = 0
+
+    def match(self, pattern):
+        """
+        Find the keys matching a shell-style wildcard pattern. The literal prefix of the pattern
+        (up to the first wildcard character) is looked up in the sorted index, and only the names
+        starting with the prefix are matched against the full pattern.
+        @param pattern  Pattern (fnmatch syntax, case sensitive) or a plain name
+
+        @return Sorted list of matching keys
+        """
+
+        prefix, match = _parse_pattern(pattern)
+
+        if prefix == pattern:
+            # not a pattern
+            if pattern in self:
+                return [pattern]
+            else:
+                return []
+
+        try:
+            if len(self._new_names) != 0:
+                self._merge_index()
+        except AttributeError:
+            self.build_index()
+
+        result = _match_sorted(self._names, prefix, match)
+
+        if self._num_removed != 0:
+            # drop the removed names and duplicates of names re-added after removal
+            filtered = []
+            last = None
+            for name in result:
+                if name != last and name in self:
+                    filtered.append(name)
+                last = name
+
+            result = filtered
+
+        return result
+
+    def _merge_index(self):
+        # The list is sorted except for the tail; sort() merges the two runs in about linear time
+        self._names.extend(self._new_names)
+        self._names.sort()
+        self._new_names = []
+
+    def _removed(self):
+        try:
+            self._num_removed += 1
+        except AttributeError:
+            return
+
+        if self._num_removed > len(self._names) / 4 + NameKeyDict.MERGE_THRESHOLD:
+            # compact (also removes duplicates of re-added names)
+            self._merge_index()
+            names = []
+            last = None
+            for name in self._names:
+                if name != last and name in self:
+                    names.append(name)
+                last = name
+
+            self._names = names
+            self._num_removed = 0
+
+    def _drop_index(self):
+        try:
+            del self._names
+            del self._new_names
+            del self._num_removed
+        except AttributeError:
+            pass
+
+
+class ImageDatasetDict(NameKeyDict):
+    """
+    Dataset dict of an ImageInventory. Datasets in the inventory image are materialized at the first
+    access by name or by iteration; datasets added afterwards are held as in a NameKeyDict. The dict proper
+    contains only the materialized datasets, and the other methods account for the rest of the image.
+    """
+
+    __slots__ = ['_inventory', '_image', '_state', '_num_unloaded', '_added']
+
+    # States of the image entries
+    UNLOADED, LOADED, DELETED = range(3)
+
+    def __init__(self, inventory, image):
+        dict.__init__(self)
+
+        self._inventory = inventory
+        self._image = image
+        self._state = bytearray(image.num_datasets)
+        self._num_unloaded = image.num_datasets
+        # names of the datasets not in the image
+        self._added = set()
+
+    def __getitem__(self, key):
+        try:
+            return dict.__getitem__(self, key)
+        except KeyError:
+            index = self._unloaded_index(key)
+            if index == -1:
+                raise
+
+            return self._inventory._load_dataset(index)
+
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or self._unloaded_index(key) != -1
+
+    def has_key(self, key):
+        return key in self
+
+    def __len__(self):
+        return dict.__len__(self) + self._num_unloaded
+
+    def __iter__(self):
+        names = self._image.names
+        state = self._state
+        for index in xrange(len(state)):
+            if state[index] != ImageDatasetDict.DELETED:
+                yield names[index]
+
+        for key in list(self._added):
+            if dict.__contains__(self, key):
+                yield key
+
+    def iterkeys(self):
+        return iter(self)
+
+    def keys(self):
+        return list(self)
+
+    def iteritems(self):
+        for key in self:
+            try:
+                yield key, self[key]
+            except KeyError:
+                # deleted during the iteration
+                pass
+
+    def items(self):
+        return list(self.iteritems())
+
+    def itervalues(self):
+        for key, value in self.iteritems():
+            yield value
+
+    def values(self):
+        return list(self.itervalues())
+
+    def __setitem__(self, key, value):
+        if not dict.__contains__(self, key):
+            index = self._image.find(key)
+            if index == -1:
+                self._added.add(key)
+            else:
+                if self._state[index] == ImageDatasetDict.UNLOADED:
+                    self._num_unloaded -= 1
+                self._state[index] = ImageDatasetDict.LOADED
+
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self.pop(key)
+
+    def pop(self, key, *default):
+        try:
+            # materialize first if in the image
+            self[key]
+        except KeyError:
+            return dict.pop(self, key, *default)
+
+        value = dict.pop(self, key)
+
+        index = self._image.find(key)
+        if index == -1:
+            self._added.discard(key)
+        else:
+            self._state[index] = ImageDatasetDict.DELETED
+
+        return value
+
+    def clear(self):
+        dict.clear(self)
+        self._state = bytearray([ImageDatasetDict.DELETED] * len(self._state))
+        self._num_unloaded = 0
+        self._added.clear()
+
+    def popitem(self):
+        for key in self:
+            return key, self.pop(key)
+
+        raise KeyError('popitem(): dictionary is empty')
+
+    def update(self, *args, **kwd):
+        for key, value in dict(*args, **kwd).iteritems():
+            self[key] = value
+
+    def setdefault(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            self[key] = default
+            return default
+
+    def build_index(self):
+        # the image has its own sorted name column
+        pass
+
+    def match(self, pattern):
+        """
+        Same as NameKeyDict.match, using the name column of the image.
+        """
+
+        prefix, match = _parse_pattern(pattern)
+
+        if prefix == pattern:
+            if pattern in self:
+                return [pattern]
+            else:
+                return []
+
+        state = self._state
+        find = self._image.find
+        result = [name for name in _match_sorted(self._image.names, prefix, match) if state[find(name)] != ImageDatasetDict.DELETED]
+
+        if len(self._added) != 0:
+            result.extend(_match_sorted(sorted(self._added), prefix, match))
+            result.sort()
+
+        return result
+
+    def _unloaded_index(self, key):
+        """
+        @return Index of the dataset in the image if it is not materialized yet, -1 otherwise.
+        """
+
+        if not isinstance(key, basestring) or self._num_unloaded == 0:
+            return -1
+
+        index = self._image.find(key)
+        if index != -1 and self._state[index] == ImageDatasetDict.UNLOADED:
+            return index
+        else:
+            return -1
+
+    def _loaded(self, index):
+        self._state[index] = ImageDatasetDict.LOADED
+        self._num_unloaded -= 1
+
 
 class ObjectRepository(object):
     """Base class of the inventory which is just a bundle of dicts"""
@@ -29,12 +399,30 @@ class ObjectRepository(object):
         # This base class does not actually have a persistency store
         self._store = None
 
+        # Aggregate statistics; set and built by inventories that keep one
+        self.stat_cube = None
+
     def update(self, obj):
-        return obj.embed_into(self)
+        if self.stat_cube is None:
+            return obj.embed_into(self)
+
+        state = self.stat_cube.pre_update(self, obj)
+        embedded_clone = obj.embed_into(self)
+        self.stat_cube.post_update(self, obj, state)
+
+        return embedded_clone
 
     def delete(self, obj):
         try:
-            return obj.unlink_from(self)
+            if self.stat_cube is None:
+                return obj.unlink_from(self)
+
+            state = self.stat_cube.pre_delete(self, obj)
+            deleted_object = obj.unlink_from(self)
+            self.stat_cube.post_delete(self, obj, state)
+
+            return deleted_object
+
         except (KeyError, df.ObjectError) as e:
             # When delete is attempted on a nonexistent object or something linked to a nonexistent object
             # As this is less alarming, error message is suppressed to debug level.
@@ -97,9 +485,13 @@ class DynamoInventoryProxy(ObjectRepository):
         self._store = inventory.new_store_handle()
         self._store.server_side = False
         df.Block.inventory_store = self._store
+        df.Block.files_cache.reset_lock()
+
+        # Changes made through the proxy are not reflected in the statistics
+        self.stat_cube = None
 
         # When the user application is authorized to change the inventory state, all updated
-        # and deleted objects are kept in this list until the end of execution.
+        # and deleted objects are kept in this list (as serialization records) until the end of execution.
         self._update_commands = None
 
     def update(self, obj): #override
@@ -122,14 +514,14 @@ class DynamoInventoryProxy(ObjectRepository):
 
     def register_update(self, obj): #override
         """
-        Put the text representation of obj to _update_commands.
+        Put the serialized representation of obj to _update_commands.
         """
 
         if self._update_commands is None:
             return
 
         LOG.debug('%s has changed. Adding a clone to updated objects list.', str(obj))
-        self._update_commands.append((DynamoInventory.CMD_UPDATE, repr(obj)))
+        self._update_commands.append((DynamoInventory.CMD_UPDATE, serialization.pack(obj)))
 
     def delete(self, obj): #override
         """
@@ -145,7 +537,7 @@ class DynamoInventoryProxy(ObjectRepository):
 
         if self._update_commands is not None:
             LOG.debug('%s is deleted.', str(obj))
-            self._update_commands.append((DynamoInventory.CMD_DELETE, repr(deleted_object)))
+            self._update_commands.append((DynamoInventory.CMD_DELETE, serialization.pack(deleted_object)))
 
         return deleted_object
 
@@ -159,6 +551,190 @@ class DynamoInventoryProxy(ObjectRepository):
             self._update_commands = []
 
 
+class ReadOnlyInventoryProxy(DynamoInventoryProxy):
+    """
+    Inventory given to web modules that are not write-enabled. The objects are those of the inventory image
+    of the web server process, which is shared by all requests the process serves. update, delete, and
+    register_update raise. Direct modifications of the objects (attribute assignments, changes of the replica
+    sets etc.) are not detected; the web server therefore keeps a process serving further requests only after
+    modules marked side_effect_free.
+    """
+
+    def __init__(self, inventory):
+        DynamoInventoryProxy.__init__(self, inventory)
+
+        # Nothing changes through this proxy; the statistics of the inventory image are valid
+        self.stat_cube = inventory.stat_cube
+
+    def update(self, obj): #override
+        raise RuntimeError('Inventory update attempted by a read-only web module')
+
+    def delete(self, obj): #override
+        raise RuntimeError('Inventory deletion attempted by a read-only web module')
+
+    def register_update(self, obj): #override
+        raise RuntimeError('Inventory update attempted by a read-only web module')
+
+
+# Slot descriptors of Site, wrapped by ImageSite
+_site_dataset_replicas = df.Site.__dict__['_dataset_replicas']
+_site_partitions = df.Site.__dict__['partitions']
+
+class ImageSite(df.Site):
+    """
+    Site of an ImageInventory. The dataset replicas and the site partitions of a site are complete only
+    after all datasets with a replica at the site are materialized, which is done at the first access to
+    either member.
+    """
+
+    __slots__ = ['_image_inventory', '_image_index', '_loaded']
+
+    def __init__(self, inventory, index, site):
+        """
+        @param inventory  ImageInventory
+        @param index      Index of the site in the image
+        @param site       Unlinked site unpacked from the image
+        """
+
+        df.Site.__init__(self, site.name, sid = site.id)
+        self.copy(site)
+
+        self._image_inventory = inventory
+        self._image_index = index
+        self._loaded = False
+
+    def _get_dataset_replicas(self):
+        self._load()
+        return _site_dataset_replicas.__get__(self)
+
+    def _set_dataset_replicas(self, value):
+        _site_dataset_replicas.__set__(self, value)
+
+    _dataset_replicas = property(_get_dataset_replicas, _set_dataset_replicas)
+
+    def _get_partitions(self):
+        self._load()
+        return _site_partitions.__get__(self)
+
+    def _set_partitions(self, value):
+        _site_partitions.__set__(self, value)
+
+    partitions = property(_get_partitions, _set_partitions)
+
+    def find_dataset_replica(self, dataset, must_find = False): #override
+        # A materialized dataset has all its replicas linked to the sites; no need to load the site.
+        try:
+            return _site_dataset_replicas.__get__(self)[dataset]
+        except KeyError:
+            if must_find:
+                raise df.ObjectError('Could not find replica of %s in %s' % (dataset.name, self._name))
+            else:
+                return None
+
+    def _load(self):
+        # Sites are filled while a dataset is being materialized; the dataset replica lists are
+        # then not needed in full.
+        if self._loaded or self._image_inventory._loading:
+            return
+
+        self._loaded = True
+        self._image_inventory._load_site(self)
+
+
+class ImageInventory(ObjectRepository):
+    """
+    Inventory content materialized from an inventory image (see core.image) on demand. Groups, sites, and
+    site partitions are created at construction; datasets with their blocks and replicas are created
+    at the first access (see ImageDatasetDict and ImageSite). Used in the application subprocesses instead
+    of the object graph inherited from the server, so that the pages of the server process are not touched.
+    """
+
+    def __init__(self, inventory, image):
+        """
+        @param inventory  DynamoInventory of the server (provides the partitions and the store)
+        @param image      core.image.InventoryImage
+        """
+
+        ObjectRepository.__init__(self)
+
+        self._base = inventory
+        self._image = image
+
+        # True while objects are being created from the image
+        self._loading = True
+
+        self.partitions = inventory.partitions
+        self.datasets = ImageDatasetDict(self, image)
+
+        isite = 0
+        for section, record in image.objects():
+            if section == imagefile.SEC_GROUP:
+                self.groups.add(serialization.unpack(record))
+
+            elif section == imagefile.SEC_SITE:
+                site = ImageSite(self, isite, serialization.unpack(record))
+                isite += 1
+                self.sites.add(site)
+
+                for partition in self.partitions.itervalues():
+                    site.partitions[partition] = df.SitePartition(site, partition)
+
+            elif section == imagefile.SEC_SITEPARTITION:
+                sitepartition = serialization.unpack(record)
+                site = self.sites[sitepartition._site_name()]
+                try:
+                    partition = self.partitions[sitepartition._partition_name()]
+                except KeyError:
+                    continue
+
+                site.partitions[partition].set_quota(sitepartition._quota)
+
+        self._loading = False
+
+        self.groups.build_index()
+        self.sites.build_index()
+
+        # Image content is not aggregated
+        self.stat_cube = None
+
+    def new_store_handle(self):
+        return self._base.new_store_handle()
+
+    def _load_dataset(self, index):
+        """
+        Create the dataset at index of the image together with its blocks and replicas.
+        @return The dataset
+        """
+
+        record, software_version_id, content = self._image.dataset(index)
+
+        dataset = serialization.unpack(record)
+        dataset._software_version_id = software_version_id
+
+        dict.__setitem__(self.datasets, dataset.name, dataset)
+        self.datasets._loaded(index)
+
+        if content is not None:
+            loading = self._loading
+            self._loading = True
+            try:
+                snapshot.unpack_content(self, content)
+            finally:
+                self._loading = loading
+
+        return dataset
+
+    def _load_site(self, site):
+        """
+        Materialize all datasets with a replica at the site.
+        """
+
+        state = self.datasets._state
+        for index in self._image.site_datasets(site._image_index):
+            if state[index] == ImageDatasetDict.UNLOADED:
+                self._load_dataset(index)
+
+
 class DynamoInventory(ObjectRepository):
     """
     Inventory class. ObjectRepository with a persistent store backend.
@@ -188,6 +764,11 @@ class DynamoInventory(ObjectRepository):
 
         self.partition_def_path = config.partition_def_path
 
+        # Path of the on-disk snapshot of the inventory content. None -> no snapshot
+        self.snapshot_path = config.get('snapshot_path', None)
+
+        self.stat_cube = InventoryStatCube()
+
     def init_store(self, module, config):
         if self._store:
             self._store.close()
@@ -220,8 +801,16 @@ class DynamoInventory(ObjectRepository):
     def new_store_handle(self):
         return self._store.new_handle()
 
-    def create_proxy(self):
-        return DynamoInventoryProxy(self)
+    def create_proxy(self, image = None):
+        """
+        @param image  If given, a core.image.InventoryImage of the current content. The proxy then
+                      materializes the objects from the image instead of using this inventory.
+        """
+
+        if image is None:
+            return DynamoInventoryProxy(self)
+        else:
+            return DynamoInventoryProxy(ImageInventory(self, image))
 
     def load(self, groups = (None, None), sites = (None, None), datasets = (None, None)):
         """
@@ -231,24 +820,14 @@ class DynamoInventory(ObjectRepository):
         @param datasets 2-tuple (included, excluded)
         """
 
-        self.loaded = False
-        
-        self.groups.clear()
-        self.groups[None] = df.Group.null_group
-        self.sites.clear()
-        self.datasets.clear()
-        self.partitions.clear()
-
-        LOG.info('Setting up partitions.')
-
-        self._load_partitions()
-
-        LOG.info('Loading data from persistent storage.')
-
         group_names = self._get_group_names(*groups)
         site_names = self._get_site_names(*sites)
         dataset_names = self._get_dataset_names(*datasets)
 
+        self._reset()
+
+        LOG.info('Loading data from persistent storage.')
+
         self._store.load_data(
             self,
             group_names = group_names,
@@ -265,8 +844,79 @@ class DynamoInventory(ObjectRepository):
 
         LOG.info('Data is loaded to memory. %d groups, %d sites, %d datasets, %d dataset replicas, %d block replicas.\n', len(self.groups), len(self.sites), len(self.datasets), num_dataset_replicas, num_block_replicas)
 
+        self._build_name_indices()
+        self.stat_cube.build(self)
+
         self.loaded = True
 
+    def snapshot_version(self):
+        """
+        @return Store version of the on-disk snapshot, or None if there is no usable snapshot.
+        """
+
+        if self.snapshot_path is None:
+            return None
+
+        return snapshot.read_version(self.snapshot_path)
+
+    def load_snapshot(self):
+        """
+        Load inventory content from the on-disk snapshot instead of the persistency store.
+        Caller is responsible for checking that the snapshot version matches the store.
+        """
+
+        self._reset()
+
+        LOG.info('Loading data from snapshot %s.', self.snapshot_path)
+
+        snapshot.load(self, self.snapshot_path)
+
+        LOG.info('Data is loaded to memory. %d groups, %d sites, %d datasets.\n', len(self.groups), len(self.sites), len(self.datasets))
+
+        self._build_name_indices()
+        self.stat_cube.build(self)
+
+        self.loaded = True
+
+    def write_snapshot(self, store_version):
+        """
+        Write the inventory content to the on-disk snapshot.
+        @param store_version  Store version corresponding to the current content.
+        """
+
+        snapshot.write(self, self.snapshot_path, store_version)
+
+    def write_image(self, path, version):
+        """
+        Write the inventory image for the application subprocesses.
+        @param path     Image file path
+        @param version  Version number of the current content
+        """
+
+        imagefile.write(self, path, version)
+
+    def _reset(self):
+        """Clear the content and set up the partitions."""
+
+        self.loaded = False
+        self.stat_cube.clear()
+        
+        self.groups.clear()
+        self.groups[None] = df.Group.null_group
+        self.sites.clear()
+        self.datasets.clear()
+        self.partitions.clear()
+
+        LOG.info('Setting up partitions.')
+
+        self._load_partitions()
+
+    def _build_name_indices(self):
+        """Build the name indices in the server process, so that the forked processes inherit them."""
+
+        for objects in [self.groups, self.sites, self.datasets, self.partitions]:
+            objects.build_index()
+
     def _load_partitions(self):
         """Load partition data from a text table."""
 
@@ -385,6 +1035,10 @@ class DynamoInventory(ObjectRepository):
                 LOG.error('Exception writing %s to inventory store', str(obj))
                 raise
 
+        if type(embedded_clone) is df.File:
+            # the file set of the block may have been cached from the store before the write
+            df.Block.files_cache.pop(embedded_clone.block)
+
         return embedded_clone
 
     def delete(self, obj): #override
@@ -406,4 +1060,7 @@ class DynamoInventory(ObjectRepository):
                 LOG.error('Exception writing deletion of %s to inventory store', str(obj))
                 raise
 
+        if type(deleted_object) is df.File:
+            df.Block.files_cache.pop(deleted_object.block)
+
         return deleted_object
@@ -4,15 +4,16 @@ import shutil
 import time
 import logging
 import signal
+import gc
 import code
 import hashlib
 import multiprocessing
 import threading
-import Queue
 import traceback
 import shlex
 
 from dynamo.core.inventory import DynamoInventory
+from dynamo.core.image import InventoryImage
 from dynamo.core.manager import ServerManager
 import dynamo.core.serverutils as serverutils
 from dynamo.core.components.appserver import AppServer
@@ -21,7 +22,8 @@ from dynamo.core.components.appmanager import AppManager
 from dynamo.web.server import WebServer
 from dynamo.utils.log import log_exception, reset_logger
 from dynamo.utils.signaling import SignalBlocker
-from dynamo.dataformat import Configuration
+from dynamo.dataformat import Configuration, ObjectError
+import dynamo.dataformat.serialization as serialization
 
 LOG = logging.getLogger(__name__)
 CHANGELOG = logging.getLogger('changelog')
@@ -29,6 +31,9 @@ CHANGELOG = logging.getLogger('changelog')
 class DynamoServer(object):
     """Main daemon class."""
 
+    # Number of update commands sent in one frame from the child processes
+    update_chunk_size = 10000
+
     def __init__(self, config):
         LOG.info('Initializing Dynamo server %s.', __file__)
 
@@ -76,12 +81,30 @@ class DynamoServer(object):
     
                 self.inventory_load_opts[objs] = (included, excluded)
 
-        ## Queue to send / receive inventory updates
-        self.inventory_update_queue = multiprocessing.JoinableQueue()
+        ## Pipe to send / receive inventory updates (serialized in frames)
+        self.inventory_update_receiver, self.inventory_update_sender = multiprocessing.Pipe(duplex = False)
 
         ## Recipient of error message emails
         self.notification_recipient = config.notification_recipient
 
+        ## Process writing the inventory snapshot and the store version to write when it is busy
+        self.snapshot_writer = None
+        self.pending_snapshot_version = None
+
+        ## Inventory image for the application subprocesses (None -> applications use the server inventory)
+        if self.applications_config.enabled:
+            self.inventory_image_path = self.applications_config.get('inventory_image', '') or None
+        else:
+            self.inventory_image_path = None
+        # Incremented at each change of the inventory content
+        self.inventory_version = 0
+        # Version of the image on disk (None if there is no valid image)
+        self.image_version = None
+        ## Process writing the image, the version it writes, and whether the image must be written again when it finishes
+        self.image_writer = None
+        self.image_writer_version = None
+        self.pending_image = False
+
     def load_inventory(self):
         ## Wait until there is no write process
         while self.manager.master.get_writing_process_id() is not None:
@@ -116,8 +139,20 @@ class DynamoServer(object):
                 # Use this remote store as mine (read-only)
                 self._setup_remote_store(hostname, module, config)
 
-        LOG.info('Loading the inventory.')
-        self.inventory.load(**self.inventory_load_opts)
+        if self._use_snapshot():
+            store_version = self.inventory.store_version()
+        else:
+            store_version = None
+
+        if store_version is not None and self.inventory.snapshot_version() == store_version:
+            LOG.info('Loading the inventory from snapshot.')
+            self.inventory.load_snapshot()
+        else:
+            LOG.info('Loading the inventory.')
+            self.inventory.load(**self.inventory_load_opts)
+
+            if store_version is not None:
+                self._write_snapshot(store_version)
 
         LOG.info('Inventory is ready.')
 
@@ -138,6 +173,14 @@ class DynamoServer(object):
 
             self.load_inventory()
 
+            # Move the loaded objects to the oldest GC generation. Forked processes then run full
+            # collections (which write to every inherited object) only after allocating a sizable fraction
+            # of the inventory anew.
+            gc.collect()
+
+            self.inventory_version += 1
+            self._write_image()
+
             bconf = self.manager_config.board
             self.manager.master.advertise_board(bconf.module, bconf.config)
 
@@ -237,6 +280,9 @@ class DynamoServer(object):
                 ## Step 4 (easier to do here because we use "continue"s)
                 LOG.debug('Read updates')
                 self._read_updates()
+
+                self._check_snapshot_writer()
+                self._check_image_writer()
     
                 ## Step 5 (easier to do here because we use "continue"s)
                 LOG.debug('Collect processes')
@@ -394,6 +440,8 @@ class DynamoServer(object):
                 ## Step 1
                 self._read_updates()
 
+                self._check_snapshot_writer()
+
                 if self.webserver is not None:
                     self._collect_updates_from_web()
     
@@ -512,39 +560,51 @@ class DynamoServer(object):
         update_commands = []
 
         while True:
-            try:
-                # Once we have an item sent, we'll read until the end (EOM).
-                # If the child dies in the middle of messaging, we get out of the while loop by timeout = 60
-                cmd, objstr = self.inventory_update_queue.get(block = reading, timeout = 60)
-            except Queue.Empty:
+            # Once we have a frame sent, we'll read until the end (EOM).
+            # If the child dies in the middle of messaging, we get out of the while loop by timeout = 60
+            if reading:
+                timeout = 60
+            else:
+                timeout = 0
+
+            if not self.inventory_update_receiver.poll(timeout):
                 if reading:
                     # The child process crashed or timed out
                     return 2, update_commands
                 else:
                     return 0, update_commands
-            else:
-                self.inventory_update_queue.task_done()
 
-                reading = True # Now we have to read until the end - start blocking queue.get
+            reading = True # Now we have to read until the end
+
+            try:
+                frame = serialization.decode_frame(self.inventory_update_receiver.recv_bytes())
+            except (EOFError, ObjectError):
+                log_exception(LOG)
+                return 2, update_commands
+
+            for cmd, record in frame:
+                if cmd == DynamoInventory.CMD_EOM:
+                    LOG.info('Received %d updates and %d deletes.', updates_received, deletes_received)
+                    return 1, update_commands
 
                 if LOG.getEffectiveLevel() == logging.DEBUG:
                     if cmd == DynamoInventory.CMD_UPDATE:
-                        LOG.debug('Update %d from queue: %s', updates_received, objstr)
+                        LOG.debug('Update %d from child: %s', updates_received, str(record))
                     elif cmd == DynamoInventory.CMD_DELETE:
-                        LOG.debug('Delete %d from queue: %s', deletes_received, objstr)
+                        LOG.debug('Delete %d from child: %s', deletes_received, str(record))
 
                 if cmd == DynamoInventory.CMD_UPDATE:
                     updates_received += 1
-                    update_commands.append((cmd, objstr))
                 elif cmd == DynamoInventory.CMD_DELETE:
                     deletes_received += 1
-                    update_commands.append((cmd, objstr))
+                else:
+                    continue
 
-                if cmd == DynamoInventory.CMD_EOM or len(update_commands) % print_every == 0:
-                    LOG.info('Received %d updates and %d deletes.', updates_received, deletes_received)
+                # Create a python object from the serialized record
+                update_commands.append((cmd, serialization.unpack(record)))
 
-                if cmd == DynamoInventory.CMD_EOM:
-                    return 1, update_commands
+                if len(update_commands) % print_every == 0:
+                    LOG.info('Received %d updates and %d deletes.', updates_received, deletes_received)
 
     def _collect_updates_from_web(self):
         if self.manager.master.get_writing_process_id() != 0 or self.manager.master.get_writing_process_host() != self.manager.hostname:
@@ -601,16 +661,20 @@ class DynamoServer(object):
         # My updates
         self.manager.set_status(ServerHost.STAT_UPDATING)
 
+        # Representation strings of the applied updates, to be written to the update boards of other servers
+        relayed_commands = []
+
         with SignalBlocker():
-            self._exec_updates(update_commands)
+            self._exec_updates(update_commands, relayed_commands)
 
         self.manager.set_status(ServerHost.STAT_ONLINE)
 
         # Others
-        self.manager.send_updates(update_commands)
+        self.manager.send_updates(relayed_commands)
 
     def _read_updates(self):
-        update_commands = self.manager.get_updates()
+        # Create python objects from the representation strings on the board
+        update_commands = ((cmd, self.inventory.make_object(objstr)) for cmd, objstr in self.manager.get_updates())
 
         num_updates, num_deletes = self._exec_updates(update_commands)
 
@@ -619,34 +683,160 @@ class DynamoServer(object):
             # The server which sent the updates has set this server's status to updating
             self.manager.set_status(ServerHost.STAT_ONLINE)
 
-    def _exec_updates(self, update_commands):
+    def _exec_updates(self, update_commands, relayed_commands = None):
+        """
+        @param update_commands   Iterable of (cmd, obj)
+        @param relayed_commands  If a list is given, (cmd, repr(obj)) of the applied updates are appended.
+        """
+
         num_updates = 0
         num_deletes = 0
-        for cmd, objstr in update_commands:
-            # Create a python object from its representation string
-            obj = self.inventory.make_object(objstr)
-
+        # serialized applied updates for the web server
+        web_commands = []
+        for cmd, obj in update_commands:
             if cmd == DynamoInventory.CMD_UPDATE:
                 num_updates += 1
                 embedded_object = self.inventory.update(obj)
                 CHANGELOG.info('Saved %s', str(embedded_object))
 
+                if self.webserver:
+                    web_commands.append((cmd, serialization.pack(embedded_object)))
+
+                if relayed_commands is not None:
+                    relayed_commands.append((cmd, repr(embedded_object)))
+
             elif cmd == DynamoInventory.CMD_DELETE:
                 num_deletes += 1
                 deleted_object = self.inventory.delete(obj)
                 if deleted_object is not None:
                     CHANGELOG.info('Deleting %s', str(deleted_object))
 
+                    if self.webserver:
+                        web_commands.append((cmd, serialization.pack(deleted_object)))
+
+                    if relayed_commands is not None:
+                        relayed_commands.append((cmd, repr(deleted_object)))
+
         if num_updates + num_deletes != 0:
             if self.inventory.has_store:
-                self.manager.master.advertise_store_version(self.inventory.store_version())
+                store_version = self.inventory.store_version()
+                self.manager.master.advertise_store_version(store_version)
+
+                if self._use_snapshot():
+                    self._write_snapshot(store_version)
+
+            self.inventory_version += 1
+            self._write_image()
 
             if self.webserver:
-                # Restart the web server so it gets the latest inventory image
-                self.webserver.restart()
+                # Web server processes apply the updates to their inventory images at their next request
+                self.webserver.publish_updates(web_commands)
 
         return num_updates, num_deletes
 
+    def _use_snapshot(self):
+        # Snapshot is only for the full inventory backed by our own store
+        return self.inventory.snapshot_path is not None and self.inventory.has_store and len(self.inventory_load_opts) == 0
+
+    def _write_snapshot(self, store_version):
+        """
+        Write the inventory snapshot in a forked process, which sees a frozen image of the inventory.
+        If a previous writer is still running, the snapshot is written when it finishes.
+        """
+
+        if self.snapshot_writer is not None and self.snapshot_writer.is_alive():
+            self.pending_snapshot_version = store_version
+            return
+
+        self.pending_snapshot_version = None
+
+        self.snapshot_writer = multiprocessing.Process(target = self._run_snapshot_writer, name = 'snapshot', args = (store_version,))
+        self.snapshot_writer.daemon = True
+        self.snapshot_writer.start()
+
+    def _run_snapshot_writer(self, store_version):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        try:
+            self.inventory.write_snapshot(store_version)
+        except:
+            LOG.error('Failed to write the inventory snapshot.')
+            log_exception(LOG)
+
+    def _check_snapshot_writer(self):
+        if self.snapshot_writer is None or self.snapshot_writer.is_alive():
+            return
+
+        self.snapshot_writer.join()
+        self.snapshot_writer = None
+
+        if self.pending_snapshot_version is not None:
+            self._write_snapshot(self.pending_snapshot_version)
+
+    def _write_image(self):
+        """
+        Write the inventory image in a forked process, as with the snapshot. The image becomes usable
+        when the writer finishes, if the inventory has not changed in the meantime.
+        """
+
+        if self.inventory_image_path is None:
+            return
+
+        if self.image_writer is not None and self.image_writer.is_alive():
+            self.pending_image = True
+            return
+
+        self.pending_image = False
+        self.image_writer_version = self.inventory_version
+
+        self.image_writer = multiprocessing.Process(target = self._run_image_writer, name = 'image', args = (self.inventory_version,))
+        self.image_writer.daemon = True
+        self.image_writer.start()
+
+    def _run_image_writer(self, version):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        try:
+            self.inventory.write_image(self.inventory_image_path, version)
+        except:
+            LOG.error('Failed to write the inventory image.')
+            log_exception(LOG)
+            sys.exit(1)
+
+    def _check_image_writer(self):
+        if self.image_writer is None or self.image_writer.is_alive():
+            return
+
+        self.image_writer.join()
+        if self.image_writer.exitcode == 0:
+            self.image_version = self.image_writer_version
+
+        self.image_writer = None
+
+        if self.pending_image:
+            self._write_image()
+
+    def _create_app_inventory(self):
+        """
+        Create the inventory used within an application subprocess. When the inventory image is up to
+        date, the objects are materialized from the image so that the pages of the server inventory are
+        not touched (and copied) by the subprocess.
+        """
+
+        if self.image_version is not None and self.image_version == self.inventory_version:
+            try:
+                image = InventoryImage(self.inventory_image_path)
+            except (IOError, OSError, ObjectError):
+                LOG.warning('Cannot open the inventory image %s.', self.inventory_image_path)
+                log_exception(LOG)
+            else:
+                if image.version == self.inventory_version:
+                    return self.inventory.create_proxy(image = image)
+
+                image.close()
+
+        return self.inventory.create_proxy()
+
     def _start_subprocess(self, app, is_local):
         proc_args = (app['path'], app['args'], is_local, app['auth_level'])
 
@@ -674,7 +864,7 @@ class DynamoServer(object):
         sys.stderr = stderr
 
         # Create an inventory proxy object used as "the" inventory within the subprocess
-        inventory = self.inventory.create_proxy()
+        inventory = self._create_app_inventory()
 
         path = self._pre_execution(path, is_local, auth_level, inventory)
     
@@ -716,7 +906,7 @@ class DynamoServer(object):
         else:
             if auth_level == AppManager.LV_WRITE:
                 self._send_updates(inventory)
-                # Queue stays available on the other end even if we terminate the process
+                # Data stays available on the other end of the pipe even if we terminate the process
     
         finally:
             # cleanup
@@ -740,7 +930,7 @@ class DynamoServer(object):
         """
     
         # Create an inventory proxy object used as "the" inventory within the subprocess
-        inventory = self.inventory.create_proxy()
+        inventory = self._create_app_inventory()
     
         old_stdout = sys.stdout
         old_stderr = sys.stderr
@@ -865,17 +1055,19 @@ class DynamoServer(object):
         sys.stderr.write('Sending %d updated objects to the server process.\n' % nobj)
         sys.stderr.flush()
 
+        chunk_size = DynamoServer.update_chunk_size
+
         wm = 0.
-        for iobj, (cmd, objstr) in enumerate(inventory._update_commands):
+        for iobj in xrange(0, nobj, chunk_size):
             if float(iobj) / nobj * 100. > wm:
                 sys.stderr.write(' %.0f%%..' % (float(iobj) / nobj * 100.))
                 sys.stderr.flush()
                 wm += 5.
-    
+
             try:
-                self.inventory_update_queue.put((cmd, objstr))
+                self.inventory_update_sender.send_bytes(serialization.encode_frame(inventory._update_commands[iobj:iobj + chunk_size]))
             except:
-                sys.stderr.write('Exception while sending %s %s\n' % (DynamoInventory._cmd_str[cmd], objstr))
+                sys.stderr.write('Exception while sending updated objects %d-%d\n' % (iobj, min(iobj + chunk_size, nobj) - 1))
                 sys.stderr.flush()
                 raise
     
@@ -884,7 +1076,6 @@ class DynamoServer(object):
             sys.stderr.flush()
         
         # Put end-of-message
-        self.inventory_update_queue.put((DynamoInventory.CMD_EOM, None))
-    
-        # Wait until all messages are received
-        self.inventory_update_queue.join()
+        # The pipe is unbuffered on the sending side; once send_bytes returns, the data stays available
+        # to the server even if we terminate the process.
+        self.inventory_update_sender.send_bytes(serialization.encode_frame([(DynamoInventory.CMD_EOM, None)]))
@@ -0,0 +1,289 @@
+"""
+On-disk snapshot of the inventory content, used to restart the server without loading from the
+persistency store. The snapshot is tagged with the store version at the time of writing and is only
+valid while the store has the same version.
+
+File layout: header (magic, format version, store version), followed by zlib-compressed frames
+(see dataformat.serialization) of (section, payload) pairs. Groups, sites, site partitions and
+datasets are serialization records. Blocks and replicas are written per dataset in a compact form
+that refers to the dataset, site, and group by name and to blocks by their index within the dataset.
+"""
+
+import os
+import time
+import struct
+import zlib
+import logging
+from array import array
+
+import dynamo.dataformat.serialization as serialization
+from dynamo.dataformat import Dataset, Block, SitePartition, DatasetReplica, BlockReplica, ObjectError
+
+LOG = logging.getLogger(__name__)
+
+# Increment when the layout of the sections changes
+FORMAT_VERSION = 1
+
+_MAGIC = 'DYNS'
+_HEADER = struct.Struct('!4sBBH') # magic, snapshot format version, serialization format version, store version length
+_FRAME_LENGTH = struct.Struct('!I')
+
+SEC_SOFTWARE_VERSION, SEC_GROUP, SEC_SITE, SEC_SITEPARTITION, SEC_DATASET, SEC_CONTENT = range(6)
+
+# Number of entries per frame
+frame_size = 10000
+
+def read_version(path):
+    """
+    @param path  Snapshot file path
+    @return Store version the snapshot was taken at, or None if the file does not exist or is not a valid snapshot.
+    """
+
+    try:
+        with open(path, 'rb') as source:
+            return _read_header(source)
+    except (IOError, ObjectError):
+        return None
+
+def write(inventory, path, store_version):
+    """
+    Write the inventory content to path. The file is written under a temporary name and renamed at
+    the end, so that a reader never sees a partial snapshot.
+    @param inventory      ObjectRepository
+    @param path           Snapshot file path
+    @param store_version  Version of the persistency store the inventory content corresponds to.
+    """
+
+    start = time.time()
+
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+
+    try:
+        with open(tmp_path, 'wb') as output:
+            output.write(_HEADER.pack(_MAGIC, FORMAT_VERSION, serialization.FORMAT_VERSION, len(store_version)))
+            output.write(store_version)
+
+            entries = []
+
+            def flush():
+                data = zlib.compress(serialization.encode_frame(entries), 1)
+                output.write(_FRAME_LENGTH.pack(len(data)))
+                output.write(data)
+                del entries[:]
+
+            def add(section, payload):
+                entries.append((section, payload))
+                if len(entries) == frame_size:
+                    flush()
+
+            for version in Dataset._software_versions_byid:
+                add(SEC_SOFTWARE_VERSION, (version.id, version.value))
+
+            for group in inventory.groups.itervalues():
+                if group.name is not None:
+                    add(SEC_GROUP, serialization.pack(group))
+
+            for site in inventory.sites.itervalues():
+                add(SEC_SITE, serialization.pack(site))
+
+            for site in inventory.sites.itervalues():
+                for sitepartition in site.partitions.itervalues():
+                    # quotas are set only on the base partitions
+                    if sitepartition.partition.subpartitions is None:
+                        add(SEC_SITEPARTITION, serialization.pack(sitepartition))
+
+            for dataset in inventory.datasets.itervalues():
+                # software version id is kept to match the store
+                add(SEC_DATASET, (serialization.pack(dataset), dataset._software_version_id))
+
+            for dataset in inventory.datasets.itervalues():
+                if len(dataset.blocks) == 0 and len(dataset.replicas) == 0:
+                    continue
+
+                add(SEC_CONTENT, pack_content(dataset))
+
+            if len(entries) != 0:
+                flush()
+
+        os.rename(tmp_path, path)
+
+    except:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+        raise
+
+    LOG.info('Wrote inventory snapshot %s (store version %s) in %.1f seconds.', path, store_version, time.time() - start)
+
+def load(inventory, path):
+    """
+    Load the snapshot content into an inventory with partitions set up and no other content.
+    @param inventory  ObjectRepository
+    @param path       Snapshot file path
+    @return Store version of the snapshot.
+    """
+
+    start = time.time()
+
+    with open(path, 'rb') as source:
+        store_version = _read_header(source)
+
+        software_versions = []
+
+        while True:
+            length_data = source.read(_FRAME_LENGTH.size)
+            if len(length_data) == 0:
+                break
+            elif len(length_data) != _FRAME_LENGTH.size:
+                raise ObjectError('Truncated inventory snapshot %s' % path)
+
+            length = _FRAME_LENGTH.unpack(length_data)[0]
+            data = source.read(length)
+            if len(data) != length:
+                raise ObjectError('Truncated inventory snapshot %s' % path)
+
+            for section, payload in serialization.decode_frame(zlib.decompress(data)):
+                if section == SEC_CONTENT:
+                    unpack_content(inventory, payload)
+
+                elif section == SEC_DATASET:
+                    if software_versions is not None:
+                        # all software versions come before the datasets
+                        _set_software_versions(software_versions)
+                        software_versions = None
+
+                    record, software_version_id = payload
+                    dataset = serialization.unpack(record)
+                    dataset._software_version_id = software_version_id
+                    inventory.datasets.add(dataset)
+
+                elif section == SEC_SOFTWARE_VERSION:
+                    software_versions.append(payload)
+
+                elif section == SEC_GROUP:
+                    inventory.groups.add(serialization.unpack(payload))
+
+                elif section == SEC_SITE:
+                    site = serialization.unpack(payload)
+                    inventory.sites.add(site)
+
+                    for partition in inventory.partitions.itervalues():
+                        site.partitions[partition] = SitePartition(site, partition)
+
+                elif section == SEC_SITEPARTITION:
+                    sitepartition = serialization.unpack(payload)
+                    site = inventory.sites[sitepartition._site_name()]
+                    try:
+                        partition = inventory.partitions[sitepartition._partition_name()]
+                    except KeyError:
+                        # partition was removed from the definitions since the snapshot was written
+                        continue
+
+                    site.partitions[partition].set_quota(sitepartition._quota)
+
+                else:
+                    raise ObjectError('Unknown section %d in inventory snapshot %s' % (section, path))
+
+    if software_versions is not None:
+        # there were no datasets
+        _set_software_versions(software_versions)
+
+    LOG.info('Loaded inventory snapshot %s (store version %s) in %.1f seconds.', path, store_version, time.time() - start)
+
+    return store_version
+
+def _read_header(source):
+    header = source.read(_HEADER.size)
+    if len(header) != _HEADER.size:
+        raise ObjectError('Truncated snapshot header')
+
+    magic, version, serialization_version, version_length = _HEADER.unpack(header)
+    if magic != _MAGIC:
+        raise ObjectError('Invalid snapshot header')
+    if version != FORMAT_VERSION or serialization_version != serialization.FORMAT_VERSION:
+        raise ObjectError('Snapshot format version %d.%d is not supported' % (version, serialization_version))
+
+    store_version = source.read(version_length)
+    if len(store_version) != version_length:
+        raise ObjectError('Truncated snapshot header')
+
+    return store_version
+
+def _set_software_versions(versions):
+    Dataset._software_versions_byid = [Dataset.SoftwareVersion(value, vid) for vid, value in versions]
+    Dataset._software_versions_byvalue = dict((v.value, v) for v in Dataset._software_versions_byid if v.value is not None)
+
+def pack_content(dataset):
+    """
+    @return (dataset name, [block], [(site name, growing, group name, [block replica])])
+    """
+
+    block_indices = {}
+    blocks = []
+    for block in dataset.blocks:
+        block_indices[block] = len(blocks)
+        blocks.append((block._name, block._size, block._num_files, block.is_open, block.last_update, block.id))
+
+    replicas = []
+    for replica in dataset.replicas:
+        block_replicas = []
+        for block_replica in replica.block_replicas:
+            file_ids = block_replica.file_ids
+            if type(file_ids) is array:
+                # marshal does not handle arrays
+                file_ids = tuple(file_ids)
+
+            block_replicas.append((block_indices[block_replica.block], block_replica.group.name, block_replica.is_custodial,
+                                   block_replica.last_update, block_replica.size, file_ids))
+
+        if replica.growing:
+            group_name = replica.group.name
+        else:
+            group_name = None
+
+        replicas.append((replica.site.name, replica.growing, group_name, block_replicas))
+
+    return (dataset.name, blocks, replicas)
+
+def unpack_content(inventory, payload):
+    """
+    Create the blocks and replicas of a dataset already in the inventory.
+    @param inventory  ObjectRepository with the sites and groups of the content
+    @param payload    Return value of pack_content
+    """
+
+    dataset_name, block_data, replica_data = payload
+
+    dataset = inventory.datasets[dataset_name]
+    groups = inventory.groups
+
+    blocks = []
+    for name, size, num_files, is_open, last_update, block_id in block_data:
+        block = Block(name, dataset, size = size, num_files = num_files, is_open = is_open, last_update = last_update, bid = block_id)
+        dataset.blocks.add(block)
+        blocks.append(block)
+
+    for site_name, growing, group_name, block_replica_data in replica_data:
+        site = inventory.sites[site_name]
+
+        dataset_replica = DatasetReplica(dataset, site)
+        if growing:
+            dataset_replica.growing = True
+            dataset_replica.group = groups[group_name]
+
+        for iblock, group_name, is_custodial, last_update, size, file_ids in block_replica_data:
+            block = blocks[iblock]
+
+            block_replica = BlockReplica(block, site, groups[group_name], is_custodial = is_custodial, last_update = last_update)
+            # same as in the store load: block replica is created as complete, then adjusted
+            block_replica.size = size
+            block_replica.file_ids = file_ids
+
+            dataset_replica.block_replicas.add(block_replica)
+            block.replicas.add(block_replica)
+
+        # add to dataset and site after filling all block replicas (see MySQLInventoryStore._load_replicas)
+        dataset.replicas.add(dataset_replica)
+        site.add_dataset_replica(dataset_replica, add_block_replicas = True)
@@ -0,0 +1,198 @@
+import collections
+import logging
+
+import dynamo.dataformat as df
+
+LOG = logging.getLogger(__name__)
+
+class InventoryStatCube(object):
+    """
+    Aggregate of the block replicas in the inventory. Each cell is keyed by
+    (site name, group name, DatasetAttributes) and holds
+    [bytes, logical bytes, files, logical files, number of block replicas],
+    where the logical quantities are those of the full blocks. The cube is built from the loaded inventory
+    and then maintained by ObjectRepository.update and delete: the contributions of the block replicas
+    affected by the object are taken out before the change and put back after it.
+    """
+
+    # Stand-in for the dataset in the cell key. Dataset categorizations of the web stats module that only
+    # look at these attributes can be evaluated on it.
+    DatasetAttributes = collections.namedtuple('DatasetAttributes', ['status', 'data_type', 'software_version'])
+
+    BYTES, LOGICAL_BYTES, FILES, LOGICAL_FILES, REPLICAS = range(5)
+
+    def __init__(self):
+        self.built = False
+        # {(site name, group name, DatasetAttributes): [values]}
+        self._cells = {}
+
+    def build(self, inventory):
+        """
+        Fill the cube from scratch.
+        @param inventory  ObjectRepository
+        """
+
+        self._cells = {}
+
+        for dataset in inventory.datasets.itervalues():
+            for replica in dataset.replicas:
+                self._add(InventoryStatCube._contribution(br) for br in replica.block_replicas)
+
+        self.built = True
+
+        LOG.info('Built inventory statistics cube with %d cells.', len(self._cells))
+
+    def clear(self):
+        self._cells = {}
+        self.built = False
+
+    def cells(self):
+        """
+        @return Iterator over ((site name, group name, DatasetAttributes), [values]). Values must not be modified.
+        """
+
+        return self._cells.iteritems()
+
+    def pre_update(self, inventory, obj):
+        """
+        Called before obj is embedded into the inventory.
+        @return State to be passed to post_update.
+        """
+
+        if not self.built:
+            return None
+
+        return [InventoryStatCube._contribution(br) for br in InventoryStatCube._affected_block_replicas(inventory, obj, False)]
+
+    def post_update(self, inventory, obj, state):
+        """
+        Called after obj is embedded into the inventory.
+        @param state  Return value of pre_update.
+        """
+
+        if state is None:
+            return
+
+        self._subtract(state)
+        self._add(InventoryStatCube._contribution(br) for br in InventoryStatCube._affected_block_replicas(inventory, obj, False))
+
+    def pre_delete(self, inventory, obj):
+        """
+        Called before obj is unlinked from the inventory.
+        @return State to be passed to post_delete.
+        """
+
+        if not self.built:
+            return None
+
+        block_replicas = InventoryStatCube._affected_block_replicas(inventory, obj, True)
+        return block_replicas, [InventoryStatCube._contribution(br) for br in block_replicas]
+
+    def post_delete(self, inventory, obj, state):
+        """
+        Called after obj is unlinked from the inventory.
+        @param state  Return value of pre_delete.
+        """
+
+        if state is None:
+            return
+
+        block_replicas, contributions = state
+
+        self._subtract(contributions)
+
+        if isinstance(obj, df.Group):
+            # block replicas of a deleted group are handed to the null group
+            self._add(InventoryStatCube._contribution(br) for br in block_replicas)
+
+    def _add(self, contributions):
+        for key, values in contributions:
+            try:
+                cell = self._cells[key]
+            except KeyError:
+                self._cells[key] = list(values)
+            else:
+                for i in xrange(5):
+                    cell[i] += values[i]
+
+    def _subtract(self, contributions):
+        for key, values in contributions:
+            cell = self._cells[key]
+            for i in xrange(5):
+                cell[i] -= values[i]
+
+            if cell[InventoryStatCube.REPLICAS] == 0:
+                self._cells.pop(key)
+
+    @staticmethod
+    def _contribution(block_replica):
+        block = block_replica.block
+        dataset = block.dataset
+        key = (block_replica.site.name, block_replica.group.name, InventoryStatCube.DatasetAttributes(dataset.status, dataset.data_type, dataset.software_version))
+        return key, (block_replica.size, block.size, block_replica.num_files, block.num_files, 1)
+
+    @staticmethod
+    def _affected_block_replicas(inventory, obj, deletion):
+        """
+        @return List of the block replicas in the inventory whose contributions can be changed by embedding
+                (deletion = False) or unlinking (deletion = True) obj.
+        """
+
+        if isinstance(obj, df.BlockReplica):
+            dataset = inventory.datasets.get(obj._dataset_name())
+            if dataset is None:
+                return []
+            block = dataset.find_block(obj._block_name())
+            if block is None:
+                return []
+            replica = block.find_replica(obj._site_name())
+            if replica is None:
+                return []
+            return [replica]
+
+        elif isinstance(obj, df.Block):
+            dataset = inventory.datasets.get(obj._dataset_name())
+            if dataset is None:
+                return []
+            block = dataset.find_block(obj.name)
+            if block is None:
+                return []
+            return list(block.replicas)
+
+        elif isinstance(obj, df.DatasetReplica):
+            dataset = inventory.datasets.get(obj._dataset_name())
+            if dataset is None:
+                return []
+            replica = dataset.find_replica(obj._site_name())
+            if replica is None:
+                return []
+            return list(replica.block_replicas)
+
+        elif isinstance(obj, df.Dataset):
+            dataset = inventory.datasets.get(obj.name)
+            if dataset is None:
+                return []
+            return [br for replica in dataset.replicas for br in replica.block_replicas]
+
+        elif not deletion:
+            # site and group attributes are not in the cell keys
+            return []
+
+        elif isinstance(obj, df.Site):
+            site = inventory.sites.get(obj.name)
+            if site is None:
+                return []
+            return [br for replica in site.dataset_replicas() for br in replica.block_replicas]
+
+        elif isinstance(obj, df.Group):
+            group = inventory.groups.get(obj.name)
+            if group is None or group.name is None:
+                return []
+            return InventoryStatCube._group_block_replicas(inventory, group)
+
+        else:
+            return []
+
+    @staticmethod
+    def _group_block_replicas(inventory, group):
+        return [br for dataset in inventory.datasets.itervalues() for replica in dataset.replicas for br in replica.block_replicas if br.group == group]
@@ -0,0 +1,127 @@
+import sys
+import threading
+import collections
+
+class BlockFileCache(object):
+    """
+    LRU cache of the file sets of blocks, bounded by an estimate of the memory held by the sets.
+    One instance (Block.files_cache) is shared by all blocks of the process. Thread-safe.
+    """
+
+    # Estimated memory of a File in a cached set besides the LFN string: the object, its size, id, and
+    # checksum values, and its entries in the set and in the lookup index.
+    FILE_OVERHEAD = 300
+
+    def __init__(self, max_bytes):
+        """
+        @param max_bytes  Memory budget of the cached sets.
+        """
+
+        self.max_bytes = max_bytes
+
+        # {block: (files, estimated bytes)} from the least to the most recently used
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, block):
+        return block in self._entries
+
+    def get(self, block):
+        """
+        @param block  Block
+        @return Cached file set of the block or None.
+        """
+
+        with self._lock:
+            try:
+                entry = self._entries.pop(block)
+            except KeyError:
+                self.misses += 1
+                return None
+
+            # reinsert as the most recently used
+            self._entries[block] = entry
+            self.hits += 1
+
+            return entry[0]
+
+    def put(self, block, files):
+        """
+        Cache the file set of the block and evict the least recently used sets beyond the budget.
+        Sets larger than the full budget are not cached.
+        @param block  Block
+        @param files  Set of files (should not be modified afterwards)
+        """
+
+        nbytes = BlockFileCache.estimate_size(files)
+
+        with self._lock:
+            self._pop(block)
+
+            if nbytes > self.max_bytes:
+                return
+
+            self._entries[block] = (files, nbytes)
+            self.nbytes += nbytes
+
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last = False)
+                self.nbytes -= evicted_bytes
+                self.evictions += 1
+
+    def pop(self, block):
+        """
+        Remove the block from the cache.
+        @param block  Block
+        @return The file set of the block or None if the block was not in the cache.
+        """
+
+        with self._lock:
+            return self._pop(block)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def reset_lock(self):
+        """
+        Call in a forked child process. The lock may have been held by another thread of the parent at fork.
+        """
+
+        self._lock = threading.Lock()
+
+    def stats(self):
+        """
+        @return {'blocks': N, 'bytes': N, 'max_bytes': N, 'hits': N, 'misses': N, 'evictions': N}
+        """
+
+        return {
+            'blocks': len(self._entries),
+            'bytes': self.nbytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+    def _pop(self, block):
+        try:
+            files, nbytes = self._entries.pop(block)
+        except KeyError:
+            return None
+
+        self.nbytes -= nbytes
+        return files
+
+    @staticmethod
+    def estimate_size(files):
+        return sys.getsizeof(files) + sum(len(f.lfn) for f in files) + BlockFileCache.FILE_OVERHEAD * len(files)
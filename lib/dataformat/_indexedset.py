@@ -0,0 +1,145 @@
+class IndexedSet(set):
+    """
+    Set with a lookup index by the name of the elements. The index is built at the first lookup
+    and maintained by the in-place modifications, so the object can be used everywhere a set is.
+    Subclasses define _key(element).
+    """
+
+    __slots__ = ['_index']
+
+    def find(self, name):
+        """
+        @param name  Key of the element
+        @return The element or None if not found.
+        """
+
+        try:
+            index = self._index
+        except AttributeError:
+            # index not built yet, or this object was created by a set operation
+            key = self._key
+            index = self._index = dict((key(elem), elem) for elem in self)
+
+        return index.get(name)
+
+    def add(self, elem):
+        set.add(self, elem)
+        try:
+            self._index[self._key(elem)] = elem
+        except AttributeError:
+            pass
+
+    def remove(self, elem):
+        set.remove(self, elem)
+        self._unindex(elem)
+
+    def discard(self, elem):
+        if elem in self:
+            set.remove(self, elem)
+            self._unindex(elem)
+
+    def pop(self):
+        elem = set.pop(self)
+        self._unindex(elem)
+        return elem
+
+    def clear(self):
+        set.clear(self)
+        self._index = {}
+
+    # Bulk modifications drop the index, to be rebuilt at the next lookup
+
+    def update(self, *others):
+        set.update(self, *others)
+        self._drop_index()
+
+    def difference_update(self, *others):
+        set.difference_update(self, *others)
+        self._drop_index()
+
+    def intersection_update(self, *others):
+        set.intersection_update(self, *others)
+        self._drop_index()
+
+    def symmetric_difference_update(self, other):
+        set.symmetric_difference_update(self, other)
+        self._drop_index()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __isub__(self, other):
+        self.difference_update(other)
+        return self
+
+    def __iand__(self, other):
+        self.intersection_update(other)
+        return self
+
+    def __ixor__(self, other):
+        self.symmetric_difference_update(other)
+        return self
+
+    def _unindex(self, elem):
+        try:
+            index = self._index
+        except AttributeError:
+            return
+
+        key = self._key(elem)
+        if index.get(key) is elem:
+            del index[key]
+
+    def _drop_index(self):
+        try:
+            del self._index
+        except AttributeError:
+            pass
+
+
+class FrozenIndexedSet(frozenset):
+    """
+    Immutable counterpart of IndexedSet.
+    """
+
+    __slots__ = ['_index']
+
+    def find(self, name):
+        try:
+            index = self._index
+        except AttributeError:
+            key = self._key
+            index = self._index = dict((key(elem), elem) for elem in self)
+
+        return index.get(name)
+
+
+class BlockSet(IndexedSet):
+    """Set of blocks indexed by the (internal) block name."""
+
+    __slots__ = []
+
+    @staticmethod
+    def _key(block):
+        return block._name
+
+
+class FileSet(IndexedSet):
+    """Set of files indexed by the LFN."""
+
+    __slots__ = []
+
+    @staticmethod
+    def _key(lfile):
+        return lfile._lfn
+
+
+class FrozenFileSet(FrozenIndexedSet):
+    """Immutable set of files indexed by the LFN."""
+
+    __slots__ = []
+
+    @staticmethod
+    def _key(lfile):
+        return lfile._lfn
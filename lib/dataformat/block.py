@@ -1,9 +1,8 @@
 import time
-import collections
-import threading
-import weakref
 
 from exceptions import ObjectError, IntegrityError, OperationalError
+from _indexedset import FileSet, FrozenFileSet
+from _filecache import BlockFileCache
 from _namespace import customize_block
 
 class Block(object):
@@ -13,10 +12,9 @@ class Block(object):
 
     __slots__ = ['_name', '_dataset', 'id', '_size', '_num_files', 'is_open', 'replicas', 'last_update', '_files']
 
-    # Container for the file-set "originals" - Block._files will normally be a weakref pointing to a value of this dict
-    _files_cache = collections.OrderedDict()
-    _files_cache_lock = threading.Lock()
-    _MAX_FILES_CACHE_DEPTH = 1000
+    # LRU cache of the file sets loaded from the store. Block._files is None while the files of the block
+    # are only in the cache (or not loaded).
+    files_cache = BlockFileCache(max_bytes = 200000000)
 
     # Pointer to inventory._store
     inventory_store = None
@@ -121,10 +119,17 @@ class Block(object):
             # identical object -> return False if check is requested
             pass
         else:
+            old_size = block._size
+
             # server-side inventory should not load files and just copy the values
             server_side = hasattr(inventory, 'has_store')
             block._copy_no_check(self, load_files = (not server_side))
 
+            if block._size != old_size:
+                # projected occupancy of the sites holding this block changes
+                for replica in block.replicas:
+                    replica.site.adjust_occupancy(replica, 0, block._size - old_size)
+
             updated = True
 
         if check:
@@ -150,10 +155,7 @@ class Block(object):
 
         self._dataset.blocks.remove(self)
 
-        try:
-            Block._files_cache.pop(self)
-        except KeyError:
-            pass
+        Block.files_cache.pop(self)
 
     def write_into(self, store):
         store.save_block(self)
@@ -180,14 +182,12 @@ class Block(object):
         @param lfn        File name
         @param must_find  Raise an exception if file is not found.
         """
-        try:
-            return next(f for f in self.files if f._lfn == lfn)
+        lfile = self.files.find(lfn)
 
-        except StopIteration:
-            if must_find:
-                raise ObjectError('Cannot find file %s' % str(lfn))
-            else:
-                return None
+        if lfile is None and must_find:
+            raise ObjectError('Cannot find file %s' % str(lfn))
+
+        return lfile
 
     def add_file(self, lfile):
         """
@@ -228,60 +228,31 @@ class Block(object):
             return self._dataset.name
 
     def _check_and_load_files(self, cache = True):
-        if type(self._files) is set:
+        if type(self._files) is FileSet:
+            return self._files
+        elif type(self._files) is set:
+            # files were set directly as a plain set
+            self._files = FileSet(self._files)
             return self._files
 
-        if not Block.inventory_store.server_side:
-            # if server side we won't be using any caching
-            Block._files_cache_lock.acquire()
-
-        try:
-            if cache:
-                if self._files is not None:
-                    # self._files is either a real set (if _files was directly set), a valid weak proxy to a frozenset,
-                    # or an expired weak proxy to a frozenset.
-                    try:
-                        len(self._files)
-                    except ReferenceError:
-                        # expired proxy
-                        self._files = None
-    
-                if self._files is None:
-                    files = frozenset(self._load_files())
-                    
-                    if Block.inventory_store.server_side:
-                        # In server side inventory, we don't keep the files in memory
-                        return files
-
-                    while len(Block._files_cache) >= Block._MAX_FILES_CACHE_DEPTH:
-                        # Keep _files_cache FIFO to Block._MAX_FILES_CACHE_DEPTH
-                        Block._files_cache.popitem(last = False)
-
-                    Block._files_cache[self] = files
-                    self._files = weakref.proxy(files)
-
-            else:
-                if Block.inventory_store.server_side:
-                    raise OperationalError('Block.files should not be loaded as non-cache on the server side.')
+        if cache:
+            files = Block.files_cache.get(self)
+            if files is None:
+                files = FrozenFileSet(self._load_files())
+                Block.files_cache.put(self, files)
 
-                if type(self._files) is weakref.ProxyType:
-                    try:
-                        self._files = set(self._files)
-                    except ReferenceError:
-                        # expired proxy
-                        self._files = None
+            return files
 
-                    try:
-                        Block._files_cache.pop(self)
-                    except KeyError:
-                        pass
+        else:
+            if Block.inventory_store.server_side:
+                raise OperationalError('Block.files should not be loaded as non-cache on the server side.')
 
-                if self._files is None:
-                    self._files = self._load_files()
+            # take over the cached set if there is one
+            files = Block.files_cache.pop(self)
+            if files is None:
+                files = self._load_files()
 
-        finally:
-            if not Block.inventory_store.server_side:
-                Block._files_cache_lock.release()
+            self._files = FileSet(files)
 
         return self._files
 
@@ -290,22 +261,65 @@ class Block(object):
             return set()
 
         files = Block.inventory_store.get_files(self)
+        self._check_files(files)
 
+        return files
+
+    def _check_files(self, files):
         if len(files) != self._num_files:
             raise IntegrityError('Number of files mismatch in %s: predicted %d, loaded %d' % (str(self), self._num_files, len(files)))
         size = sum(f.size for f in files)
         if size != self._size:
             raise IntegrityError('Size mismatch in %s: predicted %d, loaded %d' % (str(self), self._size, size))
 
-        return files
+    @staticmethod
+    def prefetch_files(blocks):
+        """
+        Load the files of multiple blocks with one store query and put them in the cache.
+        @param blocks  List of blocks
+        @return {block: files} for all blocks (also for the blocks whose files were already loaded)
+        """
+
+        block_files = {}
+        to_load = []
+
+        for block in blocks:
+            if block._files is not None or block.id == 0:
+                block_files[block] = block._check_and_load_files()
+                continue
+
+            files = Block.files_cache.get(block)
+            if files is None:
+                to_load.append(block)
+            else:
+                block_files[block] = files
+
+        if len(to_load) == 0:
+            return block_files
+
+        loaded = Block.inventory_store.get_files_for_blocks(to_load)
+
+        for block in to_load:
+            files = loaded.get(block, set())
+            block._check_files(files)
+
+            files = FrozenFileSet(files)
+            Block.files_cache.put(block, files)
+            block_files[block] = files
+
+        return block_files
 
     def _copy_no_check(self, other, load_files = True):
         self.is_open = other.is_open
         self.last_update = other.last_update
 
-        if load_files and (self._size != other._size or self._num_files != other._num_files):
-            # updating file parameters -> need to load files permanently
-            self._check_and_load_files(cache = False)
+        if self._size != other._size or self._num_files != other._num_files:
+            if load_files:
+                # updating file parameters -> need to load files permanently
+                self._check_and_load_files(cache = False)
+            else:
+                # cached files are from before the update
+                Block.files_cache.pop(self)
 
         self._size = other._size
         self._num_files = other._num_files
@@ -1,5 +1,7 @@
 import logging
 import time
+import bisect
+from array import array
 
 from exceptions import ObjectError
 from block import Block
@@ -11,10 +13,13 @@ class BlockReplica(object):
     """Block placement at a site. Holds an attribute 'group' which can be None.
     BlockReplica size can be different from that of the Block."""
 
-    __slots__ = ['_block', '_site', 'group', 'is_custodial', 'size', 'last_update', 'file_ids']
+    __slots__ = ['_block', '_site', 'group', 'is_custodial', 'size', 'last_update', '_file_ids']
 
     _use_file_ids = True
 
+    # array type code of the file ids (signed 64-bit on LP64 platforms; Python 2 array has no 'q')
+    FILE_ID_TYPECODE = 'l'
+
     @property
     def block(self):
         return self._block
@@ -23,6 +28,19 @@ class BlockReplica(object):
     def site(self):
         return self._site
 
+    @property
+    def file_ids(self):
+        """
+        If _use_file_ids is True, None for a complete replica. Otherwise a sorted array of the file ids,
+        or a tuple if some of the files are identified by LFNs (not registered in the inventory yet).
+        If _use_file_ids is False, number of files.
+        """
+        return self._file_ids
+
+    @file_ids.setter
+    def file_ids(self, value):
+        self._file_ids = BlockReplica._pack_file_ids(value)
+
     @property
     def num_files(self):
         if self.file_ids is None:
@@ -32,8 +50,9 @@ class BlockReplica(object):
 
     def __init__(self, block, site, group, is_custodial = False, size = -1, last_update = 0, file_ids = None):
         # User of the object is responsible for making sure size and file_ids are consistent
-        # if _use_file_ids is True, file_ids should be a tuple of (long) integers or LFN strings,
-        #   latter in case where the file is not yet registered with the inventory
+        # if _use_file_ids is True, file_ids should be an iterable of (long) integers or LFN strings,
+        #   latter in case where the file is not yet registered with the inventory. It is stored as a
+        #   sorted array of integers whenever possible.
         # if _use_file_ids is False, file_ids is the number of files this replica has.
 
         self._block = block
@@ -84,15 +103,19 @@ class BlockReplica(object):
             self.size = size
 
             if BlockReplica._use_file_ids:
-                # some iterable
-                tmplist = []
-                for fid in file_ids:
-                    if type(self._block) is not str and type(fid) is str:
-                        tmplist.append(self._block.find_file(fid, must_find = True).id)
-                    else:
-                        tmplist.append(fid)
-    
-                self.file_ids = tuple(tmplist)
+                if type(file_ids) is array:
+                    # already packed
+                    self._file_ids = file_ids
+                else:
+                    # some iterable
+                    tmplist = []
+                    for fid in file_ids:
+                        if type(self._block) is not str and type(fid) is str:
+                            tmplist.append(self._block.find_file(fid, must_find = True).id)
+                        else:
+                            tmplist.append(fid)
+        
+                    self.file_ids = tmplist
             else:
                 # must be an integer
                 self.file_ids = file_ids
@@ -111,6 +134,8 @@ class BlockReplica(object):
         else:
             size = self.size
             file_ids = self.file_ids
+            if type(file_ids) is array:
+                file_ids = tuple(file_ids)
 
         return 'BlockReplica(%s,%s,%s,%s,%d,%d,%s)' % \
             (repr(self._block_full_name()), repr(self._site_name()), repr(self._group_name()), \
@@ -118,12 +143,16 @@ class BlockReplica(object):
 
     def __eq__(self, other):
         if BlockReplica._use_file_ids:
-            # check len() first to avoid having to create sets for no good reason
             if (self.file_ids is None and other.file_ids is not None) or \
                (self.file_ids is not None and other.file_ids is None):
                 return False
 
-            file_ids_match = (self.file_ids == other.file_ids) or ((len(self.file_ids) == len(other.file_ids)) and (set(self.file_ids) == set(other.file_ids)))
+            if type(self.file_ids) is array and type(other.file_ids) is array:
+                # both sorted
+                file_ids_match = (self.file_ids == other.file_ids)
+            else:
+                # check len() first to avoid having to create sets for no good reason
+                file_ids_match = (self.file_ids == other.file_ids) or ((len(self.file_ids) == len(other.file_ids)) and (set(self.file_ids) == set(other.file_ids)))
         else:
             file_ids_match = self.file_ids == other.file_ids
 
@@ -177,6 +206,8 @@ class BlockReplica(object):
             # identical object -> return False if check is requested
             pass
         else:
+            old_size = replica.size
+
             replica.copy(self)
             if type(self.group) is str or self.group is None:
                 # can happen if self is an unlinked clone
@@ -185,6 +216,10 @@ class BlockReplica(object):
                 # self represents a full block replica without the knowledge of the actual size (again an unlinked clone)
                 replica.size = block.size
 
+            if replica.size != old_size:
+                # update the partition occupancy with the current partitioning first
+                site.adjust_occupancy(replica, replica.size - old_size)
+
             site.update_partitioning(replica)
             updated = True
 
@@ -210,24 +245,7 @@ class BlockReplica(object):
             dataset_replica = self._site.find_dataset_replica(self._block._dataset, must_find = True)
 
         for site_partition in self._site.partitions.itervalues():
-            try:
-                block_replicas = site_partition.replicas[dataset_replica]
-
-            except KeyError:
-                continue
-
-            if block_replicas is None:
-                # site_partition contained all block replicas. It will contain all after a deletion.
-                continue
-
-            try:
-                block_replicas.remove(self)
-            except KeyError:
-                # this replica was not part of the partition
-                continue
-
-            if len(block_replicas) == 0:
-                site_partition.replicas.pop(dataset_replica)
+            site_partition.remove_block_replica(dataset_replica, self)
 
         dataset_replica.block_replicas.remove(self)
 
@@ -272,6 +290,9 @@ class BlockReplica(object):
         block_files = self.block.files
         if self.file_ids is None:
             return set(block_files)
+        elif type(self.file_ids) is array:
+            file_ids = self.file_ids
+            return set(f for f in block_files if f.id != 0 and BlockReplica._contains_id(file_ids, f.id))
         else:
             by_id = dict((f.id, f) for f in block_files if f.id != 0)
             result = set()
@@ -301,7 +322,23 @@ class BlockReplica(object):
             return False
 
         else:
-            return lfile.id in self.file_ids
+            return BlockReplica._contains_id(self.file_ids, lfile.id)
+
+    def missing_files(self):
+        """
+        @return Set of the files of the block that are not in this replica.
+        """
+
+        if not BlockReplica._use_file_ids:
+            raise NotImplementedError('BlockReplica.missing_files')
+
+        if self.file_ids is None:
+            return set()
+        elif type(self.file_ids) is array:
+            file_ids = self.file_ids
+            return set(f for f in self.block.files if f.id == 0 or not BlockReplica._contains_id(file_ids, f.id))
+        else:
+            return set(self.block.files) - self.files()
 
     def add_file(self, lfile):
         if lfile.block != self.block:
@@ -330,7 +367,7 @@ class BlockReplica(object):
             if self.size == self.block.size and len(file_ids) == self.block.num_files:
                 self.file_ids = None
             else:
-                self.file_ids = tuple(file_ids)
+                self.file_ids = file_ids
 
         else:
             self.file_ids += 1
@@ -361,14 +398,14 @@ class BlockReplica(object):
                 else:                    
                     file_ids = [(f.id if f.id != 0 else f.lfn) for f in self.block.files]
 
-            elif identifier not in self.file_ids:
+            elif not BlockReplica._contains_id(self.file_ids, identifier):
                 return False
 
             else:
                 file_ids = list(self.file_ids)
 
             file_ids.remove(identifier)
-            self.file_ids = tuple(file_ids)
+            self.file_ids = file_ids
 
         else:
             self.file_ids -= 1
@@ -422,6 +459,9 @@ class BlockReplica(object):
         if BlockReplica._use_file_ids:
             if other.file_ids is None:
                 self.file_ids = None
+            elif type(other.file_ids) is array:
+                # arrays are never modified in place and can be shared
+                self._file_ids = other.file_ids
             else:
                 tmplist = []
                 for fid in other.file_ids:
@@ -438,7 +478,37 @@ class BlockReplica(object):
                     else:
                         tmplist.append(fid)
     
-                self.file_ids = tuple(tmplist)
+                self.file_ids = tmplist
 
         else:
             self.file_ids = other.file_ids
+
+    @staticmethod
+    def _pack_file_ids(file_ids):
+        """
+        @param file_ids  None, number of files, or an iterable of file ids and LFNs
+        @return None, number of files, sorted array of file ids, or tuple if there are LFNs
+        """
+
+        if file_ids is None or not BlockReplica._use_file_ids or type(file_ids) is array:
+            return file_ids
+
+        try:
+            return array(BlockReplica.FILE_ID_TYPECODE, sorted(file_ids))
+        except TypeError:
+            # some files are identified by LFNs
+            return tuple(file_ids)
+
+    @staticmethod
+    def _contains_id(file_ids, fid):
+        if type(file_ids) is array:
+            try:
+                fid += 0
+            except TypeError:
+                # LFN
+                return False
+
+            index = bisect.bisect_left(file_ids, fid)
+            return index != len(file_ids) and file_ids[index] == fid
+        else:
+            return fid in file_ids
@@ -3,6 +3,8 @@ import copy
 import threading
 
 from exceptions import ObjectError
+from block import Block
+from _indexedset import BlockSet
 from _namespace import customize_dataset
 
 class Dataset(object):
@@ -74,8 +76,8 @@ class Dataset(object):
     @property
     def files(self):
         all_files = set()
-        for block in self.blocks:
-            all_files.update(block.files)
+        for files in Block.prefetch_files(self.blocks).itervalues():
+            all_files.update(files)
 
         return all_files
 
@@ -109,7 +111,7 @@ class Dataset(object):
 
         self.id = did
 
-        self.blocks = set()
+        self.blocks = BlockSet()
         self.replicas = set()
 
         # "transient" members - excluded in __getstate__
@@ -201,15 +203,26 @@ class Dataset(object):
         store.delete_dataset(self)
 
     def find_block(self, block_name, must_find = False):
-        try:
-            return next(b for b in self.blocks if b.name == block_name)
-        except StopIteration:
-            if must_find:
-                raise ObjectError('Could not find block %s in %s', block_name, self._name)
-            else:
-                return None
+        block = self.blocks.find(block_name)
+
+        if block is None and must_find:
+            raise ObjectError('Could not find block %s in %s', block_name, self._name)
+
+        return block
 
     def find_file(self, path, must_find = False):
+        # Ask the store which block the file belongs to, to avoid loading the files of all blocks
+        store = Block.inventory_store
+        if store is not None:
+            result = store.find_block_containing(path)
+            if result is not None and result[0] == self._name:
+                block = self.find_block(result[1])
+                if block is not None:
+                    f = block.find_file(path)
+                    if f is not None:
+                        return f
+
+        # File not in the store yet
         for block in self.blocks:
             f = block.find_file(path)
             if f is not None:
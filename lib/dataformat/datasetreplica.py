@@ -114,10 +114,7 @@ class DatasetReplica(object):
 
     def unlink(self):
         for site_partition in self._site.partitions.itervalues():
-            try:
-                site_partition.replicas.pop(self)
-            except KeyError:
-                pass
+            site_partition.remove_replica(self)
 
         self._site._dataset_replicas.pop(self._dataset)
 
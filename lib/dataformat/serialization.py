@@ -0,0 +1,178 @@
+"""
+Compact binary serialization of dataformat objects, used to communicate inventory updates
+between processes without going through repr() and eval().
+
+An object is packed into a tuple of primitive values (its "record"), whose first element is
+the type code. Records are what the repr strings used to be: snapshots of the object state that
+can be unpacked into an unlinked clone and embedded into an inventory.
+Lists of records are marshalled into frames that carry a magic string and a format version.
+"""
+
+import marshal
+import struct
+from array import array
+
+from exceptions import ObjectError
+from dataset import Dataset
+from block import Block
+from lfile import File
+from site import Site
+from sitepartition import SitePartition
+from group import Group
+from datasetreplica import DatasetReplica
+from blockreplica import BlockReplica
+from partition import Partition
+
+# Increment when the record layout of any type changes
+FORMAT_VERSION = 1
+
+_FRAME_MAGIC = 'DYNF'
+_FRAME_HEADER = struct.Struct('!4sBI') # magic, version, number of records
+
+# Type codes. Never reuse a code for a different type.
+T_GROUP, T_PARTITION, T_SITE, T_SITEPARTITION, T_DATASET, T_BLOCK, T_FILE, T_DATASETREPLICA, T_BLOCKREPLICA = range(1, 10)
+
+def _pack_group(obj):
+    return (T_GROUP, obj._name, obj._olevel, obj.id)
+
+def _pack_partition(obj):
+    return (T_PARTITION, obj._name, obj.id)
+
+def _pack_site(obj):
+    filename_mapping = dict((protocol, mapping._chains) for protocol, mapping in obj.filename_mapping.iteritems())
+    return (T_SITE, obj._name, obj.host, obj.storage_type, obj.backend, obj.status, filename_mapping, obj.x509proxy, obj.id)
+
+def _pack_sitepartition(obj):
+    return (T_SITEPARTITION, obj._site_name(), obj._partition_name(), obj._quota)
+
+def _pack_dataset(obj):
+    return (T_DATASET, obj._name, obj.status, obj.data_type, obj.software_version, obj.last_update, obj.is_open, obj.id)
+
+def _pack_block(obj):
+    return (T_BLOCK, obj.real_name(), obj._dataset_name(), obj._size, obj._num_files, obj.is_open, obj.last_update, obj.id)
+
+def _pack_file(obj):
+    return (T_FILE, obj._lfn, obj._block_full_name(), obj.size, obj.checksum, obj.id)
+
+def _pack_datasetreplica(obj):
+    return (T_DATASETREPLICA, obj._dataset_name(), obj._site_name(), obj.growing, obj._group_name())
+
+def _pack_blockreplica(obj):
+    # same convention as BlockReplica.__repr__: size = -1 if the replica is complete
+    if obj.is_complete():
+        size = -1
+        file_ids = None
+    else:
+        size = obj.size
+        file_ids = obj.file_ids
+        if type(file_ids) is array:
+            # marshal does not handle arrays
+            file_ids = tuple(file_ids)
+
+    return (T_BLOCKREPLICA, obj._block_full_name(), obj._site_name(), obj._group_name(), obj.is_custodial, size, obj.last_update, file_ids)
+
+def _unpack_group(rec):
+    return Group(rec[1], rec[2], rec[3])
+
+def _unpack_partition(rec):
+    return Partition(rec[1], None, rec[2])
+
+def _unpack_site(rec):
+    return Site(rec[1], rec[2], rec[3], rec[4], rec[5], rec[6], rec[7], rec[8])
+
+def _unpack_sitepartition(rec):
+    return SitePartition(rec[1], rec[2], rec[3])
+
+def _unpack_dataset(rec):
+    return Dataset(rec[1], rec[2], rec[3], rec[4], rec[5], rec[6], rec[7])
+
+def _unpack_block(rec):
+    return Block(rec[1], rec[2], rec[3], rec[4], rec[5], rec[6], rec[7], False)
+
+def _unpack_file(rec):
+    return File(rec[1], rec[2], rec[3], rec[4], rec[5])
+
+def _unpack_datasetreplica(rec):
+    return DatasetReplica(rec[1], rec[2], rec[3], rec[4])
+
+def _unpack_blockreplica(rec):
+    return BlockReplica(rec[1], rec[2], rec[3], rec[4], rec[5], rec[6], rec[7])
+
+_packers = {
+    Group: _pack_group,
+    Partition: _pack_partition,
+    Site: _pack_site,
+    SitePartition: _pack_sitepartition,
+    Dataset: _pack_dataset,
+    Block: _pack_block,
+    File: _pack_file,
+    DatasetReplica: _pack_datasetreplica,
+    BlockReplica: _pack_blockreplica
+}
+
+_unpackers = [None, _unpack_group, _unpack_partition, _unpack_site, _unpack_sitepartition, _unpack_dataset,
+              _unpack_block, _unpack_file, _unpack_datasetreplica, _unpack_blockreplica]
+
+def pack(obj):
+    """
+    @param obj  A dataformat object.
+    @return A record (tuple of primitive values) representing the current state of obj.
+    """
+
+    try:
+        packer = _packers[type(obj)]
+    except KeyError:
+        # subclasses (e.g. sites of an inventory image) are packed as their base type
+        for base in type(obj).__mro__[1:]:
+            if base in _packers:
+                packer = _packers[base]
+                break
+        else:
+            raise ObjectError('Cannot serialize object of type %s' % type(obj).__name__)
+
+    return packer(obj)
+
+def unpack(record):
+    """
+    @param record  A record returned by pack()
+    @return An unlinked object (equivalent to eval(repr(obj)) of the original).
+    """
+
+    try:
+        unpacker = _unpackers[record[0]]
+    except (IndexError, TypeError):
+        unpacker = None
+
+    if unpacker is None:
+        raise ObjectError('Unknown record type %s' % str(record[0]))
+
+    return unpacker(record)
+
+def encode_frame(records):
+    """
+    @param records  List of marshallable values (typically (cmd, record) pairs).
+    @return Binary string of one frame.
+    """
+
+    return _FRAME_HEADER.pack(_FRAME_MAGIC, FORMAT_VERSION, len(records)) + marshal.dumps(records, 2)
+
+def decode_frame(data):
+    """
+    @param data  Binary string returned by encode_frame.
+    @return List of values in the frame.
+    """
+
+    if len(data) < _FRAME_HEADER.size:
+        raise ObjectError('Truncated frame (%d bytes)' % len(data))
+
+    magic, version, num_records = _FRAME_HEADER.unpack_from(data)
+    if magic != _FRAME_MAGIC:
+        raise ObjectError('Invalid frame header')
+    if version != FORMAT_VERSION:
+        raise ObjectError('Frame format version %d is not supported (expected %d)' % (version, FORMAT_VERSION))
+
+    records = marshal.loads(data[_FRAME_HEADER.size:])
+    if len(records) != num_records:
+        raise ObjectError('Frame is corrupt: expected %d records, got %d' % (num_records, len(records)))
+
+    return records
@@ -237,9 +237,9 @@ class Site(object):
                     continue
     
                 if block_replicas == replica.block_replicas:
-                    site_partition.replicas[replica] = None
+                    site_partition.set_replica(replica, None)
                 else:
-                    site_partition.replicas[replica] = block_replicas
+                    site_partition.set_replica(replica, block_replicas)
 
     def add_block_replica(self, replica):
         # this function should be called automatically to avoid integrity errors
@@ -253,26 +253,27 @@ class Site(object):
 
         for partition, site_partition in self.partitions.iteritems():
             if not partition.contains(replica):
+                if dataset_replica in site_partition.replicas and site_partition.replicas[dataset_replica] is None:
+                    # the partition contained all block replicas until now
+                    block_replicas = set(dataset_replica.block_replicas)
+                    block_replicas.remove(replica)
+                    site_partition.set_replica(dataset_replica, block_replicas)
+
                 continue
 
-            try:
-                block_replica_list = site_partition.replicas[dataset_replica]
-            except KeyError:
+            if dataset_replica not in site_partition.replicas:
                 if len(dataset_replica.block_replicas) == 1:
                     # this is the sole block replica
-                    site_partition.replicas[dataset_replica] = None
+                    site_partition.set_replica(dataset_replica, None)
                 else:
-                    site_partition.replicas[dataset_replica] = set([replica])
+                    site_partition.set_replica(dataset_replica, set([replica]))
             else:
-                if block_replica_list is None:
-                    # assume this function was called for all new block replicas
-                    # then we are just adding another replica to this partition
-                    pass
-                else:
-                    # again assuming this function is called for all new block replicas,
-                    # block_replica_list not being None implies that adding this new
-                    # replica will not make the dataset replica in this partition complete
-                    block_replica_list.add(replica)
+                # If the entry is None, assume this function was called for all new block replicas
+                # then we are just adding another replica to this partition.
+                # Again assuming this function is called for all new block replicas,
+                # block replica list not being None implies that adding this new
+                # replica will not make the dataset replica in this partition complete
+                site_partition.add_block_replica(dataset_replica, replica)
 
     def update_partitioning(self, replica):
         if replica.site is not self:
@@ -296,7 +297,7 @@ class Site(object):
                             block_replicas.add(block_replica)
 
                     if block_replicas != replica.block_replicas:
-                        site_partition.replicas[replica] = block_replicas
+                        site_partition.set_replica(replica, block_replicas)
 
                     continue
 
@@ -315,14 +316,11 @@ class Site(object):
                         block_replicas.add(block_replica)
                
                 if len(block_replicas) == 0:
-                    try:
-                        site_partition.replicas.pop(replica)
-                    except KeyError:
-                        pass
+                    site_partition.remove_replica(replica)
                 elif block_replicas == replica.block_replicas:
-                    site_partition.replicas[replica] = None
+                    site_partition.set_replica(replica, None)
                 else:
-                    site_partition.replicas[replica] = block_replicas
+                    site_partition.set_replica(replica, block_replicas)
 
         else:
             # BlockReplica
@@ -357,15 +355,34 @@ class Site(object):
                             pass
 
                 if len(block_replicas) == 0:
-                    try:
-                        site_partition.replicas.pop(dataset_replica)
-                    except KeyError:
-                        pass
-
+                    site_partition.remove_replica(dataset_replica)
                 elif block_replicas == dataset_replica.block_replicas:
-                    site_partition.replicas[dataset_replica] = None
+                    site_partition.set_replica(dataset_replica, None)
                 else:
-                    site_partition.replicas[dataset_replica] = block_replicas
+                    site_partition.set_replica(dataset_replica, block_replicas)
+
+    def adjust_occupancy(self, replica, physical_delta, projected_delta = 0):
+        """
+        Propagate a size change of a block replica to the occupancy of the partitions that contain it.
+        Call before update_partitioning if the replica size changes together with the partitioning.
+        @param replica          BlockReplica
+        @param physical_delta   Change in the replica size
+        @param projected_delta  Change in the block size
+        """
+
+        dataset_replica = self.find_dataset_replica(replica.block.dataset)
+
+        if dataset_replica is None:
+            return
+
+        for site_partition in self.partitions.itervalues():
+            try:
+                block_replicas = site_partition.replicas[dataset_replica]
+            except KeyError:
+                continue
+
+            if block_replicas is None or replica in block_replicas:
+                site_partition.adjust_occupancy(dataset_replica, physical_delta, projected_delta)
 
     def to_pfn(self, lfn, protocol):
         try:
@@ -5,7 +5,10 @@ from exceptions import ObjectError, IntegrityError
 class SitePartition(object):
     """State of a partition at a site."""
 
-    __slots__ = ['_site', '_partition', '_quota', 'replicas']
+    __slots__ = ['_site', '_partition', '_quota', 'replicas', '_replica_sizes', '_physical_size', '_projected_size']
+
+    # If True, occupancy_fraction() verifies the running totals against a full recount (slow; for debugging)
+    _check_occupancy = False
 
     @property
     def site(self):
@@ -37,7 +40,13 @@ class SitePartition(object):
         # partition quota in bytes
         self._quota = quota
         # {dataset_replica: set(block_replicas) or None (if all blocks are in)}
+        # Use set_replica, remove_replica etc. to modify the content so that the occupancy stays consistent.
         self.replicas = {}
+        # {dataset_replica: [physical size, projected size]} of the replicas in this partition
+        self._replica_sizes = {}
+        # running totals of the values in _replica_sizes
+        self._physical_size = 0
+        self._projected_size = 0
 
     def __str__(self):
         if type(self._partition) is str:
@@ -129,16 +138,151 @@ class SitePartition(object):
         elif quota < 0:
             return 0.
         else:
-            total_size = 0.
-            for replica, block_replicas in self.replicas.iteritems():
-                if block_replicas is None:
-                    total_size += replica.size(physical = physical)
-                elif physical:
-                    total_size += sum(br.size for br in block_replicas)
-                else:
-                    total_size += sum(br.block.size for br in block_replicas)
+            if SitePartition._check_occupancy:
+                self.check_occupancy()
+
+            if physical:
+                return float(self._physical_size) / quota
+            else:
+                return float(self._projected_size) / quota
+
+    def set_replica(self, replica, block_replicas):
+        """
+        Set the block replicas of the dataset replica contained in this partition and update the occupancy.
+        @param replica         DatasetReplica
+        @param block_replicas  Set of block replicas or None if all block replicas of the dataset replica are in.
+        """
+
+        self.replicas[replica] = block_replicas
+
+        physical, projected = self._count_size(replica, block_replicas)
+
+        try:
+            sizes = self._replica_sizes[replica]
+        except KeyError:
+            self._replica_sizes[replica] = [physical, projected]
+        else:
+            self._physical_size -= sizes[0]
+            self._projected_size -= sizes[1]
+            sizes[0] = physical
+            sizes[1] = projected
+
+        self._physical_size += physical
+        self._projected_size += projected
+
+    def remove_replica(self, replica):
+        """
+        Remove the dataset replica from this partition. No-op if the replica is not in the partition.
+        @param replica  DatasetReplica
+        """
+
+        try:
+            self.replicas.pop(replica)
+        except KeyError:
+            return
+
+        sizes = self._replica_sizes.pop(replica)
+        self._physical_size -= sizes[0]
+        self._projected_size -= sizes[1]
+
+    def add_block_replica(self, replica, block_replica):
+        """
+        Add a block replica to an existing entry in this partition.
+        If the entry is None (full dataset replica), block_replica is assumed to be already in replica.block_replicas.
+        @param replica        DatasetReplica
+        @param block_replica  BlockReplica
+        """
 
-            return total_size / quota
+        block_replicas = self.replicas[replica]
+        if block_replicas is not None:
+            if block_replica in block_replicas:
+                return
+
+            block_replicas.add(block_replica)
+
+        self.adjust_occupancy(replica, block_replica.size, block_replica.block.size)
+
+    def remove_block_replica(self, replica, block_replica):
+        """
+        Remove a block replica that is being unlinked from replica.
+        @param replica        DatasetReplica
+        @param block_replica  BlockReplica
+        """
+
+        try:
+            block_replicas = self.replicas[replica]
+        except KeyError:
+            return
+
+        if block_replicas is not None:
+            try:
+                block_replicas.remove(block_replica)
+            except KeyError:
+                # this replica was not part of the partition
+                return
+
+            if len(block_replicas) == 0:
+                self.remove_replica(replica)
+                return
+
+        # if block_replicas is None, site_partition contained all block replicas. It will contain all after a deletion.
+        self.adjust_occupancy(replica, -block_replica.size, -block_replica.block.size)
+
+    def adjust_occupancy(self, replica, physical_delta, projected_delta):
+        """
+        Account for a size change of a block replica belonging to replica in this partition.
+        """
+
+        try:
+            sizes = self._replica_sizes[replica]
+        except KeyError:
+            return
+
+        sizes[0] += physical_delta
+        sizes[1] += projected_delta
+        self._physical_size += physical_delta
+        self._projected_size += projected_delta
+
+    def reset_occupancy(self):
+        """
+        Recount the occupancy from scratch.
+        """
+
+        self._replica_sizes = {}
+        self._physical_size = 0
+        self._projected_size = 0
+
+        for replica, block_replicas in self.replicas.iteritems():
+            physical, projected = self._count_size(replica, block_replicas)
+            self._replica_sizes[replica] = [physical, projected]
+            self._physical_size += physical
+            self._projected_size += projected
+
+    def check_occupancy(self):
+        """
+        Compare the running occupancy totals against a full recount. Raise IntegrityError if they do not agree.
+        """
+
+        physical_total = 0
+        projected_total = 0
+        for replica, block_replicas in self.replicas.iteritems():
+            physical, projected = self._count_size(replica, block_replicas)
+            try:
+                sizes = self._replica_sizes[replica]
+            except KeyError:
+                raise IntegrityError('%s/%s: %s is not accounted in occupancy' % (self._site_name(), self._partition_name(), str(replica)))
+
+            if sizes[0] != physical or sizes[1] != projected:
+                raise IntegrityError('%s/%s: occupancy of %s is (%d, %d) but recount gives (%d, %d)' % \
+                    (self._site_name(), self._partition_name(), str(replica), sizes[0], sizes[1], physical, projected))
+
+            physical_total += physical
+            projected_total += projected
+
+        if len(self._replica_sizes) != len(self.replicas) or \
+                physical_total != self._physical_size or projected_total != self._projected_size:
+            raise IntegrityError('%s/%s: occupancy totals (%d, %d) do not match recount (%d, %d)' % \
+                (self._site_name(), self._partition_name(), self._physical_size, self._projected_size, physical_total, projected_total))
 
     def embed_tree(self, inventory):
         if self._partition._subpartitions is not None:
@@ -158,3 +302,15 @@ class SitePartition(object):
             return self._partition
         else:
             return self._partition.name
+
+    def _count_size(self, replica, block_replicas):
+        if block_replicas is None:
+            block_replicas = replica.block_replicas
+
+        physical = 0
+        projected = 0
+        for block_replica in block_replicas:
+            physical += block_replica.size
+            projected += block_replica.block.size
+
+        return physical, projected
@@ -0,0 +1,329 @@
+"""
+Columnar snapshot of the detox decisions of a cycle. The snapshot is written directly from the decision
+maps of the cycle to an uncompressed file in the spool directory, which the history readers map into
+memory, and (for numbered cycles) at the same time to an xz-compressed archive copy.
+
+File layout (integers little endian):
+  header (magic, format version, number of sites, number of indexed sites, number of replicas)
+  site columns: site_id, quota, status
+  site index columns: site_id, first replica row (one extra entry for the end), replica count and
+                      volume per decision
+  replica columns: dataset_id, size, condition, decision
+Replica rows are sorted by (site_id, dataset_id). The site index is sorted by site_id.
+"""
+
+import os
+import mmap
+import struct
+import bisect
+import logging
+
+import lzma
+
+LOG = logging.getLogger(__name__)
+
+# Increment when the layout changes
+FORMAT_VERSION = 1
+
+# Decision codes are indices in this list (same order as the MySQL enum of the history cache tables)
+DECISIONS = ('delete', 'keep', 'protect')
+
+_MAGIC = 'DYDX'
+_HEADER = struct.Struct('<4sBxxxIII')
+
+# Number of values packed at once
+_CHUNK = 65536
+
+def write(path, archive_path, replicas, sites):
+    """
+    Write the snapshot. Files are written under temporary names and renamed at the end.
+    @param path          Path of the uncompressed snapshot.
+    @param archive_path  Path of the xz-compressed copy or None.
+    @param replicas      List of (site_id, dataset_id, size, decision, condition_id) with decision in DECISIONS.
+                         Sorted in place.
+    @param sites         List of (site_id, status, quota). Quotas (TB) are rounded to integers.
+    """
+
+    replicas.sort()
+    sites = sorted(sites)
+
+    index_site_ids = []
+    index_offsets = []
+    index_counts = []
+    index_volumes = []
+    for irow, (site_id, _, size, decision, _) in enumerate(replicas):
+        if len(index_site_ids) == 0 or site_id != index_site_ids[-1]:
+            index_site_ids.append(site_id)
+            index_offsets.append(irow)
+            index_counts.extend([0] * len(DECISIONS))
+            index_volumes.extend([0] * len(DECISIONS))
+
+        pos = (len(index_site_ids) - 1) * len(DECISIONS) + DECISIONS.index(decision)
+        index_counts[pos] += 1
+        index_volumes[pos] += size
+
+    index_offsets.append(len(replicas))
+
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    if archive_path is not None:
+        tmp_archive_path = '%s.%d.tmp' % (archive_path, os.getpid())
+
+    output = open(tmp_path, 'wb')
+    archive = None
+    compressor = None
+
+    try:
+        if archive_path is not None:
+            archive = open(tmp_archive_path, 'wb')
+            compressor = lzma.LZMACompressor()
+
+        def put(data):
+            output.write(data)
+            if compressor is not None:
+                archive.write(compressor.compress(data))
+
+        def put_column(fmt, values):
+            for start in xrange(0, len(values), _CHUNK):
+                chunk = values[start:start + _CHUNK]
+                put(struct.pack('<%d%s' % (len(chunk), fmt), *chunk))
+
+        put(_HEADER.pack(_MAGIC, FORMAT_VERSION, len(sites), len(index_site_ids), len(replicas)))
+
+        put_column('I', [s[0] for s in sites])
+        # quotas are passed in TB as floats; round as the integer column of the old MySQL table did
+        put_column('i', [int(round(s[2])) for s in sites])
+        put_column('B', [s[1] for s in sites])
+
+        put_column('I', index_site_ids)
+        put_column('I', index_offsets)
+        put_column('I', index_counts)
+        put_column('Q', index_volumes)
+
+        for column, fmt in [(1, 'I'), (2, 'Q'), (4, 'I')]:
+            put_column(fmt, [r[column] for r in replicas])
+
+        put_column('B', [DECISIONS.index(r[3]) for r in replicas])
+
+        output.close()
+
+        if archive is not None:
+            archive.write(compressor.flush())
+            archive.close()
+            os.rename(tmp_archive_path, archive_path)
+
+        os.rename(tmp_path, path)
+
+    except:
+        output.close()
+        tmp_paths = [tmp_path]
+        if archive is not None:
+            archive.close()
+            tmp_paths.append(tmp_archive_path)
+
+        for tmp in tmp_paths:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+
+        raise
+
+    LOG.info('Wrote detox snapshot %s with %d replicas.', path, len(replicas))
+
+def decompress(archive_path, path, chunk_size = 1048576):
+    """
+    Restore the uncompressed snapshot from the archive copy, without holding the full content in memory.
+    """
+
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+
+    decompressor = lzma.LZMADecompressor()
+
+    try:
+        with open(archive_path, 'rb') as source:
+            with open(tmp_path, 'wb') as output:
+                while True:
+                    data = source.read(chunk_size)
+                    if not data:
+                        break
+
+                    output.write(decompressor.decompress(data))
+
+        os.rename(tmp_path, path)
+
+    except:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+        raise
+
+def diff(old, new, site_ids = None):
+    """
+    Compare the decisions of two snapshots in one merge-join over the replica rows on (site_id, dataset_id).
+    A replica can have several rows (block-level decisions); the rows of a replica are compared as a whole.
+    @param old       CycleSnapshot
+    @param new       CycleSnapshot
+    @param site_ids  If not None, limit to these sites.
+    @return Generator of (site_id, dataset_id, old_rows, new_rows) in (site_id, dataset_id) order for the
+            replicas whose decisions differ. Rows are lists of (size, decision, condition_id). old_rows is
+            empty for replicas that only appear in new, and new_rows for replicas that only appear in old.
+    """
+
+    old_replicas = _group_rows(old.replicas(site_ids))
+    new_replicas = _group_rows(new.replicas(site_ids))
+
+    old_key, old_rows = next(old_replicas, (None, None))
+    new_key, new_rows = next(new_replicas, (None, None))
+
+    while old_key is not None or new_key is not None:
+        if new_key is None or (old_key is not None and old_key < new_key):
+            yield old_key[0], old_key[1], old_rows, []
+            old_key, old_rows = next(old_replicas, (None, None))
+
+        elif old_key is None or new_key < old_key:
+            yield new_key[0], new_key[1], [], new_rows
+            new_key, new_rows = next(new_replicas, (None, None))
+
+        else:
+            if old_rows != new_rows:
+                yield old_key[0], old_key[1], old_rows, new_rows
+
+            old_key, old_rows = next(old_replicas, (None, None))
+            new_key, new_rows = next(new_replicas, (None, None))
+
+def _group_rows(replicas):
+    """
+    @param replicas  Iterator over (site_id, dataset_id, size, decision, condition_id) in (site_id, dataset_id) order
+    @return Generator of ((site_id, dataset_id), [(size, decision, condition_id)])
+    """
+
+    key = None
+    rows = []
+    for site_id, dataset_id, size, decision, condition_id in replicas:
+        if (site_id, dataset_id) != key:
+            if key is not None:
+                yield key, rows
+
+            key = (site_id, dataset_id)
+            rows = []
+
+        rows.append((size, decision, condition_id))
+
+    if key is not None:
+        yield key, rows
+
+
+class CycleSnapshot(object):
+    """
+    Read access to a snapshot file. Columns are decoded from the mapped file on each call.
+    """
+
+    def __init__(self, path):
+        """
+        @param path  Path of the uncompressed snapshot.
+        """
+
+        self.path = path
+
+        with open(path, 'rb') as source:
+            self._map = mmap.mmap(source.fileno(), 0, access = mmap.ACCESS_READ)
+
+        magic, version, self.num_sites, self.num_indexed, self.num_replicas = _HEADER.unpack_from(self._map, 0)
+
+        if magic != _MAGIC:
+            raise RuntimeError('Invalid detox snapshot %s' % path)
+        if version != FORMAT_VERSION:
+            raise RuntimeError('Detox snapshot format version %d is not supported' % version)
+
+        # column positions
+        pos = _HEADER.size
+        self._columns = {}
+        for name, fmt, length in [
+                ('site_id', 'I', self.num_sites), ('quota', 'i', self.num_sites), ('status', 'B', self.num_sites),
+                ('index_site_id', 'I', self.num_indexed), ('index_offset', 'I', self.num_indexed + 1),
+                ('index_count', 'I', self.num_indexed * len(DECISIONS)), ('index_volume', 'Q', self.num_indexed * len(DECISIONS)),
+                ('dataset_id', 'I', self.num_replicas), ('size', 'Q', self.num_replicas), ('condition', 'I', self.num_replicas),
+                ('decision', 'B', self.num_replicas)]:
+            self._columns[name] = (pos, fmt)
+            pos += struct.calcsize('<' + fmt) * length
+
+        if pos != len(self._map):
+            raise RuntimeError('Truncated detox snapshot %s' % path)
+
+        self._index_site_ids = self._column('index_site_id', 0, self.num_indexed)
+        self._index_offsets = self._column('index_offset', 0, self.num_indexed + 1)
+
+    def close(self):
+        self._map.close()
+
+    def sites(self):
+        """
+        @return List of (site_id, status, quota)
+        """
+
+        return zip(self._column('site_id', 0, self.num_sites), self._column('status', 0, self.num_sites), self._column('quota', 0, self.num_sites))
+
+    def replica_site_ids(self):
+        """
+        @return Sorted list of the ids of the sites with replicas
+        """
+
+        return list(self._index_site_ids)
+
+    def site_summary(self):
+        """
+        @return {site_id: ([count per decision], [volume per decision])} with the decisions in the order of DECISIONS
+        """
+
+        ndec = len(DECISIONS)
+        counts = self._column('index_count', 0, self.num_indexed * ndec)
+        volumes = self._column('index_volume', 0, self.num_indexed * ndec)
+
+        summary = {}
+        for isite, site_id in enumerate(self._index_site_ids):
+            summary[site_id] = (list(counts[isite * ndec:(isite + 1) * ndec]), list(volumes[isite * ndec:(isite + 1) * ndec]))
+
+        return summary
+
+    def site_replicas(self, site_id):
+        """
+        @param site_id  Site id
+        @return List of (dataset_id, size, decision, condition_id) sorted by dataset_id
+        """
+
+        isite = bisect.bisect_left(self._index_site_ids, site_id)
+        if isite == self.num_indexed or self._index_site_ids[isite] != site_id:
+            return []
+
+        return self._rows(self._index_offsets[isite], self._index_offsets[isite + 1])
+
+    def replicas(self, site_ids = None):
+        """
+        Iterate over the replica rows in (site_id, dataset_id) order, decoding one site at a time.
+        @param site_ids  If not None, only iterate over the rows of these sites (looked up in the site index).
+        @return Generator of (site_id, dataset_id, size, decision, condition_id)
+        """
+
+        if site_ids is None:
+            isites = xrange(self.num_indexed)
+        else:
+            isites = []
+            for site_id in sorted(set(site_ids)):
+                isite = bisect.bisect_left(self._index_site_ids, site_id)
+                if isite != self.num_indexed and self._index_site_ids[isite] == site_id:
+                    isites.append(isite)
+
+        for isite in isites:
+            site_id = self._index_site_ids[isite]
+            for dataset_id, size, decision, condition_id in self._rows(self._index_offsets[isite], self._index_offsets[isite + 1]):
+                yield site_id, dataset_id, size, decision, condition_id
+
+    def _rows(self, begin, end):
+        decisions = [DECISIONS[code] for code in self._column('decision', begin, end)]
+        return zip(self._column('dataset_id', begin, end), self._column('size', begin, end), decisions, self._column('condition', begin, end))
+
+    def _column(self, name, begin, end):
+        pos, fmt = self._columns[name]
+        return struct.unpack_from('<%d%s' % (end - begin, fmt), self._map, pos + struct.calcsize('<' + fmt) * begin)
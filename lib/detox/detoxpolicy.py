@@ -1,9 +1,11 @@
+import time
 import logging
 
 from dynamo.dataformat import ConfigurationError
 import dynamo.policy.variables as variables
 import dynamo.policy.attrs as attrs
 import dynamo.policy.predicates as predicates
+import dynamo.policy.columnar as columnar
 from dynamo.policy.producers import get_producers
 from dynamo.detox.conditions import ReplicaCondition, SiteCondition
 from dynamo.detox.sort import SortKey
@@ -71,6 +73,9 @@ class PolicyLine(object):
         self.decision = decision
         self.has_match = False
 
+        # Which kinds of state changes (attrs.Attr.SCOPE_*) can alter the result of this line
+        self.scopes = set(self.condition.scopes)
+
         # filled by history interface
         self.condition_id = 0
 
@@ -78,25 +83,203 @@ class PolicyLine(object):
         return self.condition.text
 
     def evaluate(self, replica):
-        action = None
-
         if self.condition.match(replica):
-            self.has_match = True
+            return self.make_action(replica, self.condition.get_matching_blocks)
+        else:
+            return None
+
+    def make_action(self, replica, get_matching_blocks):
+        """
+        Create the action for a replica that matched the condition.
+        @param replica              DatasetReplica
+        @param get_matching_blocks  Function that returns the list of matching block replicas of a dataset replica
+        """
+
+        self.has_match = True
+
+        if issubclass(self.decision.action_cls, BlockAction):
+            # block-level
+            matching_block_replicas = get_matching_blocks(replica)
+
+            if len(matching_block_replicas) == len(replica.block_replicas):
+                # but all blocks matched - return dataset level
+                return self.decision.action_cls.dataset_level(self)
+            else:
+                return self.decision.action(self, matching_block_replicas)
+        else:
+            return self.decision.action(self)
 
 
-            if issubclass(self.decision.action_cls, BlockAction):
-                # block-level
-                matching_block_replicas = self.condition.get_matching_blocks(replica)
+class EvaluationPlan(object):
+    """
+    Policy lines compiled for one cycle. Attribute values and the sub-expressions they share (see
+    Attr.compile) are memoized per object until invalidate() is called for a replica of the dataset.
+    Time clauses of the lines are fixed at compilation.
+    If NumPy is available and the candidate replicas are given, the lines are also evaluated over a
+    columnar snapshot of the replicas (see policy.columnar), and the per-object evaluation is done
+    only where the snapshot cannot determine the outcome.
+    """
 
-                if len(matching_block_replicas) == len(replica.block_replicas):
-                    # but all blocks matched - return dataset level
-                    action = self.decision.action_cls.dataset_level(self)
+    def __init__(self, policy_lines, default_decision, replicas = None, now = None):
+        self.default_decision = default_decision
+
+        # [(line, [(predicate evaluation function, compiled attr)])] for the active lines
+        self.lines = []
+        # {function: {object: value}}
+        self.memo = {}
+        # memos of functions that depend on the block replica content of dataset replicas
+        self.volatile_memos = []
+        # columnar.ReplicaColumns
+        self.columns = None
+        # [[(predicate evaluation function, compiled attr)]] per line: tests not vectorized in the columns
+        self.residual_tests = None
+
+        active_lines = [line for line in policy_lines if line.condition.is_active(now)]
+
+        compiled_attrs = {}
+        # [([(predicate, compiled attr)], final)] for the columnar snapshot
+        conditions = []
+
+        for line in active_lines:
+            tests = []
+            conditions.append(([], not issubclass(line.decision.action_cls, BlockAction)))
+            for predicate in line.condition.predicates:
+                variable = predicate.variable
+                try:
+                    get = compiled_attrs[variable]
+                except KeyError:
+                    get = compiled_attrs[variable] = variable.compile(self._memoize)
+
+                tests.append((predicate.evaluate_lhs, get))
+                conditions[-1][0].append((predicate, get))
+
+            self.lines.append((line, tests))
+
+        LOG.info('Compiled %d policy lines with %d memoized expressions.', len(self.lines), len(self.memo))
+
+        if replicas is not None and len(self.lines) != 0:
+            if columnar.available():
+                self.columns = columnar.ReplicaColumns(replicas)
+                if self.columns.evaluate(conditions) == 0:
+                    # nothing to gain
+                    self.columns = None
                 else:
-                    action = self.decision.action(self, matching_block_replicas)
+                    self.residual_tests = [[tests[i] for i in itests] for (_, tests), itests in zip(self.lines, self.columns.residual_tests)]
+            else:
+                LOG.info('NumPy is not available. Policy lines are evaluated object by object.')
+
+    def evaluate(self, replica):
+        """
+        Same as DetoxPolicy.evaluate without a plan.
+        @param replica  DatasetReplica
+        @return List of actions
+        """
+
+        actions = []
+        block_replicas_tmp = set()
+
+        # line states from the columnar snapshot
+        if self.columns is None:
+            states = None
+        else:
+            states = self.columns.get_states(replica)
+
+        FALSE, UNDETERMINED, RESIDUAL = columnar.ReplicaColumns.FALSE, columnar.ReplicaColumns.UNDETERMINED, columnar.ReplicaColumns.RESIDUAL
+
+        for iline, (line, tests) in enumerate(self.lines):
+            if states is not None and states[iline] != UNDETERMINED:
+                if states[iline] == FALSE:
+                    continue
+                elif states[iline] == RESIDUAL and not EvaluationPlan._match(self.residual_tests[iline], replica):
+                    continue
+
+            elif not EvaluationPlan._match(tests, replica):
+                continue
+
+            action = line.make_action(replica, lambda r: [br for br in r.block_replicas if EvaluationPlan._match(tests, br)])
+
+            actions.append(action)
+            if isinstance(action, DatasetAction):
+                break
+
             else:
-                action = self.decision.action(self)
+                # strip the block replicas from dataset replica so the successive
+                # policy lines don't see them any more
+                for block_replica in action.block_replicas:
+                    replica.block_replicas.remove(block_replica)
+                    block_replicas_tmp.add(block_replica)
+
+                # values computed from the full replica are no longer valid
+                self._forget(replica)
+                states = None
+
+        else:
+            actions.append(self.default_decision.action(None))
+
+        if len(block_replicas_tmp) != 0:
+            # return the block replicas
+            replica.block_replicas.update(block_replicas_tmp)
+            self._forget(replica)
+
+        return actions
+
+    def invalidate(self, replica):
+        """
+        Discard memoized values that can depend on the state of the replica. Call when the block replicas
+        of the replica are deleted or change ownership.
+        @param replica  DatasetReplica
+        """
+
+        dataset = replica.dataset
+        keys = [dataset]
+        keys.extend(dataset.blocks)
+        for dataset_replica in dataset.replicas:
+            keys.append(dataset_replica)
+            keys.extend(dataset_replica.block_replicas)
+
+        if replica not in dataset.replicas:
+            keys.append(replica)
+            keys.extend(replica.block_replicas)
 
-        return action
+        for memo in self.memo.itervalues():
+            for key in keys:
+                memo.pop(key, None)
+
+        if self.columns is not None:
+            self.columns.invalidate(replica)
+
+    @staticmethod
+    def _match(tests, obj):
+        for test, get in tests:
+            if not test(get(obj)):
+                return False
+
+        return True
+
+    def _memoize(self, func, volatile = True):
+        try:
+            memo = self.memo[func]
+        except KeyError:
+            memo = self.memo[func] = {}
+            if volatile:
+                self.volatile_memos.append(memo)
+
+        def get(obj):
+            try:
+                return memo[obj]
+            except KeyError:
+                value = memo[obj] = func(obj)
+                return value
+
+        return get
+
+    def _forget(self, replica):
+        # Only values of dataset replicas and datasets depend on the set of block replicas in a
+        # dataset replica (block replica values are computed from the block replica and its block).
+        dataset = replica.dataset
+        for memo in self.volatile_memos:
+            memo.pop(replica, None)
+            memo.pop(dataset, None)
 
 
 class DetoxPolicy(object):
@@ -127,6 +310,12 @@ class DetoxPolicy(object):
         # the replicas that should not be deleted.
         self.predelete_check = None
 
+        # EvaluationPlan for the current cycle. Lines are evaluated one by one when None.
+        self.plan = None
+
+        # Use the NumPy columnar snapshot in the evaluation plan when available.
+        self.use_columns = config.get('use_columns', True)
+
     def parse_lines(self, lines, attrs_config):
         LOG.info('Parsing policy stack.')
 
@@ -218,10 +407,56 @@ class DetoxPolicy(object):
 
         self.attr_producers = list(set(get_producers(attr_names, attrs_config).itervalues()))
 
+        # Union of the dependency scopes of the policy lines. Because the lines are evaluated in
+        # sequence, the result for a replica can change whenever any of the lines can.
+        self.evaluation_scopes = set()
+        for line in self.policy_lines:
+            self.evaluation_scopes.update(line.scopes)
+
         LOG.info('Policy stack for %s: %d lines using dataset attr producers [%s]', \
                  self.partition_name, len(self.policy_lines), ' '.join(type(p).__name__ for p in self.attr_producers))
 
+    def resolve_time_conditions(self):
+        """
+        Re-resolve the until / from clauses of all conditions against the current time.
+        Called at the beginning of each cycle.
+        """
+
+        now = time.time()
+
+        for conds in [self.target_site_def, self.deletion_trigger, self.stop_condition]:
+            for cond in conds:
+                cond.resolve_time_condition(now)
+
+        for line in self.policy_lines:
+            line.condition.resolve_time_condition(now)
+
+    def compile_plan(self, replicas = None):
+        """
+        Compile the policy lines into an EvaluationPlan for the current cycle. Call after the inventory
+        is loaded and the dataset attrs are produced; memoized values are valid until invalidate() is called.
+        @param replicas  Candidate dataset replicas. If given and use_columns is True, the lines are
+                         pre-evaluated over a columnar snapshot of the replicas.
+        """
+
+        if not self.use_columns:
+            replicas = None
+
+        self.plan = EvaluationPlan(self.policy_lines, self.default_decision, replicas = replicas)
+
+    def invalidate(self, replica):
+        """
+        Inform the evaluation plan that the replica was modified.
+        @param replica  DatasetReplica
+        """
+
+        if self.plan is not None:
+            self.plan.invalidate(replica)
+
     def evaluate(self, replica):
+        if self.plan is not None:
+            return self.plan.evaluate(replica)
+
         actions = []
         block_replicas_tmp = set()
 
@@ -1,11 +1,12 @@
 import os
 import re
+import time
 import sqlite3
 import lzma
 import hashlib
-import signal
 import logging
 
+import dynamo.detox.cyclesnapshot as cyclesnapshot
 from dynamo.utils.interface.mysql import MySQL
 from dynamo.dataformat import Site
 from dynamo.operation.history import DeletionHistoryDatabase
@@ -76,9 +77,35 @@ class DetoxHistoryBase(DeletionHistoryDatabase):
         @param cycle_number   Detox cycle number
         @param skip_unused    If true, don't list sites that had no data in the cycle
 
-        @return {site_name:  (id, status, quota)}
+        @return {site_name:  (status, quota)}
         """
 
+        snapshot = self._open_snapshot(cycle_number)
+        if snapshot is None:
+            return self._get_sites_from_cache(cycle_number, skip_unused)
+
+        try:
+            sites = snapshot.sites()
+            if skip_unused:
+                used = set(snapshot.replica_site_ids())
+                sites = [s for s in sites if s[0] in used]
+        finally:
+            snapshot.close()
+
+        site_names = self._get_names('sites', [s[0] for s in sites])
+
+        sites_dict = {}
+
+        for site_id, status, quota in sites:
+            try:
+                sites_dict[site_names[site_id]] = (Site.status_name(status), quota)
+            except KeyError:
+                pass
+
+        return sites_dict
+
+    def _get_sites_from_cache(self, cycle_number, skip_unused):
+        # cycles saved before the columnar snapshots
         self._fill_snapshot_cache('sites', cycle_number)
 
         table_name = 'sites_%d' % cycle_number
@@ -105,9 +132,72 @@ class DetoxHistoryBase(DeletionHistoryDatabase):
         @param decisions      If a list, limit to specified decisions
         
         @return If size_only = True: a dict {site: (protect_size, delete_size, keep_size)}
-                If size_only = False: a massive dict {site: [(dataset, size, decision, reason)]}
+                If size_only = False: a massive dict {site: [(dataset, size, decision, condition_id, reason)]}
         """
 
+        snapshot = self._open_snapshot(cycle_number)
+        if snapshot is None:
+            return self._get_deletion_decisions_from_cache(cycle_number, size_only, decisions)
+
+        if type(decisions) is not list:
+            decisions = list(cyclesnapshot.DECISIONS)
+
+        try:
+            if size_only:
+                summary = snapshot.site_summary()
+            else:
+                site_rows = {}
+                for site_id in snapshot.replica_site_ids():
+                    rows = [row for row in snapshot.site_replicas(site_id) if row[2] in decisions]
+                    if len(rows) != 0:
+                        site_rows[site_id] = rows
+        finally:
+            snapshot.close()
+
+        if size_only:
+            # return {site_name: (protect_size, delete_size, keep_size)}
+            site_names = self._get_names('sites', summary.keys())
+
+            product = {}
+
+            for site_id, (counts, volumes) in summary.iteritems():
+                try:
+                    site_name = site_names[site_id]
+                except KeyError:
+                    continue
+
+                v = {}
+                found = False
+                for idec, decision in enumerate(cyclesnapshot.DECISIONS):
+                    if decision in decisions:
+                        v[decision] = volumes[idec] * 1.e-12
+                        found |= (counts[idec] != 0)
+                    else:
+                        v[decision] = 0
+
+                if found:
+                    product[site_name] = (v['protect'], v['delete'], v['keep'])
+
+            return product
+
+        else:
+            # return {site_name: [(dataset_name, size, decision, condition_id, reason)]}
+            site_names = self._get_names('sites', site_rows.keys())
+
+            product = {}
+
+            for site_id, rows in site_rows.iteritems():
+                try:
+                    site_name = site_names[site_id]
+                except KeyError:
+                    continue
+
+                product[site_name] = self._make_decision_list(rows)
+
+            return product
+
+    def _get_deletion_decisions_from_cache(self, cycle_number, size_only, decisions):
+        # cycles saved before the columnar snapshots
         self._fill_snapshot_cache('replicas', cycle_number)
 
         table_name = 'replicas_%d' % cycle_number
@@ -172,6 +262,25 @@ class DetoxHistoryBase(DeletionHistoryDatabase):
         @return  site-specific version of get_deletion_decisions with size_only = False
         """
 
+        snapshot = self._open_snapshot(cycle_number)
+        if snapshot is None:
+            return self._get_site_deletion_decisions_from_cache(cycle_number, site_name)
+
+        try:
+            site_id = self.db.query('SELECT `id` FROM `{0}`.`sites` WHERE `name` = %s'.format(self.history_db), site_name)[0]
+        except IndexError:
+            snapshot.close()
+            return []
+
+        try:
+            rows = snapshot.site_replicas(site_id)
+        finally:
+            snapshot.close()
+
+        return self._make_decision_list(rows)
+
+    def _get_site_deletion_decisions_from_cache(self, cycle_number, site_name):
+        # cycles saved before the columnar snapshots
         self._fill_snapshot_cache('replicas', cycle_number)
 
         table_name = 'replicas_%d' % cycle_number
@@ -184,6 +293,245 @@ class DetoxHistoryBase(DeletionHistoryDatabase):
 
         return self.db.query(query, site_name)
 
+    def get_decision_diff(self, old_cycle, new_cycle, site_names = None):
+        """
+        Compare the deletion decisions of two cycles.
+        @param old_cycle   Cycle number or partition name
+        @param new_cycle   Cycle number or partition name
+        @param site_names  If a list, limit to the sites
+
+        @return {site_name: [(dataset_name, old_decisions, new_decisions)]} where decisions are lists of
+                (size, decision, condition_id, condition_text). old_decisions is empty for replicas that
+                are only in new_cycle and new_decisions is empty for replicas that are only in old_cycle.
+        """
+
+        if site_names is None:
+            site_ids = None
+        else:
+            if len(site_names) == 0:
+                return {}
+
+            table_str = MySQL.bare('`%s`.`sites`' % self.history_db)
+            site_ids = self.db.select_many(table_str, ('id',), 'name', site_names)
+
+        old = self._open_snapshot(old_cycle, convert_legacy = True)
+        if old is None:
+            raise RuntimeError('Snapshot of cycle %s does not exist' % old_cycle)
+
+        try:
+            new = self._open_snapshot(new_cycle, convert_legacy = True)
+            if new is None:
+                raise RuntimeError('Snapshot of cycle %s does not exist' % new_cycle)
+
+            try:
+                changes = list(cyclesnapshot.diff(old, new, site_ids))
+            finally:
+                new.close()
+        finally:
+            old.close()
+
+        site_names = self._get_names('sites', set(c[0] for c in changes))
+        dataset_names = self._get_names('datasets', set(c[1] for c in changes))
+        condition_ids = set()
+        for change in changes:
+            condition_ids.update(row[2] for row in change[2])
+            condition_ids.update(row[2] for row in change[3])
+        condition_texts = self._get_names('policy_conditions', condition_ids, column = 'text')
+
+        product = {}
+
+        for site_id, dataset_id, old_rows, new_rows in changes:
+            try:
+                site_name = site_names[site_id]
+                dataset_name = dataset_names[dataset_id]
+            except KeyError:
+                continue
+
+            old_decisions = [(size, decision, cid, condition_texts.get(cid)) for size, decision, cid in old_rows]
+            new_decisions = [(size, decision, cid, condition_texts.get(cid)) for size, decision, cid in new_rows]
+
+            try:
+                product[site_name].append((dataset_name, old_decisions, new_decisions))
+            except KeyError:
+                product[site_name] = [(dataset_name, old_decisions, new_decisions)]
+
+        return product
+
+    def get_site_volume_series(self, partition, site_name = None, since = 0, operation = 'deletion'):
+        """
+        Volumes of each decision per site over the cycles of a partition. The volumes are recorded when
+        the cycles are closed.
+        @param partition  Partition name
+        @param site_name  If not None, limit to the site
+        @param since      Only cycles started at or after this UNIX time
+        @param operation  'deletion' or 'deletion_test'
+
+        @return [(cycle, timestamp, {site_name: (protect_size, delete_size, keep_size)})] in the order of
+                cycles, sizes in TB
+        """
+
+        sql = 'SELECT c.`id`, UNIX_TIMESTAMP(c.`time_start`), s.`name`, v.`decision`, v.`volume` * 1.e-12'
+        sql += ' FROM `{0}`.`deletion_site_volumes` AS v'.format(self.history_db)
+        sql += ' INNER JOIN `{0}`.`deletion_cycles` AS c ON c.`id` = v.`cycle_id`'.format(self.history_db)
+        sql += ' INNER JOIN `{0}`.`partitions` AS p ON p.`id` = c.`partition_id`'.format(self.history_db)
+        sql += ' INNER JOIN `{0}`.`sites` AS s ON s.`id` = v.`site_id`'.format(self.history_db)
+        sql += ' WHERE p.`name` = %s AND c.`operation` = %s AND c.`time_start` >= FROM_UNIXTIME(%s)'
+
+        args = (partition, operation, since)
+
+        if site_name is not None:
+            sql += ' AND s.`name` = %s'
+            args += (site_name,)
+
+        sql += ' ORDER BY c.`id`'
+
+        series = []
+        volumes = {}
+
+        for cycle_number, timestamp, sname, decision, volume in self.db.xquery(sql, *args):
+            if len(series) == 0 or series[-1][0] != cycle_number:
+                volumes = {}
+                series.append((cycle_number, timestamp, volumes))
+
+            try:
+                site_volumes = volumes[sname]
+            except KeyError:
+                site_volumes = volumes[sname] = {'protect': 0., 'delete': 0., 'keep': 0.}
+
+            site_volumes[decision] = volume
+
+        for _, _, volumes in series:
+            for sname, v in volumes.items():
+                volumes[sname] = (v['protect'], v['delete'], v['keep'])
+
+        return series
+
+    def _make_decision_list(self, rows):
+        """
+        @param rows  List of (dataset_id, size, decision, condition_id) of a site
+        @return List of (dataset_name, size, decision, condition_id, condition_text) in decreasing order of size
+        """
+
+        dataset_names = self._get_names('datasets', set(row[0] for row in rows))
+        condition_texts = self._get_names('policy_conditions', set(row[3] for row in rows), column = 'text')
+
+        decision_list = []
+        for dataset_id, size, decision, condition_id in sorted(rows, key = lambda row: row[1], reverse = True):
+            try:
+                dataset_name = dataset_names[dataset_id]
+            except KeyError:
+                continue
+
+            decision_list.append((dataset_name, size, decision, condition_id, condition_texts.get(condition_id)))
+
+        return decision_list
+
+    def _get_names(self, table, ids, column = 'name'):
+        """
+        @return {id: name} for the ids found in the history table
+        """
+
+        if len(ids) == 0:
+            return {}
+
+        table_str = MySQL.bare('`%s`.`%s`' % (self.history_db, table))
+
+        return dict(self.db.select_many(table_str, ('id', column), 'id', list(ids)))
+
+    def _snapshot_paths(self, cycle_number):
+        """
+        @param cycle_number  Cycle number or partition name
+        @return (path of the spooled snapshot, path of the archived copy or None)
+        """
+
+        try:
+            cycle_number += 0
+        except TypeError:
+            # partition snapshots are not archived
+            return '%s/snapshot_%s.dyd' % (self.snapshots_spool_dir, cycle_number), None
+
+        scycle = '%09d' % cycle_number
+        spool_path = '%s/snapshot_%s.dyd' % (self.snapshots_spool_dir, scycle)
+        archive_path = '%s/%s/%s/snapshot_%s.dyd.xz' % (self.snapshots_archive_dir, scycle[:3], scycle[3:6], scycle)
+
+        return spool_path, archive_path
+
+    def _open_snapshot(self, cycle_number, convert_legacy = False):
+        """
+        @param cycle_number    Cycle number or partition name
+        @param convert_legacy  If True, write the columnar snapshot of a numbered cycle saved by an older
+                               version (through the cache tables).
+        @return CycleSnapshot, or None if the cycle has no snapshot in the columnar format.
+        """
+
+        spool_path, archive_path = self._snapshot_paths(cycle_number)
+
+        if os.path.exists(spool_path):
+            try:
+                # mark as used for the spool cleanup
+                os.utime(spool_path, None)
+            except OSError:
+                pass
+
+        else:
+            if archive_path is None:
+                return None
+
+            if os.path.exists(archive_path):
+                try:
+                    os.makedirs(self.snapshots_spool_dir)
+                    os.chmod(self.snapshots_spool_dir, 0777)
+                except OSError:
+                    pass
+
+                cyclesnapshot.decompress(archive_path, spool_path)
+
+            elif convert_legacy:
+                self._convert_legacy_snapshot(cycle_number)
+
+            else:
+                return None
+
+            self._clean_snapshot_spool()
+
+        return cyclesnapshot.CycleSnapshot(spool_path)
+
+    def _convert_legacy_snapshot(self, cycle_number):
+        """
+        Write the columnar snapshot of a numbered cycle saved by an older version to the spool directory.
+        """
+
+        self._fill_snapshot_cache('replicas', cycle_number)
+        self._fill_snapshot_cache('sites', cycle_number)
+
+        sql = 'SELECT `site_id`, `dataset_id`, `size`, `decision`, `condition` FROM `{0}`.`replicas_{1}`'.format(self.cache_db, cycle_number)
+        replicas = list(self.db.xquery(sql))
+
+        sql = 'SELECT `site_id`, `status`, `quota` FROM `{0}`.`sites_{1}`'.format(self.cache_db, cycle_number)
+        sites = [(site_id, Site.status_val(status), quota) for site_id, status, quota in self.db.xquery(sql)]
+
+        spool_path, _ = self._snapshot_paths(cycle_number)
+
+        cyclesnapshot.write(spool_path, None, replicas, sites)
+
+    def _clean_snapshot_spool(self):
+        """
+        Delete the spooled snapshots of numbered cycles not used for a week (the archive copies remain).
+        """
+
+        cutoff = time.time() - 7 * 24 * 3600
+
+        for file_name in os.listdir(self.snapshots_spool_dir):
+            if re.match('snapshot_[0-9]{9}\.dyd$', file_name) is None:
+                continue
+
+            path = '%s/%s' % (self.snapshots_spool_dir, file_name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.unlink(path)
+            except OSError:
+                LOG.error('Failed to delete %s' % path)
+
     def _fill_snapshot_cache(self, template, cycle_number):
         self.db.use_db(self.cache_db)
 
@@ -352,6 +700,35 @@ class DetoxHistory(DetoxHistoryBase):
 
         self.db.query('UPDATE `deletion_cycles` SET `time_end` = NOW() WHERE `id` = %s', cycle_number)
 
+        self.save_site_volumes(cycle_number)
+
+    def save_site_volumes(self, cycle_number):
+        """
+        Record the volumes of each decision per site of the cycle for the time series.
+        @param cycle_number   Cycle number
+        """
+
+        if self._read_only:
+            return
+
+        snapshot = self._open_snapshot(cycle_number)
+        if snapshot is None:
+            LOG.warning('Cycle %d has no snapshot. Site volumes are not recorded.', cycle_number)
+            return
+
+        try:
+            summary = snapshot.site_summary()
+        finally:
+            snapshot.close()
+
+        def volume_entries():
+            for site_id, (counts, volumes) in summary.iteritems():
+                for idec, decision in enumerate(cyclesnapshot.DECISIONS):
+                    yield (cycle_number, site_id, decision, counts[idec], volumes[idec])
+
+        fields = ('cycle_id', 'site_id', 'decision', 'num_replicas', 'volume')
+        self.db.insert_many('deletion_site_volumes', fields, None, volume_entries())
+
     def save_policy(self, policy_text):
         md5 = hashlib.md5(policy_text).hexdigest()
         result = self.db.query('SELECT `id`, `text` FROM `deletion_policies` WHERE `hash` = UNHEX(%s)', md5)
@@ -401,110 +778,31 @@ class DetoxHistory(DetoxHistoryBase):
         if self._read_only:
             return
 
-        self.save_sites([s.name for s in quotas.iterkeys()])
-
-        datasets = set()
-        for replica, matches in deleted_list.iteritems():
-            datasets.add(replica.dataset.name)
-        for replica, matches in kept_list.iteritems():
-            datasets.add(replica.dataset.name)
-        for replica, matches in protected_list.iteritems():
-            datasets.add(replica.dataset.name)
-
-        self.save_datasets(datasets)
-    
-        reuse = self.db.reuse_connection
-        self.db.reuse_connection = True
+        site_names = set(s.name for s in quotas.iterkeys())
+        dataset_names = set()
+        for entries in [deleted_list, kept_list, protected_list]:
+            for replica in entries.iterkeys():
+                site_names.add(replica.site.name)
+                dataset_names.add(replica.dataset.name)
 
-        self.db.use_db(self.cache_db)
+        site_ids = self.site_id_map(list(site_names))
+        dataset_ids = self.dataset_id_map(list(dataset_names))
 
         ## Replica state (deletion decisions)
-
-        # Insert full data into a temporary table with site and dataset names
-        tmp_table = 'replicas_tmp'
-        columns = [
-            '`site` varchar(32) CHARACTER SET latin1 COLLATE latin1_general_cs NOT NULL',
-            '`dataset` varchar(512) CHARACTER SET latin1 COLLATE latin1_general_cs NOT NULL',
-            '`size` bigint(20) unsigned NOT NULL',
-            '`decision` enum(\'delete\',\'keep\',\'protect\') CHARACTER SET latin1 COLLATE latin1_general_ci NOT NULL',
-            '`condition` int(10) unsigned NOT NULL',
-            'KEY `site_dataset` (`site`,`dataset`)'
-        ]
-        self.db.create_tmp_table(tmp_table, columns)
-
-        def replica_entry(entries, decision):
+        replicas = []
+        for decision, entries in [('delete', deleted_list), ('keep', kept_list), ('protect', protected_list)]:
             for replica, matches in entries.iteritems():
-                site_name = replica.site.name
-                dataset_name = replica.dataset.name
+                site_id = site_ids[replica.site.name]
+                dataset_id = dataset_ids[replica.dataset.name]
                 for condition_id, block_replicas in matches.iteritems():
                     size = sum(r.size for r in block_replicas)
-                    yield (site_name, dataset_name, size, decision, condition_id)
-
-        fields = ('site', 'dataset', 'size', 'decision', 'condition')
-        self.db.insert_many(tmp_table, fields, None, replica_entry(deleted_list, 'delete'), do_update = False, db = self.db.scratch_db)
-        self.db.insert_many(tmp_table, fields, None, replica_entry(kept_list, 'keep'), do_update = False, db = self.db.scratch_db)
-        self.db.insert_many(tmp_table, fields, None, replica_entry(protected_list, 'protect'), do_update = False, db = self.db.scratch_db)
-
-        # Make a snapshot table
-        replica_table_name = 'replicas_%s' % cycle_number
-
-        if self.db.table_exists(replica_table_name):
-            self.db.query('DROP TABLE `{0}`'.format(replica_table_name))
-
-        self.db.query('CREATE TABLE `{0}` LIKE `replicas`'.format(replica_table_name))
-
-        # Then use insert select join to convert the names to ids
-        sql = 'INSERT INTO `{0}` (`site_id`, `dataset_id`, `size`, `decision`, `condition`)'.format(replica_table_name)
-        sql += ' SELECT s.`id`, d.`id`, r.`size`, r.`decision`, r.`condition` FROM `{0}`.`{1}` AS r'.format(self.db.scratch_db, tmp_table)
-        sql += ' INNER JOIN `{0}`.`sites` AS s ON s.`name` = r.`site`'.format(self.history_db)
-        sql += ' INNER JOIN `{0}`.`datasets` AS d ON d.`name` = r.`dataset`'.format(self.history_db)
-        self.db.query(sql)
-
-        self.db.drop_tmp_table(tmp_table)
+                    replicas.append((site_id, dataset_id, size, decision, condition_id))
 
         ## Site state (status and quotas)
+        sites = [(site_ids[site.name], site.status, quota) for site, quota in quotas.iteritems()]
 
-        # Insert full data into a temporary table with site info
-        tmp_table = 'sites_tmp'
-        columns = [
-            '`site` varchar(32) CHARACTER SET latin1 COLLATE latin1_general_cs NOT NULL',
-            '`status` enum(\'ready\',\'waitroom\',\'morgue\',\'unknown\') CHARACTER SET latin1 COLLATE latin1_general_ci NOT NULL',
-            '`quota` int(10) NOT NULL',
-            'KEY `site` (`site`)'
-        ]
-        self.db.create_tmp_table(tmp_table, columns)
-
-        fields = ('site', 'status', 'quota')
-        mapping = lambda (site, quota): (site.name, site.status, quota)
-        self.db.insert_many(tmp_table, fields, mapping, quotas.iteritems(), do_update = False, db = self.db.scratch_db)
-
-        # Make a snapshot table
-        site_table_name = 'sites_%s' % cycle_number
-
-        if self.db.table_exists(site_table_name):
-            self.db.query('DROP TABLE `{0}`'.format(site_table_name))
-
-        self.db.query('CREATE TABLE `{0}` LIKE `sites`'.format(site_table_name))
-
-        # Then use insert select join to convert the names to ids
-        sql = 'INSERT INTO `{0}` (`site_id`, `status`, `quota`)'.format(site_table_name)
-        sql += ' SELECT s.`id`, t.`status`, t.`quota` FROM `{0}`.`{1}` AS t'.format(self.db.scratch_db, tmp_table)
-        sql += ' INNER JOIN `{0}`.`sites` AS s ON s.`name` = t.`site`'.format(self.history_db)
-        self.db.query(sql)
-
-        self.db.drop_tmp_table(tmp_table)
-
-        ## Now transfer data to an SQLite file
-        try:
-            cycle_number += 0
-        except TypeError:
-            # cycle_number is actually the partition name
-            db_file_name = '%s/snapshot_%s.db' % (self.snapshots_spool_dir, cycle_number)
-            is_cycle = False
-        else:
-            # Saving quotas during a cycle
-            db_file_name = '%s/snapshot_%09d.db' % (self.snapshots_spool_dir, cycle_number)
-            is_cycle = True
+        ## Write the snapshot (and the archive copy for numbered cycles)
+        spool_path, archive_path = self._snapshot_paths(cycle_number)
 
         try:
             os.makedirs(self.snapshots_spool_dir)
@@ -512,125 +810,15 @@ class DetoxHistory(DetoxHistoryBase):
         except OSError:
             pass
 
-        if os.path.exists(db_file_name):
-            os.unlink(db_file_name)
-
-        LOG.info('Creating snapshot SQLite3 DB %s', db_file_name)
-
-        # For some unknown reason, we observed sqlite3.connect hanging - employing alarm mechanism to time out
-        class Timeout(Exception):
-            pass
-
-        def timeout_handler(signum, frame):
-            raise Timeout()
-
-        signal.signal(signal.SIGALRM, timeout_handler)
-
-        signal.alarm(5)
-
-        for att in range(3):
-            try:
-                snapshot_db = sqlite3.connect(db_file_name)
-            except Timeout:
-                continue
-            else:
-                signal.alarm(0)
-                break
-        else:
-            raise RuntimeError('Failed to create %s' % db_file_name)
-
-        snapshot_cursor = snapshot_db.cursor()
-
-        # Make enum mapping tables
-        # Get the decision value to name mapping from MySQL information_schema
-        # This is just a fancy way to arrive at a list [(1, 'delete'), (2, 'keep'), (3, 'protect')]
-        enum = self.db.query('SELECT `COLUMN_TYPE` FROM `information_schema`.`COLUMNS` WHERE `TABLE_SCHEMA` = %s AND `TABLE_NAME` = \'replicas\' AND `COLUMN_NAME` = \'decision\'', self.cache_db)[0]
-        # "enum('delete','keep','protect')" -> ['delete', 'keep', 'protect']
-        values = map(lambda s: s.replace("'", '').replace('"', ''), enum[5:-1].split(','))
-        decision_mapping = []
-        for idec, decision in enumerate(values):
-            # MySQL enum starts at 1
-            decision_mapping.append((idec + 1, decision))
-
-        sql = 'CREATE TABLE `decisions` ('
-        sql += '`id` TINYINT PRIMARY KEY NOT NULL,'
-        sql += '`value` TEXT NOT NULL'
-        sql += ')'
-        snapshot_db.execute(sql)
-        for value, name in decision_mapping:
-            snapshot_db.execute('INSERT INTO `decisions` VALUES (?, ?)', (value, name))
-
-        sql = 'CREATE TABLE `statuses` ('
-        sql += '`id` TINYINT PRIMARY KEY NOT NULL,'
-        sql += '`value` TEXT NOT NULL'
-        sql += ')'
-        snapshot_db.execute(sql)
-        snapshot_db.execute('INSERT INTO `statuses` VALUES (%d, \'ready\')' % Site.STAT_READY)
-        snapshot_db.execute('INSERT INTO `statuses` VALUES (%d, \'waitroom\')' % Site.STAT_WAITROOM)
-        snapshot_db.execute('INSERT INTO `statuses` VALUES (%d, \'morgue\')' % Site.STAT_MORGUE)
-        snapshot_db.execute('INSERT INTO `statuses` VALUES (%d, \'unknown\')' % Site.STAT_UNKNOWN)
-
-        # Fill in the replica states
-        sql = 'CREATE TABLE `replicas` ('
-        sql += '`site_id` SMALLINT NOT NULL,'
-        sql += '`dataset_id` INT NOT NULL,'
-        sql += '`size` BIGINT NOT NULL,'
-        sql += '`decision_id` TINYINT NOT NULL REFERENCES `decisions`(`id`),'
-        sql += '`condition` MEDIUMINT NOT NULL'
-        sql += ')'
-        snapshot_db.execute(sql)
-        snapshot_db.execute('CREATE INDEX `site_dataset` ON `replicas` (`site_id`, `dataset_id`)')
-
-        sql = 'INSERT INTO `replicas` VALUES (?, ?, ?, ?, ?)'
-
-        for entry in self.db.xquery('SELECT `site_id`, `dataset_id`, `size`, 0+`decision`, `condition` FROM `{0}`'.format(replica_table_name)):
-            snapshot_cursor.execute(sql, entry)
-
-        snapshot_db.commit()
-
-        # Fill in the site states
-        sql = 'CREATE TABLE `sites` ('
-        sql += '`site_id` SMALLINT PRIMARY KEY NOT NULL,'
-        sql += '`status_id` TINYINT NOT NULL REFERENCES `statuses`(`id`),'
-        sql += '`quota` INT NOT NULL'
-        sql += ')'
-        snapshot_db.execute(sql)
-
-        sql = 'INSERT INTO `sites` VALUES (?, ?, ?)'
-
-        for entry in self.db.xquery('SELECT `site_id`, 0+`status`, `quota` FROM `{0}`'.format(site_table_name)):
-            snapshot_cursor.execute(sql, entry)
-
-        snapshot_db.commit()
-
-        # Close the sqlite file
-        snapshot_cursor.close()
-        snapshot_db.close()
-
-        if is_cycle:
-            # This was a numbered cycle
-            # Archive the sqlite3 file
-    
-            scycle = '%09d' % cycle_number
-            archive_dir_name = '%s/%s/%s' % (self.snapshots_archive_dir, scycle[:3], scycle[3:6])
-            xz_file_name = '%s/snapshot_%09d.db.xz' % (archive_dir_name, cycle_number)
-    
+        if archive_path is not None:
             try:
-                os.makedirs(archive_dir_name)
+                os.makedirs(os.path.dirname(archive_path))
             except OSError:
                 pass
-    
-            with open(db_file_name, 'rb') as db_file:
-                with open(xz_file_name, 'wb') as xz_file:
-                    xz_file.write(lzma.compress(db_file.read()))
-
-            self._update_cache_usage('replicas', cycle_number)
-            self._update_cache_usage('sites', cycle_number)
 
-        # Finally restore the history DB
-        self.db.use_db(self.history_db)
+        LOG.info('Writing detox snapshot %s', spool_path)
 
-        self.db.reuse_connection = reuse
+        cyclesnapshot.write(spool_path, archive_path, replicas, sites)
 
     def make_cycle_entry(self, cycle_number, site):
         history_record = self.make_entry(site.name)
@@ -10,6 +10,7 @@ from dynamo.detox.detoxpolicy import Ignore, Protect, Delete, Dismiss, ProtectBl
 from dynamo.detox.history import DetoxHistory
 from dynamo.operation.deletion import DeletionInterface
 from dynamo.utils.signaling import SignalBlocker
+from dynamo.policy.attrs import Attr
 
 LOG = logging.getLogger(__name__)
 
@@ -47,6 +48,9 @@ class Detox(object):
         @param create_cycle If True, assign a cycle number and make a permanent record in the history.
         """
 
+        # Time-bounded policy lines are evaluated against the start time of this cycle
+        self.policy.resolve_time_conditions()
+
         if create_cycle:
             # fetch the deletion cycle number
             cycle_tag = self.history.new_cycle(self.policy.partition_name, self.policy.policy_text, comment = comment, test = self.test_run)
@@ -132,7 +136,7 @@ class Detox(object):
                         block.replicas.add(block_replica)
 
                     # Add to the site partition
-                    site.partitions[partition].replicas[replica] = None
+                    site.partitions[partition].set_replica(replica, None)
 
         # Create a copy of the inventory, limiting to the current partition
         # We will be stripping replicas off the image as we process the policy in iterations
@@ -193,10 +197,9 @@ class Detox(object):
                     # all block reps in partition
                     block_replica_set = dataset_replica.block_replicas
                     full_replica = True
-                    site_partition_clone.replicas[replica_clone] = None
                 else:
                     full_replica = False
-                    block_replica_clone_set = site_partition_clone.replicas[replica_clone] = set()
+                    block_replica_clone_set = set()
 
                 for block_replica in block_replica_set:
                     block_clone = block_to_clone[block_replica.block]
@@ -221,6 +224,12 @@ class Detox(object):
                     if not full_replica:
                         block_replica_clone_set.add(block_replica_clone)
 
+                # Add to the site partition after all block replicas are created to get the occupancy right
+                if full_replica:
+                    site_partition_clone.set_replica(replica_clone, None)
+                else:
+                    site_partition_clone.set_replica(replica_clone, block_replica_clone_set)
+
         return partition_repository
 
     def _execute_policy(self, repository):
@@ -274,12 +283,31 @@ class Detox(object):
                 s = replica_map[condition_id] = set()
                 return s
 
+        # Policy evaluation results are cached across iterations and recomputed only for replicas whose
+        # inputs changed. Which changes matter depends on the dependency scopes of the policy lines.
+        scopes = self.policy.evaluation_scopes
+        evaluated = {} # {replica: actions}
+
+        # Attribute values are memoized in the evaluation plan
+        self.policy.compile_plan(all_replicas)
+
+        # Objects modified since the previous evaluation
+        changed_replicas = set()
+        changed_datasets = set()
+        changed_sites = set()
+
+        def touch(replica):
+            # call before modifying the replica
+            self.policy.invalidate(replica)
+            changed_replicas.add(replica)
+            changed_datasets.add(replica.dataset)
+            changed_sites.add(replica.site)
+
         iteration = 0
 
         # now iterate through deletions, updating site usage as we go
         while True:
             iteration += 1
-            LOG.info('Iteration %d, evaluating %d replicas', iteration, len(all_replicas))
 
             # Delete candidates: replicas that match Dismiss lines and are on sites where deletion is triggered.
             # We will only move a few replicas (on a single site up to deletion_per_iteration) from
@@ -295,15 +323,36 @@ class Detox(object):
 
             ignored_replicas = set()
             empty_replicas = set()
+
+            # Replicas whose cached evaluation result may be outdated.
+            # Changes recorded from here on are picked up in the next iteration.
+            stale_replicas = set(changed_replicas)
+            if Attr.SCOPE_DATASET in scopes:
+                for dataset in changed_datasets:
+                    stale_replicas.update(dataset.replicas)
+            if Attr.SCOPE_SITE in scopes:
+                for site in changed_sites:
+                    stale_replicas.update(site.dataset_replicas())
+
+            changed_replicas.clear()
+            changed_datasets.clear()
+            changed_sites.clear()
+
+            num_replicas = len(all_replicas)
+            num_evaluated = 0
             start = time.time()
 
             for replica in all_replicas:
-                # Call policy.evaluate for each replica
+                # Call policy.evaluate for each new or stale replica
                 # Function evaluate() returns a list of actions. If the replica matches a dataset-level policy,
                 # there is only one element in the returned list.
                 # Block-level actions are triggered only if the condition does not apply to all blocks.
                 # Sort the evaluation results into the three candidate containers above.
-                actions = self.policy.evaluate(replica)
+                if replica in stale_replicas or replica not in evaluated:
+                    actions = evaluated[replica] = self.policy.evaluate(replica)
+                    num_evaluated += 1
+                else:
+                    actions = evaluated[replica]
 
                 # Keep track of block replicas matching block-level conditions
                 block_replicas = set(replica.block_replicas)
@@ -328,6 +377,9 @@ class Detox(object):
                         # ones to be reowned are added to reowned
                         # the two sets overlap only when reowning causes the block replica to go out of the partition
                         # unlinked - reowned are returned as to_delete
+                        if len(action.block_replicas) != 0:
+                            touch(replica)
+
                         to_delete = self._unlink_block_replicas(replica, partition, action.block_replicas, repository, reowned, block_replicas)
 
                         if len(to_delete) != 0:
@@ -356,6 +408,9 @@ class Detox(object):
     
                     elif isinstance(action, Delete):
                         # delete a full dataset or a remainder after block-level operations
+                        if len(block_replicas) != 0:
+                            touch(replica)
+
                         to_delete = self._unlink_block_replicas(replica, partition, block_replicas, repository, reowned)
 
                         if len(to_delete) != 0:
@@ -382,7 +437,12 @@ class Detox(object):
             all_replicas -= empty_replicas
             all_replicas -= ignored_replicas
 
-            LOG.info('Took %f seconds to evaluate', time.time() - start)
+            for replica in empty_replicas:
+                evaluated.pop(replica, None)
+            for replica in ignored_replicas:
+                evaluated.pop(replica, None)
+
+            LOG.info('Iteration %d: evaluated %d of %d replicas (%d stale) in %f seconds', iteration, num_evaluated, num_replicas, len(stale_replicas), time.time() - start)
             LOG.info(' %d dataset replicas in deletion candidates', len(delete_candidates))
 
             if len(delete_candidates) == 0:
@@ -393,6 +453,9 @@ class Detox(object):
 
                 break
 
+            start = time.time()
+            num_deleted = 0
+
             # now figure out which of deletion candidates to actually delete
             if self.policy.iterative_deletion:
                 # we will delete from one site at a time
@@ -447,6 +510,9 @@ class Detox(object):
 
                 LOG.debug('Deleting replica: %s', str(replica))
 
+                touch(replica)
+                num_deleted += 1
+
                 for condition_id, matches in delete_candidates[replica].iteritems():
                     to_delete = self._unlink_block_replicas(replica, partition, matches, repository, reowned)
 
@@ -462,6 +528,7 @@ class Detox(object):
                     
                     replica.unlink_from(repository)
                     all_replicas.remove(replica)
+                    evaluated.pop(replica)
 
                 site_partition = site.partitions[partition]
 
@@ -471,8 +538,12 @@ class Detox(object):
                         triggered_sites.remove(site)
                         break
 
+            LOG.info('Iteration %d: deleted from %d dataset replicas in %f seconds', iteration, num_deleted, time.time() - start)
+
         # done iterating
 
+        self.policy.plan = None
+
         LOG.info(' %d dataset replicas in delete list', len(deleted))
         LOG.info(' %d dataset replicas in keep list', len(kept))
         LOG.info(' %d dataset replicas in protect list', len(protected))
@@ -17,7 +17,8 @@ def delete(task_id, pfn):
     @return  (exit code, start time, finish time, error message, log string)
     """
 
-    activated = PoolManager.db.query('UPDATE `standalone_deletion_tasks` SET `status` = \'active\' WHERE `id` = %s', task_id)
+    # The queued state may still be in the status buffer of the parent process
+    activated = PoolManager.db.query('UPDATE `standalone_deletion_tasks` SET `status` = \'active\' WHERE `id` = %s AND `status` IN (\'new\', \'queued\')', task_id)
     if activated == 0:
         # task was cancelled
         return -1, None, None, '', ''            
@@ -28,7 +29,7 @@ def delete(task_id, pfn):
 class DeletionPoolManager(StatefulPoolManager):
     def __init__(self, site, max_concurrent, proxy):
         opformat = '{0}'
-        PoolManager.__init__(self, site, 'deletion', opformat, delete, max_concurrent, proxy)
+        PoolManager.__init__(self, site, 'deletion', opformat, delete, max_concurrent, proxy, link = ('deletion', site, ''))
 
 
 def unmanaged_delete(task_id, url):
@@ -54,7 +55,7 @@ def unmanaged_delete(task_id, url):
     else:
         result = gfal_exec('unlink', (url,))
 
-    return (0,) + rmdir_result[1:]
+    return (0,) + result[1:]
 
 
 class UnmanagedDeletionPoolManager(PoolManager):
@@ -0,0 +1,154 @@
+import os
+import threading
+import multiprocessing
+import collections
+import Queue
+import logging
+
+from dynamo.utils.log import log_exception
+
+LOG = logging.getLogger(__name__)
+
+def run_task(task, args, proxy):
+    """
+    Wrapper of the task function executed in the worker processes. Exceptions are returned instead of raised
+    so that the result callback is always called (Python 2 Pool.apply_async has no error callback).
+    @param task   Task function
+    @param args   Arguments to the task function
+    @param proxy  X509 proxy to use for the task (workers are shared by all managers)
+
+    @return (True, task return value) or (False, exception string)
+    """
+
+    original_proxy = os.environ.get('X509_USER_PROXY', None)
+    if proxy:
+        os.environ['X509_USER_PROXY'] = proxy
+
+    try:
+        return True, task(*args)
+    except Exception as exc:
+        return False, '%s: %s' % (type(exc).__name__, str(exc))
+    finally:
+        if proxy:
+            if original_proxy is None:
+                os.environ.pop('X509_USER_PROXY')
+            else:
+                os.environ['X509_USER_PROXY'] = original_proxy
+
+class TaskDispatcher(object):
+    """
+    Single worker pool shared by all PoolManagers. PoolManagers act as per-link task queues; the dispatcher
+    thread takes tasks from the queues in round-robin order, so that each link gets a fair share of the
+    workers, while never exceeding the slots of the link. Task results are pushed to a completion queue by
+    the pool callback and handed back to the manager by the same thread. Worker processes are replaced after
+    max_tasks_per_worker tasks.
+    """
+
+    def __init__(self, num_workers, max_tasks_per_worker = 0, initializer = None):
+        """
+        @param num_workers           Number of worker processes.
+        @param max_tasks_per_worker  Number of tasks after which a worker process is replaced (0 -> never).
+        @param initializer           Function to call at the start of each worker process.
+        """
+
+        self.num_workers = num_workers
+
+        if max_tasks_per_worker == 0:
+            max_tasks_per_worker = None
+
+        self._pool = multiprocessing.Pool(num_workers, initializer = initializer, maxtasksperchild = max_tasks_per_worker)
+        # (manager, tid, result); tid = None is a notification of new tasks in the manager
+        self._completed = Queue.Queue()
+        self._num_running = 0
+
+        self._stop_flag = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target = self._run, name = 'dispatcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, terminate = False):
+        """
+        Stop the dispatcher thread and the workers.
+        @param terminate  If True, kill the running tasks instead of waiting for them.
+        """
+
+        self._stop_flag.set()
+        self._completed.put((None, None, None))
+
+        if self._thread is not None:
+            self._thread.join()
+
+        if terminate:
+            LOG.warning('Terminating the worker pool')
+            self._pool.terminate()
+        else:
+            self._pool.close()
+
+        self._pool.join()
+
+    def notify(self, manager):
+        """
+        Tell the dispatcher that the manager has new pending tasks. Can be called from any thread.
+        """
+
+        self._completed.put((manager, None, None))
+
+    def num_running(self):
+        return self._num_running
+
+    def _run(self):
+        # managers with pending tasks in round-robin order
+        active = collections.deque()
+        in_active = set()
+
+        while True:
+            try:
+                item = self._completed.get(timeout = 1)
+            except Queue.Empty:
+                continue
+
+            if self._stop_flag.is_set():
+                return
+
+            # process everything that has arrived before dispatching again
+            items = [item]
+            while True:
+                try:
+                    items.append(self._completed.get_nowait())
+                except Queue.Empty:
+                    break
+
+            for manager, tid, result in items:
+                if manager is None:
+                    continue
+
+                if tid is not None:
+                    self._num_running -= 1
+                    try:
+                        manager.task_done(tid, result)
+                    except:
+                        log_exception(LOG)
+
+                if manager not in in_active and manager.has_pending():
+                    active.append(manager)
+                    in_active.add(manager)
+
+            while self._num_running < self.num_workers and len(active) != 0:
+                manager = active.popleft()
+
+                task = manager.next_task()
+                if task is None:
+                    # no pending task or no free slot; the manager comes back with its next completion or notification
+                    in_active.remove(manager)
+                    continue
+
+                tid, args = task
+                callback = lambda result, manager = manager, tid = tid: self._completed.put((manager, tid, result))
+                self._pool.apply_async(run_task, (manager.task, (tid,) + args, manager.proxy), callback = callback)
+                self._num_running += 1
+
+                # back to the end of the queue
+                active.append(manager)
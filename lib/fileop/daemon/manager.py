@@ -1,31 +1,38 @@
-import os
 import threading
-import signal
-import multiprocessing
+import collections
 import logging
 
 LOG = logging.getLogger(__name__)
 
 class PoolManager(object):
     """
-    Base class for managing one task pool. Asynchronous results of the tasks are collected
-    in collect_results() running as a separate thread, automatically started when the first
-    task is added to the pool
+    Base class for a per-link task queue. Tasks are held in a pending queue and handed to the shared
+    TaskDispatcher as long as the number of running tasks is below the number of slots. When a scheduler
+    is set, the number of slots follows LinkScheduler.slots() for the link of the manager; otherwise it is
+    fixed to max_concurrent. Results are processed in the dispatcher thread through task_done().
     """
 
     db = None
-    stop_flag = None
     ## Need to have a global signal converter that subprocesses can unset blocking
     signal_converter = None
-
-    def __init__(self, name, optype, opformat, task, max_concurrent, proxy):
+    ## TaskDispatcher shared by all managers
+    dispatcher = None
+    ## TaskStatusBuffer for the task state transitions
+    status_buffer = None
+    ## LinkScheduler (optional)
+    scheduler = None
+    ## Event set when a manager has run through its backlog of pending tasks
+    wakeup = None
+
+    def __init__(self, name, optype, opformat, task, max_concurrent, proxy, link = None):
         """
         @param name           Name of the instance. Used in logging.
         @param optype         'transfer' or 'deletion'.
         @param opformat       Format string used in logging.
         @param task           Task function to run
-        @param max_concurrent Maximum number of concurrent processes in the pool.
+        @param max_concurrent Maximum number of concurrent tasks.
         @param proxy          X509 proxy
+        @param link           Key of the link in the scheduler. If None, max_concurrent tasks run concurrently.
         """
 
         self.name = name
@@ -33,101 +40,120 @@ class PoolManager(object):
         self.task = task
         self.opformat = opformat
         self.proxy = proxy
-
-        self._pool = multiprocessing.Pool(max_concurrent, initializer = self._pre_exec)
-        self._results = []
-        self._collector_thread = None
-        self._closed = False
-
-    def add_task(self, tid, *args):
+        self.link = link
+        self.max_concurrent = max_concurrent
+
+        # (tid, args, size) waiting for a slot
+        self._pending = collections.deque()
+        # {tid: (args, size)}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        # True while tasks wait for slots
+        self._backlogged = False
+
+    def add_task(self, tid, *args, **kwd):
         """
-        Add a task to the pool and start the results collector.
+        Add a task to the queue and notify the dispatcher.
+        @param tid   Task id
+        @param args  Arguments passed to the task function
+        @param kwd   size: bytes processed by the task (used in the link statistics)
         """
 
-        if self._closed:
-            raise RuntimeError('PoolManager %s is closed' % self.name)
-
         if not self._set_queued(tid):
             return
 
         opstring = self.opformat.format(*args)
         LOG.info('%s: %s %s', self.name, self.optype, opstring)
 
-        proc_args = (tid,) + args
-        async_result = self._pool.apply_async(self.task, proc_args)
-        self._results.append((tid, async_result) + args)
+        with self._lock:
+            self._pending.append((tid, args, kwd.get('size', 0)))
 
-        if self._collector_thread is None or not self._collector_thread.is_alive():
-            self.start_collector()
+        PoolManager.dispatcher.notify(self)
 
-    def process_result(self, result_tuple):
+    def num_tasks(self):
         """
-        Process the result of a completed task.
+        @return Number of pending and running tasks.
         """
-        pass
 
-    def ready_for_recycle(self):
+        with self._lock:
+            return len(self._pending) + len(self._in_flight)
+
+    def has_pending(self):
+        return len(self._pending) != 0
+
+    def next_task(self):
         """
-        Check if this pool manager can be shut down. Managers should be shut down whenever
-        possible to keep the resource (threads and subprocesses) usage down and also to
-        adjust the concurrency on each link as needed.
+        Called by the dispatcher. Move the first pending task to the running set if a slot is free.
+        @return (tid, args) or None
         """
 
-        if self._closed:
-            return True
+        if self.link is not None and PoolManager.scheduler is not None:
+            slots = PoolManager.scheduler.slots(self.link)
+        else:
+            slots = self.max_concurrent
 
-        if len(self._results) != 0:
-            return False
+        with self._lock:
+            if len(self._pending) == 0 or len(self._in_flight) >= slots:
+                task = None
+            else:
+                tid, args, size = self._pending.popleft()
+                self._in_flight[tid] = (args, size)
+                task = (tid, args)
 
-        if self._collector_thread is None:
-            return True
+            num_pending = len(self._pending)
+            num_in_flight = len(self._in_flight)
 
-        if self._collector_thread.is_alive():
-            return False
+        if num_pending != 0:
+            self._backlogged = True
 
-        if PoolManager.stop_flag.is_set():
-            LOG.warning('Terminating pool %s' % self.name)
-            self._pool.terminate()
+        if self.link is not None and PoolManager.scheduler is not None:
+            PoolManager.scheduler.set_load(self.link, num_pending, num_in_flight)
 
-        self._pool.close()
-        self._pool.join()
+        return task
 
-        self._collector_thread.join()
+    def task_done(self, tid, result):
+        """
+        Called by the dispatcher when a task completes.
+        @param tid     Task id
+        @param result  (True, return value of the task function) or (False, exception string)
+        """
 
-        self._closed = True
+        with self._lock:
+            args, size = self._in_flight.pop(tid)
+            num_pending = len(self._pending)
 
-        return True
+        success, result = result
+
+        if success:
+            self.process_result(tid, args, result)
+            self._record(result, size)
+        else:
+            LOG.error('%s: exception in %s task %d: %s', self.name, self.optype, tid, result)
 
-    def start_collector(self):
-        if self._collector_thread is not None:
-            self._collector_thread.join()
-
-        self._collector_thread = threading.Thread(target = self.collect_results, name = self.name)
-        self._collector_thread.start()
-
-    def collect_results(self):
-        while len(self._results) != 0:
-            ir = 0
-            while ir != len(self._results):
-                if PoolManager.stop_flag.is_set():
-                    return
-    
-                if not self._results[ir][1].ready():
-                    ir += 1
-                    continue
-    
-                self.process_result(self._results.pop(ir))
-    
-            is_set = PoolManager.stop_flag.wait(5)
-            if is_set: # True if Python 2.7 + flag is set
-                return
-
-    def _pre_exec(self):
-        PoolManager.signal_converter.unset(signal.SIGTERM)
-        PoolManager.signal_converter.unset(signal.SIGHUP)
-        
-        if self.proxy:
-            os.environ['X509_USER_PROXY'] = self.proxy
+        if num_pending == 0 and self._backlogged:
+            # tasks were waiting for slots and now all are running; let the main loop look for new tasks
+            self._backlogged = False
+            if PoolManager.wakeup is not None:
+                PoolManager.wakeup.set()
+
+    def process_result(self, tid, args, result):
+        """
+        Process the result of a completed task.
+        @param tid     Task id
+        @param args    Task arguments
+        @param result  Return value of the task function
+        """
+        pass
+
+    def ready_for_recycle(self):
+        """
+        Check if this manager can be discarded (no pending or running tasks).
+        """
+
+        return self.num_tasks() == 0
+
+    def _record(self, result, size):
+        pass
 
     def _set_queued(self, task_id):
         return True
@@ -138,17 +164,14 @@ class StatefulPoolManager(PoolManager):
     PoolManager for tasks with states (transfer and deletion).
     """
 
-    def process_result(self, result_tuple):
+    def process_result(self, tid, args, result):
         """
         Process the result of a completed task.
         """
 
         delim = '--------------'
 
-        tid, result = result_tuple[:2]
-        args = result_tuple[2:]
-
-        exitcode, start_time, finish_time, msg, log = result.get()
+        exitcode, start_time, finish_time, msg, log = result
 
         if finish_time is not None and start_time is not None:
             optime = finish_time - start_time
@@ -166,11 +189,14 @@ class StatefulPoolManager(PoolManager):
             LOG.info('%s: failed %s (%s s, %d: %s) %s\n%s\n%s%s', self.name, self.optype, optime, exitcode, msg, opstring, delim, log, delim)
             status = 'failed'
 
-        sql = 'UPDATE `standalone_{op}_tasks` SET `status` = %s, `exitcode` = %s, `message` = %s, `start_time` = FROM_UNIXTIME(%s), `finish_time` = FROM_UNIXTIME(%s) WHERE `id` = %s'.format(op = self.optype)
+        PoolManager.status_buffer.set_status(self.optype, tid, status, exitcode, msg, start_time, finish_time)
 
-        PoolManager.db.query(sql, status, exitcode, msg, start_time, finish_time, tid)
+    def _record(self, result, size):
+        if self.link is not None and PoolManager.scheduler is not None:
+            exitcode, start_time, finish_time = result[:3]
+            PoolManager.scheduler.record(self.link, exitcode, start_time, finish_time, size)
 
     def _set_queued(self, task_id):
-        sql = 'UPDATE `standalone_{op}_tasks` SET `status` = \'queued\' WHERE `id` = %s'.format(op = self.optype)
-        updated = PoolManager.db.query(sql, tid)
-        return updated != 0
+        # Tasks cancelled or deleted in the meantime are caught at activation
+        PoolManager.status_buffer.set_queued(self.optype, task_id)
+        return True
@@ -0,0 +1,190 @@
+import time
+import datetime
+import threading
+import logging
+
+LOG = logging.getLogger(__name__)
+
+class LinkScheduler(object):
+    """
+    Per-link concurrency control for the file operations daemon. Throughput, latency, and failure rate are
+    accumulated from the completed tasks of each link (a (source, destination) pair for transfers, a site for
+    deletions), and the number of worker slots of the link is adjusted once per window of completed tasks:
+     - failure rate above max_error_rate: slots halved
+     - rate (bytes/s, or tasks/s for deletions) of a saturated link dropped by more than a tolerance from the
+       previous window: one slot less
+     - otherwise, if the link has tasks waiting for a slot: one slot more, as long as the total over all
+       links stays within max_total_slots
+    Slots stay within [min_slots, max_slots].
+    """
+
+    class Link(object):
+        __slots__ = ['slots', 'queued', 'in_flight', 'throughput', 'latency', 'error_rate', 'rate', 'num_done', 'num_failed',
+            'window_start', 'window_tasks', 'window_failures', 'window_bytes', 'window_time', 'last_update']
+
+        def __init__(self, slots):
+            self.slots = slots
+            self.queued = 0
+            self.in_flight = 0
+            # bytes/s, s, fraction of the last window
+            self.throughput = 0.
+            self.latency = 0.
+            self.error_rate = 0.
+            # rate compared between windows (bytes/s, or successful tasks/s for links without byte counts)
+            self.rate = 0.
+            # counts since the daemon start
+            self.num_done = 0
+            self.num_failed = 0
+            # accumulation window
+            self.window_start = time.time()
+            self.window_tasks = 0
+            self.window_failures = 0
+            self.window_bytes = 0
+            self.window_time = 0.
+            self.last_update = time.time()
+
+    def __init__(self, config):
+        """
+        @param config  Configuration with parameters initial_slots, min_slots, max_slots, max_total_slots,
+                       max_error_rate, throughput_tolerance, min_window.
+        """
+
+        self.initial_slots = config.initial_slots
+        self.min_slots = config.get('min_slots', 1)
+        self.max_slots = config.get('max_slots', self.initial_slots * 2)
+        self.max_total_slots = config.get('max_total_slots', 0) # 0 -> no global limit
+        self.max_error_rate = config.get('max_error_rate', 0.5)
+        self.throughput_tolerance = config.get('throughput_tolerance', 0.1)
+        # minimum number of completed tasks to evaluate a window
+        self.min_window = config.get('min_window', 10)
+
+        # {(optype, source, destination): Link}
+        self._links = {}
+        self._lock = threading.Lock()
+
+    def slots(self, link):
+        """
+        @param link  (optype, source, destination)
+        @return Current number of worker slots of the link.
+        """
+
+        with self._lock:
+            return self._get_link(link).slots
+
+    def set_load(self, link, queued, in_flight):
+        """
+        Report the number of tasks waiting for a slot and running on the link.
+        """
+
+        with self._lock:
+            state = self._get_link(link)
+            state.queued = queued
+            state.in_flight = in_flight
+            state.last_update = time.time()
+
+    def record(self, link, exitcode, start_time, finish_time, nbytes):
+        """
+        Record a completed task and adjust the slots of the link if a window is complete.
+        @param link         (optype, source, destination)
+        @param exitcode     Exit code of the task (0 = success, -1 = cancelled)
+        @param start_time   UNIX start time (can be None)
+        @param finish_time  UNIX finish time (can be None)
+        @param nbytes       Bytes processed by the task
+        """
+
+        if exitcode == -1:
+            # cancelled before start
+            return
+
+        with self._lock:
+            state = self._get_link(link)
+
+            state.window_tasks += 1
+
+            if exitcode == 0:
+                state.num_done += 1
+                state.window_bytes += nbytes
+            else:
+                state.num_failed += 1
+                state.window_failures += 1
+
+            if start_time is not None and finish_time is not None:
+                state.window_time += finish_time - start_time
+
+            if state.window_tasks >= max(state.slots, self.min_window):
+                self._adjust(link, state)
+
+    def write_stats(self, db):
+        """
+        Export the link states to the standalone_link_stats table. Links without activity for a day are dropped.
+        @param db  MySQL handle
+        """
+
+        now = time.time()
+
+        with self._lock:
+            stale = [link for link, state in self._links.iteritems() if now - state.last_update > 24 * 3600]
+            for link in stale:
+                self._links.pop(link)
+
+            rows = []
+            for (optype, source, destination), state in self._links.iteritems():
+                rows.append((optype, source, destination, state.slots, state.queued, state.in_flight, state.throughput,
+                    state.latency, state.error_rate, state.num_done, state.num_failed, datetime.datetime.fromtimestamp(state.last_update)))
+
+        fields = ('optype', 'source', 'destination', 'slots', 'queued', 'in_flight', 'throughput', 'latency', 'error_rate', 'num_done', 'num_failed', 'last_update')
+        db.insert_many('standalone_link_stats', fields, None, rows)
+
+        if len(stale) != 0:
+            db.execute_many('DELETE FROM `standalone_link_stats`', ('optype', 'source', 'destination'), stale)
+
+    def _get_link(self, link):
+        try:
+            return self._links[link]
+        except KeyError:
+            state = self._links[link] = LinkScheduler.Link(self.initial_slots)
+            return state
+
+    def _adjust(self, link, state):
+        now = time.time()
+
+        num_tasks = state.window_tasks
+        num_success = num_tasks - state.window_failures
+
+        error_rate = float(state.window_failures) / num_tasks
+        throughput = state.window_bytes / max(now - state.window_start, 1.)
+        latency = state.window_time / num_tasks
+
+        if state.window_bytes != 0:
+            rate = throughput
+        else:
+            rate = num_success / max(now - state.window_start, 1.)
+
+        slots = state.slots
+
+        if error_rate > self.max_error_rate:
+            slots = max(self.min_slots, slots / 2)
+
+        elif num_success != 0 and state.queued != 0 and rate < state.rate * (1. - self.throughput_tolerance):
+            # compare only while the link is saturated; a lower rate from lack of demand says nothing about the link
+            slots = max(self.min_slots, slots - 1)
+
+        elif state.queued != 0 and slots < self.max_slots:
+            if self.max_total_slots == 0 or sum(s.slots for s in self._links.itervalues()) < self.max_total_slots:
+                slots += 1
+
+        if slots != state.slots:
+            LOG.info('Link %s: %d -> %d slots (%.1f MB/s, %.1f s/task, %.0f%% failed)', '/'.join(l for l in link if l), state.slots, slots,
+                throughput * 1.e-6, latency, error_rate * 100.)
+
+        state.slots = slots
+        state.throughput = throughput
+        state.latency = latency
+        state.error_rate = error_rate
+        state.rate = rate
+
+        state.window_start = now
+        state.window_tasks = 0
+        state.window_failures = 0
+        state.window_bytes = 0
+        state.window_time = 0.
@@ -24,14 +24,7 @@ class StagingPoolManager(PoolManager):
         opformat = '{0}'
         PoolManager.__init__(self, site, 'staging', opformat, stage, max_concurrent, proxy)
 
-    def process_result(self, result_tuple):
-        delim = '--------------'
-
-        tid, result = result_tuple[:2]
-        args = result_tuple[2:]
-
-        staged = result.get()
-
+    def process_result(self, tid, args, staged):
         opstring = self.opformat.format(*args)
 
         if not staged:
@@ -39,6 +32,4 @@ class StagingPoolManager(PoolManager):
 
         LOG.info('%s: staged %s', self.name, opstring)
 
-        sql = 'UPDATE `standalone_transfer_tasks` SET `status` = \'staged\' WHERE `id` = %s'
-
-        PoolManager.db.query(sql, tid)
+        PoolManager.status_buffer.set_status('transfer', tid, 'staged')
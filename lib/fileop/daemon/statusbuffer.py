@@ -0,0 +1,186 @@
+import time
+import datetime
+import threading
+import logging
+
+from dynamo.utils.log import log_exception
+
+LOG = logging.getLogger(__name__)
+
+class TaskStatusBuffer(object):
+    """
+    Write-behind buffer of the task state transitions in standalone_{op}_tasks. Transitions are held in
+    memory and written with multi-row statements by a flusher thread every flush_interval milliseconds,
+    or as soon as flush_size transitions are buffered. stop() flushes whatever is left. Transitions that
+    never reach the DB (crash) leave the tasks in new or active state, which are requeued at the next start.
+    """
+
+    _tmp_table = 'standalone_status_tmp'
+
+    def __init__(self, db, flush_size = 1000, flush_interval = 1000):
+        """
+        @param db              MySQL handle
+        @param flush_size      Number of buffered transitions that triggers a flush.
+        @param flush_interval  Maximum time in milliseconds between flushes.
+        """
+
+        self.db = db
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+
+        # {optype: [task id]}
+        self._queued = {'transfer': [], 'deletion': []}
+        # {optype: {task id: (status, exitcode, message, start_time, finish_time)}}
+        self._updates = {'transfer': {}, 'deletion': {}}
+        self._size = 0
+
+        self._lock = threading.Lock()
+        # serializes the flushes of the flusher thread and explicit flush() calls
+        self._flush_lock = threading.Lock()
+
+        self._flush_request = threading.Event()
+        self._stop_flag = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target = self._run, name = 'status_flush')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the flusher thread and write out all buffered transitions.
+        """
+
+        self._stop_flag.set()
+        self._flush_request.set()
+
+        if self._thread is not None:
+            self._thread.join()
+
+        self.flush()
+
+    def set_queued(self, optype, task_id):
+        """
+        Buffer the new (staged) -> queued transition. Applied only to tasks still in the new or staged state at the time of the flush.
+        """
+
+        with self._lock:
+            self._queued[optype].append(task_id)
+            self._size += 1
+            full = self._size >= self.flush_size
+
+        if full:
+            self._flush_request.set()
+
+    def set_status(self, optype, task_id, status, exitcode = None, message = None, start_time = None, finish_time = None):
+        """
+        Buffer a final (or staging) state of a task.
+        @param optype       'transfer' or 'deletion'
+        @param task_id      Task id
+        @param status       New status
+        @param exitcode     Exit code
+        @param message      Error message
+        @param start_time   UNIX start time
+        @param finish_time  UNIX finish time
+        """
+
+        if start_time is not None:
+            start_time = datetime.datetime.fromtimestamp(start_time)
+        if finish_time is not None:
+            finish_time = datetime.datetime.fromtimestamp(finish_time)
+
+        with self._lock:
+            self._updates[optype][task_id] = (status, exitcode, message, start_time, finish_time)
+            self._size += 1
+            full = self._size >= self.flush_size
+
+        if full:
+            self._flush_request.set()
+
+    def flush(self):
+        """
+        Write out the buffered transitions. Transitions that fail to be written are kept for the next flush.
+        """
+
+        with self._flush_lock:
+            with self._lock:
+                queued = self._queued
+                updates = self._updates
+                self._queued = {'transfer': [], 'deletion': []}
+                self._updates = {'transfer': {}, 'deletion': {}}
+                self._size = 0
+
+            start = time.time()
+            num_rows = 0
+
+            for optype in ['transfer', 'deletion']:
+                try:
+                    if len(queued[optype]) != 0:
+                        self._write_queued(optype, queued[optype])
+                        num_rows += len(queued[optype])
+                        queued[optype] = []
+
+                    if len(updates[optype]) != 0:
+                        self._write_updates(optype, updates[optype])
+                        num_rows += len(updates[optype])
+                        updates[optype] = {}
+
+                except:
+                    # put back what was not written; newer transitions of the same tasks take precedence
+                    with self._lock:
+                        for op in ['transfer', 'deletion']:
+                            self._queued[op][0:0] = queued[op]
+                            for task_id, update in updates[op].iteritems():
+                                self._updates[op].setdefault(task_id, update)
+
+                            self._size += len(queued[op]) + len(updates[op])
+
+                    raise
+
+            if num_rows != 0:
+                LOG.debug('Wrote %d task state transitions in %.2f seconds.', num_rows, time.time() - start)
+
+    def _write_queued(self, optype, task_ids):
+        sql = 'UPDATE `standalone_{op}_tasks` SET `status` = \'queued\''.format(op = optype)
+        self.db.execute_many(sql, 'id', task_ids, ['`status` IN (\'new\', \'staged\')'])
+
+    def _write_updates(self, optype, updates):
+        columns = (
+            '`id` bigint(20) unsigned NOT NULL',
+            '`status` varchar(16) NOT NULL',
+            '`exitcode` smallint(5) DEFAULT NULL',
+            '`message` varchar(512) DEFAULT NULL',
+            '`start_time` datetime DEFAULT NULL',
+            '`finish_time` datetime DEFAULT NULL',
+            'PRIMARY KEY (`id`)'
+        )
+        self.db.create_tmp_table(TaskStatusBuffer._tmp_table, columns)
+
+        try:
+            fields = ('id', 'status', 'exitcode', 'message', 'start_time', 'finish_time')
+            mapping = lambda item: (item[0],) + item[1]
+            self.db.insert_many(TaskStatusBuffer._tmp_table, fields, mapping, updates.iteritems(), do_update = False, db = self.db.scratch_db)
+
+            sql = 'UPDATE `standalone_{op}_tasks` AS t'
+            sql += ' INNER JOIN `{scratch}`.`{tmp}` AS s ON s.`id` = t.`id`'
+            sql += ' SET t.`status` = s.`status`, t.`exitcode` = s.`exitcode`, t.`message` = s.`message`,'
+            sql += ' t.`start_time` = s.`start_time`, t.`finish_time` = s.`finish_time`'
+            self.db.query(sql.format(op = optype, scratch = self.db.scratch_db, tmp = TaskStatusBuffer._tmp_table))
+
+        finally:
+            self.db.drop_tmp_table(TaskStatusBuffer._tmp_table)
+
+    def _run(self):
+        while not self._stop_flag.is_set():
+            self._flush_request.wait(self.flush_interval * 1.e-3)
+            self._flush_request.clear()
+
+            if self._stop_flag.is_set():
+                # stop() does the final flush
+                return
+
+            try:
+                self.flush()
+            except:
+                log_exception(LOG)
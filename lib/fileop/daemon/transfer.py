@@ -20,7 +20,8 @@ def transfer(task_id, src_pfn, dest_pfn, params_config):
     @return  (exit code, start time, finish time, error message, log string)
     """
 
-    activated = PoolManager.db.query('UPDATE `standalone_transfer_tasks` SET `status` = \'active\' WHERE `id` = %s', task_id)    
+    # The queued state may still be in the status buffer of the parent process
+    activated = PoolManager.db.query('UPDATE `standalone_transfer_tasks` SET `status` = \'active\' WHERE `id` = %s AND `status` IN (\'new\', \'queued\', \'staged\')', task_id)
     if activated == 0:
         # task was cancelled
         return -1, None, None, '', ''
@@ -49,8 +50,32 @@ def transfer(task_id, src_pfn, dest_pfn, params_config):
     return gfal_exec('filecopy', (params, src_pfn, dest_pfn), transfer_nonerrors)
 
 
+def get_new_transfers(db):
+    """
+    Select the tasks in new and staged states to be started, ordered by link.
+    The file size is taken from the inventory tables; tasks whose file cannot be found there are still
+    returned, with size 0.
+    @param db  MySQL handle to the inventory DB
+
+    @return  List of (task id, source PFN, destination PFN, checksum algorithm, checksum, source site,
+             destination site, size) ordered by (source site, destination site, task id)
+    """
+
+    sql = 'SELECT q.`id`, a.`source`, a.`destination`, a.`checksum_algo`, a.`checksum`, b.`source_site`, b.`destination_site`,'
+    sql += ' COALESCE(f.`size`, 0)'
+    sql += ' FROM `standalone_transfer_tasks` AS a'
+    sql += ' INNER JOIN `transfer_tasks` AS q ON q.`id` = a.`id`'
+    sql += ' INNER JOIN `standalone_transfer_batches` AS b ON b.`batch_id` = q.`batch_id`'
+    sql += ' LEFT JOIN `file_subscriptions` AS u ON u.`id` = q.`subscription_id`'
+    sql += ' LEFT JOIN `files` AS f ON f.`id` = u.`file_id`'
+    sql += ' WHERE (a.`status` = \'new\' AND b.`mss_source` = 0) OR a.`status` = \'staged\''
+    sql += ' ORDER BY b.`source_site`, b.`destination_site`, q.`id`'
+
+    return db.query(sql)
+
+
 class TransferPoolManager(StatefulPoolManager):
     def __init__(self, src, dest, max_concurrent, proxy):
         name = '%s-%s' % (src, dest)
         opformat = '{0} -> {1}'
-        PoolManager.__init__(self, name, 'transfer', opformat, transfer, max_concurrent, proxy)
+        PoolManager.__init__(self, name, 'transfer', opformat, transfer, max_concurrent, proxy, link = ('transfer', src, dest))
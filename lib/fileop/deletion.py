@@ -83,6 +83,16 @@ class FileDeletionQuery(FileQuery):
         """
         raise NotImplementedError('write_deletion_history')
 
+    def write_deletion_history_many(self, history_db, task_history_ids):
+        """
+        Bulk version of write_deletion_history. Plugins with per-task history should override this with
+        a set-based implementation; the default calls write_deletion_history for each task.
+        @param history_db        HistoryDatabase instance
+        @param task_history_ids  List of (deletion task id, ID in the history file_deletions table)
+        """
+        for task_id, history_id in task_history_ids:
+            self.write_deletion_history(history_db, task_id, history_id)
+
     def forget_deletion_status(self, task_id):
         """
         Delete the internal record (if there is any) of the specific task.
@@ -90,6 +100,14 @@ class FileDeletionQuery(FileQuery):
         """
         raise NotImplementedError('fotget_deletion_status')
 
+    def forget_deletion_status_many(self, task_ids):
+        """
+        Bulk version of forget_deletion_status. The default calls forget_deletion_status for each task.
+        @param task_ids  List of integer ids of the deletion tasks.
+        """
+        for task_id in task_ids:
+            self.forget_deletion_status(task_id)
+
     def forget_deletion_batch(self, batch_id):
         """
         Delete the internal record (if there is any) of the specific batch.
@@ -6,6 +6,7 @@ import collections
 import json
 import logging
 import errno
+import threading
 
 import fts3.rest.client.easy as fts3
 from fts3.rest.client.request import Request
@@ -15,6 +16,7 @@ from dynamo.fileop.base import FileQuery
 from dynamo.fileop.transfer import FileTransferOperation, FileTransferQuery
 from dynamo.fileop.deletion import FileDeletionOperation, FileDeletionQuery
 from dynamo.fileop.errors import find_msg_code
+from dynamo.fileop.impl.ftsstatus import FTSJobStatusCache
 from dynamo.utils.interface.mysql import MySQL
 from dynamo.dataformat import Site
 from dynamo.core.executable import inventory
@@ -56,9 +58,12 @@ class FTSFileOperation(FileTransferOperation, FileTransferQuery, FileDeletionOpe
         # Bookkeeping device
         self.db = MySQL(config.db_params)
 
-        # Reuse the context object
+        # Reuse the context object (one context per thread)
         self.keep_context = config.get('keep_context', False)
-        self._context = None
+        self._local = threading.local()
+
+        # Job status is polled concurrently and cached between cycles
+        self._status_cache = FTSJobStatusCache(self._get_job_status, config.get('status_poll_threads', 8), config.get('status_poll_interval', 30))
 
     def num_pending_transfers(self): #override
         # Check the number of files in queue
@@ -66,52 +71,14 @@ class FTSFileOperation(FileTransferOperation, FileTransferQuery, FileDeletionOpe
         #files = self._ftscallurl('/files?state_in=ACTIVE,SUBMITTED,READY&limit=%d' % self.max_pending_transfers)
         #return len(files)
 
-        num_pending = 0
-        file_states = ['SUBMITTED', 'READY', 'ACTIVE', 'STAGING', 'STARTED']
-
-        jobs = self._ftscall('list_jobs', state_in = ['SUBMITTED', 'ACTIVE', 'STAGING'])
-        from random import shuffle
-        shuffle(jobs)
-
-        total_count = 0
-        for job in jobs:
-            total_count = total_count + 1
-            #LOG.info("List_files call 1")
-            job_info = self._ftscall('get_job_status', job['job_id'], list_files = True)
-            for file_info in job_info['files']:
-                if file_info['file_state'] in file_states:
-                    num_pending += 1
-                    if num_pending == self.max_pending_transfers + 1:
-                        # don't need to query more
-                        return num_pending
-
-        return num_pending
+        return self._num_pending('transfer', ['SUBMITTED', 'ACTIVE', 'STAGING'])
 
     def num_pending_deletions(self): #override
         # See above
         #files = self._ftscallurl('/files?state_in=ACTIVE,SUBMITTED,READY&limit=%d' % self.max_pending_deletions)
         #return len(files)
 
-        num_pending = 0
-        file_states = ['SUBMITTED', 'READY', 'ACTIVE']
-
-        jobs = self._ftscall('list_jobs', state_in = ['SUBMITTED', 'ACTIVE'])
-        from random import shuffle
-        shuffle(jobs)
-
-        total_count = 0
-        for job in jobs:
-            total_count = total_count + 1
-            #LOG.info("List_files call 2")
-            job_info = self._ftscall('get_job_status', job['job_id'], list_files = True)
-            for file_info in job_info['dm']:
-                if file_info['file_state'] in file_states:
-                    num_pending += 1
-                    if num_pending == self.max_pending_deletions + 1:
-                        # don't need to query more
-                        return num_pending
-
-        return num_pending
+        return self._num_pending('deletion', ['SUBMITTED', 'ACTIVE'])
 
     def form_batches(self, tasks): #override
         if len(tasks) == 0:
@@ -336,12 +303,24 @@ class FTSFileOperation(FileTransferOperation, FileTransferQuery, FileDeletionOpe
     def write_deletion_history(self, history_db, task_id, history_id): #override
         self._write_history(history_db, task_id, history_id, 'deletion')
 
+    def write_transfer_history_many(self, history_db, task_history_ids): #override
+        self._write_history_many(history_db, task_history_ids, 'transfer')
+
+    def write_deletion_history_many(self, history_db, task_history_ids): #override
+        self._write_history_many(history_db, task_history_ids, 'deletion')
+
     def forget_transfer_status(self, task_id): #override
         return self._forget_status(task_id, 'transfer')
 
     def forget_deletion_status(self, task_id): #override
         return self._forget_status(task_id, 'deletion')
 
+    def forget_transfer_status_many(self, task_ids): #override
+        return self._forget_status_many(task_ids, 'transfer')
+
+    def forget_deletion_status_many(self, task_ids): #override
+        return self._forget_status_many(task_ids, 'deletion')
+
     def forget_transfer_batch(self, task_id): #override
         return self._forget_batch(task_id, 'transfer')
 
@@ -355,7 +334,13 @@ class FTSFileOperation(FileTransferOperation, FileTransferQuery, FileDeletionOpe
         # Call to FTS URLs that don't have python bindings
         return self._do_ftscall(url = url)
 
-    def _do_ftscall(self, binding = None, url = None):
+    def _get_job_status(self, job_id):
+        # Called from the status cache threads; contexts are kept to reuse the connections
+        return self._do_ftscall(binding = ('get_job_status', (job_id,), {'list_files': True}), keep_context = True)
+
+    def _do_ftscall(self, binding = None, url = None, keep_context = None):
+        if keep_context is None:
+            keep_context = self.keep_context
         
         proxy = self.x509proxy
 
@@ -367,7 +352,9 @@ class FTSFileOperation(FileTransferOperation, FileTransferQuery, FileDeletionOpe
                     LOG.info("Setting proxy to %s" % k[1])
                     proxy = k[1]
 
-        if self._context is None:
+        context = getattr(self._local, 'context', None)
+
+        if context is None:
             # request_class = Request -> use "requests"-based https call (instead of default PyCURL,
             # which may not be able to handle proxy certificates depending on the cURL installation)
             # verify = False -> do not verify the server certificate
@@ -375,10 +362,8 @@ class FTSFileOperation(FileTransferOperation, FileTransferQuery, FileDeletionOpe
             context = fts3.Context(self.server_url, ucert = proxy, ukey = proxy,
                                    request_class = Request, verify = False)
 
-            if self.keep_context:
-                self._context = context
-        else:
-            context = self._context
+            if keep_context:
+                self._local.context = context
 
         if binding is not None:
             reqstring = binding[0]
@@ -437,12 +422,19 @@ class FTSFileOperation(FileTransferOperation, FileTransferQuery, FileDeletionOpe
                 key = 'dm'
 
             #LOG.info("List_files call 3")
-            fts_files = self._ftscall('get_job_status', job_id = job_id, list_files = True)[key]
+            job_info = self._ftscall('get_job_status', job_id = job_id, list_files = True)
+            fts_files = job_info[key]
         except:
             exc_type, exc, tb = sys.exc_info()
             LOG.error('Failed to get status of job %s from FTS: Exception %s (%s)', job_id, exc_type.__name__, str(exc))
             return False
 
+        if not self._read_only:
+            if optype == 'staging':
+                self._status_cache.update('transfer', job_id, job_info)
+            else:
+                self._status_cache.update(optype, job_id, job_info)
+
         if self.server_id == 0:
             self._set_server_id()
 
@@ -496,34 +488,32 @@ class FTSFileOperation(FileTransferOperation, FileTransferQuery, FileDeletionOpe
             sql += ' WHERE `task_type` = %s AND `fts_server_id` = %s AND `batch_id` = %s'
             batch_data = self.db.query(sql, optype, self.server_id, batch_id)
             task_table_name = 'fts_transfer_tasks'
+            cache_optype = 'transfer'
         else:
             sql = 'SELECT `id`, `job_id` FROM `fts_deletion_batches`'
             sql += ' WHERE `fts_server_id` = %s AND `batch_id` = %s'
             batch_data = self.db.query(sql, self.server_id, batch_id)
             task_table_name = 'fts_deletion_tasks'
+            cache_optype = 'deletion'
 
         message_pattern = re.compile('(?:DESTINATION|SOURCE|TRANSFER|DELETION) \[([0-9]+)\] (.*)')
 
+        # Poll all jobs of the batch concurrently (jobs in terminal states are taken from the cache)
+        job_files = self._status_cache.refresh(cache_optype, [job_id for _, job_id in batch_data])
+
         results = []
 
         for fts_batch_id, job_id in batch_data:
             LOG.debug('Checking status of FTS %s batch %s', optype, job_id)
 
-            sql = 'SELECT `fts_file_id`, `id` FROM `{table}` WHERE `fts_batch_id` = %s'.format(table = task_table_name)
-            fts_to_task = dict(self.db.xquery(sql, fts_batch_id))
-
             try:
-                #LOG.info("List_files call 4")
-                result = self._ftscall('get_job_status', job_id = job_id, list_files = True)
-            except:
-                LOG.error('Failed to get job status for FTS job %s', job_id)
-                LOG.error(optype)
+                fts_files = job_files[job_id]
+            except KeyError:
+                # failed to get the job status
                 continue
-    
-            if optype == 'transfer' or optype == 'staging':
-                fts_files = result['files']
-            else:
-                fts_files = result['dm']
+
+            sql = 'SELECT `fts_file_id`, `id` FROM `{table}` WHERE `fts_batch_id` = %s'.format(table = task_table_name)
+            fts_to_task = dict(self.db.xquery(sql, fts_batch_id))
 
             for fts_file in fts_files:
                 try:
@@ -625,6 +615,36 @@ class FTSFileOperation(FileTransferOperation, FileTransferQuery, FileDeletionOpe
 
             history_db.db.insert_update('fts_file_{op}s'.format(op = optype), ('id', 'fts_batch_id', 'fts_file_id'), history_id, batch_id, fts_file_id)
 
+    def _write_history_many(self, history_db, task_history_ids, optype):
+        if len(task_history_ids) == 0:
+            return
+
+        if not self._read_only:
+            history_db.db.insert_update('fts_servers', ('url',), self.server_url)
+
+        try:
+            server_id = history_db.db.query('SELECT `id` FROM `fts_servers` WHERE `url` = %s', self.server_url)[0]
+        except IndexError:
+            server_id = 0
+
+        history_ids = dict(task_history_ids)
+
+        sql = 'SELECT t.`id`, b.`job_id`, t.`fts_file_id` FROM `fts_{op}_tasks` AS t'
+        sql += ' INNER JOIN `fts_{op}_batches` AS b ON b.`id` = t.`fts_batch_id`'
+        task_data = self.db.execute_many(sql.format(op = optype), 't.`id`', history_ids.keys())
+
+        if self._read_only or len(task_data) == 0:
+            return
+
+        job_ids = list(set(job_id for _, job_id, _ in task_data))
+
+        history_db.db.insert_many('fts_batches', ('fts_server_id', 'job_id'), lambda j: (server_id, j), job_ids)
+        batch_ids = dict(history_db.db.select_many('fts_batches', ('job_id', 'id'), 'job_id', job_ids, ['`fts_server_id` = %d' % server_id]))
+
+        fields = ('id', 'fts_batch_id', 'fts_file_id')
+        mapping = lambda (task_id, job_id, fts_file_id): (history_ids[task_id], batch_ids[job_id], fts_file_id)
+        history_db.db.insert_many('fts_file_{op}s'.format(op = optype), fields, mapping, task_data)
+
     def _forget_status(self, task_id, optype):
         if self._read_only:
             return
@@ -632,13 +652,35 @@ class FTSFileOperation(FileTransferOperation, FileTransferQuery, FileDeletionOpe
         sql = 'DELETE FROM `fts_{optype}_tasks` WHERE `id` = %s'.format(optype = optype)
         self.db.query(sql, task_id)
 
+    def _forget_status_many(self, task_ids, optype):
+        if self._read_only:
+            return
+
+        self.db.delete_many('fts_{optype}_tasks'.format(optype = optype), 'id', task_ids)
+
     def _forget_batch(self, batch_id, optype):
         if self._read_only:
             return
 
+        sql = 'SELECT `job_id` FROM `fts_{optype}_batches` WHERE `batch_id` = %s'.format(optype = optype)
+        self._status_cache.forget(optype, self.db.query(sql, batch_id))
+
         sql = 'DELETE FROM `fts_{optype}_batches` WHERE `batch_id` = %s'.format(optype = optype)
         self.db.query(sql, batch_id)
 
+    def _num_pending(self, optype, job_states):
+        # One listing call to find the active jobs (including ones submitted by other processes);
+        # file counts come from the status cache, which polls only the jobs not in terminal states.
+        jobs = self._ftscall('list_jobs', state_in = job_states)
+
+        job_ids = set(job['job_id'] for job in jobs)
+        # previously active jobs that are no longer listed need one more poll to see their final state
+        job_ids.update(self._status_cache.active_jobs(optype))
+
+        self._status_cache.refresh(optype, job_ids, keep = False)
+
+        return self._status_cache.num_pending(optype)
+
     def _set_server_id(self):
         if not self._read_only:
             self.db.query('INSERT INTO `fts_servers` (`url`) VALUES (%s) ON DUPLICATE KEY UPDATE `url`=VALUES(`url`)', self.server_url)
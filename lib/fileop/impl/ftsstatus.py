@@ -0,0 +1,190 @@
+import time
+import threading
+import logging
+from multiprocessing.pool import ThreadPool
+
+LOG = logging.getLogger(__name__)
+
+class FTSJobStatusCache(object):
+    """
+    Cache of FTS job status shared by the status queries and the pending-file counters of FTSFileOperation.
+    Jobs are polled concurrently by a persistent pool of threads (each thread keeps its own FTS context, so
+    that the HTTPS connections are reused). Jobs in a terminal state are never polled again, and jobs in
+    other states are polled at most once per poll_interval. The number of pending files per operation type
+    is updated incrementally as the job entries change.
+    """
+
+    TERMINAL_STATES = frozenset(['FINISHED', 'FAILED', 'FINISHEDDIRTY', 'CANCELED'])
+
+    # File states counted as pending
+    PENDING_FILE_STATES = {
+        'transfer': frozenset(['SUBMITTED', 'READY', 'ACTIVE', 'STAGING', 'STARTED']),
+        'deletion': frozenset(['SUBMITTED', 'READY', 'ACTIVE'])
+    }
+
+    # Key of the file list in the job status
+    FILE_KEYS = {'transfer': 'files', 'deletion': 'dm'}
+
+    class Job(object):
+        __slots__ = ['state', 'files', 'num_pending', 'last_poll', 'keep']
+
+        def __init__(self):
+            self.state = None
+            self.files = []
+            self.num_pending = 0
+            self.last_poll = 0
+            # Keep the entry after the job reaches a terminal state (until forget() is called)
+            self.keep = False
+
+        @property
+        def terminal(self):
+            return self.state in FTSJobStatusCache.TERMINAL_STATES
+
+    def __init__(self, get_job_status, num_threads = 8, poll_interval = 30):
+        """
+        @param get_job_status  Function (job_id) -> job status dict with the file list (FTS get_job_status with list_files = True)
+        @param num_threads     Maximum number of concurrent queries.
+        @param poll_interval   Minimum interval in seconds between two queries of the same job.
+        """
+
+        self._get_job_status = get_job_status
+        self.num_threads = num_threads
+        self.poll_interval = poll_interval
+
+        # {optype: {job_id: Job}}
+        self._jobs = {'transfer': {}, 'deletion': {}}
+        # {optype: number of pending files}
+        self._num_pending = {'transfer': 0, 'deletion': 0}
+
+        self._lock = threading.Lock()
+        # thread pool is created at the first poll
+        self._pool = None
+
+    def refresh(self, optype, job_ids, keep = True):
+        """
+        Poll the jobs that are not in a terminal state and were not polled within poll_interval.
+        @param optype   'transfer' or 'deletion'
+        @param job_ids  Iterable of job ids
+        @param keep     If True, terminal jobs stay in the cache until forget() is called. Otherwise
+                        they are dropped once their terminal state is seen (unless kept by another caller).
+
+        @return {job_id: list of file status dicts} for the jobs with a known status
+        """
+
+        job_ids = list(job_ids)
+
+        jobs = self._jobs[optype]
+        now = time.time()
+
+        with self._lock:
+            to_poll = []
+            for job_id in job_ids:
+                try:
+                    job = jobs[job_id]
+                except KeyError:
+                    job = jobs[job_id] = FTSJobStatusCache.Job()
+
+                if keep:
+                    job.keep = True
+
+                if not job.terminal and now - job.last_poll > self.poll_interval:
+                    to_poll.append(job_id)
+
+        if len(to_poll) != 0:
+            start = time.time()
+
+            if self._pool is None:
+                self._pool = ThreadPool(self.num_threads)
+
+            results = self._pool.map(self._poll, to_poll)
+
+            num_failed = 0
+            for job_id, info in zip(to_poll, results):
+                if info is None:
+                    num_failed += 1
+                else:
+                    self.update(optype, job_id, info)
+
+            LOG.debug('Polled %d FTS %s jobs (%d failed) in %.1f seconds.', len(to_poll), optype, num_failed, time.time() - start)
+
+        result = {}
+
+        with self._lock:
+            for job_id in job_ids:
+                try:
+                    job = jobs[job_id]
+                except KeyError:
+                    continue
+
+                if job.state is not None:
+                    result[job_id] = job.files
+
+                if job.terminal and not job.keep:
+                    del jobs[job_id]
+                    self._num_pending[optype] -= job.num_pending
+
+        return result
+
+    def update(self, optype, job_id, info):
+        """
+        Set the status of a job from a get_job_status result.
+        @param optype   'transfer' or 'deletion'
+        @param job_id   Job id
+        @param info     Job status dict with the file list
+        """
+
+        pending_states = FTSJobStatusCache.PENDING_FILE_STATES[optype]
+        files = info[FTSJobStatusCache.FILE_KEYS[optype]]
+        num_pending = sum(1 for f in files if f['file_state'] in pending_states)
+
+        with self._lock:
+            try:
+                job = self._jobs[optype][job_id]
+            except KeyError:
+                job = self._jobs[optype][job_id] = FTSJobStatusCache.Job()
+                job.keep = True
+
+            self._num_pending[optype] += num_pending - job.num_pending
+
+            job.state = info['job_state']
+            job.files = files
+            job.num_pending = num_pending
+            job.last_poll = time.time()
+
+    def forget(self, optype, job_ids):
+        """
+        Remove the jobs from the cache.
+        """
+
+        jobs = self._jobs[optype]
+
+        with self._lock:
+            for job_id in job_ids:
+                try:
+                    job = jobs.pop(job_id)
+                except KeyError:
+                    continue
+
+                self._num_pending[optype] -= job.num_pending
+
+    def active_jobs(self, optype):
+        """
+        @return List of ids of the cached jobs not in a terminal state.
+        """
+
+        with self._lock:
+            return [job_id for job_id, job in self._jobs[optype].iteritems() if not job.terminal]
+
+    def num_pending(self, optype):
+        """
+        @return Number of files in pending states in the cached jobs.
+        """
+
+        return self._num_pending[optype]
+
+    def _poll(self, job_id):
+        try:
+            return self._get_job_status(job_id)
+        except:
+            LOG.error('Failed to get job status for FTS job %s', job_id)
+            return None
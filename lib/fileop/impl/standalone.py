@@ -162,12 +162,24 @@ class StandaloneFileOperation(FileTransferOperation, FileTransferQuery, FileDele
     def write_deletion_history(self, history_db, task_id, history_id): #override
         pass
 
+    def write_transfer_history_many(self, history_db, task_history_ids): #override
+        pass
+
+    def write_deletion_history_many(self, history_db, task_history_ids): #override
+        pass
+
     def forget_transfer_status(self, task_id): #override
         return self._forget_status(task_id, 'transfer')
 
     def forget_deletion_status(self, task_id): #override
         return self._forget_status(task_id, 'deletion')
 
+    def forget_transfer_status_many(self, task_ids): #override
+        return self._forget_status_many(task_ids, 'transfer')
+
+    def forget_deletion_status_many(self, task_ids): #override
+        return self._forget_status_many(task_ids, 'deletion')
+
     def forget_transfer_batch(self, batch_id): #override
         return self._forget_batch(batch_id, 'transfer')
 
@@ -193,6 +205,12 @@ class StandaloneFileOperation(FileTransferOperation, FileTransferQuery, FileDele
         sql = 'DELETE FROM `standalone_{op}_tasks` WHERE `id` = %s'.format(op = optype)
         self.db.query(sql, task_id)
 
+    def _forget_status_many(self, task_ids, optype):
+        if self._read_only:
+            return
+
+        self.db.delete_many('standalone_{op}_tasks'.format(op = optype), 'id', task_ids)
+
     def _forget_batch(self, batch_id, optype):
         if self._read_only:
             return
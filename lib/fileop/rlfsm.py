@@ -137,6 +137,9 @@ class RLFSM(object):
 
         self.sites_in_downtime = []
 
+        # Cache of history DB site ids {site name: id}
+        self._history_site_ids = {}
+
         # Cycle thread
         self.main_cycle = None
         self.cycle_stop = threading.Event()
@@ -145,6 +148,8 @@ class RLFSM(object):
 
     def set_read_only(self, value = True):
         self._read_only = value
+        # history ids are all 0 in read-only mode
+        self._history_site_ids = {}
         self.history_db.set_read_only(value)
         for _, op in self.transfer_operations:
             op.set_read_only(value)
@@ -484,6 +489,30 @@ class RLFSM(object):
 
         self._subscribe(site, lfile, 1)
 
+    def subscribe_files(self, site, files):
+        """
+        Make file subscriptions at a site in bulk. Same as calling subscribe_file for each file,
+        with a fixed number of queries.
+        @param site  Site object
+        @param files List of File objects
+        """
+        files = list(files)
+        LOG.debug('Subscribing %d files to %s', len(files), site.name)
+
+        self._subscribe_many([(site, lfile, None) for lfile in files], 0)
+
+    def desubscribe_files(self, site, files):
+        """
+        Book deletions of files at a site in bulk. Same as calling desubscribe_file for each file,
+        with a fixed number of queries.
+        @param site  Site object
+        @param files List of File objects
+        """
+        files = list(files)
+        LOG.debug('Desubscribing %d files from %s', len(files), site.name)
+
+        self._subscribe_many([(site, lfile, None) for lfile in files], 1)
+
     def cancel_subscription(self, site = None, lfile = None, sub_id = None):
         sql = 'UPDATE `file_subscriptions` SET `status` = \'cancelled\' WHERE '
 
@@ -506,6 +535,10 @@ class RLFSM(object):
         sql = 'SELECT `id`, `file_name`, `site_name`, UNIX_TIMESTAMP(`created`), `delete` FROM `file_pre_subscriptions`'
 
         sids = []
+        # Runs of consecutive pre-subscriptions with the same operation are converted in bulk
+        # (the order matters when a file is subscribed and desubscribed at the same site)
+        entries = []
+        last_delete = None
 
         for sid, lfn, site_name, created, delete in self.db.query(sql):
             lfile = inventory.find_file(lfn)
@@ -522,7 +555,15 @@ class RLFSM(object):
 
             sids.append(sid)
 
-            self._subscribe(site, lfile, delete, created = created)
+            if delete != last_delete and len(entries) != 0:
+                self._subscribe_many(entries, last_delete)
+                entries = []
+
+            entries.append((site, lfile, created))
+            last_delete = delete
+
+        if len(entries) != 0:
+            self._subscribe_many(entries, last_delete)
 
         if not self._read_only:
             self.db.lock_tables(write = ['file_pre_subscriptions'])
@@ -542,6 +583,8 @@ class RLFSM(object):
         # First convert all pre-subscriptions
         self.convert_pre_subscriptions(inventory)
 
+        start = time.time()
+
         subscriptions = []
 
         get_all = 'SELECT u.`id`, u.`status`, u.`delete`, f.`block_id`, f.`name`, s.`name`, u.`hold_reason`, u.`created`'
@@ -562,13 +605,28 @@ class RLFSM(object):
 
         get_all += ' ORDER BY s.`id`, f.`block_id`'
 
-        get_tried_sites = 'SELECT s.`name`, f.`exitcode` FROM `failed_transfers` AS f'
-        get_tried_sites += ' INNER JOIN `sites` AS s ON s.`id` = f.`source_id`'
-        get_tried_sites += ' WHERE f.`subscription_id` = %s'
+        # Failed transfer history of all subscriptions in retry, in order of occurrence
+        tried_sites = collections.defaultdict(list) # {subscription_id: [(source name, exitcode)]}
+        if op != 'deletion' and (status is None or 'retry' in status):
+            get_tried_sites = 'SELECT f.`subscription_id`, s.`name`, f.`exitcode` FROM `failed_transfers` AS f'
+            get_tried_sites += ' INNER JOIN `sites` AS s ON s.`id` = f.`source_id`'
+            get_tried_sites += ' INNER JOIN `file_subscriptions` AS u ON u.`id` = f.`subscription_id`'
+            get_tried_sites += ' WHERE u.`status` = \'retry\''
+            get_tried_sites += ' ORDER BY f.`subscription_id`, f.`id`'
+
+            for sub_id, source_name, exitcode in self.db.xquery(get_tried_sites):
+                tried_sites[sub_id].append((source_name, exitcode))
+
+        # Blocks are resolved by id without going through the inventory store
+        id_block_map = None
 
         _destination_name = ''
         _block_id = -1
 
+        num_rows = 0
+        num_copy = 0
+        num_delete = 0
+
         no_source = []
         all_failed = []
         to_done = []
@@ -581,6 +639,14 @@ class RLFSM(object):
         for row in self.db.query(get_all):
             sub_id, st, optype, block_id, file_name, site_name, hold_reason, created = row
 
+            num_rows += 1
+
+            if id_block_map is None:
+                id_block_map = {}
+                for dataset in inventory.datasets.itervalues():
+                    for block in dataset.blocks:
+                        id_block_map[block.id] = block
+
             if site_name != _destination_name:
                 _destination_name = site_name
                 try:
@@ -595,22 +661,44 @@ class RLFSM(object):
                 continue
 
             if block_id != _block_id:
-                lfile = inventory.find_file(file_name)
-                if lfile is None:
-                    # Dataset, block, or file was deleted from the inventory earlier in this process 
-                    #(deletion not reflected in the inventory store yet)
+                _block_id = block_id
+                try:
+                    block = id_block_map[block_id]
+                except KeyError:
+                    # Dataset or block was deleted from the inventory earlier in this process
+                    # (deletion not reflected in the inventory store yet)
+                    block = None
                     continue
 
-                _block_id = block_id
-                block = lfile.block
                 dest_replica = block.find_replica(destination)
 
-            else:
-                lfile = block.find_file(file_name)
-                if lfile is None:
-                    # Dataset, block, or file was deleted from the inventory earlier in this process 
-                    #(deletion not reflected in the inventory store yet)
-                    continue
+                # Source candidates for this block and destination
+                full_sources = ([], []) # (disk, tape)
+                partial_sources = []
+                for replica in block.replicas:
+                    if replica.site == destination or replica.site.status != Site.STAT_READY:
+                        continue
+
+                    if replica.site.storage_type not in (Site.TYPE_DISK, Site.TYPE_MSS):
+                        continue
+
+                    if replica.file_ids is None:
+                        # has all files
+                        if replica.site.storage_type == Site.TYPE_DISK:
+                            full_sources[0].append(replica.site)
+                        else:
+                            full_sources[1].append(replica.site)
+                    else:
+                        partial_sources.append(replica)
+
+            if block is None:
+                continue
+
+            lfile = block.find_file(file_name)
+            if lfile is None:
+                # File was deleted from the inventory earlier in this process
+                # (deletion not reflected in the inventory store yet)
+                continue
 
             if dest_replica is None and st != 'cancelled':
                 LOG.debug('Destination replica for %s does not exist. Canceling the subscription.', file_name)
@@ -627,16 +715,14 @@ class RLFSM(object):
                 st = 'cancelled'
 
             if optype == COPY:
+                num_copy += 1
+
                 disk_sources = None
                 tape_sources = None
                 failed_sources = None
 
-                
-                #create_time = int( time.mktime(datetime.datetime(created).timetuple()) )
-                #if (now_time-create_time) > 7*(60*60*24):
-                #    LOG.info('---- very old request-----')
-                LOG.info(row)
-
+                if LOG.getEffectiveLevel() == logging.DEBUG:
+                    LOG.debug(row)
 
                 if st not in ('done', 'held', 'cancelled'):
                     if dest_replica.has_file(lfile):
@@ -646,20 +732,14 @@ class RLFSM(object):
                         st = 'done'
 
                     else:
-                        disk_sources = []
-                        tape_sources = []
-                        skip_rest = False
-                        for replica in block.replicas:
-                            if replica.site == destination or replica.site.status != Site.STAT_READY:
-                                continue
-            
+                        disk_sources = list(full_sources[0])
+                        tape_sources = list(full_sources[1])
+                        for replica in partial_sources:
                             if replica.has_file(lfile):
                                 if replica.site.storage_type == Site.TYPE_DISK:
                                     disk_sources.append(replica.site)
-                                elif replica.site.storage_type == Site.TYPE_MSS:
+                                else:
                                     tape_sources.append(replica.site)
-                        if skip_rest:
-                            continue
             
                         if len(disk_sources) + len(tape_sources) == 0:
                             LOG.info('Transfer of %s to %s has no source.', file_name, site_name)
@@ -669,7 +749,7 @@ class RLFSM(object):
 
                 if st == 'retry':
                     failed_sources = {}
-                    for source_name, exitcode in self.db.query(get_tried_sites, sub_id):
+                    for source_name, exitcode in tried_sites.get(sub_id, []):
                         try:
                             source = inventory.sites[source_name]
                         except KeyError:
@@ -706,6 +786,8 @@ class RLFSM(object):
                     subscriptions.append(subscription)
 
             elif optype == DELETE:
+                num_delete += 1
+
                 if st not in ('done', 'held', 'cancelled') and not dest_replica.has_file(lfile):
                     LOG.debug('%s is already gone from %s', file_name, site_name)
                     to_done.append(sub_id)
@@ -723,6 +805,8 @@ class RLFSM(object):
             if len(all_failed) != 0:
                 msg += ', %d held with reason "all_failed"' % len(all_failed)
 
+            LOG.info(msg)
+
         if not self._read_only:
             self.db.execute_many('UPDATE `file_subscriptions` SET `status` = \'done\', `last_update` = NOW()', 'id', to_done)
             self.db.execute_many('UPDATE `file_subscriptions` SET `status` = \'held\', `hold_reason` = \'no_source\', `last_update` = NOW()', 'id', no_source)
@@ -740,6 +824,9 @@ class RLFSM(object):
             sql += ' WHERE u.`id` IS NULL'
             self.db.query(sql)
 
+        LOG.info('Processed %d subscription rows (%d copy, %d delete, %d with failure history) into %d subscriptions in %.1f seconds.',
+            num_rows, num_copy, num_delete, len(tried_sites), len(subscriptions), time.time() - start)
+
         return subscriptions
 
     def close_subscriptions(self, done_ids):
@@ -867,58 +954,87 @@ class RLFSM(object):
             if not self._read_only:
                 self.db.unlock_tables()
 
-    def _get_cancelled_tasks(self, optype):
-        if optype == 'transfer':
-            delete = 0
-        else:
-            delete = 1
+    def _subscribe_many(self, entries, delete):
+        """
+        Set-based version of _subscribe. The (file, site) pairs are staged in a temporary table, and
+        the cancellation of the opposite operations and the upsert are done with one statement each.
+        The subscription table is locked only for these two statements.
+        @param entries  List of (site, lfile, created) where created is a UNIX time or None (now)
+        @param delete   0 for subscriptions, 1 for desubscriptions
+        """
 
-        sql = 'SELECT q.`id` FROM `{op}_tasks` AS q'.format(op = optype)
-        sql += ' INNER JOIN `file_subscriptions` AS u ON u.`id` = q.`subscription_id`'
-        sql += ' WHERE u.`status` = \'cancelled\' AND u.`delete` = %d' % delete
-        return self.db.query(sql)
+        opp_op = 0 if delete == 1 else 1
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
 
-    def _update_status(self, optype, inventory):
-        if optype == 'transfer':
-            site_columns = 'ss.`name`, sd.`name`'
-            site_joins = ' INNER JOIN `sites` AS ss ON ss.`id` = q.`source_id`'
-            site_joins += ' INNER JOIN `sites` AS sd ON sd.`id` = u.`site_id`'
-        else:
-            site_columns = 's.`name`'
-            site_joins = ' INNER JOIN `sites` AS s ON s.`id` = u.`site_id`'
+        pre_subscriptions = []
+        subscriptions = []
 
-        get_task_data = 'SELECT u.`id`, f.`name`, f.`size`, UNIX_TIMESTAMP(q.`created`), ' + site_columns + ' FROM `{op}_tasks` AS q'
-        get_task_data += ' INNER JOIN `file_subscriptions` AS u ON u.`id` = q.`subscription_id`'
-        get_task_data += ' INNER JOIN `files` AS f ON f.`id` = u.`file_id`'
-        get_task_data += site_joins
-        get_task_data += ' WHERE q.`id` = %s'
+        for site, lfile, created in entries:
+            if lfile.id == 0 or site.id == 0:
+                # file is not registered in inventory store yet; update the presubscription
+                pre_subscriptions.append((lfile.lfn, site.name, now, delete))
+            else:
+                if created is None:
+                    created = now
+                else:
+                    created = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created))
 
-        get_task_data = get_task_data.format(op = optype)
+                subscriptions.append((lfile.id, site.id, created))
 
-        if optype == 'transfer':
-            history_table_name = 'file_transfers'
-            history_site_fields = ('source_id', 'destination_id')
-        else:
-            history_table_name = 'file_deletions'
-            history_site_fields = ('site_id',)
+        if self._read_only:
+            return
 
-        history_fields = ('file_id', 'exitcode', 'message', 'batch_id', 'created', 'started', 'finished', 'completed') + history_site_fields
+        if len(pre_subscriptions) != 0:
+            fields = ('file_name', 'site_name', 'created', 'delete')
+            self.db.insert_many('file_pre_subscriptions', fields, None, pre_subscriptions, update_columns = ('delete',))
 
-        if optype == 'transfer':
-            insert_failure = 'INSERT INTO `failed_transfers` (`id`, `subscription_id`, `source_id`, `exitcode`)'
-            insert_failure += ' SELECT `id`, `subscription_id`, `source_id`, %s FROM `transfer_tasks` WHERE `id` = %s'
-            insert_failure += ' ON DUPLICATE KEY UPDATE `id`=VALUES(`id`)'
-            delete_failures = 'DELETE FROM `failed_transfers` WHERE `subscription_id` = %s'
+        if len(subscriptions) == 0:
+            return
 
-        get_subscription_status = 'SELECT `status` FROM `file_subscriptions` WHERE `id` = %s'
+        columns = [
+            '`file_id` bigint(20) unsigned NOT NULL',
+            '`site_id` int(11) unsigned NOT NULL',
+            '`created` datetime NOT NULL',
+            'PRIMARY KEY (`file_id`, `site_id`)'
+        ]
+        self.db.create_tmp_table('file_subscriptions_tmp', columns)
 
-        update_subscription = 'UPDATE `file_subscriptions` SET `status` = %s, `last_update` = NOW() WHERE `id` = %s'
-        delete_subscription = 'DELETE FROM `file_subscriptions` WHERE `id` = %s'
+        try:
+            self.db.insert_many('file_subscriptions_tmp', ('file_id', 'site_id', 'created'), None, subscriptions, db = self.db.scratch_db)
 
-        delete_task = 'DELETE FROM `{op}_tasks` WHERE `id` = %s'.format(op = optype)
+            # temporary tables need not be locked
+            self.db.lock_tables(write = ['file_subscriptions', ('file_subscriptions', 'u')])
 
-        delete_batch = 'DELETE FROM `{op}_batches` WHERE `id` = %s'.format(op = optype)
+            try:
+                sql = 'UPDATE `file_subscriptions` AS u'
+                sql += ' INNER JOIN `{db}`.`file_subscriptions_tmp` AS t ON t.`file_id` = u.`file_id` AND t.`site_id` = u.`site_id`'
+                sql += ' SET u.`status` = \'cancelled\''
+                sql += ' WHERE u.`delete` = %s AND u.`status` IN (\'new\', \'inbatch\', \'retry\', \'held\')'
+                self.db.query(sql.format(db = self.db.scratch_db), opp_op)
+
+                sql = 'INSERT INTO `file_subscriptions` (`file_id`, `site_id`, `status`, `delete`, `created`, `last_update`)'
+                sql += ' SELECT t.`file_id`, t.`site_id`, \'new\', %s, t.`created`, %s FROM `{db}`.`file_subscriptions_tmp` AS t'
+                sql += ' ON DUPLICATE KEY UPDATE `status` = VALUES(`status`), `last_update` = VALUES(`last_update`)'
+                self.db.query(sql.format(db = self.db.scratch_db), delete, now)
+
+            finally:
+                self.db.unlock_tables()
 
+        finally:
+            self.db.drop_tmp_table('file_subscriptions_tmp')
+
+    def _get_cancelled_tasks(self, optype):
+        if optype == 'transfer':
+            delete = 0
+        else:
+            delete = 1
+
+        sql = 'SELECT q.`id` FROM `{op}_tasks` AS q'.format(op = optype)
+        sql += ' INNER JOIN `file_subscriptions` AS u ON u.`id` = q.`subscription_id`'
+        sql += ' WHERE u.`status` = \'cancelled\' AND u.`delete` = %d' % delete
+        return self.db.query(sql)
+
+    def _update_status(self, optype, inventory):
         done_subscriptions = []
         num_success = 0
         num_failure = 0
@@ -926,21 +1042,10 @@ class RLFSM(object):
 
         # Collect completed tasks
 
-        total_counter = 0
-
         for batch_id in self.db.query('SELECT `id` FROM `{op}_batches`'.format(op = optype)):
             results = []
 
-            
             if optype == 'transfer':
-
-                total_counter = total_counter + 1
-
-#                if total_counter > 200:
-#                    LOG.info('-- getiing out transfer_status as counter > ' + str(total_counter))
-#                    break
-
-                
                 for condition, query in self.transfer_queries:
                     results = query.get_transfer_status(batch_id)
                     if len(results) != 0:
@@ -952,9 +1057,11 @@ class RLFSM(object):
                     if len(results) != 0:
                         break
 
-
             batch_complete = True
 
+            # {task_id: (status, exitcode, message, start_time, finish_time)}
+            completed = {}
+
             for task_id, status, exitcode, message, start_time, finish_time in results:
                 # start_time and finish_time can be None
                 LOG.debug('%s result: %d %s %d %s %s', optype, task_id, FileQuery.status_name(status), exitcode, start_time, finish_time)
@@ -969,137 +1076,190 @@ class RLFSM(object):
                     batch_complete = False
                     continue
 
-                try:
-                    task_data = self.db.query(get_task_data, task_id)[0]
-                except IndexError:
-                    LOG.warning('%s task %d got lost.', optype, task_id)
-                    if optype == 'transfer':
-                        query.forget_transfer_status(task_id)
-                    else:
-                        query.forget_deletion_status(task_id)
+                completed[task_id] = (status, exitcode, message, start_time, finish_time)
 
-                    if not self._read_only:
-                        self.db.query(delete_task, task_id)
+            if len(completed) != 0:
+                done_subscriptions.extend(self._archive_tasks(optype, batch_id, completed, query))
 
-                    continue
-
-                subscription_id, lfn, size, create_time = task_data[:4]
+            if batch_complete:
+                if not self._read_only:
+                    self.db.query('DELETE FROM `{op}_batches` WHERE `id` = %s'.format(op = optype), batch_id)
 
                 if optype == 'transfer':
-                    source_name, dest_name = task_data[4:]
-                    history_site_ids = (
-                        self.history_db.save_sites([source_name], get_ids = True)[0],
-                        self.history_db.save_sites([dest_name], get_ids = True)[0]
-                    )
+                    query.forget_transfer_batch(batch_id)
                 else:
-                    site_name = task_data[4]
-                    history_site_ids = (self.history_db.save_sites([site_name], get_ids = True)[0],)
+                    query.forget_deletion_batch(batch_id)
 
-                file_id = self.history_db.save_files([(lfn, size)], get_ids = True)[0]
+            if self.cycle_stop.is_set():
+                break
 
-                if start_time is None:
-                    sql_start_time = None
-                else:
-                    sql_start_time = datetime.datetime(*time.localtime(start_time)[:6])
+        if num_success + num_failure + num_cancelled != 0:
+            LOG.info('Archived file %s: %d succeeded, %d failed, %d cancelled.', optype, num_success, num_failure, num_cancelled)
+        else:
+            LOG.debug('Archived file %s: %d succeeded, %d failed, %d cancelled.', optype, num_success, num_failure, num_cancelled)
 
-                if finish_time is None:
-                    sql_finish_time = None
-                else:
-                    sql_finish_time = datetime.datetime(*time.localtime(finish_time)[:6])
+        return done_subscriptions
 
-                values = (file_id, exitcode, message, batch_id, datetime.datetime(*time.localtime(create_time)[:6]),
-                    sql_start_time, sql_finish_time, MySQL.bare('NOW()')) + history_site_ids
+    def _archive_tasks(self, optype, batch_id, completed, query):
+        """
+        Archive the completed tasks of one batch in bulk. The task data is collected in one join, history
+        entries are written with multi-row inserts, and the subscription states are updated with set-based
+        statements conditional on the current state instead of under a table lock.
+        @param optype     'transfer' or 'deletion'
+        @param batch_id   Integer id of the batch
+        @param completed  {task_id: (status, exit code, message, start time (UNIX), finish time (UNIX))}
+        @param query      FileTransferQuery or FileDeletionQuery that reported the task status
+
+        @return  List of ids of the subscriptions whose tasks succeeded.
+        """
 
-                if optype == 'transfer':
-                    LOG.debug('Archiving transfer of %s from %s to %s (exitcode %d)', lfn, source_name, dest_name, exitcode)
-                else:
-                    LOG.debug('Archiving deletion of %s at %s (exitcode %d)', lfn, site_name, exitcode)
+        start = time.time()
 
-                if self._read_only:
-                    history_id = 0
-                else:
-                    #LOG.error(values)
-                    #values_tmp = set()
-                    #for v in values:
-                    #    try:
-                    #        tmp = v.replace(u"\u2019", "'")
-                    #        values_tmp.add(tmp)
-                    #    except:
-                    #        values_tmp.add(v)
-                    #LOG.error(history_fields)
-                    #LOG.error(values_tmp)
-                    #values = values_tmp
-
-                    history_id = self.history_db.db.insert_get_id(history_table_name, history_fields, values)
+        if optype == 'transfer':
+            site_columns = 'q.`source_id`, ss.`name`, sd.`name`'
+            site_joins = ' INNER JOIN `sites` AS ss ON ss.`id` = q.`source_id`'
+            site_joins += ' INNER JOIN `sites` AS sd ON sd.`id` = u.`site_id`'
 
-                if optype == 'transfer':
-                    query.write_transfer_history(self.history_db, task_id, history_id)
-                else:
-                    query.write_deletion_history(self.history_db, task_id, history_id)
+            history_table_name = 'file_transfers'
+            history_site_fields = ('source_id', 'destination_id')
 
-                # We check the subscription status and update accordingly. Need to lock the tables.
-                if not self._read_only:
-                    self.db.lock_tables(write = ['file_subscriptions'])
+            write_history_many = query.write_transfer_history_many
+            forget_status_many = query.forget_transfer_status_many
+        else:
+            site_columns = 's.`name`'
+            site_joins = ' INNER JOIN `sites` AS s ON s.`id` = u.`site_id`'
 
-                try:
-                    subscription_status = self.db.query(get_subscription_status, subscription_id)[0]
+            history_table_name = 'file_deletions'
+            history_site_fields = ('site_id',)
 
-                    if subscription_status == 'inbatch':
-                        if status == FileQuery.STAT_DONE:
-                            LOG.debug('Subscription %d done.', subscription_id)
-                            if not self._read_only:
-                                self.db.query(update_subscription, 'done', subscription_id)
-        
-                        elif status == FileQuery.STAT_FAILED:
-                            LOG.debug('Subscription %d failed (exit code %d). Flagging retry.', subscription_id, exitcode)
-                            if not self._read_only:
-                                self.db.query(update_subscription, 'retry', subscription_id)
-        
-                    elif subscription_status == 'cancelled':
-                        # subscription is cancelled and task terminated -> delete the subscription now, irrespective of the task status
-                        LOG.debug('Subscription %d is cancelled.', subscription_id)
-                        if not self._read_only:
-                            self.db.query(delete_subscription, subscription_id)
-                finally:
-                    if not self._read_only:
-                        self.db.unlock_tables()
+            write_history_many = query.write_deletion_history_many
+            forget_status_many = query.forget_deletion_status_many
 
-                if not self._read_only:
-                    if optype == 'transfer':
-                        if subscription_status == 'cancelled' or (subscription_status == 'inbatch' and status == FileQuery.STAT_DONE):
-                            # Delete entries from failed_transfers table
-                            self.db.query(delete_failures, subscription_id)
-    
-                        elif subscription_status == 'inbatch' and status == FileQuery.STAT_FAILED:
-                            # Insert entry to failed_transfers table
-                            self.db.query(insert_failure, exitcode, task_id)
-        
-                    self.db.query(delete_task, task_id)
+        history_fields = ('file_id', 'exitcode', 'message', 'batch_id', 'created', 'started', 'finished', 'completed') + history_site_fields
 
-                if status == FileQuery.STAT_DONE:
-                    done_subscriptions.append(subscription_id)
+        # Subscription status is read together with the task data; the state transitions below are
+        # conditional on the status so that concurrent changes (e.g. cancellations) are not overwritten.
+        sql = 'SELECT q.`id`, u.`id`, u.`status`, f.`name`, f.`size`, UNIX_TIMESTAMP(q.`created`), ' + site_columns + ' FROM `{op}_tasks` AS q'
+        sql += ' INNER JOIN `file_subscriptions` AS u ON u.`id` = q.`subscription_id`'
+        sql += ' INNER JOIN `files` AS f ON f.`id` = u.`file_id`'
+        sql += site_joins
 
-                if optype == 'transfer':
-                    query.forget_transfer_status(task_id)
-                else:
-                    query.forget_deletion_status(task_id)
+        task_data = self.db.execute_many(sql.format(op = optype), 'q.`id`', completed.keys())
 
-                if self.cycle_stop.is_set():
-                    break
+        found_task_ids = set(row[0] for row in task_data)
+        lost_task_ids = [task_id for task_id in completed.iterkeys() if task_id not in found_task_ids]
 
-            if batch_complete:
-                if not self._read_only:
-                    self.db.query(delete_batch, batch_id)
+        if len(lost_task_ids) != 0:
+            LOG.warning('%d %s tasks of batch %d got lost.', len(lost_task_ids), optype, batch_id)
+            forget_status_many(lost_task_ids)
 
-                if optype == 'transfer':
-                    query.forget_transfer_batch(batch_id)
-                else:
-                    query.forget_deletion_batch(batch_id)
+            if not self._read_only:
+                self.db.delete_many('{op}_tasks'.format(op = optype), 'id', lost_task_ids)
 
-        if num_success + num_failure + num_cancelled != 0:
-            LOG.info('Archived file %s: %d succeeded, %d failed, %d cancelled.', optype, num_success, num_failure, num_cancelled)
+        if len(task_data) == 0:
+            return []
+
+        # Resolve the history ids of sites (cached across cycles) and files
+
+        if optype == 'transfer':
+            site_names = set(row[7] for row in task_data)
+            site_names.update(row[8] for row in task_data)
         else:
-            LOG.debug('Archived file %s: %d succeeded, %d failed, %d cancelled.', optype, num_success, num_failure, num_cancelled)
+            site_names = set(row[6] for row in task_data)
+
+        new_site_names = [name for name in site_names if name not in self._history_site_ids]
+        if len(new_site_names) != 0:
+            self._history_site_ids.update(self.history_db.site_id_map(new_site_names))
+
+        history_file_ids = self.history_db.file_id_map(list(set((row[3], row[4]) for row in task_data)))
+
+        def to_datetime(t):
+            if t is None:
+                return None
+            else:
+                return datetime.datetime(*time.localtime(t)[:6])
+
+        now = to_datetime(time.time())
+
+        task_ids = []
+        history_values = []
+
+        done_subscription_ids = []
+        retry_subscription_ids = []
+        failures = []
+
+        done_subscriptions = []
+
+        for row in task_data:
+            task_id, subscription_id, subscription_status, lfn, size, create_time = row[:6]
+            status, exitcode, message, start_time, finish_time = completed[task_id]
+
+            if optype == 'transfer':
+                source_id, source_name, dest_name = row[6:]
+                history_site_ids = (self._history_site_ids[source_name], self._history_site_ids[dest_name])
+                LOG.debug('Archiving transfer of %s from %s to %s (exitcode %d)', lfn, source_name, dest_name, exitcode)
+            else:
+                site_name = row[6]
+                history_site_ids = (self._history_site_ids[site_name],)
+                LOG.debug('Archiving deletion of %s at %s (exitcode %d)', lfn, site_name, exitcode)
+
+            task_ids.append(task_id)
+            history_values.append((history_file_ids[lfn], exitcode, message, batch_id, to_datetime(create_time),
+                to_datetime(start_time), to_datetime(finish_time), now) + history_site_ids)
+
+            if subscription_status == 'inbatch':
+                if status == FileQuery.STAT_DONE:
+                    LOG.debug('Subscription %d done.', subscription_id)
+                    done_subscription_ids.append(subscription_id)
+
+                elif status == FileQuery.STAT_FAILED:
+                    LOG.debug('Subscription %d failed (exit code %d). Flagging retry.', subscription_id, exitcode)
+                    retry_subscription_ids.append(subscription_id)
+                    if optype == 'transfer':
+                        failures.append((task_id, subscription_id, source_id, exitcode))
+
+            elif subscription_status == 'cancelled':
+                # subscription is cancelled and task terminated -> delete the subscription now, irrespective of the task status
+                LOG.debug('Subscription %d is cancelled.', subscription_id)
+
+            if status == FileQuery.STAT_DONE:
+                done_subscriptions.append(subscription_id)
+
+        if self._read_only:
+            history_ids = [0] * len(history_values)
+        else:
+            history_ids = self.history_db.db.insert_many_get_ids(history_table_name, history_fields, None, history_values)
+
+        write_history_many(self.history_db, zip(task_ids, history_ids))
+
+        if not self._read_only:
+            update_subscription = 'UPDATE `file_subscriptions` SET `status` = \'{status}\', `last_update` = NOW()'
+            self.db.execute_many(update_subscription.format(status = 'done'), 'id', done_subscription_ids, ['`status` = \'inbatch\''])
+            self.db.execute_many(update_subscription.format(status = 'retry'), 'id', retry_subscription_ids, ['`status` = \'inbatch\''])
+
+            # also catches subscriptions cancelled after the task data was read
+            all_subscription_ids = [row[1] for row in task_data]
+            self.db.delete_many('file_subscriptions', 'id', all_subscription_ids, ['`status` = \'cancelled\''])
+
+            if optype == 'transfer':
+                # The status read with the task data may be outdated: re-read what the transitions above left behind.
+                # Failures are recorded only for the subscriptions actually moved to retry, and the failure records of
+                # all subscriptions deleted above (including the ones cancelled after the read) are cleaned up.
+                remaining = dict(self.db.select_many('file_subscriptions', ('id', 'status'), 'id', all_subscription_ids))
+                deleted_subscription_ids = [sid for sid in all_subscription_ids if sid not in remaining]
+
+                self.db.delete_many('failed_transfers', 'subscription_id', done_subscription_ids + deleted_subscription_ids)
+
+                failures = [f for f in failures if remaining.get(f[1]) == 'retry']
+
+                fields = ('id', 'subscription_id', 'source_id', 'exitcode')
+                self.db.insert_many('failed_transfers', fields, None, failures, update_columns = ('id',))
+
+            self.db.delete_many('{op}_tasks'.format(op = optype), 'id', task_ids)
+
+        forget_status_many(task_ids)
+
+        LOG.debug('Archived %d %s tasks of batch %d in %.1f seconds.', len(task_ids), optype, batch_id, time.time() - start)
 
         return done_subscriptions
 
@@ -76,6 +76,16 @@ class FileTransferQuery(FileQuery):
         """
         raise NotImplementedError('write_transfer_history')
 
+    def write_transfer_history_many(self, history_db, task_history_ids):
+        """
+        Bulk version of write_transfer_history. Plugins with per-task history should override this with
+        a set-based implementation; the default calls write_transfer_history for each task.
+        @param history_db        HistoryDatabase instance
+        @param task_history_ids  List of (transfer task id, ID in the history file_transfers table)
+        """
+        for task_id, history_id in task_history_ids:
+            self.write_transfer_history(history_db, task_id, history_id)
+
     def forget_transfer_status(self, task_id):
         """
         Delete the internal record (if there is any) of the specific task.
@@ -83,6 +93,14 @@ class FileTransferQuery(FileQuery):
         """
         raise NotImplementedError('fotget_transfer_status')
 
+    def forget_transfer_status_many(self, task_ids):
+        """
+        Bulk version of forget_transfer_status. The default calls forget_transfer_status for each task.
+        @param task_ids  List of integer ids of the transfer tasks.
+        """
+        for task_id in task_ids:
+            self.forget_transfer_status(task_id)
+
     def forget_transfer_batch(self, batch_id):
         """
         Delete the internal record (if there is any) of the specific batch.
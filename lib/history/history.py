@@ -156,3 +156,42 @@ class HistoryDatabase(object):
 
         if get_ids:
             return self.db.select_many('files', ('id',), 'name', [f[0] for f in file_data])
+
+    def site_id_map(self, site_names):
+        """
+        Bulk version of save_sites(get_ids = True).
+        @param site_names  List of site names
+        @return {site name: id}
+        """
+        if self._read_only:
+            return dict((name, 0) for name in site_names)
+
+        self.save_sites(site_names)
+
+        return dict(self.db.select_many('sites', ('name', 'id'), 'name', site_names))
+
+    def file_id_map(self, file_data):
+        """
+        Bulk version of save_files(get_ids = True).
+        @param file_data  List of (lfn, size)
+        @return {lfn: id}
+        """
+        if self._read_only:
+            return dict((f[0], 0) for f in file_data)
+
+        self.save_files(file_data)
+
+        return dict(self.db.select_many('files', ('name', 'id'), 'name', [f[0] for f in file_data]))
+
+    def dataset_id_map(self, dataset_names):
+        """
+        Bulk version of save_datasets(get_ids = True).
+        @param dataset_names  List of dataset names
+        @return {dataset name: id}
+        """
+        if self._read_only:
+            return dict((name, 0) for name in dataset_names)
+
+        self.save_datasets(dataset_names)
+
+        return dict(self.db.select_many('datasets', ('name', 'id'), 'name', dataset_names))
@@ -2,7 +2,7 @@ import time
 import logging
 
 from dynamo.operation.copy import CopyInterface
-from dynamo.dataformat import DatasetReplica, BlockReplica, OperationalError
+from dynamo.dataformat import DatasetReplica, Block, BlockReplica, OperationalError
 from dynamo.fileop.rlfsm import RLFSM
 
 LOG = logging.getLogger(__name__)
@@ -27,7 +27,11 @@ class RLFSMCopyInterface(CopyInterface):
 
         LOG.info('Scheduling copy of %d replicas to %s using RLFSM (operation %d)', len(replica_list), list(sites)[0], operation_id)
 
+        site = list(sites)[0]
+
         result = []
+        # files are subscribed in bulk
+        missing_files = []
 
         for replica in replica_list:
             # Function spec is to return clones (so that if specific block fails to copy, we can return a dataset replica without the block)
@@ -35,23 +39,25 @@ class RLFSMCopyInterface(CopyInterface):
             clone_replica.copy(replica)
             result.append(clone_replica)
 
+            # load the files of all incomplete blocks at once
+            Block.prefetch_files([br.block for br in replica.block_replicas if br.file_ids is not None])
+
             for block_replica in replica.block_replicas:
                 LOG.debug('Subscribing files for %s', str(block_replica))
 
                 if block_replica.file_ids is None:
                     LOG.debug('No file to subscribe for %s', str(block_replica))
+                    self.rlfsm.subscribe_files(site, missing_files)
                     return
         
-                all_files = block_replica.block.files
-                missing_files = all_files - block_replica.files()
-
-                for lfile in missing_files:
-                    self.rlfsm.subscribe_file(block_replica.site, lfile)
+                missing_files.extend(block_replica.missing_files())
 
                 clone_block_replica = BlockReplica(block_replica.block, block_replica.site, block_replica.group)
                 clone_block_replica.copy(block_replica)
                 clone_block_replica.last_update = int(time.time())
                 clone_replica.block_replicas.add(clone_block_replica)
 
+        self.rlfsm.subscribe_files(site, missing_files)
+
         # no external dependency - everything is a success
         return result
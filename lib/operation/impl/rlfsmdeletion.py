@@ -2,7 +2,7 @@ import time
 import logging
 
 from dynamo.operation.deletion import DeletionInterface
-from dynamo.dataformat import DatasetReplica, BlockReplica
+from dynamo.dataformat import DatasetReplica, Block, BlockReplica
 from dynamo.fileop.rlfsm import RLFSM
 
 LOG = logging.getLogger(__name__)
@@ -30,6 +30,8 @@ class RLFSMDeletionInterface(DeletionInterface):
         LOG.info('Scheduling deletion of %d replicas from %s using RLFSM (operation %d)', len(replica_list), site.name, operation_id)
 
         clones = []
+        # files are desubscribed in bulk at the end
+        files = []
 
         for dataset_replica, block_replicas in replica_list:
             if block_replicas is None:
@@ -37,9 +39,10 @@ class RLFSMDeletionInterface(DeletionInterface):
             else:
                 to_delete = block_replicas
 
+            Block.prefetch_files([br.block for br in to_delete])
+
             for block_replica in to_delete:
-                for lfile in block_replica.files():
-                    self.rlfsm.desubscribe_file(block_replica.site, lfile)
+                files.extend(block_replica.files())
 
             # No external dependency -> all operations are successful
 
@@ -56,6 +59,8 @@ class RLFSMDeletionInterface(DeletionInterface):
                     clone_block_replica.last_update = int(time.time())
                     clones[-1][1].append(clone_block_replica)
 
+        self.rlfsm.desubscribe_files(site, files)
+
         return clones
 
     def deletion_status(self, operation_id): #override
@@ -1,6 +1,7 @@
 import re
 import fnmatch
 import subprocess
+import itertools
 
 from dynamo.dataformat import DatasetReplica, BlockReplica, Site, SitePartition
 from dynamo.dataformat.exceptions import OperationalError
@@ -16,6 +17,11 @@ class Attr(object):
     """
 
     BOOL_TYPE, NUMERIC_TYPE, TEXT_TYPE, TIME_TYPE = range(4)
+    # Dependency scopes: which state changes can alter the value of the attribute.
+    # REPLICA: the replica itself (its block replicas and their owners)
+    # DATASET: any replica of the same dataset or block
+    # SITE: the site partition (e.g. occupancy)
+    SCOPE_REPLICA, SCOPE_DATASET, SCOPE_SITE = range(3)
 
     def __init__(self, vtype, attr = '', args = None):
         self.vtype = vtype
@@ -24,10 +30,30 @@ class Attr(object):
 
         # Names of dataset.attr used by the instance
         self.required_attrs = []
+
+        # Static attributes of datasets and sites do not change within a cycle; the
+        # inherited classes override the scope if the value depends on other objects.
+        self.scope = Attr.SCOPE_REPLICA
         
     def get(self, obj):
         return self._get(obj)
 
+    def compile(self, memoize):
+        """
+        Return a function equivalent to get, for use in an evaluation plan.
+        @param memoize  memoize(func, volatile = True) returns a function that caches func(obj) per obj
+                        until the plan invalidates the object. Functions that compare equal share the
+                        cache. Pass volatile = False if func(obj) does not depend on which block
+                        replicas the dataset replicas hold (e.g. it only looks at block.replicas); such
+                        values survive the stripping of block replicas during evaluation.
+        """
+
+        return self.get
+
+    def _is_simple(self):
+        """True if the value is a plain attribute lookup, which is cheaper than memoization."""
+        return self.args is None and type(self)._get.im_func is Attr._get.im_func
+
     def _get(self, obj):
         if self.args is None:
             # simple attribute
@@ -87,6 +113,25 @@ class DatasetAttr(Attr):
         else:
             return self._get(dataset)
 
+    def compile(self, memoize):
+        if len(self.required_attrs) == 1 or self._is_simple():
+            return self.get
+
+        get_dataset = self._compile_dataset(memoize)
+
+        def get(replica):
+            if type(replica) is DatasetReplica:
+                return get_dataset(replica.dataset)
+            else:
+                return get_dataset(replica.block.dataset)
+
+        return get
+
+    def _compile_dataset(self, memoize):
+        """Return a function equivalent to _get. Override to share sub-expressions through memoize."""
+
+        return memoize(self._get)
+
 
 class DatasetReplicaAttr(Attr):
     """Extract an attribute from a dataset replica. If a block replica is passed, return the attribute of the owning dataset replica."""
@@ -101,6 +146,26 @@ class DatasetReplicaAttr(Attr):
         else:
             return self._get(replica)
 
+    def compile(self, memoize):
+        # values are memoized under the dataset replica even if a block replica is passed
+        get_replica = self._compile_replica(memoize)
+
+        def get(replica):
+            if type(replica) is BlockReplica:
+                replica = replica.block.dataset.find_replica(replica.site)
+
+            return get_replica(replica)
+
+        return get
+
+    def _compile_replica(self, memoize):
+        """Return a function equivalent to _get. Override to share sub-expressions through memoize."""
+
+        if self._is_simple():
+            return self._get
+        else:
+            return memoize(self._get)
+
 
 class BlockReplicaAttr(Attr):
     """Extract an attribute from a block replica. If a dataset replica is passed, return a list of values."""
@@ -114,6 +179,26 @@ class BlockReplicaAttr(Attr):
         else:
             return map(self._get, replica.block_replicas)
 
+    def compile(self, memoize):
+        get_block_replica = self._compile_block_replica(memoize)
+
+        def get(replica):
+            if type(replica) is BlockReplica:
+                return get_block_replica(replica)
+            else:
+                # predicates take the OR over the values - compute lazily
+                return itertools.imap(get_block_replica, replica.block_replicas)
+
+        return get
+
+    def _compile_block_replica(self, memoize):
+        """
+        Return a function equivalent to _get. Values of individual block replicas are rarely reused and
+        are not memoized by default. Override to share sub-expressions through memoize.
+        """
+
+        return self._get
+
 
 class ReplicaSiteAttr(Attr):
     """Extract an attribute from the site of a replica."""
@@ -134,9 +219,11 @@ class SiteAttr(Attr):
         # When this is true, attribute is extracted from sitepartition.site
         self.get_from_site = False
 
+        self.scope = Attr.SCOPE_SITE
+
     def get(self, obj):
         if self.get_from_site:
-            if type(obj) is Site:
+            if isinstance(obj, Site):
                 return self._get(obj)
             elif type(obj) is SitePartition:
                 return self._get(obj.site)
@@ -0,0 +1,534 @@
+"""
+Columnar view of dataset replicas for vectorized evaluation of policy conditions.
+Requires NumPy; use columnar.available() to check before creating a ReplicaColumns instance.
+"""
+
+import logging
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from dynamo.dataformat import Site, BlockReplica
+from dynamo.policy.attrs import Attr, DatasetAttr, DatasetReplicaAttr, ReplicaSiteAttr
+import dynamo.policy.variables as variables
+
+LOG = logging.getLogger(__name__)
+
+def available():
+    return numpy is not None
+
+class ReplicaColumns(object):
+    """
+    Snapshot of the values of the numeric, time, and boolean attrs of a list of dataset replicas,
+    stored as one array per attr. Conditions (lists of predicates) are evaluated as array masks over
+    all replicas at once, and the outcome for each replica is kept as a per-condition state:
+      TRUE: all predicates are true
+      FALSE: at least one predicate is false
+      RESIDUAL: all vectorized predicates are true; the predicates listed in residual_tests must be
+        evaluated object by object
+      UNDETERMINED: must be evaluated object by object.
+    A predicate is not vectorized if the predicate class has no evaluate_array implementation or if
+    its variable is not a scalar attr of dataset replicas. A vectorized predicate is undetermined for
+    the replicas where the variable does not give a plain number (e.g. a list of block replica values).
+    Columns of the attrs known to ReplicaTable are computed for all replicas at once from the
+    arrays of the table. Other attrs are computed object by object through the compiled getter.
+    The snapshot is not updated when the replicas change. Call invalidate() before modifying a
+    replica to make the conditions undetermined for the affected replicas.
+    """
+
+    FALSE, TRUE, UNDETERMINED, RESIDUAL = range(4)
+
+    # Vectorizable variable types
+    _vtypes = (Attr.NUMERIC_TYPE, Attr.TIME_TYPE, Attr.BOOL_TYPE)
+    _scalar_types = (int, long, float, bool)
+
+    def __init__(self, replicas):
+        """
+        @param replicas  List of dataset replicas (rows)
+        """
+
+        self.replicas = list(replicas)
+        # {replica: row}
+        self.rows = dict((replica, irow) for irow, replica in enumerate(self.replicas))
+
+        # {variable: (values, exact, computed)} where exact is True for rows with a scalar value
+        self.columns = {}
+
+        # [[state of condition]] per row, or None for rows that have been invalidated
+        self.states = [None] * len(self.replicas)
+
+        # [[index of test]] per condition: tests that are not vectorized
+        self.residual_tests = []
+
+        # ReplicaTable, made when the first column that can use it is requested
+        self._table = None
+        # table row of each replica (-1 if not found)
+        self._table_rows = None
+
+    def evaluate(self, conditions):
+        """
+        Evaluate the conditions in sequence and store the states. Like the per-object evaluation,
+        attr values are computed only for the replicas that can reach the predicate: those for which
+        no previous predicate of the condition is false and no previous final condition is true.
+        @param conditions  List of (tests, final), where tests is a list of (predicate, get) with get
+                           the function that returns the variable value for a dataset replica, and
+                           final is True if the evaluation stops at the condition when it is true.
+        @return Number of conditions that were at least partially vectorized.
+        """
+
+        num_rows = len(self.replicas)
+        if num_rows == 0:
+            return 0
+
+        states = numpy.empty((len(conditions), num_rows), dtype = numpy.int8)
+        # rows that reach the condition
+        alive = numpy.ones(num_rows, dtype = bool)
+        num_vectorized = 0
+
+        self.residual_tests = []
+
+        for icond, (tests, final) in enumerate(conditions):
+            is_false = numpy.zeros(num_rows, dtype = bool)
+            undetermined = numpy.zeros(num_rows, dtype = bool)
+            residual = []
+
+            for itest, (predicate, get) in enumerate(tests):
+                pred_false, pred_undetermined = self._evaluate_predicate(predicate, get, alive & ~is_false)
+
+                if pred_false is None:
+                    residual.append(itest)
+                else:
+                    is_false |= pred_false
+                    undetermined |= pred_undetermined
+
+            self.residual_tests.append(residual)
+
+            if len(residual) == len(tests):
+                state = numpy.full(num_rows, ReplicaColumns.UNDETERMINED, dtype = numpy.int8)
+            else:
+                num_vectorized += 1
+
+                if len(residual) == 0:
+                    state = numpy.where(undetermined, ReplicaColumns.UNDETERMINED, ReplicaColumns.TRUE)
+                else:
+                    state = numpy.where(undetermined, ReplicaColumns.UNDETERMINED, ReplicaColumns.RESIDUAL)
+
+                # false wins over undetermined
+                state[is_false] = ReplicaColumns.FALSE
+            states[icond] = state
+
+            if final:
+                alive &= (state != ReplicaColumns.TRUE)
+
+        self.states = states.T.tolist()
+
+        LOG.info('Vectorized %d of %d conditions over %d replicas using %d columns.', num_vectorized, len(conditions), num_rows, len(self.columns))
+
+        return num_vectorized
+
+    def get_states(self, replica):
+        """
+        @param replica  DatasetReplica
+        @return List of condition states, or None if the replica is not in the snapshot or is invalidated.
+        """
+
+        try:
+            return self.states[self.rows[replica]]
+        except KeyError:
+            return None
+
+    def invalidate(self, replica):
+        """
+        Make the states of all replicas of the dataset undetermined.
+        @param replica  DatasetReplica
+        """
+
+        for dataset_replica in replica.dataset.replicas:
+            try:
+                self.states[self.rows[dataset_replica]] = None
+            except KeyError:
+                pass
+
+        try:
+            self.states[self.rows[replica]] = None
+        except KeyError:
+            pass
+
+    def _evaluate_predicate(self, predicate, get, rows):
+        """
+        @param rows  Boolean mask of the rows to evaluate the predicate for
+        @return (false mask, undetermined mask) or (None, None) if the predicate cannot be vectorized.
+        """
+
+        if predicate.evaluate_array(numpy.zeros(0)) is None:
+            # not supported - don't compute the column
+            return None, None
+
+        column = self._get_column(predicate.variable, get, rows)
+        if column is None:
+            return None, None
+
+        values, exact = column
+
+        mask = predicate.evaluate_array(values)
+        if mask is None:
+            return None, None
+
+        return exact & ~mask, ~exact
+
+    def _get_column(self, variable, get, rows):
+        """
+        Compute the column values for the rows that were not computed yet.
+        @return (values, exact) or None if the variable cannot be stored in a column.
+        """
+
+        try:
+            column = self.columns[variable]
+        except KeyError:
+            if variable.vtype not in ReplicaColumns._vtypes or variable.scope == Attr.SCOPE_SITE:
+                # text values are matched against patterns; site-scope values change with every deletion
+                column = None
+            else:
+                column = self._build_column(variable)
+                if column is None:
+                    num_rows = len(self.replicas)
+                    # values, exact, computed
+                    column = (numpy.zeros(num_rows, dtype = numpy.float64), numpy.zeros(num_rows, dtype = bool), numpy.zeros(num_rows, dtype = bool))
+
+            self.columns[variable] = column
+
+        if column is None:
+            return None
+
+        values, exact, computed = column
+
+        new_rows = numpy.flatnonzero(rows & ~computed)
+        if len(new_rows) == 0:
+            return values, exact
+
+        computed[new_rows] = True
+
+        replicas = self.replicas
+        scalar_types = ReplicaColumns._scalar_types
+        for irow in new_rows.tolist():
+            value = get(replicas[irow])
+            if type(value) in scalar_types:
+                values[irow] = value
+                exact[irow] = True
+
+        return values, exact
+
+    def _build_column(self, variable):
+        """
+        Compute the column of all rows from the replica table.
+        @return (values, exact, computed) or None if the table does not know the variable.
+        """
+
+        builder = ReplicaTable.get_builder(variable)
+        if builder is None:
+            return None
+
+        if self._table is None:
+            self._table = ReplicaTable(self.replicas)
+            self._table_rows = numpy.array([self._table.rows.get(replica, -1) for replica in self.replicas], dtype = numpy.int64)
+
+        if len(self._table.replicas) == 0:
+            return None
+
+        table_values, table_exact = builder(self._table)
+
+        found = self._table_rows >= 0
+        values = table_values[self._table_rows]
+        exact = table_exact[self._table_rows] & found
+        values[~found] = 0.
+
+        return values, exact, numpy.ones(len(self.replicas), dtype = bool)
+
+
+class ReplicaTable(object):
+    """
+    Values of all replicas of a set of datasets in arrays, filled in one pass over the dataformat
+    objects. Rows are the dataset replicas, ordered so that the replicas of a dataset are contiguous.
+    Block replicas are stored in arrays with the row of their dataset replica. Columns of the attrs
+    listed in get_builder are computed from these arrays and are equal to the values of Attr.get.
+    """
+
+    def __init__(self, replicas):
+        """
+        @param replicas  Dataset replicas. The table holds all replicas of their datasets.
+        """
+
+        # dataset replica rows
+        self.replicas = []
+        # {replica: row}
+        self.rows = {}
+        self.datasets = []
+        self.sites = []
+
+        dataset_index = {}
+        site_index = {}
+
+        replica_dataset = []
+        replica_site = []
+        dataset_first = []
+        dataset_num_replicas = []
+        dataset_num_blocks = []
+
+        block_replicas = []
+        block_replica_row = []
+
+        for replica in replicas:
+            dataset = replica.dataset
+            if dataset in dataset_index:
+                continue
+
+            idataset = dataset_index[dataset] = len(self.datasets)
+            self.datasets.append(dataset)
+            dataset_first.append(len(self.replicas))
+            dataset_num_replicas.append(len(dataset.replicas))
+            dataset_num_blocks.append(len(dataset.blocks))
+
+            for dataset_replica in dataset.replicas:
+                irow = self.rows[dataset_replica] = len(self.replicas)
+                self.replicas.append(dataset_replica)
+                replica_dataset.append(idataset)
+
+                site = dataset_replica.site
+                try:
+                    isite = site_index[site]
+                except KeyError:
+                    isite = site_index[site] = len(self.sites)
+                    self.sites.append(site)
+
+                replica_site.append(isite)
+
+                block_replicas.extend(dataset_replica.block_replicas)
+                block_replica_row.extend([irow] * len(dataset_replica.block_replicas))
+
+        # values of the block replicas
+        block_replica_size = [br.size for br in block_replicas]
+        block_replica_last_update = [br.last_update for br in block_replicas]
+        if BlockReplica._use_file_ids:
+            # file_ids is None for complete replicas
+            block_replica_complete = [br.file_ids is None or br.is_complete() for br in block_replicas]
+        else:
+            block_replica_complete = [br.is_complete() for br in block_replicas]
+        block_replica_group = [br.group for br in block_replicas]
+
+        group_index = dict((group, igroup) for igroup, group in enumerate(set(block_replica_group)))
+        block_replica_group = [group_index[group] for group in block_replica_group]
+
+        self.num_groups = len(group_index)
+
+        self.replica_dataset = numpy.array(replica_dataset, dtype = numpy.int64)
+        self.replica_site = numpy.array(replica_site, dtype = numpy.int64)
+        self.dataset_first = numpy.array(dataset_first, dtype = numpy.int64)
+        self.dataset_num_replicas = numpy.array(dataset_num_replicas, dtype = numpy.int64)
+        self.dataset_num_blocks = numpy.array(dataset_num_blocks, dtype = numpy.int64)
+
+        self.site_storage_type = numpy.array([site.storage_type for site in self.sites], dtype = numpy.int64)
+        self.site_status = numpy.array([site.status for site in self.sites], dtype = numpy.int64)
+
+        self.block_replica_row = numpy.array(block_replica_row, dtype = numpy.int64)
+        self.block_replica_size = numpy.array(block_replica_size, dtype = numpy.float64)
+        self.block_replica_last_update = numpy.array(block_replica_last_update, dtype = numpy.float64)
+        self.block_replica_complete = numpy.array(block_replica_complete, dtype = bool)
+        self.block_replica_group = numpy.array(block_replica_group, dtype = numpy.int64)
+
+        # derived arrays, computed on first use
+        self._is_full = None
+        self._owners = None
+
+    @staticmethod
+    def get_builder(variable):
+        """
+        @param variable  Attr
+        @return Function that takes a ReplicaTable and returns the (values, exact) arrays of the
+                variable, or None if the variable is not known.
+        """
+
+        vtype = type(variable)
+
+        if isinstance(variable, DatasetAttr):
+            if len(variable.required_attrs) == 1:
+                return lambda table: table.dataset_dict_column(variable.required_attrs[0], variable.dict_default)
+            elif variable._is_simple():
+                return lambda table: table.dataset_attr_column(variable.attr)
+            elif vtype is variables.DatasetNumFullDiskCopy:
+                return lambda table: table.num_full_copy_column(disk_only = True)
+            elif vtype is variables.DatasetNumFullCopy:
+                return lambda table: table.num_full_copy_column(disk_only = False)
+            elif vtype is variables.DatasetOnTape:
+                return ReplicaTable.on_tape_column
+
+        elif isinstance(variable, ReplicaSiteAttr):
+            if variable._is_simple():
+                return lambda table: table.site_attr_column(variable.attr)
+
+        elif vtype is variables.ReplicaSize:
+            return ReplicaTable.size_column
+        elif vtype is variables.ReplicaIncomplete:
+            return ReplicaTable.incomplete_column
+        elif vtype is variables.ReplicaFirstBlockCreated:
+            return ReplicaTable.first_block_created_column
+        elif vtype is DatasetReplicaAttr and variable.attr == 'last_block_created':
+            return ReplicaTable.last_block_created_column
+        elif vtype is variables.ReplicaNumFullDiskCopyCommonOwner:
+            return lambda table: table.common_owner_column(other_site = False)
+        elif vtype is variables.ReplicaNumFullOtherCopyCommonOwner:
+            return lambda table: table.common_owner_column(other_site = True)
+        elif vtype is variables.ReplicaEnforcerProtected:
+            return ReplicaTable.enforcer_protected_column
+        elif vtype is variables.ReplicaIsLastSource:
+            return ReplicaTable.is_last_transfer_source_column
+        elif vtype is variables.BlockReplicaOnTape:
+            return ReplicaTable.block_on_tape_column
+
+        return None
+
+    def dataset_dict_column(self, key, default):
+        return self._per_dataset(self._to_arrays([dataset.attr.get(key, default) for dataset in self.datasets]))
+
+    def dataset_attr_column(self, attr):
+        return self._per_dataset(self._to_arrays([getattr(dataset, attr) for dataset in self.datasets]))
+
+    def site_attr_column(self, attr):
+        values, exact = self._to_arrays([getattr(site, attr) for site in self.sites])
+        return values[self.replica_site], exact[self.replica_site]
+
+    def size_column(self):
+        return self._exact(numpy.bincount(self.block_replica_row, weights = self.block_replica_size, minlength = len(self.replicas)))
+
+    def incomplete_column(self):
+        return self._exact(self._count_per_row(~self.block_replica_complete) != 0)
+
+    def first_block_created_column(self):
+        values = numpy.full(len(self.replicas), 0xffffffff, dtype = numpy.float64)
+        numpy.minimum.at(values, self.block_replica_row, self.block_replica_last_update)
+        return self._exact(values)
+
+    def last_block_created_column(self):
+        values = numpy.zeros(len(self.replicas), dtype = numpy.float64)
+        numpy.maximum.at(values, self.block_replica_row, self.block_replica_last_update)
+        return self._exact(values)
+
+    def num_full_copy_column(self, disk_only):
+        counted = self.is_full() & self._site_ready()
+        if disk_only:
+            counted &= self._site_storage_type() == Site.TYPE_DISK
+
+        return self._per_dataset((self._count_per_dataset(counted), numpy.ones(len(self.datasets), dtype = bool)))
+
+    def on_tape_column(self):
+        on_tape = self._site_storage_type() == Site.TYPE_MSS
+        # 1 if there is a full replica on tape, 2 if only partial ones
+        full = self._count_per_dataset(on_tape & self.is_full()) != 0
+        partial = self._count_per_dataset(on_tape) != 0
+        values = numpy.where(full, 1., numpy.where(partial, 2., 0.))
+        return self._per_dataset((values, numpy.ones(len(self.datasets), dtype = bool)))
+
+    def common_owner_column(self, other_site):
+        owners = self.owners()
+        if owners is None:
+            return self._inexact()
+
+        counted = self.is_full() & self._site_ready()
+        if not other_site:
+            counted &= self._site_storage_type() == Site.TYPE_DISK
+
+        # all pairs (irow, jrow) of replicas of the same dataset
+        num_rows = len(self.replicas)
+        num_others = self.dataset_num_replicas[self.replica_dataset]
+        irow = numpy.repeat(numpy.arange(num_rows), num_others)
+        offsets = numpy.arange(len(irow)) - numpy.repeat(numpy.cumsum(num_others) - num_others, num_others)
+        jrow = self.dataset_first[self.replica_dataset[irow]] + offsets
+
+        match = counted[jrow] & ((owners[irow] & owners[jrow]) != 0)
+        if other_site:
+            match &= self.replica_site[irow] != self.replica_site[jrow]
+
+        return self._exact(numpy.bincount(irow, weights = match, minlength = num_rows))
+
+    def enforcer_protected_column(self):
+        values = numpy.zeros(len(self.replicas), dtype = numpy.float64)
+        for idataset, dataset in enumerate(self.datasets):
+            try:
+                protected_replicas = dataset.attr['enforcer_protected_replicas']
+            except KeyError:
+                continue
+
+            first = int(self.dataset_first[idataset])
+            for irow in xrange(first, first + int(self.dataset_num_replicas[idataset])):
+                values[irow] = (self.replicas[irow] in protected_replicas)
+
+        return self._exact(values)
+
+    def is_last_transfer_source_column(self):
+        # no block of the dataset is being transferred
+        transferring = self._count_per_dataset(self._count_per_row(~self.block_replica_complete)) != 0
+        return self._false_for_all_blocks(~transferring)
+
+    def block_on_tape_column(self):
+        # no block of the dataset has a complete replica on tape
+        on_tape = self.block_replica_complete & (self._site_storage_type()[self.block_replica_row] == Site.TYPE_MSS)
+        return self._false_for_all_blocks(self._count_per_dataset(self._count_per_row(on_tape)) == 0)
+
+    def is_full(self):
+        """Boolean array of DatasetReplica.is_full per row."""
+
+        if self._is_full is None:
+            num_block_replicas = self._count_per_row(numpy.ones(len(self.block_replica_row), dtype = bool))
+            num_incomplete = self._count_per_row(~self.block_replica_complete)
+            self._is_full = (num_block_replicas == self.dataset_num_blocks[self.replica_dataset]) & (num_incomplete == 0)
+
+        return self._is_full
+
+    def owners(self):
+        """Bit mask of the groups of the block replicas per row, or None if there are too many groups."""
+
+        if self._owners is None and self.num_groups < 63:
+            self._owners = numpy.zeros(len(self.replicas), dtype = numpy.int64)
+            numpy.bitwise_or.at(self._owners, self.block_replica_row, numpy.left_shift(numpy.int64(1), self.block_replica_group))
+
+        return self._owners
+
+    def _site_ready(self):
+        return self.site_status[self.replica_site] == Site.STAT_READY
+
+    def _site_storage_type(self):
+        return self.site_storage_type[self.replica_site]
+
+    def _count_per_row(self, block_replica_mask):
+        return numpy.bincount(self.block_replica_row, weights = block_replica_mask, minlength = len(self.replicas))
+
+    def _count_per_dataset(self, row_mask):
+        return numpy.bincount(self.replica_dataset, weights = row_mask, minlength = len(self.datasets))
+
+    def _per_dataset(self, arrays):
+        values, exact = arrays
+        return values[self.replica_dataset], exact[self.replica_dataset]
+
+    def _exact(self, values):
+        return values.astype(numpy.float64), numpy.ones(len(self.replicas), dtype = bool)
+
+    def _false_for_all_blocks(self, dataset_mask):
+        """
+        Column of a block replica attr that is False for all block replicas of the datasets in dataset_mask.
+        Other rows and rows without block replicas are not exact.
+        """
+
+        num_block_replicas = self._count_per_row(numpy.ones(len(self.block_replica_row), dtype = bool))
+        exact = dataset_mask[self.replica_dataset] & (num_block_replicas != 0)
+        return numpy.zeros(len(self.replicas), dtype = numpy.float64), exact
+
+    def _inexact(self):
+        return numpy.zeros(len(self.replicas), dtype = numpy.float64), numpy.zeros(len(self.replicas), dtype = bool)
+
+    @staticmethod
+    def _to_arrays(values):
+        scalar_types = ReplicaColumns._scalar_types
+        exact = numpy.array([type(value) in scalar_types for value in values], dtype = bool)
+        values = numpy.array([value if is_exact else 0 for value, is_exact in zip(values, exact.tolist())], dtype = numpy.float64)
+        return values, exact
@@ -1,9 +1,60 @@
+import re
+import time
+import calendar
 import logging
+import dateutil.parser as dateparser
 
 from dynamo.policy.predicates import Predicate
+from dynamo.policy.attrs import InvalidExpression
 
 LOG = logging.getLogger(__name__)
 
+_time_units = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400, 'week': 604800}
+_relative_time_re = re.compile('([+-]?[0-9]+) *(second|minute|hour|day|week)s?( +ago)?$')
+
+def resolve_time(expr, now = None):
+    """
+    Convert a time expression to a UNIX timestamp. Accepts absolute dates (parsed in local time
+    unless a time zone is given), 'now', 'today', 'yesterday', 'tomorrow', and relative
+    expressions like '3 days ago' or '+2 weeks'.
+    @param expr  Time expression string
+    @param now   Reference UNIX time for relative expressions (default: current time)
+    @return Integer UNIX timestamp
+    """
+
+    if now is None:
+        now = time.time()
+
+    text = expr.strip().lower()
+
+    if text == 'now':
+        return int(now)
+
+    if text in ('today', 'yesterday', 'tomorrow'):
+        # midnight local time
+        midnight = list(time.localtime(now))
+        midnight[3:6] = [0, 0, 0]
+        midnight = time.mktime(tuple(midnight))
+        return int(midnight + {'today': 0, 'yesterday': -86400, 'tomorrow': 86400}[text])
+
+    matches = _relative_time_re.match(text)
+    if matches:
+        delta = int(matches.group(1)) * _time_units[matches.group(2)]
+        if matches.group(3):
+            delta = -delta
+
+        return int(now + delta)
+
+    try:
+        dt = dateparser.parse(expr)
+    except (ValueError, OverflowError):
+        raise InvalidExpression('Invalid time expression %s' % expr)
+
+    if dt.tzinfo is None:
+        return int(time.mktime(dt.timetuple()))
+    else:
+        return calendar.timegm(dt.utctimetuple())
+
 class Condition(object):
     """AND-chained Predicates."""
 
@@ -11,10 +62,15 @@ class Condition(object):
         self.text = text
         self.predicates = []
         self.required_attrs = set()
+        # dependency scopes (Attr.SCOPE_*) of the variables used
+        self.scopes = set()
 
         pred_strs = map(str.strip, text.split(' and '))
 
+        # 'until <time>' or 'from <time>' clause
         self.time_condition = None
+        # UNIX timestamp of the time clause, resolved at construction and by resolve_time_condition()
+        self.time_limit = None
 
         tmp = ''
         if ' until ' in pred_strs[-1]:
@@ -27,6 +83,8 @@ class Condition(object):
             pred_strs[-1] = tmp[0]             
             self.time_condition = tmp[-1]
 
+            self.resolve_time_condition()
+
         # parsing the individual components
         for pred_str in pred_strs:
             words = pred_str.split()
@@ -43,6 +101,7 @@ class Condition(object):
 
             # list of name of attrs
             self.required_attrs.update(variable.required_attrs)
+            self.scopes.add(variable.scope)
 
             if len(words) >= 2:
                 operator = words[1]
@@ -59,18 +118,39 @@ class Condition(object):
     def __repr__(self):
         return 'Condition(\'%s\')' % self.text
 
+    def resolve_time_condition(self, now = None):
+        """
+        (Re-)compute the time limit from the time clause. Relative expressions are evaluated with respect to now.
+        """
+
+        if self.time_condition is None:
+            return
+
+        if self.time_condition.startswith('until '):
+            self.time_limit = resolve_time(self.time_condition[6:], now)
+        else: # from
+            self.time_limit = resolve_time(self.time_condition[5:], now)
+
+    def is_active(self, now = None):
+        """
+        @param now  UNIX time (default: current time)
+        @return False if the time clause excludes now.
+        """
+
+        if self.time_limit is None:
+            return True
+
+        if now is None:
+            now = time.time()
+
+        if self.time_condition.startswith('until '):
+            return now <= self.time_limit
+        else: # from
+            return now >= self.time_limit
+
     def match(self, obj):
-        if self.time_condition is not None:
-            if 'until' in self.time_condition:
-                proc = subprocess.Popen(['date', '-d', self.time_condition.split('until ')[1], '+%s'], stdout = subprocess.PIPE, stderr = subprocess.PIPE)
-                unixt, err = proc.communicate()
-                if time.time() > unixt:
-                    return False
-            else: # from
-                proc = subprocess.Popen(['date', '-d', self.time_condition.split('from ')[1], '+%s'], stdout = subprocess.PIPE, stderr = subprocess.PIPE)
-                unixt, err = proc.communicate()
-                if time.time() < unixt:
-                    return False
+        if not self.is_active():
+            return False
 
         for predicate in self.predicates:
             if not predicate(obj):
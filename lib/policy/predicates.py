@@ -33,6 +33,9 @@ class Predicate(object):
         self.variable = variable
 
     def __call__(self, obj):
+        return self.evaluate_lhs(self.variable.get(obj))
+
+    def evaluate_lhs(self, lhs):
         """
         Call _eval of the inherited classes.
         In case the LHS is a container (can happen when evaluating a block-level
@@ -40,10 +43,8 @@ class Predicate(object):
         container elements.
         """
 
-        lhs = self.variable.get(obj)
-
-        # first check for strings - strings are iterable
-        if isinstance(lhs, basestring):
+        # first check for strings and numbers - strings are iterable
+        if isinstance(lhs, (basestring, int, long, float)):
             pass
         else:
             try:
@@ -60,6 +61,15 @@ class Predicate(object):
 
         return self._eval(lhs)
 
+    def evaluate_array(self, values):
+        """
+        Vectorized version of _eval.
+        @param values  NumPy array of numeric LHS values (booleans as 0 and 1)
+        @return NumPy boolean array, or None if the predicate cannot be evaluated on arrays.
+        """
+
+        return None
+
 class UnaryExpr(Predicate):
     operators = ['', 'not']
 
@@ -101,6 +111,9 @@ class BinaryExpr(Predicate):
 
         self.rhs = self.variable.rhs_map(rhs_expr, is_re = is_re)
 
+    def _has_numeric_rhs(self):
+        return type(self.rhs) in (int, long, float, bool)
+
 class SetElementExpr(Predicate):
     operators = ['in', 'notin']
 
@@ -124,6 +137,23 @@ class SetElementExpr(Predicate):
 
         self.rhs = map(self.variable.rhs_map, elem_exprs)
 
+    def _array_in(self, values):
+        # OR of the equalities; None if any element is not a number
+        if self.variable.vtype != attrs.Attr.NUMERIC_TYPE or len(self.rhs) == 0:
+            return None
+
+        mask = None
+        for elem in self.rhs:
+            if type(elem) not in (int, long, float, bool):
+                return None
+
+            if mask is None:
+                mask = (values == elem)
+            else:
+                mask |= (values == elem)
+
+        return mask
+
 
 #################################
 ## Unary (boolean) expressions ##
@@ -133,10 +163,16 @@ class Assert(UnaryExpr):
     def _eval(self, boolexpr):
         return boolexpr
 
+    def evaluate_array(self, values):
+        return values != 0
+
 class Negate(UnaryExpr):
     def _eval(self, boolexpr):
         return not boolexpr
 
+    def evaluate_array(self, values):
+        return values == 0
+
 #####################################
 ## Binary (comparison) expressions ##
 #####################################
@@ -153,6 +189,12 @@ class Eq(BinaryExpr):
     def _eval(self, lhs):
         return self._call(lhs)
 
+    def evaluate_array(self, values):
+        if self._has_numeric_rhs():
+            return values == self.rhs
+        else:
+            return None
+
 class Neq(BinaryExpr):
     def __init__(self, variable, rhs_expr, is_re = False):
         BinaryExpr.__init__(self, variable, rhs_expr, is_re = is_re)
@@ -165,14 +207,32 @@ class Neq(BinaryExpr):
     def _eval(self, lhs):
         return self._call(lhs)
 
+    def evaluate_array(self, values):
+        if self._has_numeric_rhs():
+            return values != self.rhs
+        else:
+            return None
+
 class Lt(BinaryExpr):
     def _eval(self, lhs):
         return lhs < self.rhs
 
+    def evaluate_array(self, values):
+        if self._has_numeric_rhs():
+            return values < self.rhs
+        else:
+            return None
+
 class Gt(BinaryExpr):
     def _eval(self, lhs):
         return lhs > self.rhs
 
+    def evaluate_array(self, values):
+        if self._has_numeric_rhs():
+            return values > self.rhs
+        else:
+            return None
+
 #########################################
 ## Set-element (inclusion) expressions ##
 #########################################
@@ -192,6 +252,9 @@ class In(SetElementExpr):
 
             return False
 
+    def evaluate_array(self, values):
+        return self._array_in(values)
+
 class Notin(SetElementExpr):
     def _eval(self, lhs):
         if self.variable.vtype == attrs.Attr.NUMERIC_TYPE:
@@ -207,3 +270,10 @@ class Notin(SetElementExpr):
 
             return True
 
+    def evaluate_array(self, values):
+        mask = self._array_in(values)
+        if mask is None:
+            return None
+        else:
+            return ~mask
+
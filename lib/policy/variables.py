@@ -4,13 +4,63 @@ Define translations from text-based policies to actual python expressions here
 
 import re
 import fnmatch
+import itertools
 
-from dynamo.dataformat import Dataset, Site
+from dynamo.dataformat import Dataset, Site, DatasetReplica, BlockReplica
 from dynamo.policy.attrs import Attr, DatasetAttr, DatasetReplicaAttr, BlockReplicaAttr, ReplicaSiteAttr, SiteAttr, InvalidExpression
 
+# Sub-expressions shared by multiple attrs in compiled evaluation plans
+
+def _num_complete_replicas(block):
+    num = 0
+    for rep in block.replicas:
+        if rep.is_complete():
+            num += 1
+
+    return num
+
+def _transferring_blocks(dataset):
+    """Set of blocks of the dataset with at least one incomplete replica."""
+
+    blocks = set()
+    for block in dataset.blocks:
+        for block_replica in block.replicas:
+            if not block_replica.is_complete():
+                blocks.add(block)
+                break
+
+    return blocks
+
+def _blocks_on_tape(dataset):
+    """Set of blocks of the dataset with a complete replica on tape."""
+
+    blocks = set()
+    for block in dataset.blocks:
+        for block_replica in block.replicas:
+            if block_replica.site.storage_type == Site.TYPE_MSS and block_replica.is_complete():
+                blocks.add(block)
+                break
+
+    return blocks
+
+def _replica_owners(replica):
+    return set(br.group for br in replica.block_replicas)
+
+def _compile_is_full(memoize):
+    """DatasetReplica.is_full with the completeness check memoized (shared with replica.incomplete)."""
+
+    is_complete = memoize(DatasetReplica.is_complete)
+
+    def is_full(replica):
+        return len(replica.block_replicas) == len(replica.dataset.blocks) and is_complete(replica)
+
+    return is_full
+
+
 class DatasetHasIncompleteReplica(DatasetAttr):
     def __init__(self):
         DatasetAttr.__init__(self, Attr.BOOL_TYPE)
+        self.scope = Attr.SCOPE_DATASET
 
     def _get(self, dataset):
         for rep in dataset.replicas:
@@ -44,6 +94,7 @@ class DatasetStatus(DatasetAttr):
 class DatasetOnTape(DatasetAttr):
     def __init__(self):
         DatasetAttr.__init__(self, Attr.NUMERIC_TYPE)
+        self.scope = Attr.SCOPE_DATASET
 
     def rhs_map(self, expr, is_re = False):
         # historic mapping
@@ -54,17 +105,21 @@ class DatasetOnTape(DatasetAttr):
         else:
             return 1
 
-    def _get(self, dataset):
+    def _get(self, dataset, is_full = DatasetReplica.is_full):
         on_tape = 0
         for rep in dataset.replicas:
             if rep.site.storage_type == Site.TYPE_MSS:
-                if rep.is_full():
+                if is_full(rep):
                     return 1
 
                 on_tape = 2
 
         return on_tape
 
+    def _compile_dataset(self, memoize):
+        is_full = _compile_is_full(memoize)
+        return memoize(lambda dataset: self._get(dataset, is_full))
+
 class DatasetRelease(DatasetAttr):
     def __init__(self):
         DatasetAttr.__init__(self, Attr.TEXT_TYPE)
@@ -79,27 +134,37 @@ class DatasetRelease(DatasetAttr):
 class DatasetNumFullDiskCopy(DatasetAttr):
     def __init__(self):
         DatasetAttr.__init__(self, Attr.NUMERIC_TYPE)
+        self.scope = Attr.SCOPE_DATASET
 
-    def _get(self, dataset):
+    def _get(self, dataset, is_full = DatasetReplica.is_full):
         num = 0
         for rep in dataset.replicas:
-            if rep.site.storage_type == Site.TYPE_DISK and rep.site.status == Site.STAT_READY and rep.is_full():
+            if rep.site.storage_type == Site.TYPE_DISK and rep.site.status == Site.STAT_READY and is_full(rep):
                 num += 1
 
         return num
 
+    def _compile_dataset(self, memoize):
+        is_full = _compile_is_full(memoize)
+        return memoize(lambda dataset: self._get(dataset, is_full))
+
 class DatasetNumFullCopy(DatasetAttr):
     def __init__(self):
         DatasetAttr.__init__(self, Attr.NUMERIC_TYPE)
+        self.scope = Attr.SCOPE_DATASET
 
-    def _get(self, dataset):
+    def _get(self, dataset, is_full = DatasetReplica.is_full):
         num = 0
         for rep in dataset.replicas:
-            if rep.site.status == Site.STAT_READY and rep.is_full():
+            if rep.site.status == Site.STAT_READY and is_full(rep):
                 num += 1
 
         return num
 
+    def _compile_dataset(self, memoize):
+        is_full = _compile_is_full(memoize)
+        return memoize(lambda dataset: self._get(dataset, is_full))
+
 class ReplicaSize(DatasetReplicaAttr):
     def __init__(self):
         DatasetReplicaAttr.__init__(self, Attr.NUMERIC_TYPE)
@@ -117,38 +182,52 @@ class ReplicaIncomplete(DatasetReplicaAttr):
     
         return False
 
+    def _compile_replica(self, memoize):
+        is_complete = memoize(DatasetReplica.is_complete)
+        return lambda replica: not is_complete(replica)
+
 class ReplicaNumFullDiskCopyCommonOwner(DatasetReplicaAttr):
     def __init__(self):
         DatasetReplicaAttr.__init__(self, Attr.NUMERIC_TYPE)
+        self.scope = Attr.SCOPE_DATASET
 
-    def _get(self, replica):
-        owners = set(br.group for br in replica.block_replicas)
+    def _get(self, replica, is_full = DatasetReplica.is_full, get_owners = _replica_owners):
+        owners = get_owners(replica)
         dataset = replica.dataset
         num = 0
         for rep in dataset.replicas:
-            if rep.site.storage_type == Site.TYPE_DISK and rep.site.status == Site.STAT_READY and rep.is_full():
-                rep_owners = set(br.group for br in rep.block_replicas)
-                if len(owners & rep_owners) != 0:
+            if rep.site.storage_type == Site.TYPE_DISK and rep.site.status == Site.STAT_READY and is_full(rep):
+                if len(owners & get_owners(rep)) != 0:
                     num += 1
     
         return num
 
+    def _compile_replica(self, memoize):
+        is_full = _compile_is_full(memoize)
+        get_owners = memoize(_replica_owners)
+        return memoize(lambda replica: self._get(replica, is_full, get_owners))
+
 class ReplicaNumFullOtherCopyCommonOwner(DatasetReplicaAttr):
     def __init__(self):
         DatasetReplicaAttr.__init__(self, Attr.NUMERIC_TYPE)
+        self.scope = Attr.SCOPE_DATASET
 
-    def _get(self, replica):
-        owners = set(br.group for br in replica.block_replicas)
+    def _get(self, replica, is_full = DatasetReplica.is_full, get_owners = _replica_owners):
+        owners = get_owners(replica)
         dataset = replica.dataset
         num = 0
         for rep in dataset.replicas:
-            if rep.site is not replica.site and rep.site.status == Site.STAT_READY and rep.is_full():
-                rep_owners = set(br.group for br in rep.block_replicas)
-                if len(owners & rep_owners) != 0:
+            if rep.site is not replica.site and rep.site.status == Site.STAT_READY and is_full(rep):
+                if len(owners & get_owners(rep)) != 0:
                     num += 1
     
         return num
 
+    def _compile_replica(self, memoize):
+        is_full = _compile_is_full(memoize)
+        get_owners = memoize(_replica_owners)
+        return memoize(lambda replica: self._get(replica, is_full, get_owners))
+
 class ReplicaEnforcerProtected(DatasetReplicaAttr):
     def __init__(self):
         DatasetReplicaAttr.__init__(self, Attr.BOOL_TYPE)
@@ -180,6 +259,7 @@ class ReplicaIsLastSource(BlockReplicaAttr):
 
     def __init__(self):
         BlockReplicaAttr.__init__(self, Attr.BOOL_TYPE)
+        self.scope = Attr.SCOPE_DATASET
 
     def _get(self, replica):
         if not replica.is_complete():
@@ -200,6 +280,29 @@ class ReplicaIsLastSource(BlockReplicaAttr):
 
         return transfer_ongoing
 
+    def compile(self, memoize):
+        get_transferring = memoize(_transferring_blocks, volatile = False)
+
+        def get_block_replica(replica):
+            if replica.block in get_transferring(replica.block.dataset):
+                return self._get(replica)
+            else:
+                # there is no ongoing transfer of this block
+                return False
+
+        def get(replica):
+            if type(replica) is BlockReplica:
+                return get_block_replica(replica)
+            elif len(get_transferring(replica.dataset)) != 0:
+                return itertools.imap(get_block_replica, replica.block_replicas)
+            elif len(replica.block_replicas) == 0:
+                return []
+            else:
+                # False for all block replicas
+                return False
+
+        return get
+
 class ReplicaOwner(BlockReplicaAttr):
     def __init__(self):
         BlockReplicaAttr.__init__(self, Attr.TEXT_TYPE)
@@ -227,6 +330,7 @@ class ReplicaIsLocked(BlockReplicaAttr):
 class BlockNumFullDiskCopy(BlockReplicaAttr):
     def __init__(self):
         BlockReplicaAttr.__init__(self, Attr.NUMERIC_TYPE)
+        self.scope = Attr.SCOPE_DATASET
 
     def _get(self, replica):
         num = 0
@@ -236,9 +340,15 @@ class BlockNumFullDiskCopy(BlockReplicaAttr):
     
         return num
 
+    def _compile_block_replica(self, memoize):
+        # same value for all replicas of the block
+        get_num = memoize(_num_complete_replicas, volatile = False)
+        return lambda replica: get_num(replica.block)
+
 class BlockReplicaOnTape(BlockReplicaAttr):
     def __init__(self):
         BlockReplicaAttr.__init__(self, Attr.BOOL_TYPE)
+        self.scope = Attr.SCOPE_DATASET
 
     def _get(self, replica):
         if not replica.is_complete():
@@ -251,6 +361,25 @@ class BlockReplicaOnTape(BlockReplicaAttr):
 
         return False
 
+    def compile(self, memoize):
+        get_on_tape = memoize(_blocks_on_tape, volatile = False)
+
+        def get_block_replica(replica):
+            return replica.block in get_on_tape(replica.block.dataset) and replica.is_complete()
+
+        def get(replica):
+            if type(replica) is BlockReplica:
+                return get_block_replica(replica)
+            elif len(get_on_tape(replica.dataset)) != 0:
+                return itertools.imap(get_block_replica, replica.block_replicas)
+            elif len(replica.block_replicas) == 0:
+                return []
+            else:
+                # False for all block replicas
+                return False
+
+        return get
+
 class BlockReplicaRelativeAge(BlockReplicaAttr):
     def __init__(self):
         BlockReplicaAttr.__init__(self, Attr.NUMERIC_TYPE)
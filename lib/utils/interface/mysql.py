@@ -3,6 +3,7 @@ import sys
 import logging
 import time
 import re
+import itertools
 import multiprocessing
 from ConfigParser import ConfigParser
 
@@ -132,6 +133,9 @@ class MySQL(object):
         # Use insert_and_get_id() in a threaded environment.
         self.last_insert_id = 0
 
+        # {(db, table): whether multi-row INSERTs get consecutive auto-increment ids}
+        self._consecutive_ids = {}
+
     def db_name(self):
         return self._connection_parameters['db']
 
@@ -512,6 +516,113 @@ class MySQL(object):
 
             sqlbase += ' ON DUPLICATE KEY UPDATE ' + ','.join('`{f}`=VALUES(`{f}`)'.format(f = f) for f in update_columns)
 
+        num_inserted = 0
+
+        for values, _ in self._make_insert_values(obj, itr, mapping):
+            num_inserted += self.query(sqlbase % values)
+
+        return num_inserted
+
+    def insert_many_get_ids(self, table, fields, mapping, objects, db = ''):
+        """
+        INSERT INTO table (fields) VALUES (mapping(objects)) and return the auto-increment ids of the inserted rows.
+        Multi-row INSERTs are used when they are assigned consecutive ids, which holds for MyISAM tables and for
+        InnoDB tables with innodb_autoinc_lock_mode <= 1. Otherwise the rows are inserted one by one.
+        @param table          Table name.
+        @param fields         Name of columns.
+        @param mapping        Same as in insert_many.
+        @param objects        List or iterator of objects to insert.
+        @param db             DB name.
+
+        @return  List of ids in the order of objects.
+        """
+
+        itr = iter(objects)
+
+        try:
+            obj = itr.next()
+        except StopIteration:
+            return []
+
+        if db == '':
+            db = self.db_name()
+
+        sqlbase = 'INSERT INTO `%s`.`%s`' % (db, table)
+        sqlbase += ' (%s)' % ','.join('`%s`' % f for f in fields)
+        sqlbase += ' VALUES %s'
+
+        consecutive = self._has_consecutive_ids(db, table)
+
+        ids = []
+
+        # last_insert_id is not protected by the query lock
+        self._connection_lock.acquire()
+        try:
+            if consecutive:
+                for values, num_rows in self._make_insert_values(obj, itr, mapping):
+                    inserted = self.query(sqlbase % values)
+                    if inserted != num_rows:
+                        raise RuntimeError('Inserted %d rows out of %d in insert_many_get_ids' % (inserted, num_rows))
+
+                    first_id = self.last_insert_id
+                    ids.extend(xrange(first_id, first_id + num_rows))
+
+            else:
+                sql = sqlbase % ('(%s)' % ','.join(['%s'] * len(fields)))
+
+                for obj in itertools.chain([obj], itr):
+                    if mapping is None:
+                        self.query(sql, *obj)
+                    else:
+                        self.query(sql, *mapping(obj))
+
+                    ids.append(self.last_insert_id)
+
+            self._connection_lock.release()
+        except:
+            self._fully_unlock()
+            raise
+
+        return ids
+
+    def _has_consecutive_ids(self, db, table):
+        """
+        Check (once per table) whether a multi-row INSERT into the table is assigned consecutive auto-increment ids.
+        """
+
+        try:
+            return self._consecutive_ids[(db, table)]
+        except KeyError:
+            pass
+
+        sql = 'SELECT `engine` FROM `information_schema`.`tables` WHERE `table_schema` = %s AND `table_name` = %s'
+        engine = self.query(sql, db, table)
+
+        if engine == ['MyISAM']:
+            consecutive = True
+        elif engine == ['InnoDB']:
+            # 2 = interleaved: ids of concurrent statements can interleave
+            consecutive = (self.query('SELECT @@innodb_autoinc_lock_mode')[0] <= 1)
+        else:
+            consecutive = False
+
+        if not consecutive:
+            LOG.warning('Multi-row inserts into %s.%s may not get consecutive ids; inserting rows one by one.', db, table)
+
+        self._consecutive_ids[(db, table)] = consecutive
+
+        return consecutive
+
+    def _make_insert_values(self, obj, itr, mapping):
+        """
+        Generator of VALUES expressions for insert_many. Each expression stays within max_query_len.
+        @param obj      First object (already taken from itr)
+        @param itr      Iterator over the remaining objects
+        @param mapping  Function mapping an object to a row tuple, or None
+
+        @return  Yields (values string, number of rows)
+        """
+
         if mapping is None:
             ncol = len(obj)
         else:
@@ -520,16 +631,17 @@ class MySQL(object):
         # template = (%s, %s, ...)
         template = '(' + ','.join(['%s'] * ncol) + ')'
 
-        num_inserted = 0
-
         while True:
             values = ''
+            num_rows = 0
 
             while itr:
                 if mapping is None:
                     values += template % MySQL.escape(obj)
                 else:
                     values += template % MySQL.escape(mapping(obj))
+
+                num_rows += 1
     
                 try:
                     obj = itr.next()
@@ -545,10 +657,8 @@ class MySQL(object):
 
             if values == '':
                 break
-            
-            num_inserted += self.query(sqlbase % values)
 
-        return num_inserted
+            yield values, num_rows
 
     def insert_select_many(self, insert_table, insert_fields, select_table, select_fields, key, pool, do_update = True, db = '', update_columns = None, additional_conditions = [], order_by = ''):
         """
@@ -0,0 +1,135 @@
+import os
+import mmap
+import struct
+import multiprocessing
+import logging
+
+import dynamo.dataformat.serialization as serialization
+from dynamo.dataformat.exceptions import ObjectError
+from dynamo.core.inventory import ObjectRepository, DynamoInventory
+
+LOG = logging.getLogger(__name__)
+
+class UpdateJournal(object):
+    """
+    Append-only file of inventory update frames, written by the server process and replayed by the web
+    workers. The server appends frames and then advances the committed size in shared memory; each worker
+    reads the frames between the position it has applied and the committed size. The file is opened by the
+    server before the web server is forked, and the workers read it through the inherited descriptor with
+    mmap, so that they do not share a file offset.
+    """
+
+    _LENGTH = struct.Struct('>I')
+
+    def __init__(self, path):
+        """
+        @param path  Path of the journal file.
+        """
+
+        self.path = path
+
+        self.committed = None
+        self._output = None
+        self._input_fd = None
+        self._position = 0
+
+    def reset(self):
+        """
+        Start a new empty journal. Called in the server process before forking a new web server. Processes
+        forked earlier keep reading the previous file and committed size.
+        """
+
+        if self._output is not None:
+            self._output.close()
+        if self._input_fd is not None:
+            os.close(self._input_fd)
+
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+        self._output = open(self.path, 'wb')
+        self._input_fd = os.open(self.path, os.O_RDONLY)
+        self._position = 0
+
+        # new object; the previous one stays with the processes that use the previous file
+        self.committed = multiprocessing.Value('L', 0, lock = True)
+
+    def size(self):
+        return self.committed.value
+
+    def append(self, commands, chunk_size = 10000):
+        """
+        Write update commands to the journal and make them visible to the readers.
+        @param commands    List of (cmd, record) where record is a serialization.pack() result
+        @param chunk_size  Number of commands per frame
+        """
+
+        for icmd in xrange(0, len(commands), chunk_size):
+            frame = serialization.encode_frame(commands[icmd:icmd + chunk_size])
+            self._output.write(UpdateJournal._LENGTH.pack(len(frame)))
+            self._output.write(frame)
+
+        self._output.flush()
+
+        self.committed.value = self._output.tell()
+
+    def read(self):
+        """
+        Read the commands appended since the last call (in this process).
+        @return List of (cmd, record)
+        """
+
+        end = self.committed.value
+        if end == self._position:
+            return []
+
+        commands = []
+
+        view = mmap.mmap(self._input_fd, end, access = mmap.ACCESS_READ)
+        try:
+            position = self._position
+            while position < end:
+                length = UpdateJournal._LENGTH.unpack_from(view, position)[0]
+                position += UpdateJournal._LENGTH.size
+                commands.extend(serialization.decode_frame(view[position:position + length]))
+                position += length
+
+        finally:
+            view.close()
+
+        self._position = end
+
+        return commands
+
+    def apply(self, inventory):
+        """
+        Apply the commands appended since the last call (in this process) to an inventory image. The position
+        is advanced only when all commands are applied; after a failure the next call replays them.
+        @param inventory  DynamoInventory image of this process
+        @return Number of commands applied
+        """
+
+        position = self._position
+
+        try:
+            commands = self.read()
+
+            for cmd, record in commands:
+                obj = serialization.unpack(record)
+
+                # Bypass DynamoInventory.update/delete, which write to the store
+                if cmd == DynamoInventory.CMD_UPDATE:
+                    ObjectRepository.update(inventory, obj)
+                elif cmd == DynamoInventory.CMD_DELETE:
+                    try:
+                        ObjectRepository.delete(inventory, obj)
+                    except (KeyError, ObjectError):
+                        pass
+
+        except:
+            self._position = position
+            raise
+
+        return len(commands)
@@ -0,0 +1,79 @@
+import json
+import types
+
+_encode = json.JSONEncoder().encode
+
+def iterencode(obj, chunk_size = 65536):
+    """
+    Encode obj to JSON incrementally. Generators anywhere in the structure (as dict values or list elements)
+    are encoded as JSON lists while they are consumed, so that a web module can yield its records instead
+    of building the full list. The output is delivered in strings of about chunk_size bytes.
+    @param obj         Object to encode. dicts, lists, tuples, and generators are traversed; everything else
+                       is passed to json.
+    @param chunk_size  Target size of the yielded strings.
+    """
+
+    buf = []
+    size = 0
+
+    for piece in _iterencode(obj):
+        buf.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(buf)
+            buf = []
+            size = 0
+
+    if size != 0:
+        yield ''.join(buf)
+
+def _is_container(obj):
+    return type(obj) in (dict, list, tuple, types.GeneratorType)
+
+def _iterencode(obj):
+    if type(obj) is dict:
+        yield '{'
+        first = True
+        for key, value in obj.iteritems():
+            if first:
+                first = False
+            else:
+                yield ', '
+
+            if isinstance(key, basestring):
+                yield _encode(key) + ': '
+            else:
+                # same conversion as json (1 -> "1", None -> "null")
+                yield _encode(_encode(key)) + ': '
+
+            if _is_container(value):
+                for piece in _iterencode(value):
+                    yield piece
+            else:
+                yield _encode(value)
+
+        yield '}'
+
+    elif type(obj) in (list, tuple, types.GeneratorType):
+        yield '['
+        first = True
+        for item in obj:
+            if first:
+                first = False
+            else:
+                yield ', '
+
+            # Elements are normally plain records that json can encode in one go.
+            # Only those containing generators need to be traversed.
+            try:
+                piece = _encode(item)
+            except TypeError:
+                for piece in _iterencode(item):
+                    yield piece
+            else:
+                yield piece
+
+        yield ']'
+
+    else:
+        yield _encode(obj)
@@ -4,6 +4,9 @@ class WebModule(object):
         self.must_authenticate = False
         self.require_authorizer = False
         self.require_appmanager = False
+        # Set to True in modules that are not write-enabled and never modify the inventory objects. The web server
+        # process running any other module exits after the request, as its inventory image may have been changed.
+        self.side_effect_free = False
         self.content_type = 'application/json'
         self.additional_headers = []
         self.message = ''
@@ -16,6 +19,9 @@ class WebModule(object):
         @param caller    WebServer.User object (namedtuple of (name, id, authlist))
         @param request   A dictionary (or list if JSON list is uploaded) of user request
         @param inventory The inventory
+        @return Content of the response. For JSON responses, lists of records can be replaced by generators,
+                which are consumed while the response is written out. Updates to the inventory must be made
+                before returning.
         """
 
         raise NotImplementedError('run')
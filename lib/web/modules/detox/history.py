@@ -1,4 +1,5 @@
 import os
+import time
 import fnmatch
 import re
 
@@ -381,6 +382,111 @@ class DetoxDatasetSearch(WebDetoxHistory):
 
         return data
 
+class DetoxCycleDiff(WebDetoxHistory):
+    def run(self, caller, request, inventory):
+        self.get_partition_and_cycle(request)
+
+        if self.cycle == 0:
+            raise exceptions.InvalidRequest('Cycle not found')
+
+        if 'base_cycle' in request:
+            try:
+                base_cycle = int(request['base_cycle'])
+            except ValueError:
+                raise exceptions.IllFormedRequest('base_cycle', request['base_cycle'])
+
+            sql = 'SELECT COUNT(*) FROM `deletion_cycles` WHERE `id` = %s AND `partition_id` = %s AND `time_end` NOT LIKE \'0000-00-00 00:00:00\''
+            sql += ' AND `operation` = %s'
+            if self.detox_history.db.query(sql, base_cycle, self.partition_id, self.operation)[0] == 0:
+                raise exceptions.InvalidRequest('Unknown cycle %d' % base_cycle)
+
+        else:
+            # compare to the previous cycle by default
+            sql = 'SELECT `id` FROM `deletion_cycles` WHERE `id` < %s AND `partition_id` = %s AND `time_end` NOT LIKE \'0000-00-00 00:00:00\''
+            sql += ' AND `operation` = %s ORDER BY `id` DESC LIMIT 1'
+            try:
+                base_cycle = self.detox_history.db.query(sql, self.cycle, self.partition_id, self.operation)[0]
+            except IndexError:
+                raise exceptions.InvalidRequest('Cycle %d has no previous cycle' % self.cycle)
+
+        if 'site' in request:
+            site_names = request['site']
+            if type(site_names) is not list:
+                site_names = [site_names]
+        else:
+            site_names = None
+
+        data = {'cycle': self.cycle, 'base_cycle': base_cycle, 'site_data': [], 'conditions': {0: 'No policy match'}}
+        conditions = data['conditions']
+
+        try:
+            changes = self.detox_history.get_decision_diff(base_cycle, self.cycle, site_names = site_names)
+        except RuntimeError as ex:
+            # snapshot of one of the cycles does not exist
+            raise exceptions.InvalidRequest(str(ex))
+
+        def format_decisions(decisions):
+            formatted = []
+            for replica_size, decision, condition_id, condition_text in decisions:
+                formatted.append({'size': replica_size * 1.e-9, 'decision': decision, 'condition_id': condition_id})
+                if condition_id not in conditions:
+                    conditions[condition_id] = condition_text
+
+            return formatted
+
+        for site_name in sorted(changes.iterkeys()):
+            site_datasets = []
+            num_changes = {'added': 0, 'removed': 0, 'changed': 0}
+
+            for dataset_name, old_decisions, new_decisions in sorted(changes[site_name]):
+                if len(old_decisions) == 0:
+                    change = 'added'
+                elif len(new_decisions) == 0:
+                    change = 'removed'
+                else:
+                    change = 'changed'
+
+                num_changes[change] += 1
+
+                site_datasets.append({'name': dataset_name, 'change': change, 'old': format_decisions(old_decisions), 'new': format_decisions(new_decisions)})
+
+            site_data = {'name': site_name, 'datasets': site_datasets}
+            site_data.update(num_changes)
+            data['site_data'].append(site_data)
+
+        return data
+
+
+class DetoxSiteTrend(WebDetoxHistory):
+    def run(self, caller, request, inventory):
+        self.get_partition_and_cycle(request, default_latest = False)
+
+        try:
+            days = int(request.get('days', 30))
+        except ValueError:
+            raise exceptions.IllFormedRequest('days', request['days'])
+
+        since = int(time.time()) - days * 24 * 3600
+
+        try:
+            partition = self.detox_history.db.query('SELECT `name` FROM `partitions` WHERE `id` = %s', self.partition_id)[0]
+        except IndexError:
+            raise exceptions.InvalidRequest('Unknown partition id %d' % self.partition_id)
+
+        site_name = request.get('site', None)
+
+        data = {'partition': self.partition_id, 'since': since, 'series': []}
+
+        for cycle, timestamp, volumes in self.detox_history.get_site_volume_series(partition, site_name = site_name, since = since, operation = self.operation):
+            site_data = []
+            for sname in sorted(volumes.iterkeys()):
+                protect, delete, keep = volumes[sname]
+                site_data.append({'name': sname, 'protect': protect, 'keep': keep, 'delete': delete})
+
+            data['series'].append({'cycle': cycle, 'timestamp': timestamp, 'site_data': site_data})
+
+        return data
+
 export_data = {
     'partitions': DetoxPartitions,
     'cycles': DetoxCycles,
@@ -388,7 +494,9 @@ export_data = {
     'sitedetail': DetoxSiteDetail,
     'datasets': DetoxDatasetSearch,
     'dump': DetoxCycleDump,
-    'policy': DetoxCyclePolicy
+    'policy': DetoxCyclePolicy,
+    'diff': DetoxCycleDiff,
+    'trend': DetoxSiteTrend
 }
 
 def test(cls):
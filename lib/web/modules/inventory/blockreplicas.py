@@ -14,6 +14,7 @@ class ListBlockReplicas(WebModule):
 
     def __init__(self, config):
         WebModule.__init__(self, config)
+        self.side_effect_free = True
 
     def run(self, caller, request, inventory):
         dset_name = ''
@@ -28,25 +29,24 @@ class ListBlockReplicas(WebModule):
         
         # collect information from the inventory and registry according to the requests
         datasets = []
-        pattern = re.compile(fnmatch.translate(dset_name))
         if '*' in dset_name:
-            for thename in inventory.datasets.iterkeys():
-                if pattern.match(thename):
-                    datasets.append(inventory.datasets[thename])
+            for thename in inventory.datasets.match(dset_name):
+                datasets.append(inventory.datasets[thename])
         else:
             if dset_name in inventory.datasets:
                 datasets.append(inventory.datasets[dset_name])
         
 
         
-        blocks = {}
-        blockreps = {}
+        # records are generated while the response is written out
+        return {'block': self._generate(request, datasets, block_name)}
+
+    def _generate(self, request, datasets, block_name):
         if 'node' in request:
             nodepat = re.compile(fnmatch.translate(request['node']))
         if '*' in block_name:
             blockpat = re.compile(fnmatch.translate(block_name))
         for dset_obj in datasets:
-            blocks[dset_obj] = []
             for block_obj in dset_obj.blocks:
                 if '*' in block_name:
                     if not blockpat.match(block_obj.real_name()):
@@ -55,11 +55,10 @@ class ListBlockReplicas(WebModule):
                     if block_name != '' and block_name != block_obj.real_name():
                         continue
 
-                blocks[dset_obj].append(block_obj)
-                blockreps[block_obj] = []
-                for blockrep_obj in block_obj.replicas:
+                repline = []
+                for blkrep in block_obj.replicas:
                     if 'node' in request:
-                        site_name = blockrep_obj.site.name
+                        site_name = blkrep.site.name
                         if '*' in request['node']:
                             if not nodepat.match(site_name):
                                 continue
@@ -69,34 +68,26 @@ class ListBlockReplicas(WebModule):
                 
                     if 'complete' in request:
                         if request['complete'] == 'y':
-                            if not blockrep_obj.is_complete():
+                            if not blkrep.is_complete():
                                 continue
                         if request['complete'] == 'n':
-                            if blockrep_obj.is_complete():
+                            if blkrep.is_complete():
                                 continue
 
                     if 'group' in request:
-                        if request['group'] != blockrep_obj.group.name:
+                        if request['group'] != blkrep.group.name:
                             continue
 
                     if 'update_since' in request:
                         update_since = int(request['update_since'])
-                        if update_since > blockrep_obj.last_update:
+                        if update_since > blkrep.last_update:
                             continue
 
                     if 'create_since' in request:
-                        update_since = int(request['create_since'])
-                        if create_since > blockrep_obj.last_update:
+                        create_since = int(request['create_since'])
+                        if create_since > blkrep.last_update:
                             continue
-                    blockreps[block_obj].append(blockrep_obj)
-           
-        
-        response = []
-        
-        for dset_obj in blocks:
-            for block_obj in blocks[dset_obj]:
-                repline = []
-                for blkrep in blockreps[block_obj]:
+
                     if blkrep.group is Group.null_group:
                         subscribed = 'n'
                     else:
@@ -112,9 +103,7 @@ class ListBlockReplicas(WebModule):
 
                 line = {'name': block_obj.full_name(), 'files': block_obj.num_files, 'bytes': block_obj.size, 
                         'is_open': self.crt(block_obj.is_open), 'id': block_obj.id, 'replica': repline }
-                response.append(line)
-        
-        return {'block': response}
+                yield line
 
     def crt(self,boolval):
         if boolval == True: return 'y'
@@ -14,6 +14,7 @@ class ListData(WebModule):
 
     def __init__(self, config):
         WebModule.__init__(self, config)
+        self.side_effect_free = True
 
     def run(self, caller, request, inventory):
         if 'block' not in request:
@@ -29,20 +30,9 @@ class ListData(WebModule):
         if block_obj is None:
             return {"dbs":[]}
 
-        files_json = []
-        for blockrep_obj in block_obj.replicas:
-            site_name = blockrep_obj.site.name
+        # records are generated while the response is written out
+        files_json = self._generate(block_obj)
 
-            all_files = block_obj.files
-            if not blockrep_obj.is_complete():
-                all_files = blockrep_obj.files()
-            for file_obj in all_files:
-                cksum = 'alde32:' + str(file_obj.checksum[1]) + ',cksum:' + str(file_obj.checksum[0])
-                file_hash = {'checksum': cksum,'node':site_name,'lfn':file_obj.lfn,
-                             'time_create':blockrep_obj.last_update,'size':file_obj.size}
-                
-                files_json.append(file_hash)
-            
         block_open = 'n'
         if block_obj.is_open:
             block_open = 'y'
@@ -53,6 +43,18 @@ class ListData(WebModule):
         dset_hash = {"dataset":[{'time_update':None,'is_transient':'n','is_open':'y', 'name':dset_name, 'block':block_hash}]}
 
         return {"dbs":[dset_hash]}
+
+    def _generate(self, block_obj):
+        for blockrep_obj in block_obj.replicas:
+            site_name = blockrep_obj.site.name
+
+            all_files = block_obj.files
+            if not blockrep_obj.is_complete():
+                all_files = blockrep_obj.files()
+            for file_obj in all_files:
+                cksum = 'alde32:' + str(file_obj.checksum[1]) + ',cksum:' + str(file_obj.checksum[0])
+                yield {'checksum': cksum,'node':site_name,'lfn':file_obj.lfn,
+                       'time_create':blockrep_obj.last_update,'size':file_obj.size}
                 
 
 # exported to __init__.py
@@ -1,6 +1,3 @@
-import fnmatch
-import re
-
 from dynamo.web.modules._base import WebModule
 from dynamo.dataformat import Dataset
 
@@ -9,6 +6,10 @@ class ListDatasets(WebModule):
     Simple dataset listing.
     """
 
+    def __init__(self, config):
+        WebModule.__init__(self, config)
+        self.side_effect_free = True
+
     def run(self, caller, request, inventory):
         datasets = []
     
@@ -16,10 +17,8 @@ class ListDatasets(WebModule):
         if 'dataset' in request:
             match_name = request['dataset']
             if '*' in match_name:
-                pattern = re.compile(fnmatch.translate(match_name))
-                for name in inventory.datasets.iterkeys():
-                    if pattern.match(name):
-                        datasets.append(inventory.datasets[name])
+                for name in inventory.datasets.match(match_name):
+                    datasets.append(inventory.datasets[name])
                 
             else:
                 try:
@@ -27,13 +26,13 @@ class ListDatasets(WebModule):
                 except KeyError:
                     pass
     
-        response = []
+        # records are generated while the response is written out
+        return self._generate(datasets)
+
+    def _generate(self, datasets):
         for dataset in datasets:
-            response.append({'name': dataset.name, 'size': dataset.size, 'num_files': dataset.num_files,
-                'status': Dataset.status_name(dataset.status), 'type': Dataset.data_type_name(dataset.data_type)})
-    
-        # return any JSONizable python object (maybe should be limited to a list)
-        return response
+            yield {'name': dataset.name, 'size': dataset.size, 'num_files': dataset.num_files,
+                'status': Dataset.status_name(dataset.status), 'type': Dataset.data_type_name(dataset.data_type)}
 
 
 # exported to __init__.py
@@ -1,9 +1,10 @@
-import fnmatch
-import re
-
 from dynamo.web.modules._base import WebModule
 
 class ListGroups(WebModule):
+    def __init__(self, config):
+        WebModule.__init__(self, config)
+        self.side_effect_free = True
+
     def run(self, caller, request, inventory):
         # collect information from the inventory and registry according to the requests
 
@@ -12,10 +13,8 @@ class ListGroups(WebModule):
         if 'group' in request:
             match_name = request['group']
             if '*' in match_name:
-                pattern = re.compile(fnmatch.translate(match_name))
-                for name in sorted(inventory.groups.iterkeys()):
-                    if pattern.match(name):
-                        response.append({'name': name})
+                for name in inventory.groups.match(match_name):
+                    response.append({'name': name})
                 
             elif match_name in inventory.groups:
                 response.append({'name': match_name})
@@ -1,6 +1,7 @@
 import time
 import logging
 import json
+import collections
 
 from dynamo.web.exceptions import MissingParameter, IllFormedRequest, InvalidRequest, AuthorizationError, TryAgain
 from dynamo.web.modules._base import WebModule
@@ -631,11 +632,14 @@ class InjectDataSync(InjectDataBase):
 
     def _finalize(self):
         # Do this here to minimize the risk of creating invalid subscriptions
+        missing_files = collections.defaultdict(list) # {site: [file]}
+        df.Block.prefetch_files(self.blocks_with_new_file)
         for block in self.blocks_with_new_file:
-            all_files = block.files
             for replica in block.replicas:
-                for lfile in (all_files - replica.files()):
-                    self.rlfsm.subscribe_file(replica.site, lfile)
+                missing_files[replica.site].extend(replica.missing_files())
+
+        for site, files in missing_files.iteritems():
+            self.rlfsm.subscribe_files(site, files)
 
         self.message = 'Data is injected.'
 
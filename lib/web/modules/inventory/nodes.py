@@ -1,5 +1,3 @@
-import fnmatch
-import re
 import logging
 
 from dynamo.web.modules._base import WebModule
@@ -20,6 +18,7 @@ class NodesList(WebModule):
 
     def __init__(self, config):
         WebModule.__init__(self, config)
+        self.side_effect_free = True
 
 
     def run(self, caller, request, inventory):
@@ -29,10 +28,8 @@ class NodesList(WebModule):
         if 'node' in request:
             node_name = request['node']
             if '*' in node_name:
-                pattern = re.compile(fnmatch.translate(node_name))
-                for site_name in inventory.sites:
-                    if pattern.match(site_name):
-                        site_objs.append(inventory.sites[site_name])
+                for site_name in inventory.sites.match(node_name):
+                    site_objs.append(inventory.sites[site_name])
                     
             else:
                 try:
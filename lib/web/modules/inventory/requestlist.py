@@ -1,5 +1,3 @@
-import fnmatch
-import re
 import logging
 
 from dynamo.web.modules._base import WebModule
@@ -76,11 +74,7 @@ class RequestList(WebModule):
         site_names = None
         data_names = None
         if 'node' in request:
-            site_names = []
-            nodepat = re.compile(fnmatch.translate(request['node']))
-            for site in inventory.sites:
-                if nodepat.match(site):
-                    site_names.append(site)
+            site_names = inventory.sites.match(request['node'])
             if len(site_names) < 1: site_names = None
 
         if 'dataset' in request:
@@ -88,10 +82,7 @@ class RequestList(WebModule):
             dset_name = request['dataset']
 
             if '*' in dset_name:
-                pattern = re.compile(fnmatch.translate(dset_name))
-                for thename in inventory.datasets.iterkeys():
-                    if pattern.match(thename):
-                        data_names.append(thename)
+                data_names.extend(inventory.datasets.match(dset_name))
             elif dset_name in inventory.datasets:
                     data_names.append(dset_name)
             if len(data_names) < 1: data_names = None
@@ -1,6 +1,3 @@
-import fnmatch
-import re
-
 from dynamo.web.modules._base import WebModule
 from dynamo.dataformat import Site
 
@@ -9,6 +6,10 @@ class ListSites(WebModule):
     Simple site listing.
     """
 
+    def __init__(self, config):
+        WebModule.__init__(self, config)
+        self.side_effect_free = True
+
     def run(self, caller, request, inventory):
         sites = set()
     
@@ -21,10 +22,8 @@ class ListSites(WebModule):
 
             for match_name in match_names:
                 if '*' in match_name:
-                    pattern = re.compile(fnmatch.translate(match_name))
-                    for name in inventory.sites.iterkeys():
-                        if pattern.match(name):
-                            sites.add(inventory.sites[name])
+                    for name in inventory.sites.match(match_name):
+                        sites.add(inventory.sites[name])
                     
                 else:
                     try:
@@ -45,10 +44,8 @@ class ListSites(WebModule):
 
             for match_name in match_names:
                 if '*' in match_name:
-                    pattern = re.compile(fnmatch.translate(match_name))
-                    for name in inventory.partitions.iterkeys():
-                        if pattern.match(name):
-                            partitions.add(inventory.partitions[name])
+                    for name in inventory.partitions.match(match_name):
+                        partitions.add(inventory.partitions[name])
                     
                 else:
                     try:
@@ -44,27 +44,28 @@ def passes_constraints(item, constraints):
             # ORed list
             match = True
             for pat in pattern:
-                if pat is None and value is None:
-                    break
-                elif pat.match(value):
+                if pat is None:
+                    if value is None:
+                        break
+                elif value is not None and pat.match(value):
                     break
             else:
                 # no pattern matched
                 return False
                 
-        elif pattern is None and value is not None:
-            return False
+        elif pattern is None:
+            if value is not None:
+                return False
 
-        elif not pattern.match(value):
+        elif value is None or not pattern.match(value):
             return False
 
     return True
 
 
-def filter_and_categorize(request, inventory, counts_only = False):
-    # return {category: [(dataset_replica, [block_replica])]} or {category: [(dataset, replication)]} that match the filter
+def parse_constraints(request):
+    # return ({category: pattern} for datasets, sites, and groups, list_by)
 
-    # constraints
     dataset_constraints = {}
     site_constraints = {}
     group_constraints = {}
@@ -104,6 +105,115 @@ def filter_and_categorize(request, inventory, counts_only = False):
     except:
         list_by = next(cat for cat in InventoryStatCategories.categories.iterkeys())
 
+    return dataset_constraints, site_constraints, group_constraints, list_by
+
+
+# marks cell key elements that do not pass the constraints
+_rejected = object()
+
+def sum_from_cube(request, inventory):
+    # return {category: {site_name: [bytes, logical bytes]}} of the block replicas that match the filter,
+    # or None if the request cannot be answered from the statistics cube of the inventory
+
+    cube = inventory.stat_cube
+    if cube is None or not cube.built:
+        return None
+
+    dataset_constraints, site_constraints, group_constraints, list_by = parse_constraints(request)
+
+    _, target, keymap = InventoryStatCategories.categories[list_by]
+
+    # Dataset categorizations are evaluated on the dataset attributes in the cell key. Those that need other
+    # attributes (e.g. the dataset name) raise AttributeError and are served by filter_and_categorize.
+    dataset_keys = {}
+    site_keys = {}
+    group_keys = {}
+
+    product = {}
+
+    try:
+        for (site_name, group_name, dataset_attrs), values in cube.cells():
+            try:
+                dataset_key = dataset_keys[dataset_attrs]
+            except KeyError:
+                if passes_constraints(dataset_attrs, dataset_constraints):
+                    if target is Dataset:
+                        dataset_key = keymap(dataset_attrs)
+                    else:
+                        dataset_key = True
+                else:
+                    dataset_key = _rejected
+
+                dataset_keys[dataset_attrs] = dataset_key
+
+            if dataset_key is _rejected:
+                continue
+
+            try:
+                site_key = site_keys[site_name]
+            except KeyError:
+                site = inventory.sites[site_name]
+                if passes_constraints(site, site_constraints):
+                    if target is Site:
+                        site_key = keymap(site)
+                    else:
+                        site_key = True
+                else:
+                    site_key = _rejected
+
+                site_keys[site_name] = site_key
+
+            if site_key is _rejected:
+                continue
+
+            try:
+                group_key = group_keys[group_name]
+            except KeyError:
+                group = inventory.groups[group_name]
+                if passes_constraints(group, group_constraints):
+                    if target is Group:
+                        group_key = keymap(group)
+                    else:
+                        group_key = True
+                else:
+                    group_key = _rejected
+
+                group_keys[group_name] = group_key
+
+            if group_key is _rejected:
+                continue
+
+            if target is Dataset:
+                key = dataset_key
+            elif target is Site:
+                key = site_key
+            else:
+                key = group_key
+
+            try:
+                category_data = product[key]
+            except KeyError:
+                category_data = product[key] = {}
+
+            try:
+                sums = category_data[site_name]
+            except KeyError:
+                sums = category_data[site_name] = [0, 0]
+
+            sums[0] += values[cube.BYTES]
+            sums[1] += values[cube.LOGICAL_BYTES]
+
+    except AttributeError:
+        return None
+
+    return product
+
+
+def filter_and_categorize(request, inventory, counts_only = False):
+    # return {category: [(dataset_replica, [block_replica])]} or {category: [(dataset, replication)]} that match the filter
+
+    dataset_constraints, site_constraints, group_constraints, list_by = parse_constraints(request)
+
     product = {}
 
     matching_sites = set()
@@ -200,20 +310,37 @@ def filter_and_categorize(request, inventory, counts_only = False):
 
 
 class TotalSizeListing(WebModule):
+    def __init__(self, config):
+        WebModule.__init__(self, config)
+        self.side_effect_free = True
+
     def run(self, caller, request, inventory):
         """
         @return {'statistic': 'size', 'content': [{key: key_name, size: size in TB}]}
         """
 
-        if yesno(request, 'physical'):
+        physical = yesno(request, 'physical')
+
+        content = []
+
+        sums = sum_from_cube(request, inventory)
+        if sums is not None:
+            index = 0 if physical else 1
+            for category, by_site in sums.iteritems():
+                size = sum(site_sums[index] for site_sums in by_site.itervalues())
+                content.append({'key': category, 'size': size * 1.e-12})
+
+            content.sort(key = lambda x: x['size'], reverse = True)
+
+            return {'statistic': 'size', 'content': content}
+
+        if physical:
             get_size = lambda bl: sum(br.size for br in bl)
         else:
             get_size = lambda bl: sum(br.block.size for br in bl)
 
         all_replicas = filter_and_categorize(request, inventory)
 
-        content = []
-
         for category, replicas in all_replicas.iteritems():
             size = 0
             for dataset_replica, block_replicas in replicas:
@@ -227,6 +354,10 @@ class TotalSizeListing(WebModule):
 
 
 class ReplicationFactorListing(WebModule):
+    def __init__(self, config):
+        WebModule.__init__(self, config)
+        self.side_effect_free = True
+
     def run(self, caller, request, inventory):
         """
         @return {'statistic': 'replication', 'content': [{key: key_name, mean: mean rep factor, rms: rms rep factor}]}
@@ -255,12 +386,42 @@ class ReplicationFactorListing(WebModule):
 
 
 class SiteUsageListing(WebModule):
+    def __init__(self, config):
+        WebModule.__init__(self, config)
+        self.side_effect_free = True
+
     def run(self, caller, request, inventory):
         """
         @return {'statistic': 'usage', 'content': [{'site': site_name, 'usage': [{key: key_name, size: size}]}]}
         """
 
-        if yesno(request, 'physical', True):
+        physical = yesno(request, 'physical', True)
+
+        sums = sum_from_cube(request, inventory)
+        if sums is not None:
+            index = 0 if physical else 1
+
+            by_site = {} # {site_name: [{key: key_name, size: size}]}
+            for category, category_data in sums.iteritems():
+                for site_name, site_sums in category_data.iteritems():
+                    try:
+                        site_content = by_site[site_name]
+                    except KeyError:
+                        site_content = by_site[site_name] = []
+
+                    site_content.append({'key': category, 'size': site_sums[index] * 1.e-12})
+
+            content = []
+
+            for site_name, site_content in by_site.iteritems():
+                site_content.sort(key = lambda x: x['size'], reverse = True)
+                content.append({'site': site_name, 'usage': site_content})
+
+            content.sort(key = lambda x: x['site'])
+
+            return {'statistic': 'usage', 'content': content, 'keys': sorted(sums.keys())}
+
+        if physical:
             get_size = lambda bl: sum(br.size for br in bl)
         else:
             get_size = lambda bl: sum(br.block.size for br in bl)
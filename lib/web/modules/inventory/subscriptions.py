@@ -19,6 +19,7 @@ class SubscriptionsList(WebModule):
 
     def __init__(self, config):
         WebModule.__init__(self, config)
+        self.side_effect_free = True
 
     def get_replicas(self, item_name, inventory, data_blocks):
         dset_name = item_name
@@ -27,10 +28,8 @@ class SubscriptionsList(WebModule):
             dset_name, _, block_name = item_name.partition('#')
 
         if '*' in dset_name:
-            pattern = re.compile(fnmatch.translate(dset_name))
-            for thename,dset_obj in inventory.datasets.iteritems():
-                if pattern.match(thename):
-                    data_blocks[dset_obj] = []
+            for thename in inventory.datasets.match(dset_name):
+                data_blocks[inventory.datasets[thename]] = []
         elif dset_name in inventory.datasets:
             dset_obj = inventory.datasets[dset_name]
             data_blocks[dset_obj] = []
@@ -161,12 +160,12 @@ class SubscriptionsList(WebModule):
                 return {'dataset' : []}
             self.get_replicas(block_name,inventory,data_blocks)
 
-        dset_hash_lines = []
-        for dset_obj in data_blocks:
-            dset_hash = self.make_json(dset_obj,data_blocks,request,inventory)
-            dset_hash_lines.append(dset_hash)
+        # records are generated while the response is written out
+        return {'dataset': self._generate(data_blocks,request,inventory)}
 
-        return {'dataset': dset_hash_lines }
+    def _generate(self, data_blocks, request, inventory):
+        for dset_obj in data_blocks:
+            yield self.make_json(dset_obj,data_blocks,request,inventory)
         
 # exported to __init__.py
 export_data = {
@@ -7,6 +7,8 @@ import logging
 import logging.handlers
 import socket
 import collections
+import itertools
+import types
 import warnings
 import multiprocessing
 import cStringIO
@@ -14,13 +16,16 @@ from cgi import parse_qs, escape
 from flup.server.fcgi_fork import WSGIServer
 
 import dynamo.core.serverutils as serverutils
+from dynamo.core.inventory import ReadOnlyInventoryProxy
 import dynamo.web.exceptions as exceptions
+from dynamo.web.journal import UpdateJournal
+import dynamo.web.jsonstream as jsonstream
 # Actual modules imported at the bottom of this file
 from dynamo.web.modules import modules, load_modules
 from dynamo.web.modules._html import HTMLMixin
 
 from dynamo.utils.transform import unicode2str
-from dynamo.utils.log import reset_logger
+from dynamo.utils.log import reset_logger, log_exception
 
 LOG = logging.getLogger(__name__)
 
@@ -66,10 +71,21 @@ class WebServer(object):
 
         # Preforked WSGI server
         # Preforking = have at minimum min_idle and at maximum max_idle child processes listening to the out-facing port.
-        # There can be at most max_procs children. Each child process is single-use to ensure changes to shared resources (e.g. inventory)
-        # made in a child process does not affect the other processes.
-        prefork_config = {'minSpare': config.get('min_idle', 1), 'maxSpare': config.get('max_idle', 5), 'maxChildren': config.get('max_procs', 10), 'maxRequests': 1}
-        self.wsgi_server = WSGIServer(self.main, bindAddress = config.socket, umask = 0, **prefork_config)
+        # There can be at most max_procs children. Each child process serves up to max_requests requests with its copy
+        # of the inventory, which is brought up to date from the update journal at the beginning of each request. The
+        # master process applies the journal before each fork, so that new children start from the current position.
+        # Modules that are not write-enabled see a read-only inventory. A child that ran a write-enabled module exits
+        # after the request so that the changes it made to its copy do not affect the following requests.
+        prefork_config = {'minSpare': config.get('min_idle', 1), 'maxSpare': config.get('max_idle', 5), 'maxChildren': config.get('max_procs', 10), 'maxRequests': config.get('max_requests', 100)}
+        self.wsgi_server = PreforkWSGIServer(self.main, self._update_before_fork, bindAddress = config.socket, umask = 0, **prefork_config)
+
+        # Size of the pieces in which the response body is written out
+        self.chunk_size = config.get('response_chunk_size', 65536)
+
+        # Inventory updates are passed to the children through the journal. When it grows beyond max_journal_size (bytes)
+        # the web server is restarted with a fresh image of the inventory.
+        self.journal = UpdateJournal(config.get('update_journal', '/tmp/dynamoweb.journal'))
+        self.max_journal_size = config.get('max_journal_size', 100000000)
 
         self.server_proc = None
 
@@ -94,6 +110,8 @@ class WebServer(object):
         if self.server_proc and self.server_proc.is_alive():
             raise RuntimeError('Web server is already running')
 
+        self.journal.reset()
+
         self.server_proc = multiprocessing.Process(target = self._serve)
         self.server_proc.daemon = True
         self.server_proc.start()
@@ -133,6 +151,9 @@ class WebServer(object):
         old_active_count = self.active_count
         self.active_count = multiprocessing.Value('I', 0, lock = True)
 
+        # The new server starts with the current inventory image and an empty journal
+        self.journal.reset()
+
         # A new WSGI server will overtake the socket. New requests will be handled by new_server_proc
         LOG.debug('Starting new web server.')
         new_server_proc = multiprocessing.Process(target = self._serve)
@@ -154,6 +175,21 @@ class WebServer(object):
 
         LOG.info('Started web server (PID %d).', self.server_proc.pid)
 
+    def publish_updates(self, commands):
+        """
+        Pass inventory updates to the web server processes. Called in the server process.
+        @param commands  List of (cmd, record) where record is a serialization.pack() result
+        """
+
+        if self.server_proc is None:
+            return
+
+        if self.journal.size() > self.max_journal_size:
+            # Too many updates to replay; start over with a fresh image
+            self.restart()
+        else:
+            self.journal.append(commands)
+
     def _serve(self):
         if self.log_path:
             reset_logger()
@@ -203,6 +239,12 @@ class WebServer(object):
             os._exit(exc.code)
 
     def main(self, environ, start_response):
+        """
+        WSGI callable. This is a generator, so that the response body can be produced while it is being sent:
+        when a module returns a generator (possibly nested in a dict or list), its records are JSON-encoded and
+        written out in chunks of response_chunk_size bytes as they are yielded.
+        """
+
         # Increment the active count so that the parent process won't be killed before this function returns
         with self.active_count.get_lock():
             self.active_count.value += 1
@@ -215,6 +257,20 @@ class WebServer(object):
             # Log file is a shared resource - write within the lock
             LOG.info('%s-%s %s (%s:%s %s)', environ['REQUEST_SCHEME'], environ['REQUEST_METHOD'], environ['REQUEST_URI'], environ['REMOTE_ADDR'], environ['REMOTE_PORT'], agent)
 
+        # Bring the inventory image of this process up to date
+        try:
+            self._apply_updates()
+        except:
+            LOG.error('Failed to apply inventory updates in web server process %d.', os.getpid())
+            self._retire()
+
+            start_response('503 Service Unavailable', [('Content-Type', 'text/plain')])
+            with self.active_count.get_lock():
+                self.active_count.value -= 1
+
+            yield 'Web server is being updated. Please try again in a few moments.\n'
+            return
+
         # Then immediately switch to logging to a buffer
         root_logger = logging.getLogger()
         stream = cStringIO.StringIO()
@@ -229,6 +285,9 @@ class WebServer(object):
         sys.stdout = stream
         sys.stderr = stream
 
+        start_time = time.time()
+        response_size = 0
+
         try:
             self.code = 200 # HTTP response code
             self.content_type = 'application/json' # content type string
@@ -258,6 +317,7 @@ class WebServer(object):
                     if type(content) is not dict:
                         self.code == 500
                         status = 'Internal Server Error'
+                        body = [json.dumps(content)]
                     else:
                         url = '%s://%s' % (environ['REQUEST_SCHEME'], environ['HTTP_HOST'])
                         if (environ['REQUEST_SCHEME'] == 'http' and environ['SERVER_PORT'] != '80') or \
@@ -270,31 +330,45 @@ class WebServer(object):
                                                 'request_url': url, 'request_version': '2.2.1'}}
                         json_data['phedex'].update(content)
     
-                        content = json.dumps(json_data)
+                        body = jsonstream.iterencode(json_data, self.chunk_size)
 
                 else:
                     json_data = {'result': status, 'message': self.message}
                     if content is not None:
                         json_data['data'] = content
-    
-                    # replace content with the json string
-                    start = time.time()
+
+                    body = jsonstream.iterencode(json_data, self.chunk_size)
                     if self.callback is not None:
-                        LOG.info("Callback is not None")
-                        LOG.info(json_data)
-                        content = '%s(%s)' % (self.callback, json.dumps(json_data))
-                    else:
-                        LOG.info("Callback is None")
-                        LOG.info(json_data)
-                        content = json.dumps(json_data)
+                        body = itertools.chain([self.callback + '('], body, [')'])
 
-                    root_logger.info('Make JSON: %s seconds', time.time() - start)
+            elif type(content) is types.GeneratorType:
+                body = content
+
+            else:
+                body = [content]
 
             headers = [('Content-Type', self.content_type)] + self.headers
 
             start_response('%d %s' % (self.code, status), headers)
 
-            return content + '\n'
+            # The module code behind generators runs here; errors after this point cannot change the response code
+            # and result in a truncated response.
+            for chunk in itertools.chain(body, ['\n']):
+                response_size += len(chunk)
+                yield chunk
+
+        except GeneratorExit:
+            # Client went away
+            LOG.warning('Response interrupted after %d bytes.', response_size)
+            raise
+
+        except:
+            if response_size == 0:
+                raise
+
+            LOG.error('Exception while sending the response; response truncated after %d bytes.', response_size)
+            exc_type, exc, tb = sys.exc_info()
+            LOG.error('%s: %s\n%s', exc_type.__name__, str(exc), ''.join(traceback.format_tb(tb)))
 
         finally:
             sys.stdout = stdout
@@ -303,17 +377,50 @@ class WebServer(object):
             root_logger.handlers.pop()
             root_logger.addHandler(original_handler)
 
+            summary = '%d bytes in %.2f seconds' % (response_size, time.time() - start_time)
+
             delim = '--------------'
             log_tmp = stream.getvalue().strip()
             if len(log_tmp) == 0:
-                log = 'empty log'
+                log = '%s, empty log' % summary
             else:
-                log = 'return:\n%s\n%s%s' % (delim, ''.join('  %s\n' % line for line in log_tmp.split('\n')), delim)
+                log = '%s, return:\n%s\n%s%s' % (summary, delim, ''.join('  %s\n' % line for line in log_tmp.split('\n')), delim)
 
             with self.active_count.get_lock():
                 LOG.info('%s-%s %s (%s:%s) %s', environ['REQUEST_SCHEME'], environ['REQUEST_METHOD'], environ['REQUEST_URI'], environ['REMOTE_ADDR'], environ['REMOTE_PORT'], log)
                 self.active_count.value -= 1
 
+    def _apply_updates(self):
+        """
+        Apply the updates in the journal not yet seen by this process to its copy of the inventory.
+        """
+
+        num_commands = self.journal.apply(self.dynamo_server.inventory)
+        if num_commands != 0:
+            LOG.debug('Web server process %d applied %d inventory updates.', os.getpid(), num_commands)
+
+    def _update_before_fork(self):
+        """
+        Called in the master process of the WSGI server before it forks a child. The child inherits the
+        inventory image and the journal position of the master, and therefore only replays the updates
+        published after its creation. On failure the position is not advanced and the child replays the
+        updates itself.
+        """
+
+        try:
+            self._apply_updates()
+        except:
+            LOG.error('Failed to apply inventory updates in web server master process %d.', os.getpid())
+            log_exception(LOG)
+
+    def _retire(self):
+        """
+        Make this child process exit after the current request.
+        """
+
+        # flup preforkserver child loop exits when the request count reaches _maxRequests
+        self.wsgi_server._maxRequests = 1
+
     def _main(self, environ):
         """
         Body of the WSGI callable. Steps:
@@ -419,8 +526,8 @@ class WebServer(object):
 
             try:
                 if self.dynamo_server.manager.master.inhibit_write():
-                    # We need to give up here instead of waiting, because the web server processes will be flushed out as soon as
-                    # inventory is updated after the current writing process is done
+                    # We need to give up here instead of waiting, because the inventory image of this process would change
+                    # under the module once the current writing process is done
                     self.code = 503
                     self.message = 'Server cannot execute %s/%s at the moment because the inventory is being updated.' % (module, command)
                     return
@@ -465,8 +572,6 @@ class WebServer(object):
 
                 # Even though our default content type is URL form, we check if this is a JSON
                 try:
-                    LOG.info("Printing post_data")
-                    LOG.info(post_data)
                     json_data = json.loads(post_data)
                 except:
                     if content_type == 'application/json':
@@ -480,8 +585,6 @@ class WebServer(object):
 
                 if content_type == 'application/x-www-form-urlencoded':
                     try:
-                        LOG.info("Printing post_data 2")
-                        LOG.info(post_data)
                         post_request = parse_qs(post_data)
                     except:
                         self.code = 400
@@ -517,9 +620,16 @@ class WebServer(object):
             caller = WebServer.User(user, dn, user_id, authlist)
 
             if self.dynamo_server.inventory.loaded:
-                inventory = self.dynamo_server.inventory.create_proxy()
                 if provider.write_enabled:
+                    inventory = self.dynamo_server.inventory.create_proxy()
                     inventory._update_commands = []
+                    # The module modifies the inventory image of this process
+                    self._retire()
+                else:
+                    inventory = ReadOnlyInventoryProxy(self.dynamo_server.inventory)
+                    if not provider.side_effect_free:
+                        # Changes the module makes to the objects would be seen by the later requests of this process
+                        self._retire()
             else:
                 inventory = DummyInventory()
 
@@ -566,6 +676,20 @@ class WebServer(object):
 
         return response
 
+class PreforkWSGIServer(WSGIServer):
+    """
+    flup preforking WSGI server that calls a function in the master process before forking each child.
+    """
+
+    def __init__(self, application, before_fork, **kwargs):
+        WSGIServer.__init__(self, application, **kwargs)
+
+        self._before_fork = before_fork
+
+    def _spawnChild(self, sock): #override
+        self._before_fork()
+        return WSGIServer._spawnChild(self, sock)
+
 class DummyInventory(object):
     """
     Inventory placeholder that just throws a 503. To be used when inventory is not loaded yet.
@@ -0,0 +1,15 @@
+CREATE TABLE `standalone_link_stats` (
+  `optype` enum('transfer','deletion') CHARACTER SET latin1 COLLATE latin1_general_ci NOT NULL,
+  `source` varchar(32) CHARACTER SET latin1 COLLATE latin1_general_ci NOT NULL,
+  `destination` varchar(32) CHARACTER SET latin1 COLLATE latin1_general_ci NOT NULL DEFAULT '',
+  `slots` smallint(5) unsigned NOT NULL,
+  `queued` int(10) unsigned NOT NULL DEFAULT '0',
+  `in_flight` smallint(5) unsigned NOT NULL DEFAULT '0',
+  `throughput` float NOT NULL DEFAULT '0',
+  `latency` float NOT NULL DEFAULT '0',
+  `error_rate` float NOT NULL DEFAULT '0',
+  `num_done` int(10) unsigned NOT NULL DEFAULT '0',
+  `num_failed` int(10) unsigned NOT NULL DEFAULT '0',
+  `last_update` datetime NOT NULL,
+  PRIMARY KEY (`optype`,`source`,`destination`)
+) ENGINE=MyISAM DEFAULT CHARSET=latin1 COLLATE=latin1_general_cs;
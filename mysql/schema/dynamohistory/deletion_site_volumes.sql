@@ -0,0 +1,9 @@
+CREATE TABLE `deletion_site_volumes` (
+  `cycle_id` int(10) NOT NULL,
+  `site_id` int(10) unsigned NOT NULL,
+  `decision` enum('delete','keep','protect') CHARACTER SET latin1 COLLATE latin1_general_ci NOT NULL,
+  `num_replicas` int(10) unsigned NOT NULL,
+  `volume` bigint(20) unsigned NOT NULL,
+  PRIMARY KEY (`cycle_id`,`site_id`,`decision`),
+  KEY `site_cycle` (`site_id`,`cycle_id`)
+) ENGINE=MyISAM DEFAULT CHARSET=latin1;
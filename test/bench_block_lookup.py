@@ -0,0 +1,75 @@
+#! /usr/bin/env python
+
+"""
+Benchmark of the block and file lookups. Embeds the blocks and block replicas of a large dataset into
+an inventory (each embed_into looks the block up by name), then looks up every file of a large block.
+The lookups are compared with a linear scan over the same sets.
+"""
+
+import sys
+import time
+from argparse import ArgumentParser
+
+parser = ArgumentParser(description = 'Benchmark block and file lookups')
+parser.add_argument('--blocks', '-b', metavar = 'N', dest = 'num_blocks', type = int, default = 10000, help = 'Number of blocks in the dataset.')
+parser.add_argument('--files', '-f', metavar = 'N', dest = 'num_files', type = int, default = 10000, help = 'Number of files in the block.')
+
+args = parser.parse_args()
+sys.argv = []
+
+import dynamo.dataformat as df
+from dynamo.core.inventory import ObjectRepository
+
+inventory = ObjectRepository()
+
+group = inventory.update(df.Group('AnalysisOps', 'Dataset'))
+site = inventory.update(df.Site('T2_XX_Site', status = df.Site.STAT_READY))
+dataset = inventory.update(df.Dataset('/Primary/Processed-v1/AODSIM'))
+inventory.update(df.DatasetReplica(dataset, site))
+
+block_names = ['%08x-0000-0000-0000-%012x' % (0, iblock) for iblock in xrange(args.num_blocks)]
+
+print 'Embedding %d blocks and block replicas of one dataset' % args.num_blocks
+
+t0 = time.time()
+for name in block_names:
+    inventory.update(df.Block(name, dataset.name, 1000000000, 10, False, 0, 0, False))
+t_blocks = time.time() - t0
+
+t0 = time.time()
+for name in block_names:
+    inventory.update(df.BlockReplica(df.Block.to_full_name(dataset.name, name), site.name, group.name, size = -1))
+t_replicas = time.time() - t0
+
+internal_names = [df.Block.to_internal_name(name) for name in block_names]
+
+t0 = time.time()
+for name in internal_names:
+    dataset.find_block(name)
+t_find = time.time() - t0
+
+num_scan = min(len(internal_names), 1000)
+t0 = time.time()
+for name in internal_names[:num_scan]:
+    next(b for b in dataset.blocks if b.name == name)
+t_scan = (time.time() - t0) * len(internal_names) / num_scan
+
+block = dataset.find_block(internal_names[0])
+block._files = set(df.File('/store/data/file%d.root' % ifile, block, size = 100) for ifile in xrange(args.num_files))
+lfns = [f.lfn for f in block._files]
+
+t0 = time.time()
+for lfn in lfns:
+    block.find_file(lfn)
+t_find_file = time.time() - t0
+
+num_scan = min(len(lfns), 1000)
+t0 = time.time()
+for lfn in lfns[:num_scan]:
+    next(f for f in block.files if f.lfn == lfn)
+t_scan_file = (time.time() - t0) * len(lfns) / num_scan
+
+print '%-30s %10.3f s' % ('embed blocks', t_blocks)
+print '%-30s %10.3f s' % ('embed block replicas', t_replicas)
+print '%-30s %10.3f s (linear scan %.3f s)' % ('find %d blocks' % len(internal_names), t_find, t_scan)
+print '%-30s %10.3f s (linear scan %.3f s)' % ('find %d files' % len(lfns), t_find_file, t_scan_file)
@@ -0,0 +1,112 @@
+#! /usr/bin/env python
+
+"""
+Benchmark of the memory held by the file ids of incomplete block replicas. Creates block replicas with
+random subsets of the files of their blocks, once with the file ids in tuples of long integers (as loaded
+by older versions) and once in the packed arrays, and reports the growth of the resident memory and the
+time of replica comparisons. Each measurement runs in a forked child. File ids are long integers as returned
+by MySQLdb. Linux only (reads /proc/self/statm). Correctness of the packed storage is covered by
+test_blockreplica.py.
+"""
+
+import os
+import sys
+import gc
+import time
+import random
+import marshal
+from argparse import ArgumentParser
+
+parser = ArgumentParser(description = 'Benchmark block replica file id storage')
+parser.add_argument('--replicas', '-n', metavar = 'N', dest = 'num_replicas', type = int, default = 50000, help = 'Number of incomplete block replicas.')
+parser.add_argument('--files', '-f', metavar = 'N', dest = 'num_files', type = int, default = 200, help = 'Maximum number of files per block.')
+
+args = parser.parse_args()
+sys.argv = []
+
+import dynamo.dataformat as df
+
+random.seed(12345)
+
+page_size = os.sysconf('SC_PAGE_SIZE')
+
+def resident():
+    with open('/proc/self/statm') as source:
+        return int(source.read().split()[1]) * page_size
+
+dataset = df.Dataset('/Primary/Processed-v1/AODSIM')
+site = df.Site('T2_XX_Site')
+
+replicas = []
+file_id_lists = []
+next_id = 1
+for irep in xrange(args.num_replicas):
+    num_files = random.randint(2, args.num_files)
+    block = df.Block(df.Block.to_internal_name('%08x-0000-0000-0000-000000000000' % irep), dataset, size = num_files, num_files = num_files, bid = irep + 1)
+    # stored as (first id, number of files, chosen offsets) to keep the generator footprint small
+    chosen = sorted(random.sample(xrange(num_files), random.randint(1, num_files - 1)))
+    file_id_lists.append((next_id, chosen))
+    next_id += num_files
+    replicas.append(df.BlockReplica(block, site, None, size = 0))
+
+num_ids = sum(len(chosen) for _, chosen in file_id_lists)
+print 'Generated %d incomplete block replicas with %d file ids in total' % (args.num_replicas, num_ids)
+
+def fill(packed):
+    gc.collect()
+    before = resident()
+    t0 = time.time()
+    for replica, (first_id, chosen) in zip(replicas, file_id_lists):
+        file_ids = [long(first_id + offset) for offset in chosen]
+        if packed:
+            replica.file_ids = file_ids
+        else:
+            # bypass the packing as in older versions
+            replica._file_ids = tuple(file_ids)
+
+    elapsed = time.time() - t0
+    gc.collect()
+    return resident() - before, elapsed
+
+def compare(packed):
+    clones = []
+    for replica in replicas[:10000]:
+        clone = df.BlockReplica(replica.block, site, None, size = 0)
+        if packed:
+            clone.file_ids = list(replica.file_ids)
+        else:
+            clone._file_ids = tuple(reversed(replica.file_ids))
+        clones.append(clone)
+
+    t0 = time.time()
+    for replica, clone in zip(replicas, clones):
+        replica == clone
+
+    return time.time() - t0
+
+def run_child(packed):
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        growth, elapsed = fill(packed)
+        t_compare = compare(packed)
+        os.write(write_fd, marshal.dumps((growth, elapsed, t_compare)))
+        os._exit(0)
+
+    os.close(write_fd)
+    data = ''
+    while True:
+        chunk = os.read(read_fd, 4096)
+        if not chunk:
+            break
+        data += chunk
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+
+    return marshal.loads(data)
+
+print '%-8s %15s %15s %15s %15s' % ('storage', 'memory (MB)', 'bytes per id', 'fill (s)', 'compare (ms)')
+for packed, label in [(False, 'tuple'), (True, 'array')]:
+    growth, elapsed, t_compare = run_child(packed)
+    print '%-8s %15.1f %15.1f %15.2f %15.2f' % (label, growth * 1.e-6, float(growth) / num_ids, elapsed, t_compare * 1.e+3)
@@ -0,0 +1,210 @@
+#! /usr/bin/env python
+
+"""
+Benchmark of the memory growth of subprocesses forked from a server holding the inventory, with and without
+the gc.collect() that the server runs after loading the inventory (see DynamoServer.run). Writes a snapshot
+of random datasets, blocks, and block replicas and loads it into an ObjectRepository as the server does, then
+forks children that access the inventory. Each child reports the growth of its RSS and of the unshared part
+of the RSS (pages copied from the parent or newly allocated). Children are first forked before the
+collection, then after it.
+Objects that the loading promoted to the oldest GC generation and freed count toward the next full collection.
+Without the collection, children that allocate reach it sooner, and a full collection writes to every
+inherited object. The benchmark also reports how many records a child allocates before its first full
+collection.
+Does not require a running Dynamo server. Linux only (reads /proc/self/status and /proc/self/smaps).
+"""
+
+import os
+import sys
+import gc
+import time
+import random
+import marshal
+import tempfile
+from argparse import ArgumentParser
+
+parser = ArgumentParser(description = 'Benchmark memory growth of forked subprocesses')
+parser.add_argument('--datasets', '-n', metavar = 'N', dest = 'num_datasets', type = int, default = 20000, help = 'Number of datasets.')
+parser.add_argument('--sites', '-s', metavar = 'N', dest = 'num_sites', type = int, default = 50, help = 'Number of sites.')
+parser.add_argument('--children', '-c', metavar = 'N', dest = 'num_children', type = int, default = 3, help = 'Number of children per access pattern.')
+
+args = parser.parse_args()
+sys.argv = []
+
+import dynamo.dataformat as df
+from dynamo.core.inventory import ObjectRepository
+from dynamo.core.statcube import InventoryStatCube
+import dynamo.core.snapshot as snapshot
+
+def make_repository():
+    repository = ObjectRepository()
+
+    groups = [repository.update(df.Group(name)) for name in ['AnalysisOps', 'DataOps']]
+    sites = [repository.update(df.Site('T2_XX_Site%d' % isite, status = df.Site.STAT_READY)) for isite in xrange(args.num_sites)]
+
+    for idataset in xrange(args.num_datasets):
+        dataset = repository.update(df.Dataset('/Primary%d/Processed-v1/AODSIM' % idataset, status = 'valid', data_type = 'mc', software_version = ('CMSSW_9_4_0', '')))
+        replica_sites = random.sample(sites, random.randint(1, 4))
+        for site in replica_sites:
+            repository.update(df.DatasetReplica(dataset, site))
+
+        for iblock in xrange(random.randint(1, 10)):
+            block = repository.update(df.Block(df.Block.to_internal_name('%08x-0000-0000-0000-%012x' % (idataset, iblock)), dataset.name, random.randint(1, 100) * 1000000000, 10, False, 0, 0, False))
+            for site in replica_sites:
+                repository.update(df.BlockReplica(block, site, random.choice(groups), size = -1))
+
+    return repository
+
+random.seed(12345)
+
+snapshot_path = tempfile.mktemp()
+snapshot.write(make_repository(), snapshot_path, 'bench')
+# start from a clean state, as a new server process
+gc.collect()
+
+t0 = time.time()
+# as DynamoInventory.load_snapshot
+inventory = ObjectRepository()
+snapshot.load(inventory, snapshot_path)
+for objects in [inventory.groups, inventory.sites, inventory.datasets, inventory.partitions]:
+    objects.build_index()
+inventory.stat_cube = InventoryStatCube()
+inventory.stat_cube.build(inventory)
+
+print 'Loaded %d datasets in %.2f s' % (len(inventory.datasets), time.time() - t0)
+
+os.unlink(snapshot_path)
+
+def memory():
+    """
+    @return (RSS, unshared RSS) of this process in kB.
+    """
+
+    with open('/proc/self/status') as source:
+        for line in source:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1])
+                break
+
+    try:
+        source = open('/proc/self/smaps_rollup')
+    except IOError:
+        source = open('/proc/self/smaps')
+
+    unshared = 0
+    with source:
+        for line in source:
+            if line.startswith('Private_Dirty:') or line.startswith('Private_Clean:'):
+                unshared += int(line.split()[1])
+
+    return rss, unshared
+
+def noop():
+    # baseline: fork only
+    return None
+
+def site_scan():
+    # e.g. a web request listing the replicas of one site
+    rows = []
+    for replica in inventory.sites['T2_XX_Site1'].dataset_replicas():
+        for block_replica in replica.block_replicas:
+            rows.append((block_replica.block.full_name(), block_replica.size))
+
+    return rows
+
+def full_scan():
+    # e.g. an application building a summary of all replicas
+    rows = []
+    for dataset in inventory.datasets.itervalues():
+        for replica in dataset.replicas:
+            rows.append((dataset.name, replica.site.name, replica.size()))
+
+    return rows
+
+def partial_records():
+    # e.g. a web request listing the block replicas of a quarter of the datasets
+    records = []
+    for idataset, dataset in enumerate(inventory.datasets.itervalues()):
+        if idataset % 4 != 0:
+            continue
+        for replica in dataset.replicas:
+            for block_replica in replica.block_replicas:
+                records.append([block_replica.block.name, replica.site.name, block_replica.size])
+
+    return records
+
+def full_records():
+    # e.g. an application keeping a record per block replica; allocates enough containers to trigger
+    # full collections of the cyclic GC (lists are always tracked, unlike dicts of atomic values)
+    records = []
+    for dataset in inventory.datasets.itervalues():
+        for replica in dataset.replicas:
+            for block_replica in replica.block_replicas:
+                records.append([block_replica.block.name, replica.site.name, block_replica.size])
+
+    return records
+
+def first_full_collection():
+    """
+    @return Number of records allocated before the first full collection (reset of the generation 2 count).
+    """
+
+    records = []
+    last_count = gc.get_count()[2]
+    while len(records) < 10000000:
+        records.append([len(records)])
+        count = gc.get_count()[2]
+        if count < last_count:
+            break
+        last_count = count
+
+    return len(records)
+
+def run_child(access):
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        rss, unshared = memory()
+        t0 = time.time()
+        # keep the result in memory until the measurement
+        result = access()
+        elapsed = time.time() - t0
+        new_rss, new_unshared = memory()
+        if type(result) is not int:
+            result = None
+        os.write(write_fd, marshal.dumps((new_rss - rss, new_unshared - unshared, elapsed, result)))
+        os._exit(0)
+
+    os.close(write_fd)
+    data = ''
+    while True:
+        chunk = os.read(read_fd, 4096)
+        if not chunk:
+            break
+        data += chunk
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+
+    return marshal.loads(data)
+
+def run_children(label):
+    print 'Parent (%s): RSS %.1f MB, GC counts %s' % (label, memory()[0] * 1.e-3, gc.get_count())
+    print '%-18s %-15s %16s %22s %10s' % ('parent', 'access', 'RSS growth (MB)', 'unshared growth (MB)', 'time (s)')
+    for access in [noop, site_scan, full_scan, partial_records, full_records]:
+        results = [run_child(access) for _ in xrange(args.num_children)]
+        rss = sum(r[0] for r in results) / len(results)
+        unshared = sum(r[1] for r in results) / len(results)
+        elapsed = sum(r[2] for r in results) / len(results)
+        print '%-18s %-15s %16.1f %22.1f %10.2f' % (label, access.__name__, rss * 1.e-3, unshared * 1.e-3, elapsed)
+
+    num_records = run_child(first_full_collection)[3]
+    print 'First full collection in a child after allocating %d records' % num_records
+
+run_children('no gc.collect()')
+
+t0 = time.time()
+gc.collect()
+print 'gc.collect() took %.2f s' % (time.time() - t0)
+
+run_children('gc.collect()')
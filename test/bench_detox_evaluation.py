@@ -0,0 +1,174 @@
+#! /usr/bin/env python
+
+"""
+Benchmark of the Detox policy evaluation phase. Evaluates a policy stack against all replicas of a
+synthetic partition, line by line and through the compiled evaluation plan with and without the
+columnar snapshot (DetoxPolicy.use_columns). With --profile, also prints where the time of the first pass of each path goes.
+test_detoxpolicy.py checks that the paths give the same decisions.
+"""
+
+import sys
+import time
+import cProfile
+import pstats
+import random
+import tempfile
+from argparse import ArgumentParser
+
+parser = ArgumentParser(description = 'Benchmark detox policy evaluation')
+parser.add_argument('--datasets', '-n', metavar = 'N', dest = 'num_datasets', type = int, default = 100000, help = 'Number of datasets.')
+parser.add_argument('--sites', '-s', metavar = 'N', dest = 'num_sites', type = int, default = 60, help = 'Number of sites.')
+parser.add_argument('--seed', metavar = 'N', dest = 'seed', type = int, default = 1, help = 'Random seed.')
+parser.add_argument('--profile', metavar = 'N', dest = 'profile', type = int, default = 0, help = 'Profile the first pass of each path and print the N functions with the largest own time.')
+
+args = parser.parse_args()
+sys.argv = []
+
+import dynamo.dataformat as df
+from dynamo.core.inventory import ObjectRepository
+from dynamo.detox.detoxpolicy import DetoxPolicy
+import dynamo.policy.columnar as columnar
+from dynamo.dataformat import Configuration
+
+POLICY = '''
+Partition AnalysisOps
+On site.name == T2_*
+When site.occupancy > 0.9
+Until site.occupancy < 0.85
+Protect replica.incomplete
+Protect blockreplica.is_last_transfer_source
+ProtectBlock blockreplica.owner == DataOps
+Protect dataset.name == /*/*/RAW
+Dismiss dataset.status == INVALID
+Dismiss dataset.status == DEPRECATED and dataset.num_full_disk_copy > 1
+Protect dataset.num_full_disk_copy == 1
+Dismiss replica.num_full_disk_copy_common_owner > 2 and blockreplica.num_full_disk_copy > 2
+Dismiss dataset.on_tape == FULL and replica.num_full_disk_copy_common_owner > 1
+Protect replica.num_full_disk_copy_common_owner == 1 and blockreplica.num_full_disk_copy < 3
+Dismiss blockreplica.on_tape and replica.num_full_other_copy_common_owner > 0
+Dismiss
+Order increasing replica.first_block_created
+'''
+
+class Partition(object):
+    def match(self, replica):
+        return True
+
+def make_repository(num_datasets, num_sites):
+    repository = ObjectRepository()
+
+    groups = [df.Group('AnalysisOps', 'Dataset'), df.Group('DataOps', 'Block')]
+    for group in groups:
+        repository.groups.add(group)
+
+    partition = df.Partition('AnalysisOps', Partition())
+    repository.partitions.add(partition)
+
+    sites = []
+    for isite in xrange(num_sites):
+        if isite < 5:
+            site = df.Site('T1_XX_Site%d_MSS' % isite, storage_type = df.Site.TYPE_MSS, status = df.Site.STAT_READY)
+        else:
+            site = df.Site('T2_XX_Site%d' % isite, status = df.Site.STAT_READY)
+        repository.sites.add(site)
+        site.partitions[partition] = df.SitePartition(site, partition, 1.e+15)
+        sites.append(site)
+
+    statuses = [df.Dataset.STAT_VALID] * 8 + [df.Dataset.STAT_INVALID, df.Dataset.STAT_DEPRECATED]
+    tiers = ['AODSIM'] * 6 + ['MINIAODSIM'] * 3 + ['RAW']
+
+    for idataset in xrange(num_datasets):
+        dataset = df.Dataset('/Primary%d/Processed-v1/%s' % (idataset, random.choice(tiers)), status = random.choice(statuses))
+        repository.datasets.add(dataset)
+
+        for iblock in xrange(random.randint(1, 20)):
+            block = df.Block('%08x-0000-0000-0000-%012x' % (idataset, iblock), dataset, size = random.randint(1, 100) * 1000000000, num_files = 10)
+            dataset.blocks.add(block)
+
+        for site in random.sample(sites, random.randint(1, 6)):
+            replica = df.DatasetReplica(dataset, site)
+            dataset.replicas.add(replica)
+            site.add_dataset_replica(replica, add_block_replicas = False)
+
+            for block in dataset.blocks:
+                if random.random() < 0.05:
+                    continue
+
+                group = groups[1] if random.random() < 0.1 else groups[0]
+                if random.random() < 0.05:
+                    size = block.size / 2
+                    file_ids = tuple(range(5))
+                else:
+                    size = -1
+                    file_ids = None
+
+                block_replica = df.BlockReplica(block, site, group, size = size, last_update = random.randint(1400000000, 1500000000), file_ids = file_ids)
+                replica.block_replicas.add(block_replica)
+                block.replicas.add(block_replica)
+
+    return repository
+
+def evaluate_all(label):
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    t0 = time.time()
+    for replica in replicas:
+        policy.evaluate(replica)
+    elapsed = time.time() - t0
+
+    if args.profile:
+        profiler.disable()
+        print 'Profile of the %s pass (times include the profiler overhead):' % label
+        pstats.Stats(profiler, stream = sys.stdout).sort_stats('tottime').print_stats(args.profile)
+
+    return elapsed
+
+random.seed(args.seed)
+
+print 'Creating a partition with %d datasets at %d sites' % (args.num_datasets, args.num_sites)
+repository = make_repository(args.num_datasets, args.num_sites)
+replicas = [r for site in repository.sites.itervalues() for r in site.dataset_replicas()]
+
+with tempfile.NamedTemporaryFile() as policy_file:
+    policy_file.write(POLICY)
+    policy_file.flush()
+
+    policy = DetoxPolicy(Configuration(policy_file = policy_file.name, attrs = Configuration()))
+
+print 'Evaluating %d lines against %d replicas' % (len(policy.policy_lines), len(replicas))
+
+policy.plan = None
+t_direct = evaluate_all('line by line')
+
+results = []
+for label, use_columns in [('compiled', False), ('compiled, columnar', True)]:
+    if use_columns and not columnar.available():
+        print 'NumPy is not available; skipping the columnar evaluation'
+        continue
+
+    policy.use_columns = use_columns
+
+    t0 = time.time()
+    policy.compile_plan(replicas)
+    t_compile = time.time() - t0
+
+    t_compiled = evaluate_all(label)
+
+    # second pass over the same plan, as in the subsequent detox iterations
+    t0 = time.time()
+    for replica in replicas:
+        policy.evaluate(replica)
+    t_memoized = time.time() - t0
+
+    results.append((label, t_compile, t_compiled, t_memoized))
+
+print '%-20s %12s %12s %12s %12s' % ('path', 'compile (s)', 'pass 1 (s)', 'pass 2 (s)', 'total (s)')
+print '%-20s %12s %12.2f %12s %12.2f' % ('line by line', '-', t_direct, '-', t_direct)
+for label, t_compile, t_compiled, t_memoized in results:
+    print '%-20s %12.2f %12.2f %12.2f %12.2f' % (label, t_compile, t_compiled, t_memoized, t_compile + t_compiled + t_memoized)
+
+if len(results) == 2:
+    # plan with and without use_columns
+    print 'use_columns: compile + pass 1 %.2fx, total %.2fx' % ((results[0][1] + results[0][2]) / (results[1][1] + results[1][2]), sum(results[0][1:]) / sum(results[1][1:]))
@@ -0,0 +1,118 @@
+#! /usr/bin/env python
+
+"""
+Benchmark of the detox cycle snapshots. Generates random deletion decisions and writes them both as a
+columnar snapshot (with the streamed xz archive copy) and as the SQLite file compressed in one piece that
+older versions wrote after staging the decisions in MySQL. Then reads the per-site summary and the decisions
+of one site from the columnar snapshot, and compares the snapshot with that of a cycle where a fraction of the
+decisions changed. The MySQL stages of the old writer and of the old cache fill are not included.
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import sqlite3
+import tempfile
+from argparse import ArgumentParser
+
+parser = ArgumentParser(description = 'Benchmark detox cycle snapshots')
+parser.add_argument('--replicas', '-n', metavar = 'N', dest = 'num_replicas', type = int, default = 500000, help = 'Number of replica decisions.')
+parser.add_argument('--sites', '-s', metavar = 'N', dest = 'num_sites', type = int, default = 50, help = 'Number of sites.')
+parser.add_argument('--changes', '-c', metavar = 'N', dest = 'num_changes', type = int, default = 10000, help = 'Number of decisions changed in the next cycle.')
+
+args = parser.parse_args()
+sys.argv = []
+
+import lzma
+
+import dynamo.detox.cyclesnapshot as cyclesnapshot
+
+random.seed(12345)
+
+sites = [(isite + 1, 1, random.randint(100, 2000)) for isite in xrange(args.num_sites)]
+
+replicas = []
+for irep in xrange(args.num_replicas):
+    replicas.append((random.randint(1, args.num_sites), irep + 1, random.randint(1, 100) * 1000000000, random.choice(cyclesnapshot.DECISIONS), random.randint(1, 30)))
+
+workdir = tempfile.mkdtemp(prefix = 'dynamo_detox_')
+
+try:
+    ## Columnar snapshot
+    path = workdir + '/snapshot.dyd'
+    t0 = time.time()
+    cyclesnapshot.write(path, path + '.xz', list(replicas), sites)
+    t_write = time.time() - t0
+
+    print 'Columnar: wrote %.1f MB (%.1f MB xz) in %.2f s' % (os.path.getsize(path) * 1.e-6, os.path.getsize(path + '.xz') * 1.e-6, t_write)
+
+    os.unlink(path)
+    t0 = time.time()
+    cyclesnapshot.decompress(path + '.xz', path)
+    print 'Columnar: restored from the archive in %.2f s' % (time.time() - t0)
+
+    t0 = time.time()
+    snapshot = cyclesnapshot.CycleSnapshot(path)
+    summary = snapshot.site_summary()
+    t_summary = time.time() - t0
+
+    t0 = time.time()
+    site_rows = snapshot.site_replicas(1)
+    t_site = time.time() - t0
+
+    t0 = time.time()
+    num_rows = sum(1 for _ in snapshot.replicas())
+    t_scan = time.time() - t0
+    snapshot.close()
+
+    print 'Columnar: site summary in %.2f ms, one site (%d rows) in %.2f ms, full scan (%d rows) in %.2f s' % (t_summary * 1.e+3, len(site_rows), t_site * 1.e+3, num_rows, t_scan)
+
+    ## Diff with the next cycle
+    next_replicas = list(replicas)
+    for irep in random.sample(xrange(len(next_replicas)), args.num_changes):
+        site_id, dataset_id, size, decision, condition_id = next_replicas[irep]
+        next_replicas[irep] = (site_id, dataset_id, size, random.choice([d for d in cyclesnapshot.DECISIONS if d != decision]), condition_id)
+
+    next_path = workdir + '/next_snapshot.dyd'
+    cyclesnapshot.write(next_path, None, next_replicas, sites)
+
+    snapshot = cyclesnapshot.CycleSnapshot(path)
+    next_snapshot = cyclesnapshot.CycleSnapshot(next_path)
+
+    t0 = time.time()
+    num_diff = sum(1 for _ in cyclesnapshot.diff(snapshot, next_snapshot))
+    t_diff = time.time() - t0
+
+    t0 = time.time()
+    num_site_diff = sum(1 for _ in cyclesnapshot.diff(snapshot, next_snapshot, [1]))
+    t_site_diff = time.time() - t0
+
+    snapshot.close()
+    next_snapshot.close()
+
+    print 'Columnar: diff over %d changes in %.2f s, %d at one site in %.2f ms' % (num_diff, t_diff, num_site_diff, t_site_diff * 1.e+3)
+
+    ## SQLite file as written by the old save_cycle_state (after the MySQL stages)
+    db_path = workdir + '/snapshot.db'
+    t0 = time.time()
+    snapshot_db = sqlite3.connect(db_path)
+    cursor = snapshot_db.cursor()
+    cursor.execute('CREATE TABLE `decisions` (`id` TINYINT PRIMARY KEY NOT NULL, `value` TEXT NOT NULL)')
+    cursor.executemany('INSERT INTO `decisions` VALUES (?, ?)', [(i + 1, d) for i, d in enumerate(cyclesnapshot.DECISIONS)])
+    cursor.execute('CREATE TABLE `replicas` (`site_id` SMALLINT NOT NULL, `dataset_id` INT NOT NULL, `size` BIGINT NOT NULL, `decision_id` TINYINT NOT NULL REFERENCES `decisions`(`id`), `condition` MEDIUMINT NOT NULL)')
+    cursor.execute('CREATE INDEX `site_dataset` ON `replicas` (`site_id`, `dataset_id`)')
+    for site_id, dataset_id, size, decision, condition_id in replicas:
+        cursor.execute('INSERT INTO `replicas` VALUES (?, ?, ?, ?, ?)', (site_id, dataset_id, size, cyclesnapshot.DECISIONS.index(decision) + 1, condition_id))
+    snapshot_db.commit()
+    snapshot_db.close()
+
+    with open(db_path, 'rb') as db_file:
+        with open(db_path + '.xz', 'wb') as xz_file:
+            xz_file.write(lzma.compress(db_file.read()))
+
+    print 'SQLite:   wrote %.1f MB (%.1f MB xz) in %.2f s' % (os.path.getsize(db_path) * 1.e-6, os.path.getsize(db_path + '.xz') * 1.e-6, time.time() - t0)
+
+finally:
+    shutil.rmtree(workdir)
@@ -0,0 +1,88 @@
+#! /usr/bin/env python
+
+"""
+Benchmark of the FTS job status polling. Serves synthetic jobs from the local FTS stand-in (fts_mock.py)
+and counts pending transfers over several cycles, once with the serial per-job listing used before and
+once through the FTSFileOperation status cache. Requires the FTS3 REST client but no FTS server.
+"""
+
+import sys
+import time
+from argparse import ArgumentParser
+
+parser = ArgumentParser(description = 'Benchmark FTS status polling')
+parser.add_argument('--jobs', '-j', metavar = 'N', dest = 'num_jobs', type = int, default = 500, help = 'Number of active jobs.')
+parser.add_argument('--files', '-f', metavar = 'N', dest = 'num_files', type = int, default = 100, help = 'Number of files per job.')
+parser.add_argument('--latency', '-l', metavar = 'SEC', dest = 'latency', type = float, default = 0.05, help = 'Latency per request.')
+parser.add_argument('--cycles', '-n', metavar = 'N', dest = 'num_cycles', type = int, default = 5, help = 'Number of polling cycles.')
+parser.add_argument('--finish-fraction', metavar = 'F', dest = 'finish_fraction', type = float, default = 0.2, help = 'Fraction of jobs finishing between cycles.')
+parser.add_argument('--threads', '-t', metavar = 'N', dest = 'num_threads', type = int, default = 8, help = 'Number of polling threads.')
+
+args = parser.parse_args()
+sys.argv = []
+
+from fts_mock import MockFTSServer
+
+from dynamo.dataformat import Configuration
+from dynamo.fileop.impl.fts import FTSFileOperation
+
+def make_operation(url):
+    config = Configuration(fts_server = url, db_params = {}, batch_size = 100, keep_context = True,
+        status_poll_threads = args.num_threads, status_poll_interval = 0)
+
+    return FTSFileOperation(config)
+
+def count_serial(operation):
+    # per-job listing of the previous num_pending_transfers
+    num_pending = 0
+    for job in operation._ftscall('list_jobs', state_in = ['SUBMITTED', 'ACTIVE', 'STAGING']):
+        job_info = operation._ftscall('get_job_status', job['job_id'], list_files = True)
+        for file_info in job_info['files']:
+            if file_info['file_state'] in ['SUBMITTED', 'READY', 'ACTIVE', 'STAGING', 'STARTED']:
+                num_pending += 1
+
+    return num_pending
+
+def run(count):
+    """
+    @return ([seconds per cycle], [number of pending files per cycle], number of job polls)
+    """
+
+    server = MockFTSServer(latency = args.latency, job_duration = 1.e+6)
+    created = time.time()
+    for ijob in xrange(args.num_jobs):
+        server.add_job(args.num_files, created = created)
+
+    server.start()
+
+    operation = make_operation(server.url)
+
+    times = []
+    counts = []
+    try:
+        jobs = list(server._jobs.iterkeys())
+        num_finish = int(len(jobs) * args.finish_fraction)
+
+        for icycle in xrange(args.num_cycles):
+            t0 = time.time()
+            counts.append(count(operation))
+            times.append(time.time() - t0)
+
+            # finish some jobs
+            for job_id in jobs[icycle * num_finish:(icycle + 1) * num_finish]:
+                c, t, f, failed = server._jobs[job_id]
+                server._jobs[job_id] = (c - server.job_duration, t, f, failed)
+
+    finally:
+        server.stop()
+
+    return times, counts, server.num_job_polls()
+
+t_serial, c_serial, n_serial = run(count_serial)
+t_cache, c_cache, n_cache = run(lambda op: op.num_pending_transfers())
+
+print '%-10s %12s %12s %12s' % ('cycle', 'pending', 'serial (s)', 'cached (s)')
+for icycle in xrange(args.num_cycles):
+    print '%-10d %12d %12.2f %12.2f' % (icycle, c_cache[icycle], t_serial[icycle], t_cache[icycle])
+
+print 'Total %.2f s with %d job polls (serial), %.2f s with %d job polls (cached)' % (sum(t_serial), n_serial, sum(t_cache), n_cache)
@@ -0,0 +1,147 @@
+#! /usr/bin/env python
+
+"""
+Benchmark of the memory used by application subprocesses. Fills an ObjectRepository with random datasets,
+blocks, and block replicas, writes the inventory image, and forks children that read the inventory either
+through the object graph inherited from the parent or through an ImageInventory. Each child reports the
+private dirty memory it has accumulated (pages copied from the parent or newly allocated) and the elapsed time.
+Children reading the image materialize the objects they visit into their own memory, so the image pays off
+only for applications that visit a small part of the inventory.
+Does not require a running Dynamo server. Linux only (reads /proc/self/smaps).
+"""
+
+import os
+import sys
+import gc
+import time
+import random
+import marshal
+from argparse import ArgumentParser
+
+parser = ArgumentParser(description = 'Benchmark memory of application subprocesses')
+parser.add_argument('--datasets', '-n', metavar = 'N', dest = 'num_datasets', type = int, default = 20000, help = 'Number of datasets.')
+parser.add_argument('--sites', '-s', metavar = 'N', dest = 'num_sites', type = int, default = 50, help = 'Number of sites.')
+parser.add_argument('--image', '-i', metavar = 'PATH', dest = 'image_path', default = '/dev/shm/bench_inventory.image', help = 'Image file path.')
+
+args = parser.parse_args()
+sys.argv = []
+
+import dynamo.dataformat as df
+from dynamo.core.inventory import ObjectRepository, ImageInventory
+from dynamo.core.image import InventoryImage, write
+
+random.seed(12345)
+
+inventory = ObjectRepository()
+
+groups = [inventory.update(df.Group(name)) for name in ['AnalysisOps', 'DataOps']]
+sites = [inventory.update(df.Site('T2_XX_Site%d' % isite, status = df.Site.STAT_READY)) for isite in xrange(args.num_sites)]
+
+t0 = time.time()
+for idataset in xrange(args.num_datasets):
+    dataset = inventory.update(df.Dataset('/Primary%d/Processed-v1/AODSIM' % idataset, status = 'valid', data_type = 'mc', software_version = ('CMSSW_9_4_0', '')))
+    replica_sites = random.sample(sites, random.randint(1, 4))
+    for site in replica_sites:
+        inventory.update(df.DatasetReplica(dataset, site))
+
+    for iblock in xrange(random.randint(1, 10)):
+        block = inventory.update(df.Block(df.Block.to_internal_name('%08x-0000-0000-0000-%012x' % (idataset, iblock)), dataset.name, random.randint(1, 100) * 1000000000, 10, False, 0, 0, False))
+        for site in replica_sites:
+            inventory.update(df.BlockReplica(block, site, random.choice(groups), size = -1))
+
+print 'Generated %d datasets in %.2f s' % (args.num_datasets, time.time() - t0)
+
+t0 = time.time()
+write(inventory, args.image_path, 1)
+print 'Wrote image of %.1f MB in %.2f s' % (os.path.getsize(args.image_path) * 1.e-6, time.time() - t0)
+
+def private_dirty():
+    """
+    @return Private dirty memory of this process in kB.
+    """
+
+    try:
+        source = open('/proc/self/smaps_rollup')
+    except IOError:
+        source = open('/proc/self/smaps')
+
+    total = 0
+    with source:
+        for line in source:
+            if line.startswith('Private_Dirty:'):
+                total += int(line.split()[1])
+
+    return total
+
+def noop(inv):
+    # baseline: fork and image setup
+    return 0
+
+def full_scan(inv):
+    # e.g. a detox-like pass over all replicas
+    total = 0
+    for dataset in inv.datasets.itervalues():
+        for replica in dataset.replicas:
+            for block_replica in replica.block_replicas:
+                total += block_replica.size
+
+    return total
+
+def site_scan(inv):
+    # e.g. a consistency check of one site
+    total = 0
+    for replica in inv.sites['T2_XX_Site1'].dataset_replicas():
+        for block_replica in replica.block_replicas:
+            total += block_replica.size
+
+    return total
+
+def name_lookup(inv):
+    # e.g. a request for a handful of datasets
+    total = 0
+    for name in inv.datasets.match('/Primary12*'):
+        for replica in inv.datasets[name].replicas:
+            total += replica.size()
+
+    return total
+
+def run_child(access, use_image):
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        base = private_dirty()
+        t0 = time.time()
+        if use_image:
+            inv = ImageInventory(inventory, InventoryImage(args.image_path))
+        else:
+            inv = inventory
+        result = access(inv)
+        elapsed = time.time() - t0
+        os.write(write_fd, marshal.dumps((result, private_dirty() - base, elapsed)))
+        os._exit(0)
+
+    os.close(write_fd)
+    data = ''
+    while True:
+        chunk = os.read(read_fd, 4096)
+        if not chunk:
+            break
+        data += chunk
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+
+    return marshal.loads(data)
+
+# as in the server after loading the inventory (see DynamoServer.run)
+gc.collect()
+
+print 'Parent private dirty memory: %.1f MB' % (private_dirty() * 1.e-3)
+print '%-12s %-10s %14s %10s %8s' % ('access', 'source', 'growth (MB)', 'time (s)', 'agree')
+for access in [noop, full_scan, site_scan, name_lookup]:
+    inherited = run_child(access, False)
+    from_image = run_child(access, True)
+    for source, (result, growth, elapsed) in [('inherited', inherited), ('image', from_image)]:
+        print '%-12s %-10s %14.1f %10.2f %8s' % (access.__name__, source, growth * 1.e-3, elapsed, result == inherited[0])
+
+os.unlink(args.image_path)
@@ -0,0 +1,142 @@
+#! /usr/bin/env python
+
+"""
+Benchmark of the inventory restart paths. Writes a synthetic inventory to an on-disk snapshot and loads
+it back. With --config, also loads the inventory of a Dynamo installation from its persistency store and
+compares the load time with the snapshot path. test_snapshot.py checks that the content is restored.
+"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+from argparse import ArgumentParser
+
+parser = ArgumentParser(description = 'Benchmark inventory snapshot')
+parser.add_argument('--datasets', '-n', metavar = 'N', dest = 'num_datasets', type = int, default = 100000, help = 'Number of datasets.')
+parser.add_argument('--sites', '-s', metavar = 'N', dest = 'num_sites', type = int, default = 60, help = 'Number of sites.')
+parser.add_argument('--seed', metavar = 'N', dest = 'seed', type = int, default = 1, help = 'Random seed.')
+parser.add_argument('--config', '-c', metavar = 'PATH', dest = 'config', help = 'Server configuration file. If given, compare with the load from the persistency store.')
+
+args = parser.parse_args()
+sys.argv = []
+
+import dynamo.dataformat as df
+from dynamo.core.inventory import ObjectRepository
+import dynamo.core.snapshot as snapshot
+
+class Partition(object):
+    def match(self, replica):
+        return True
+
+def make_repository(num_datasets, num_sites):
+    repository = ObjectRepository()
+
+    groups = [df.Group('AnalysisOps', 'Dataset'), df.Group('DataOps', 'Block')]
+    for group in groups:
+        repository.groups.add(group)
+
+    partition = df.Partition('AnalysisOps', Partition())
+    repository.partitions.add(partition)
+
+    sites = []
+    for isite in xrange(num_sites):
+        site = df.Site('T2_XX_Site%d' % isite, status = df.Site.STAT_READY, sid = isite + 1)
+        repository.sites.add(site)
+        site.partitions[partition] = df.SitePartition(site, partition, 1.e+15)
+        sites.append(site)
+
+    for idataset in xrange(num_datasets):
+        dataset = df.Dataset('/Primary%d/Processed-v1/AODSIM' % idataset, status = df.Dataset.STAT_VALID, did = idataset + 1)
+        repository.datasets.add(dataset)
+
+        for iblock in xrange(random.randint(1, 20)):
+            block = df.Block('%08x-0000-0000-0000-%012x' % (idataset, iblock), dataset, size = random.randint(1, 100) * 1000000000, num_files = 10, bid = idataset * 20 + iblock + 1)
+            dataset.blocks.add(block)
+
+        for site in random.sample(sites, random.randint(1, 6)):
+            replica = df.DatasetReplica(dataset, site)
+
+            for block in dataset.blocks:
+                if random.random() < 0.05:
+                    continue
+
+                group = groups[1] if random.random() < 0.1 else groups[0]
+                if random.random() < 0.05:
+                    size = block.size / 2
+                    file_ids = tuple(range(5))
+                else:
+                    size = -1
+                    file_ids = None
+
+                block_replica = df.BlockReplica(block, site, group, size = size, last_update = random.randint(1400000000, 1500000000), file_ids = file_ids)
+                replica.block_replicas.add(block_replica)
+                block.replicas.add(block_replica)
+
+            dataset.replicas.add(replica)
+            site.add_dataset_replica(replica, add_block_replicas = True)
+
+    return repository
+
+def time_snapshot(inventory, make_empty, store_version):
+    path = tempfile.mktemp(prefix = 'dynamo_snapshot_')
+
+    try:
+        t0 = time.time()
+        snapshot.write(inventory, path, store_version)
+        t_write = time.time() - t0
+
+        size = os.stat(path).st_size
+
+        loaded = make_empty()
+        t0 = time.time()
+        snapshot.load(loaded, path)
+        t_load = time.time() - t0
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+    return t_write, t_load, size
+
+random.seed(args.seed)
+
+print 'Creating an inventory with %d datasets at %d sites' % (args.num_datasets, args.num_sites)
+repository = make_repository(args.num_datasets, args.num_sites)
+
+def make_empty_repository():
+    empty = ObjectRepository()
+    for partition in repository.partitions.itervalues():
+        empty.partitions.add(df.Partition(partition.name, partition._condition))
+    return empty
+
+t_write, t_load, size = time_snapshot(repository, make_empty_repository, 'synthetic')
+
+print '%-20s %12s %12s %12s' % ('inventory', 'write (s)', 'load (s)', 'size (MB)')
+print '%-20s %12.2f %12.2f %12.1f' % ('synthetic', t_write, t_load, size * 1.e-6)
+
+if args.config:
+    from dynamo.core.inventory import DynamoInventory
+    from dynamo.dataformat import Configuration
+
+    config = Configuration(args.config)
+
+    inventory = DynamoInventory(config.inventory)
+
+    t0 = time.time()
+    store_version = inventory.store_version()
+    t_version = time.time() - t0
+
+    t0 = time.time()
+    inventory.load()
+    t_store = time.time() - t0
+
+    def make_empty_inventory():
+        empty = DynamoInventory(config.inventory)
+        empty._reset()
+        return empty
+
+    t_write, t_load, size = time_snapshot(inventory, make_empty_inventory, store_version)
+
+    print '%-20s %12.2f %12.2f %12.1f' % ('installation', t_write, t_load, size * 1.e-6)
+    print 'Load from the persistency store: %.2f s (+ %.2f s to compute the store version)' % (t_store, t_version)
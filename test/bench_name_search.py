@@ -0,0 +1,87 @@
+#! /usr/bin/env python
+
+"""
+Benchmark of the wildcard name searches of the inventory. Fills the dataset name index of an ObjectRepository
+with CMS-style names (/Primary/Processed-vN/TIER) and runs typical web API patterns through the sorted index
+(NameKeyDict.match) and through the full scan with fnmatch previously done by the web modules. Also measures
+the index maintenance under updates.
+"""
+
+import sys
+import re
+import time
+import random
+import fnmatch
+from argparse import ArgumentParser
+
+parser = ArgumentParser(description = 'Benchmark wildcard name searches')
+parser.add_argument('--datasets', '-n', metavar = 'N', dest = 'num_datasets', type = int, default = 1000000, help = 'Number of dataset names.')
+parser.add_argument('--repeat', '-r', metavar = 'N', dest = 'num_repeat', type = int, default = 5, help = 'Number of searches per pattern.')
+
+args = parser.parse_args()
+sys.argv = []
+
+from dynamo.core.inventory import ObjectRepository
+
+random.seed(12345)
+
+tiers = ['AOD', 'AODSIM', 'MINIAOD', 'MINIAODSIM', 'NANOAOD', 'RAW', 'RECO', 'USER']
+primaries = ['%s%d' % (prefix, i) for prefix in ['ALCA', 'BTag', 'Charmonium', 'DoubleMuon', 'EGamma', 'JetHT', 'MET', 'SingleMuon', 'TTJets', 'WJets', 'ZeroBias'] for i in range(200)]
+campaigns = ['Run2016', 'Run2017', 'Run2018', 'RunIISummer16', 'RunIIFall17', 'RunIIAutumn18', 'Bonzai', 'CRAB3']
+
+inventory = ObjectRepository()
+datasets = inventory.datasets
+
+while len(datasets) < args.num_datasets:
+    name = '/%s/%s%s-v%d/%s' % (random.choice(primaries), random.choice(campaigns), random.choice('ABCDEFGH'), random.randint(1, 4), random.choice(tiers))
+    # values are not used by the search
+    datasets[name] = None
+
+print 'Generated %d dataset names' % len(datasets)
+
+t0 = time.time()
+datasets.build_index()
+print 'Built index in %.2f s' % (time.time() - t0)
+
+patterns = [
+    '/JetHT1*/Run2018*/AOD*',
+    '/DoubleMuon*/*/MINIAOD',
+    '/SingleMuon12/*',
+    '/TTJets1*/RunIIFall17*/*SIM',
+    '/E*/*/NANOAOD',
+    '*/RunIISummer16A-v1/AODSIM',
+    '/ZeroBias19/Run2016B-v2/RAW'
+]
+
+def scan(pattern):
+    regex = re.compile(fnmatch.translate(pattern))
+    return sorted(name for name in datasets.iterkeys() if regex.match(name))
+
+print '%-30s %10s %12s %12s' % ('pattern', 'matches', 'index (ms)', 'scan (ms)')
+for pattern in patterns:
+    t0 = time.time()
+    for _ in xrange(args.num_repeat):
+        matched = datasets.match(pattern)
+    t_index = (time.time() - t0) / args.num_repeat
+
+    t0 = time.time()
+    scan(pattern)
+    t_scan = time.time() - t0
+
+    print '%-30s %10d %12.2f %12.2f' % (pattern, len(matched), t_index * 1.e+3, t_scan * 1.e+3)
+
+## Updates: remove and add names as the server does between two web requests
+names = random.sample(list(datasets.iterkeys()), 10000)
+
+t0 = time.time()
+for name in names:
+    datasets.pop(name)
+for name in names:
+    datasets['/New' + name[1:]] = None
+t_update = time.time() - t0
+
+t0 = time.time()
+matched = datasets.match('/NewJetHT1*/*')
+t_search = time.time() - t0
+
+print 'Updated %d names in %.2f s; first search after the updates %.2f ms' % (len(names) * 2, t_update, t_search * 1.e+3)
@@ -0,0 +1,206 @@
+#! /usr/bin/env python
+
+"""
+Benchmark of the archival of completed file transfer tasks in RLFSM. Creates a synthetic transfer batch
+in the inventory DB with all tasks completed (through the standalone file operation tables), archives it
+with the bulk path (RLFSM._archive_tasks), and compares with the per-task sequence of statements used
+before (one task data SELECT, history lookups, insert_get_id, and a table lock per task), run on a sample
+and extrapolated.
+
+Writes to the inventory and history DBs of the installation given by --config. Use a test installation.
+The synthetic entries are removed at the end.
+"""
+
+import sys
+import time
+import random
+import datetime
+from argparse import ArgumentParser
+
+parser = ArgumentParser(description = 'Benchmark RLFSM task archival')
+parser.add_argument('--config', '-c', metavar = 'PATH', dest = 'config', required = True, help = 'Server configuration file.')
+parser.add_argument('--tasks', '-n', metavar = 'N', dest = 'num_tasks', type = int, default = 50000, help = 'Number of tasks in the batch.')
+parser.add_argument('--reference', '-r', metavar = 'N', dest = 'num_reference', type = int, default = 2000, help = 'Number of tasks archived with the per-task path.')
+parser.add_argument('--failure-rate', metavar = 'F', dest = 'failure_rate', type = float, default = 0.1, help = 'Fraction of failed tasks.')
+
+args = parser.parse_args()
+sys.argv = []
+
+from dynamo.dataformat import Configuration
+from dynamo.fileop.base import FileQuery
+from dynamo.fileop.rlfsm import RLFSM
+from dynamo.fileop.impl.standalone import StandaloneFileOperation
+
+config = Configuration(args.config)
+
+# Set the defaults as the server does for authorized applications
+for key, conf in config.defaults.items():
+    try:
+        myconf = conf['fullauth']
+    except KeyError:
+        try:
+            myconf = conf['all']
+        except KeyError:
+            continue
+
+    modname, clsname = key.split(':')
+    module = __import__('dynamo.' + modname, globals(), locals(), [clsname])
+    getattr(module, clsname).set_default(myconf)
+
+rlfsm = RLFSM()
+query = StandaloneFileOperation(Configuration(db_params = rlfsm.db.config()))
+
+db = rlfsm.db
+history_db = rlfsm.history_db
+
+SOURCE = 'T9_XX_BenchSource'
+DESTINATION = 'T9_XX_BenchDest'
+LFN_PREFIX = '/store/bench/rlfsm/'
+
+def make_batch(num_tasks, offset):
+    """
+    Create a transfer batch of num_tasks completed tasks.
+    @return (batch id, task ids)
+    """
+
+    now = datetime.datetime.now()
+
+    lfns = ['%s%d.root' % (LFN_PREFIX, offset + i) for i in xrange(num_tasks)]
+    db.insert_many('files', ('name', 'size'), lambda lfn: (lfn, 2000000000), lfns)
+    file_ids = db.select_many('files', ('id',), 'name', lfns)
+
+    batch_id = db.insert_get_id('transfer_batches', columns = ('id',), values = (0,))
+
+    db.insert_many('file_subscriptions', ('file_id', 'site_id', 'status', 'created', 'delete'), lambda f: (f, dest_id, 'inbatch', now, 0), file_ids)
+    subscription_ids = db.select_many('file_subscriptions', ('id',), 'file_id', file_ids, ['`site_id` = %d' % dest_id, '`delete` = 0'])
+
+    fields = ('subscription_id', 'source_id', 'batch_id', 'created')
+    task_ids = db.insert_many_get_ids('transfer_tasks', fields, lambda s: (s, source_id, batch_id, now), subscription_ids)
+
+    def standalone_entry(task_id):
+        if random.random() < args.failure_rate:
+            return (task_id, 'srm://source', 'srm://dest', 'failed', 5, 'Transfer failed', now, now)
+        else:
+            return (task_id, 'srm://source', 'srm://dest', 'done', 0, None, now, now)
+
+    fields = ('id', 'source', 'destination', 'status', 'exitcode', 'message', 'start_time', 'finish_time')
+    db.insert_many('standalone_transfer_tasks', fields, standalone_entry, task_ids)
+    db.query('INSERT INTO `standalone_transfer_batches` (`batch_id`, `source_site`, `destination_site`) VALUES (%s, %s, %s)', batch_id, SOURCE, DESTINATION)
+
+    return batch_id
+
+def get_completed(batch_id):
+    completed = {}
+    for task_id, status, exitcode, message, start_time, finish_time in query.get_transfer_status(batch_id):
+        completed[task_id] = (status, exitcode, message, start_time, finish_time)
+
+    return completed
+
+def archive_per_task(batch_id, completed):
+    """
+    Statement sequence of the per-task archival.
+    """
+
+    get_task_data = 'SELECT u.`id`, f.`name`, f.`size`, UNIX_TIMESTAMP(q.`created`), ss.`name`, sd.`name` FROM `transfer_tasks` AS q'
+    get_task_data += ' INNER JOIN `file_subscriptions` AS u ON u.`id` = q.`subscription_id`'
+    get_task_data += ' INNER JOIN `files` AS f ON f.`id` = u.`file_id`'
+    get_task_data += ' INNER JOIN `sites` AS ss ON ss.`id` = q.`source_id`'
+    get_task_data += ' INNER JOIN `sites` AS sd ON sd.`id` = u.`site_id`'
+    get_task_data += ' WHERE q.`id` = %s'
+
+    insert_failure = 'INSERT INTO `failed_transfers` (`id`, `subscription_id`, `source_id`, `exitcode`)'
+    insert_failure += ' SELECT `id`, `subscription_id`, `source_id`, %s FROM `transfer_tasks` WHERE `id` = %s'
+    insert_failure += ' ON DUPLICATE KEY UPDATE `id`=VALUES(`id`)'
+
+    history_fields = ('file_id', 'exitcode', 'message', 'batch_id', 'created', 'started', 'finished', 'completed', 'source_id', 'destination_id')
+
+    for task_id, (status, exitcode, message, start_time, finish_time) in completed.iteritems():
+        subscription_id, lfn, size, create_time, source_name, dest_name = db.query(get_task_data, task_id)[0]
+
+        history_site_ids = (
+            history_db.save_sites([source_name], get_ids = True)[0],
+            history_db.save_sites([dest_name], get_ids = True)[0]
+        )
+        file_id = history_db.save_files([(lfn, size)], get_ids = True)[0]
+
+        values = (file_id, exitcode, message, batch_id, datetime.datetime(*time.localtime(create_time)[:6]),
+            datetime.datetime(*time.localtime(start_time)[:6]), datetime.datetime(*time.localtime(finish_time)[:6]), datetime.datetime.now()) + history_site_ids
+
+        history_db.db.insert_get_id('file_transfers', history_fields, values)
+
+        db.lock_tables(write = ['file_subscriptions'])
+        try:
+            subscription_status = db.query('SELECT `status` FROM `file_subscriptions` WHERE `id` = %s', subscription_id)[0]
+            if subscription_status == 'inbatch':
+                if status == FileQuery.STAT_DONE:
+                    new_status = 'done'
+                else:
+                    new_status = 'retry'
+
+                db.query('UPDATE `file_subscriptions` SET `status` = %s, `last_update` = NOW() WHERE `id` = %s', new_status, subscription_id)
+        finally:
+            db.unlock_tables()
+
+        if status == FileQuery.STAT_DONE:
+            db.query('DELETE FROM `failed_transfers` WHERE `subscription_id` = %s', subscription_id)
+        else:
+            db.query(insert_failure, exitcode, task_id)
+
+        db.query('DELETE FROM `transfer_tasks` WHERE `id` = %s', task_id)
+        query.forget_transfer_status(task_id)
+
+def cleanup(batch_ids):
+    sql = 'DELETE FROM s USING `file_subscriptions` AS s INNER JOIN `files` AS f ON f.`id` = s.`file_id` WHERE f.`name` LIKE %s'
+    db.query(sql, LFN_PREFIX + '%')
+    sql = 'DELETE FROM t USING `failed_transfers` AS t LEFT JOIN `file_subscriptions` AS s ON s.`id` = t.`subscription_id` WHERE s.`id` IS NULL'
+    db.query(sql)
+    db.execute_many('DELETE FROM f USING `standalone_transfer_tasks` AS f INNER JOIN `transfer_tasks` AS t ON t.`id` = f.`id`', 't.`batch_id`', batch_ids)
+    db.delete_many('transfer_tasks', 'batch_id', batch_ids)
+    db.delete_many('transfer_batches', 'id', batch_ids)
+    db.delete_many('standalone_transfer_batches', 'batch_id', batch_ids)
+    db.query('DELETE FROM `files` WHERE `name` LIKE %s', LFN_PREFIX + '%')
+    db.delete_many('sites', 'name', [SOURCE, DESTINATION])
+
+    history_db.db.delete_many('file_transfers', 'batch_id', batch_ids)
+    history_db.db.query('DELETE FROM `files` WHERE `name` LIKE %s', LFN_PREFIX + '%')
+    history_db.db.delete_many('sites', 'name', [SOURCE, DESTINATION])
+
+random.seed(1)
+
+db.insert_many('sites', ('name',), lambda s: (s,), [SOURCE, DESTINATION])
+site_ids = dict(db.select_many('sites', ('name', 'id'), 'name', [SOURCE, DESTINATION]))
+source_id = site_ids[SOURCE]
+dest_id = site_ids[DESTINATION]
+
+batch_ids = []
+
+try:
+    print 'Creating a batch of %d completed transfer tasks' % args.num_tasks
+    batch_id = make_batch(args.num_tasks, 0)
+    batch_ids.append(batch_id)
+
+    completed = get_completed(batch_id)
+
+    t0 = time.time()
+    rlfsm._archive_tasks('transfer', batch_id, completed, query)
+    t_bulk = time.time() - t0
+
+    statuses = dict(db.query('SELECT `status`, COUNT(*) FROM `file_subscriptions` WHERE `site_id` = %s GROUP BY `status`', dest_id))
+    num_remaining = db.query('SELECT COUNT(*) FROM `transfer_tasks` WHERE `batch_id` = %s', batch_id)[0]
+
+    print 'Creating a batch of %d completed transfer tasks for the per-task path' % args.num_reference
+    batch_id = make_batch(args.num_reference, args.num_tasks)
+    batch_ids.append(batch_id)
+
+    completed = get_completed(batch_id)
+
+    t0 = time.time()
+    archive_per_task(batch_id, completed)
+    t_reference = (time.time() - t0) * args.num_tasks / max(args.num_reference, 1)
+
+finally:
+    cleanup(batch_ids)
+
+print 'Subscription states after the bulk archival: %s (%d tasks left)' % (', '.join('%s %d' % item for item in sorted(statuses.iteritems())), num_remaining)
+print '%-30s %10.2f s' % ('bulk', t_bulk)
+print '%-30s %10.2f s (extrapolated from %d tasks)' % ('per task', t_reference, args.num_reference)
@@ -0,0 +1,123 @@
+#! /usr/bin/env python
+
+"""
+Benchmark of the inventory statistics listings of the web server. Fills an ObjectRepository with random
+datasets, blocks, and block replicas, and runs the stats/size and stats/usage listings with the statistics
+cube and with the full inventory scan. Then measures the maintenance of the cube under block replica updates
+and deletions and dataset status changes, compared with a fresh build. test_statcube.py checks the results.
+"""
+
+import sys
+import time
+import random
+from argparse import ArgumentParser
+
+parser = ArgumentParser(description = 'Benchmark inventory statistics listings')
+parser.add_argument('--datasets', '-n', metavar = 'N', dest = 'num_datasets', type = int, default = 20000, help = 'Number of datasets.')
+parser.add_argument('--sites', '-s', metavar = 'N', dest = 'num_sites', type = int, default = 50, help = 'Number of sites.')
+parser.add_argument('--updates', '-u', metavar = 'N', dest = 'num_updates', type = int, default = 10000, help = 'Number of block replica updates.')
+
+args = parser.parse_args()
+sys.argv = []
+
+import dynamo.dataformat as df
+from dynamo.core.inventory import ObjectRepository
+from dynamo.core.statcube import InventoryStatCube
+from dynamo.web.modules.inventory.stats import TotalSizeListing, SiteUsageListing
+
+random.seed(12345)
+
+inventory = ObjectRepository()
+
+groups = [inventory.update(df.Group(name)) for name in ['AnalysisOps', 'DataOps', 'FacOps', 'local']]
+groups.append(inventory.groups[None])
+sites = [inventory.update(df.Site('T2_XX_Site%d' % isite, status = df.Site.STAT_READY)) for isite in xrange(args.num_sites)]
+
+# attribute values are skewed as in a real inventory
+statuses = ['valid'] * 16 + ['production'] * 2 + ['invalid', 'deprecated']
+data_types = ['mc'] * 6 + ['data'] * 3 + ['align', 'calib', 'cosmic', 'lumi', 'raw', 'test']
+versions = [('CMSSW_%d_%d_%d' % (major, minor, patch), '') for major in range(7, 11) for minor in range(4) for patch in range(5)]
+
+def choose_version():
+    return versions[min(int(random.expovariate(0.2)), len(versions) - 1)]
+
+def choose_sites():
+    return set(sites[min(int(random.expovariate(0.1)), len(sites) - 1)] for _ in xrange(random.randint(1, 4)))
+
+block_replicas = []
+
+t0 = time.time()
+for idataset in xrange(args.num_datasets):
+    dataset = inventory.update(df.Dataset('/Primary%d/Processed-v1/AODSIM' % idataset, status = random.choice(statuses), data_type = random.choice(data_types), software_version = choose_version()))
+    replica_sites = choose_sites()
+    for site in replica_sites:
+        inventory.update(df.DatasetReplica(dataset, site))
+
+    for iblock in xrange(random.randint(1, 10)):
+        block = inventory.update(df.Block(df.Block.to_internal_name('%08x-0000-0000-0000-%012x' % (idataset, iblock)), dataset.name, random.randint(1, 100) * 1000000000, 10, False, 0, 0, False))
+        for site in replica_sites:
+            block_replicas.append(inventory.update(df.BlockReplica(block, site, random.choice(groups), size = -1)))
+
+print 'Generated %d datasets and %d block replicas in %.2f s' % (args.num_datasets, len(block_replicas), time.time() - t0)
+
+cube = InventoryStatCube()
+t0 = time.time()
+cube.build(inventory)
+print 'Built cube with %d cells in %.2f s' % (len(cube._cells), time.time() - t0)
+
+requests = [
+    ('size', 'data_type', {}),
+    ('size', 'site', {'dataset_status': 'valid'}),
+    ('size', 'group', {'data_type': ['mc', 'data'], 'site': 'T2_XX_Site1.*'}),
+    ('size', 'dataset_software_version', {'group': 'AnalysisOps'}),
+    ('usage', 'dataset_status', {}),
+    ('usage', 'group', {'physical': 'n'}),
+    ('size', 'dataset', {'dataset': '/Primary1.*'}) # per-dataset drilldown; served by the scan
+]
+
+print '%-10s %-25s %12s %12s' % ('statistic', 'list_by', 'cube (ms)', 'scan (ms)')
+for statistic, list_by, constraints in requests:
+    request = dict(constraints)
+    request['list_by'] = list_by
+
+    if statistic == 'size':
+        module = TotalSizeListing(None)
+    else:
+        module = SiteUsageListing(None)
+
+    inventory.stat_cube = cube
+    t0 = time.time()
+    module.run(None, request, inventory)
+    t_cube = time.time() - t0
+
+    inventory.stat_cube = None
+    t0 = time.time()
+    module.run(None, request, inventory)
+    t_scan = time.time() - t0
+
+    print '%-10s %-25s %12.2f %12.2f' % (statistic, list_by, t_cube * 1.e+3, t_scan * 1.e+3)
+
+## Incremental maintenance
+inventory.stat_cube = cube
+
+t0 = time.time()
+for replica in random.sample(block_replicas, args.num_updates):
+    if random.random() < 0.5:
+        inventory.update(df.BlockReplica(replica.block, replica.site, random.choice(groups), size = -1))
+    else:
+        inventory.delete(replica)
+t_update = time.time() - t0
+
+t0 = time.time()
+for dataset in random.sample(list(inventory.datasets.values()), args.num_updates / 10):
+    inventory.update(df.Dataset(dataset.name, status = random.choice(statuses), data_type = dataset.data_type, software_version = dataset.software_version))
+t_dataset_update = time.time() - t0
+
+reference = InventoryStatCube()
+t0 = time.time()
+reference.build(inventory)
+t_rebuild = time.time() - t0
+
+print 'Applied %d block replica updates and deletions in %.2f s' % (args.num_updates, t_update)
+print 'Applied %d dataset status changes in %.2f s' % (args.num_updates / 10, t_dataset_update)
+print 'Rebuilt the cube in %.2f s' % t_rebuild
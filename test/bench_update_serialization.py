@@ -0,0 +1,126 @@
+#! /usr/bin/env python
+
+"""
+Benchmark of the inventory update protocol between application processes and the server.
+Compares the repr / eval path over a multiprocessing queue with the binary frames over a pipe.
+test_serialization.py checks that both paths give the same objects.
+"""
+
+import sys
+import time
+import multiprocessing
+from argparse import ArgumentParser
+
+parser = ArgumentParser(description = 'Benchmark inventory update serialization')
+parser.add_argument('--objects', '-n', metavar = 'N', dest = 'num_objects', type = int, default = 500000, help = 'Number of objects in the update set.')
+parser.add_argument('--chunk', '-c', metavar = 'N', dest = 'chunk_size', type = int, default = 10000, help = 'Number of objects per frame.')
+
+args = parser.parse_args()
+sys.argv = []
+
+import dynamo.dataformat as df
+import dynamo.dataformat.serialization as serialization
+
+CMD_UPDATE, CMD_DELETE, CMD_EOM = range(3)
+
+def make_objects(num_objects):
+    group = df.Group('AnalysisOps', 'Dataset', gid = 1)
+    sites = [df.Site('T2_XX_Site%d' % i, host = 'se%d.example.org' % i, sid = i + 1) for i in range(50)]
+
+    objects = []
+    idataset = 0
+    while len(objects) < num_objects:
+        dataset = df.Dataset('/Primary%d/Processed-v1/AODSIM' % idataset, status = 'valid', data_type = 'production', last_update = 1500000000, did = idataset + 1)
+        idataset += 1
+        objects.append(dataset)
+
+        for iblock in range(10):
+            block = df.Block('%08x-0000-0000-0000-%012x' % (idataset, iblock), dataset, size = 10000000000, num_files = 4, last_update = 1500000000, bid = idataset * 10 + iblock)
+            dataset.blocks.add(block)
+            objects.append(block)
+
+            for ifile in range(4):
+                objects.append(df.File('/store/data/%d/%d/file%d.root' % (idataset, iblock, ifile), block, size = 2500000000, fid = (idataset * 10 + iblock) * 4 + ifile))
+
+        for site in sites[idataset % 47:idataset % 47 + 3]:
+            replica = df.DatasetReplica(dataset, site, growing = True, group = group)
+            objects.append(replica)
+            for block in dataset.blocks:
+                block_replica = df.BlockReplica(block, site, group, size = 5000000000, last_update = 1500000000, file_ids = (1, 2))
+                replica.block_replicas.add(block_replica)
+                objects.append(block_replica)
+
+    return objects[:num_objects]
+
+def send_repr(queue, commands):
+    for command in commands:
+        queue.put(command)
+
+    queue.put((CMD_EOM, None))
+    queue.join()
+
+def send_binary(conn, commands, chunk_size):
+    for ichunk in xrange(0, len(commands), chunk_size):
+        conn.send_bytes(serialization.encode_frame(commands[ichunk:ichunk + chunk_size]))
+
+    conn.send_bytes(serialization.encode_frame([(CMD_EOM, None)]))
+
+def run_repr(objects):
+    t0 = time.time()
+    commands = [(CMD_UPDATE, repr(obj)) for obj in objects]
+    t1 = time.time()
+
+    queue = multiprocessing.JoinableQueue()
+    proc = multiprocessing.Process(target = send_repr, args = (queue, commands))
+    proc.start()
+
+    received = []
+    while True:
+        cmd, objstr = queue.get()
+        queue.task_done()
+        if cmd == CMD_EOM:
+            break
+        received.append(objstr)
+
+    t2 = time.time()
+    result = [eval('df.' + objstr) for objstr in received]
+    t3 = time.time()
+
+    proc.join()
+
+    return t1 - t0, t2 - t1, t3 - t2, result
+
+def run_binary(objects, chunk_size):
+    t0 = time.time()
+    commands = [(CMD_UPDATE, serialization.pack(obj)) for obj in objects]
+    t1 = time.time()
+
+    receiver, sender = multiprocessing.Pipe(duplex = False)
+    proc = multiprocessing.Process(target = send_binary, args = (sender, commands, chunk_size))
+    proc.start()
+
+    received = []
+    done = False
+    while not done:
+        for cmd, record in serialization.decode_frame(receiver.recv_bytes()):
+            if cmd == CMD_EOM:
+                done = True
+                break
+            received.append(record)
+
+    t2 = time.time()
+    result = [serialization.unpack(record) for record in received]
+    t3 = time.time()
+
+    proc.join()
+
+    return t1 - t0, t2 - t1, t3 - t2, result
+
+print 'Creating %d objects' % args.num_objects
+objects = make_objects(args.num_objects)
+
+print '%-10s %12s %12s %12s %12s' % ('path', 'encode (s)', 'transfer (s)', 'decode (s)', 'total (s)')
+
+for name, func, fargs in [('repr/eval', run_repr, (objects,)), ('binary', run_binary, (objects, args.chunk_size))]:
+    t_enc, t_transfer, t_dec, _ = func(*fargs)
+    print '%-10s %12.2f %12.2f %12.2f %12.2f' % (name, t_enc, t_transfer, t_dec, t_enc + t_transfer + t_dec)
@@ -0,0 +1,236 @@
+#! /usr/bin/env python
+
+"""
+Minimal local stand-in for the FTS3 REST server, serving the calls FTSFileOperation uses for status polling
+(list_jobs, get_job_status with list_files) over plain HTTP. Jobs are created at startup (or through
+add_job) and finish after a configurable duration. A per-request latency emulates the HTTPS round-trip.
+Run as a script to serve on a port, or use MockFTSServer from a test or a benchmark.
+"""
+
+import re
+import json
+import time
+import random
+import threading
+import collections
+import urlparse
+import BaseHTTPServer
+import SocketServer
+
+class MockFTSServer(object):
+    def __init__(self, port = 0, latency = 0., job_duration = 60., failure_rate = 0.):
+        """
+        @param port          Port to listen on (0 = any free port)
+        @param latency       Seconds added to each response
+        @param job_duration  Seconds between the creation of a job and its completion
+        @param failure_rate  Fraction of files that end in FAILED
+        """
+
+        self.latency = latency
+        self.job_duration = job_duration
+        self.failure_rate = failure_rate
+
+        # {job_id: (creation time, job type, [file ids], set of failed file ids)}
+        self._jobs = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        # {path: number of requests}
+        self.request_counts = collections.defaultdict(int)
+
+        self._httpd = _ThreadingHTTPServer(('localhost', port), _Handler)
+        self._httpd.mock = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://localhost:%d' % self._httpd.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target = self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+    def add_job(self, num_files, job_type = 'transfer', created = None):
+        """
+        @param num_files  Number of files in the job
+        @param job_type   'transfer' or 'deletion'
+        @param created    Creation time (default now)
+        @return Job id
+        """
+
+        if created is None:
+            created = time.time()
+
+        with self._lock:
+            job_id = '%08x-0000-0000-0000-%012x' % (random.getrandbits(32), len(self._jobs))
+            first_file_id = sum(len(j[2]) for j in self._jobs.itervalues()) + 1
+            file_ids = range(first_file_id, first_file_id + num_files)
+            failed = set(i for i in file_ids if random.random() < self.failure_rate)
+            self._jobs[job_id] = (created, job_type, file_ids, failed)
+
+        return job_id
+
+    def finish_all(self):
+        """Make all jobs complete."""
+
+        with self._lock:
+            for job_id, (created, job_type, file_ids, failed) in self._jobs.items():
+                self._jobs[job_id] = (created - self.job_duration, job_type, file_ids, failed)
+
+    def num_pending_files(self, job_type = 'transfer'):
+        now = time.time()
+        with self._lock:
+            return sum(len(j[2]) for j in self._jobs.itervalues() if j[1] == job_type and now - j[0] < self.job_duration)
+
+    def num_job_polls(self):
+        """Total number of job status requests."""
+        return sum(count for path, count in self.request_counts.iteritems() if re.match('/jobs/[^/]+$', path))
+
+    def get(self, path, query):
+        with self._lock:
+            self.request_counts[path] += 1
+
+        if path == '/':
+            return {'api': {'major': 3, 'minor': 0, 'patch': 0}, 'schema': {'major': 1, 'minor': 0, 'patch': 0}, 'delegation': {'major': 1, 'minor': 0, 'patch': 0}}
+
+        if path == '/whoami':
+            return {'dn': ['/CN=mock'], 'user_dn': '/CN=mock', 'delegation_id': 'mock', 'vos': [], 'roles': []}
+
+        if path == '/jobs':
+            states = None
+            if 'state_in' in query:
+                states = set(query['state_in'][0].split(','))
+
+            result = []
+            with self._lock:
+                for job_id in self._jobs.iterkeys():
+                    job = self._job_info(job_id)
+                    if states is None or job['job_state'] in states:
+                        result.append(job)
+
+            return result
+
+        matches = re.match('/jobs/([^/]+)(?:/(files|dm))?$', path)
+        if matches is None:
+            return None
+
+        job_id, sub = matches.groups()
+
+        with self._lock:
+            if job_id not in self._jobs:
+                return None
+
+            if sub is None:
+                return self._job_info(job_id)
+
+            created, job_type, file_ids, failed = self._jobs[job_id]
+            if (sub == 'files') != (job_type == 'transfer'):
+                return []
+
+            return self._file_info(job_id)
+
+    def _job_info(self, job_id):
+        created, job_type, file_ids, failed = self._jobs[job_id]
+        if time.time() - created < self.job_duration:
+            state = 'ACTIVE'
+        elif len(failed) == len(file_ids):
+            state = 'FAILED'
+        elif len(failed) != 0:
+            state = 'FINISHEDDIRTY'
+        else:
+            state = 'FINISHED'
+
+        return {'job_id': job_id, 'job_state': state, 'submit_time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(created))}
+
+    def _file_info(self, job_id):
+        created, job_type, file_ids, failed = self._jobs[job_id]
+        finished = time.time() - created >= self.job_duration
+
+        start_time = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(created))
+        if finished:
+            finish_time = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(created + self.job_duration))
+        else:
+            finish_time = None
+
+        files = []
+        for file_id in file_ids:
+            if not finished:
+                state = 'ACTIVE'
+                reason = None
+            elif file_id in failed:
+                state = 'FAILED'
+                reason = 'TRANSFER [5] mock failure'
+            else:
+                state = 'FINISHED'
+                reason = None
+
+            files.append({'file_id': file_id, 'job_id': job_id, 'file_state': state, 'reason': reason, 'start_time': start_time, 'finish_time': finish_time})
+
+        return files
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    # the default listen backlog (5) is smaller than the number of polling threads; dropped connections
+    # are retried by the client only after a 1 s SYN timeout
+    request_queue_size = 64
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # keep-alive, so that clients can reuse the connections
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        mock = self.server.mock
+
+        url = urlparse.urlparse(self.path)
+        content = mock.get(url.path.rstrip('/') or '/', urlparse.parse_qs(url.query))
+
+        if mock.latency > 0.:
+            time.sleep(mock.latency)
+
+        if content is None:
+            self.send_response(404)
+            body = json.dumps({'status': '404 Not Found', 'message': 'No job with the id %s' % url.path})
+        else:
+            self.send_response(200)
+            body = json.dumps(content)
+
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description = 'Local FTS3 REST stand-in')
+    parser.add_argument('--port', '-p', metavar = 'PORT', dest = 'port', type = int, default = 8446, help = 'Port to listen on.')
+    parser.add_argument('--jobs', '-j', metavar = 'N', dest = 'num_jobs', type = int, default = 100, help = 'Number of jobs.')
+    parser.add_argument('--files', '-f', metavar = 'N', dest = 'num_files', type = int, default = 100, help = 'Number of files per job.')
+    parser.add_argument('--duration', '-d', metavar = 'SEC', dest = 'duration', type = float, default = 600., help = 'Job duration.')
+    parser.add_argument('--latency', '-l', metavar = 'SEC', dest = 'latency', type = float, default = 0., help = 'Latency per request.')
+
+    args = parser.parse_args()
+
+    server = MockFTSServer(port = args.port, latency = args.latency, job_duration = args.duration)
+    for _ in xrange(args.num_jobs):
+        server.add_job(args.num_files)
+
+    print 'Serving %d jobs at %s' % (args.num_jobs, server.url)
+
+    server.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
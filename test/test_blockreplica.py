@@ -0,0 +1,114 @@
+#! /usr/bin/env python
+
+import unittest
+from array import array
+
+import dynamo.dataformat as df
+
+
+class TestFileIds(unittest.TestCase):
+    # File ids of incomplete block replicas are held in sorted arrays
+    def setUp(self):
+        self.dataset = df.Dataset('/Primary/Processed-v1/AODSIM')
+        self.site = df.Site('T2_XX_Site1')
+        self.group = df.Group('AnalysisOps')
+        self.block = df.Block(df.Block.to_internal_name('00000001-0000-0000-0000-000000000000'), self.dataset, size = 600, num_files = 6)
+
+        self.files = [df.File('/store/data/file%d.root' % ifile, self.block, size = 100, fid = 100 + ifile) for ifile in range(6)]
+        self.block._files = set(self.files)
+
+    def _replica(self, file_ids):
+        if file_ids is None:
+            size = -1
+        else:
+            size = 100 * len(file_ids)
+
+        return df.BlockReplica(self.block, self.site, self.group, size = size, file_ids = file_ids)
+
+    def test_packing(self):
+        replica = self._replica((105L, 101L, 103L))
+        self.assertIs(type(replica.file_ids), array)
+        self.assertEqual(list(replica.file_ids), [101, 103, 105])
+        self.assertEqual(replica.num_files, 3)
+
+        # the setter packs any sequence
+        replica.file_ids = set([104L, 100L])
+        self.assertEqual(list(replica.file_ids), [100, 104])
+
+        complete = self._replica(None)
+        self.assertIsNone(complete.file_ids)
+        self.assertTrue(complete.is_complete())
+
+    def test_unregistered_files(self):
+        # files not in the inventory yet (id 0) are identified by LFN; the ids are then kept in a tuple
+        new_file = df.File('/store/data/new.root', self.block, size = 100)
+        self.block._files.add(new_file)
+
+        replica = self._replica((101L,))
+        replica.file_ids = (101L, '/store/data/new.root')
+        self.assertIs(type(replica.file_ids), tuple)
+        self.assertEqual(replica.files(), set([self.files[1], new_file]))
+        self.assertTrue(replica.has_file(new_file))
+
+    def test_equality(self):
+        replica = self._replica((101L, 103L))
+
+        self.assertEqual(replica, self._replica((103L, 101L)))
+        self.assertNotEqual(replica, self._replica((101L, 104L)))
+        self.assertNotEqual(replica, self._replica(None))
+        self.assertNotEqual(self._replica(None), replica)
+
+        # tuples as loaded by older versions compare by content
+        unpacked = self._replica(None)
+        unpacked.size = 200
+        unpacked._file_ids = (103L, 101L)
+        self.assertEqual(replica, unpacked)
+        self.assertEqual(unpacked, replica)
+
+    def test_files(self):
+        replica = self._replica((101L, 103L))
+
+        self.assertEqual(replica.files(), set([self.files[1], self.files[3]]))
+        self.assertEqual(replica.missing_files(), set(self.files) - set([self.files[1], self.files[3]]))
+        self.assertTrue(replica.has_file(self.files[3]))
+        self.assertFalse(replica.has_file(self.files[2]))
+
+        self.assertEqual(self._replica(None).missing_files(), set())
+
+    def test_add_delete(self):
+        replica = self._replica((101L, 103L))
+
+        replica.add_file(self.files[0])
+        self.assertIs(type(replica.file_ids), array)
+        self.assertEqual(list(replica.file_ids), [100, 101, 103])
+        self.assertEqual(replica.size, 300)
+
+        # adding an existing file changes nothing
+        replica.add_file(self.files[0])
+        self.assertEqual(replica.size, 300)
+
+        self.assertTrue(replica.delete_file(self.files[1]))
+        self.assertFalse(replica.delete_file(self.files[1]))
+        self.assertEqual(list(replica.file_ids), [100, 103])
+        self.assertEqual(replica.size, 200)
+
+        # the replica becomes complete when it has all the files
+        for lfile in self.files:
+            replica.add_file(lfile)
+
+        self.assertIsNone(replica.file_ids)
+
+    def test_repr(self):
+        replica = self._replica((103L, 101L))
+        clone = eval('df.' + repr(replica))
+
+        self.assertEqual(list(clone.file_ids), [101, 103])
+        self.assertEqual(clone.size, 200)
+
+        copy = self._replica(None)
+        copy.copy(replica)
+        self.assertEqual(copy, replica)
+
+
+if __name__ == '__main__':
+    unittest.main()
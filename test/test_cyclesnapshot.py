@@ -0,0 +1,127 @@
+#! /usr/bin/env python
+
+import random
+import shutil
+import tempfile
+import unittest
+
+import dynamo.detox.cyclesnapshot as cyclesnapshot
+
+NUM_SITES = 5
+
+
+class TestCycleSnapshot(unittest.TestCase):
+    def setUp(self):
+        random.seed(12345)
+        self.workdir = tempfile.mkdtemp()
+        self.path = self.workdir + '/snapshot.dyd'
+
+        self.sites = [(isite + 1, random.randint(0, 2), random.randint(100, 2000)) for isite in range(NUM_SITES)]
+
+        # site 4 has no replica; some datasets have block-level decisions (several rows)
+        self.replicas = []
+        for dataset_id in range(1, 400):
+            for site_id in random.sample([1, 2, 3, 5], random.randint(1, 3)):
+                for _ in range(random.choice([1, 1, 1, 2])):
+                    self.replicas.append((site_id, dataset_id, random.randint(1, 100) * 1000000000, random.choice(cyclesnapshot.DECISIONS), random.randint(1, 30)))
+
+        cyclesnapshot.write(self.path, self.path + '.xz', list(self.replicas), self.sites)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_read(self):
+        snapshot = cyclesnapshot.CycleSnapshot(self.path)
+        try:
+            self.assertEqual(list(snapshot.replicas()), sorted(self.replicas))
+            self.assertEqual(snapshot.sites(), sorted((site_id, status, quota) for site_id, status, quota in self.sites))
+            self.assertEqual(snapshot.replica_site_ids(), [1, 2, 3, 5])
+
+            expected = sorted(r[1:] for r in self.replicas if r[0] == 2)
+            self.assertEqual(snapshot.site_replicas(2), expected)
+            self.assertEqual(snapshot.site_replicas(4), [])
+            self.assertEqual(list(snapshot.replicas([5, 4, 1])), sorted(r for r in self.replicas if r[0] in (1, 5)))
+
+            summary = snapshot.site_summary()
+            for site_id in [1, 2, 3, 5]:
+                counts = [0] * len(cyclesnapshot.DECISIONS)
+                volumes = [0] * len(cyclesnapshot.DECISIONS)
+                for sid, _, size, decision, _ in self.replicas:
+                    if sid == site_id:
+                        counts[cyclesnapshot.DECISIONS.index(decision)] += 1
+                        volumes[cyclesnapshot.DECISIONS.index(decision)] += size
+
+                self.assertEqual(summary[site_id], (counts, volumes))
+
+            self.assertNotIn(4, summary)
+
+        finally:
+            snapshot.close()
+
+    def test_float_quota(self):
+        cyclesnapshot.write(self.path, None, [], [(1, 0, 123.7), (2, 0, 0.4), (3, 0, -1.)])
+
+        snapshot = cyclesnapshot.CycleSnapshot(self.path)
+        try:
+            self.assertEqual(snapshot.sites(), [(1, 0, 124), (2, 0, 0), (3, 0, -1)])
+        finally:
+            snapshot.close()
+
+    def test_archive(self):
+        # the streamed xz copy restores the same file
+        restored = self.workdir + '/restored.dyd'
+        cyclesnapshot.decompress(self.path + '.xz', restored)
+
+        with open(self.path, 'rb') as original:
+            with open(restored, 'rb') as copy:
+                self.assertEqual(copy.read(), original.read())
+
+    def test_truncated(self):
+        with open(self.path, 'rb') as source:
+            data = source.read()
+
+        with open(self.path, 'wb') as output:
+            output.write(data[:-1])
+
+        self.assertRaises(RuntimeError, cyclesnapshot.CycleSnapshot, self.path)
+
+    def test_diff(self):
+        next_replicas = list(self.replicas)
+
+        changed = set()
+        for irep in random.sample(range(len(next_replicas)), 50):
+            site_id, dataset_id, size, decision, condition_id = next_replicas[irep]
+            next_replicas[irep] = (site_id, dataset_id, size, random.choice([d for d in cyclesnapshot.DECISIONS if d != decision]), condition_id)
+            changed.add((site_id, dataset_id))
+
+        # replicas gone in the next cycle, and a new one
+        removed = set((r[0], r[1]) for r in next_replicas if r[1] in (10, 11))
+        next_replicas = [r for r in next_replicas if r[1] not in (10, 11)]
+        next_replicas.append((4, 1000, 1000000000, 'keep', 1))
+
+        next_path = self.workdir + '/next_snapshot.dyd'
+        cyclesnapshot.write(next_path, None, list(next_replicas), self.sites)
+
+        old = cyclesnapshot.CycleSnapshot(self.path)
+        new = cyclesnapshot.CycleSnapshot(next_path)
+
+        try:
+            changes = list(cyclesnapshot.diff(old, new))
+
+            self.assertEqual(set((c[0], c[1]) for c in changes), changed | removed | set([(4, 1000)]))
+            self.assertEqual([(c[0], c[1]) for c in changes], sorted((c[0], c[1]) for c in changes))
+
+            for site_id, dataset_id, old_rows, new_rows in changes:
+                self.assertEqual(sorted(old_rows), sorted(r[2:] for r in self.replicas if r[:2] == (site_id, dataset_id)))
+                self.assertEqual(sorted(new_rows), sorted(r[2:] for r in next_replicas if r[:2] == (site_id, dataset_id)))
+
+            self.assertEqual(list(cyclesnapshot.diff(old, new, [4])), [(4, 1000, [], [(1000000000, 'keep', 1)])])
+            self.assertEqual(list(cyclesnapshot.diff(old, old)), [])
+
+        finally:
+            old.close()
+            new.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
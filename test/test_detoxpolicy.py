@@ -0,0 +1,194 @@
+#! /usr/bin/env python
+
+import random
+import tempfile
+import unittest
+
+import dynamo.dataformat as df
+from dynamo.dataformat import Configuration
+from dynamo.core.inventory import ObjectRepository
+from dynamo.detox.detoxpolicy import DetoxPolicy
+from dynamo.policy.variables import replica_variables
+import dynamo.policy.columnar as columnar
+
+POLICY = '''
+Partition AnalysisOps
+On site.name == T2_*
+When site.occupancy > 0.9
+Until site.occupancy < 0.85
+Protect replica.incomplete
+Protect blockreplica.is_last_transfer_source
+ProtectBlock blockreplica.owner == DataOps
+Protect dataset.name == /*/*/RAW
+Dismiss dataset.status == INVALID
+Dismiss dataset.status == DEPRECATED and dataset.num_full_disk_copy > 1
+Protect dataset.num_full_disk_copy == 1
+Dismiss replica.num_full_disk_copy_common_owner > 2 and blockreplica.num_full_disk_copy > 2
+Dismiss dataset.on_tape == FULL and replica.num_full_disk_copy_common_owner > 1
+Protect replica.num_full_disk_copy_common_owner == 1 and blockreplica.num_full_disk_copy < 3
+Dismiss blockreplica.on_tape and replica.num_full_other_copy_common_owner > 0
+Dismiss
+Order increasing replica.first_block_created
+'''
+
+class Partition(object):
+    def match(self, replica):
+        return True
+
+def make_repository(num_datasets, num_sites):
+    repository = ObjectRepository()
+
+    groups = [df.Group('AnalysisOps', 'Dataset'), df.Group('DataOps', 'Block')]
+    for group in groups:
+        repository.groups.add(group)
+
+    partition = df.Partition('AnalysisOps', Partition())
+    repository.partitions.add(partition)
+
+    sites = []
+    for isite in xrange(num_sites):
+        if isite < 2:
+            site = df.Site('T1_XX_Site%d_MSS' % isite, storage_type = df.Site.TYPE_MSS, status = df.Site.STAT_READY)
+        else:
+            site = df.Site('T2_XX_Site%d' % isite, status = df.Site.STAT_READY)
+        repository.sites.add(site)
+        site.partitions[partition] = df.SitePartition(site, partition, 1.e+15)
+        sites.append(site)
+
+    statuses = [df.Dataset.STAT_VALID] * 3 + [df.Dataset.STAT_INVALID, df.Dataset.STAT_DEPRECATED]
+    tiers = ['AODSIM', 'MINIAODSIM', 'RAW']
+
+    for idataset in xrange(num_datasets):
+        dataset = df.Dataset('/Primary%d/Processed-v1/%s' % (idataset, random.choice(tiers)), status = random.choice(statuses))
+        repository.datasets.add(dataset)
+
+        for iblock in xrange(random.randint(1, 6)):
+            block = df.Block('%08x-0000-0000-0000-%012x' % (idataset, iblock), dataset, size = random.randint(1, 100) * 1000000000, num_files = 10)
+            dataset.blocks.add(block)
+
+        for site in random.sample(sites, random.randint(1, 5)):
+            replica = df.DatasetReplica(dataset, site)
+            dataset.replicas.add(replica)
+            site.add_dataset_replica(replica, add_block_replicas = False)
+
+            for block in dataset.blocks:
+                if random.random() < 0.1:
+                    continue
+
+                group = groups[1] if random.random() < 0.2 else groups[0]
+                if random.random() < 0.1:
+                    size = block.size / 2
+                    file_ids = tuple(range(5))
+                else:
+                    size = -1
+                    file_ids = None
+
+                block_replica = df.BlockReplica(block, site, group, size = size, last_update = random.randint(1400000000, 1500000000), file_ids = file_ids)
+                replica.block_replicas.add(block_replica)
+                block.replicas.add(block_replica)
+
+    return repository
+
+def summarize(actions):
+    result = []
+    for action in actions:
+        line = None if action.matched_line is None else action.matched_line.condition.text
+        try:
+            blocks = tuple(sorted(br.block.name for br in action.block_replicas))
+        except AttributeError:
+            blocks = None
+
+        result.append((type(action).__name__, line, blocks))
+
+    return result
+
+
+class TestEvaluationPlan(unittest.TestCase):
+    # The compiled evaluation plan must give the decisions of the line-by-line evaluation
+    def setUp(self):
+        random.seed(1)
+
+        repository = make_repository(500, 10)
+        self.replicas = [r for site in repository.sites.itervalues() for r in site.dataset_replicas()]
+
+        with tempfile.NamedTemporaryFile() as policy_file:
+            policy_file.write(POLICY)
+            policy_file.flush()
+
+            self.policy = DetoxPolicy(Configuration(policy_file = policy_file.name, attrs = Configuration()))
+
+        self.policy.plan = None
+        self.direct = [summarize(self.policy.evaluate(replica)) for replica in self.replicas]
+
+    def _check_compiled(self, use_columns):
+        self.policy.use_columns = use_columns
+        self.policy.compile_plan(self.replicas)
+
+        compiled = [summarize(self.policy.evaluate(replica)) for replica in self.replicas]
+        self.assertEqual(compiled, self.direct)
+
+        # second pass over the same plan, as in the subsequent detox iterations
+        memoized = [summarize(self.policy.evaluate(replica)) for replica in self.replicas]
+        self.assertEqual(memoized, self.direct)
+
+    def test_decisions_vary(self):
+        # the sample exercises several lines of the policy
+        lines = set(action[1] for actions in self.direct for action in actions)
+        self.assertGreater(len(lines), 4)
+
+    def test_compiled(self):
+        self._check_compiled(False)
+
+    @unittest.skipUnless(columnar.available(), 'NumPy is not available')
+    def test_columnar(self):
+        self._check_compiled(True)
+
+
+@unittest.skipUnless(columnar.available(), 'NumPy is not available')
+class TestReplicaTable(unittest.TestCase):
+    # Columns built from the replica table must hold the values of the per-object getters
+    def setUp(self):
+        random.seed(2)
+
+        repository = make_repository(300, 10)
+        self.replicas = [r for site in repository.sites.itervalues() for r in site.dataset_replicas()]
+
+        for dataset in random.sample(list(repository.datasets.itervalues()), 100):
+            dataset.attr['num_access'] = random.randint(0, 10)
+            dataset.attr['enforcer_protected_replicas'] = set(random.sample(list(dataset.replicas), 1))
+
+    def test_columns(self):
+        table = columnar.ReplicaTable(self.replicas)
+        self.assertEqual(sorted(table.rows.values()), range(len(self.replicas)))
+
+        num_built = 0
+        for name, variable in replica_variables.iteritems():
+            builder = columnar.ReplicaTable.get_builder(variable)
+            if builder is None or variable.vtype not in columnar.ReplicaColumns._vtypes:
+                continue
+
+            values, exact = builder(table)
+            for value, is_exact, replica in zip(values.tolist(), exact.tolist(), table.replicas):
+                if not is_exact:
+                    continue
+
+                expected = variable.get(replica)
+                if type(expected) is list:
+                    # block replica attr: the same value for all block replicas
+                    self.assertNotEqual(expected, [], name)
+                    self.assertEqual(set(expected), set([value]), name)
+                else:
+                    self.assertEqual(value, expected, name)
+
+            if name.startswith('blockreplica.'):
+                self.assertTrue(exact.any(), name)
+            else:
+                self.assertTrue(exact.all(), name)
+
+            num_built += 1
+
+        self.assertGreater(num_built, 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+#! /usr/bin/env python
+
+import time
+import threading
+import unittest
+import sqlite3
+
+from dynamo.fileop.daemon.manager import PoolManager
+from dynamo.fileop.daemon.dispatcher import TaskDispatcher
+import dynamo.fileop.daemon.delete as delete_module
+import dynamo.fileop.daemon.transfer as transfer_module
+
+
+def sleep_task(task_id, duration):
+    time.sleep(duration)
+    return task_id
+
+def failing_task(task_id, message):
+    raise RuntimeError(message)
+
+
+class RecordingManager(PoolManager):
+    # PoolManager recording the order of completions and the largest number of its tasks running at once
+    completed = []
+    all_done = threading.Event()
+    num_expected = 0
+
+    def __init__(self, name, task, max_concurrent):
+        PoolManager.__init__(self, name, 'test', '{0}', task, max_concurrent, '')
+        self.max_running = 0
+        self.errors = []
+
+    def next_task(self):
+        task = PoolManager.next_task(self)
+        self.max_running = max(self.max_running, len(self._in_flight))
+        return task
+
+    def task_done(self, tid, result):
+        if not result[0]:
+            self.errors.append(tid)
+
+        PoolManager.task_done(self, tid, result)
+
+        RecordingManager.completed.append((self.name, tid))
+        if len(RecordingManager.completed) == RecordingManager.num_expected:
+            RecordingManager.all_done.set()
+
+
+class TestDispatch(unittest.TestCase):
+    # Order and concurrency of the tasks handed to the shared worker pool
+    def _run(self, num_workers, managers_tasks):
+        RecordingManager.completed = []
+        RecordingManager.all_done.clear()
+        RecordingManager.num_expected = sum(len(tasks) for _, tasks in managers_tasks)
+
+        PoolManager.dispatcher = TaskDispatcher(num_workers)
+        PoolManager.wakeup = None
+
+        try:
+            for manager, tasks in managers_tasks:
+                for args in tasks:
+                    manager.add_task(*args)
+
+            PoolManager.dispatcher.start()
+
+            self.assertTrue(RecordingManager.all_done.wait(30.))
+
+        finally:
+            PoolManager.dispatcher.stop()
+            PoolManager.dispatcher = None
+
+        return RecordingManager.completed
+
+    def test_round_robin(self):
+        # with one worker, managers take turns irrespective of the order in which their tasks were added
+        first = RecordingManager('first', sleep_task, 10)
+        second = RecordingManager('second', sleep_task, 10)
+
+        completed = self._run(1, [(first, [(tid, 0.01) for tid in range(3)]), (second, [(tid, 0.01) for tid in range(10, 13)])])
+
+        self.assertEqual(completed, [('first', 0), ('second', 10), ('first', 1), ('second', 11), ('first', 2), ('second', 12)])
+
+    def test_slots(self):
+        # a manager never runs more tasks than its slots even with idle workers; the others use the rest
+        narrow = RecordingManager('narrow', sleep_task, 1)
+        wide = RecordingManager('wide', sleep_task, 3)
+
+        completed = self._run(4, [(narrow, [(tid, 0.05) for tid in range(4)]), (wide, [(tid, 0.05) for tid in range(10, 16)])])
+
+        self.assertEqual(narrow.max_running, 1)
+        self.assertEqual(wide.max_running, 3)
+        self.assertEqual(sorted(completed), sorted([('narrow', tid) for tid in range(4)] + [('wide', tid) for tid in range(10, 16)]))
+        self.assertEqual(narrow.num_tasks(), 0)
+        self.assertEqual(wide.num_tasks(), 0)
+
+    def test_exception(self):
+        # exceptions in the task function are returned as failed results and free the slot
+        manager = RecordingManager('failing', failing_task, 1)
+
+        completed = self._run(2, [(manager, [(tid, 'failed') for tid in range(3)])])
+
+        self.assertEqual(completed, [('failing', tid) for tid in range(3)])
+        self.assertEqual(manager.errors, range(3))
+
+
+class SQLiteDB(object):
+    # Minimal handle with the query() interface of MySQL over an in-memory SQLite database
+    def __init__(self):
+        self.conn = sqlite3.connect(':memory:')
+
+    def query(self, sql, *args):
+        cursor = self.conn.execute(sql.replace('%s', '?'), args)
+        if sql.startswith('SELECT'):
+            return cursor.fetchall()
+        else:
+            return cursor.rowcount
+
+
+class TestActivation(unittest.TestCase):
+    # Worker functions run the operation only for tasks that are still waiting to be executed
+    STATUSES = ['new', 'queued', 'staged', 'active', 'done', 'failed', 'cancelled']
+
+    def setUp(self):
+        self.db = SQLiteDB()
+        for optype in ['transfer', 'deletion']:
+            self.db.query('CREATE TABLE `standalone_%s_tasks` (`id` INT, `status` TEXT)' % optype)
+            for task_id, status in enumerate(TestActivation.STATUSES):
+                self.db.query('INSERT INTO `standalone_%s_tasks` VALUES (%%s, %%s)' % optype, task_id, status)
+
+        PoolManager.db = self.db
+
+        self.executed = []
+        self.original_gfal_exec = delete_module.gfal_exec
+        delete_module.gfal_exec = lambda method, args, nonerrors = {}: self.executed.append(args[0]) or (0, 1, 2, '', '')
+
+    def tearDown(self):
+        delete_module.gfal_exec = self.original_gfal_exec
+        PoolManager.db = None
+
+    def _statuses(self, optype):
+        return [row[0] for row in self.db.query('SELECT `status` FROM `standalone_%s_tasks` ORDER BY `id`' % optype)]
+
+    def test_deletion(self):
+        results = [delete_module.delete(task_id, 'pfn%d' % task_id) for task_id in range(len(TestActivation.STATUSES))]
+
+        self.assertEqual([r[0] for r in results], [0, 0, -1, -1, -1, -1, -1])
+        self.assertEqual(self.executed, ['pfn0', 'pfn1'])
+        self.assertEqual(self._statuses('deletion'), ['active', 'active', 'staged', 'active', 'done', 'failed', 'cancelled'])
+
+    def test_transfer_skipped(self):
+        # tasks no longer waiting are returned as cancelled before any operation
+        for task_id in range(3, len(TestActivation.STATUSES)):
+            self.assertEqual(transfer_module.transfer(task_id, 'src', 'dst', {'overwrite': True}), (-1, None, None, '', ''))
+
+        self.assertEqual(self._statuses('transfer'), TestActivation.STATUSES)
+
+
+if __name__ == '__main__':
+    unittest.main()
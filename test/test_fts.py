@@ -0,0 +1,65 @@
+#! /usr/bin/env python
+
+import time
+import unittest
+
+from fts_mock import MockFTSServer
+
+from dynamo.dataformat import Configuration
+from dynamo.fileop.impl.fts import FTSFileOperation
+
+
+class TestStatusPolling(unittest.TestCase):
+    # Status polling of FTSFileOperation against the local FTS stand-in
+    def setUp(self):
+        self.server = MockFTSServer(latency = 0.05, job_duration = 1.e+6)
+        self.jobs = [self.server.add_job(10) for _ in range(20)]
+        self.server.start()
+
+        # the bookkeeping DB connection is opened lazily and is never used by the polling
+        config = Configuration(fts_server = self.server.url, db_params = {'user': 'dynamo'}, batch_size = 100, keep_context = True,
+            status_poll_threads = 8, status_poll_interval = 0)
+        self.operation = FTSFileOperation(config)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _finish(self, job_ids):
+        for job_id in job_ids:
+            created, job_type, file_ids, failed = self.server._jobs[job_id]
+            self.server._jobs[job_id] = (created - self.server.job_duration, job_type, file_ids, failed)
+
+    def test_pending_count(self):
+        self.assertEqual(self.operation.num_pending_transfers(), 200)
+
+        self._finish(self.jobs[:5])
+        self.assertEqual(self.operation.num_pending_transfers(), 150)
+
+        self._finish(self.jobs[5:])
+        self.assertEqual(self.operation.num_pending_transfers(), 0)
+
+    def test_terminal_not_polled(self):
+        cache = self.operation._status_cache
+
+        self._finish(self.jobs[:5])
+        files = cache.refresh('transfer', self.jobs)
+        self.assertEqual(len(files), 20)
+        self.assertTrue(all(f['file_state'] == 'FINISHED' for job_id in self.jobs[:5] for f in files[job_id]))
+
+        num_polls = self.server.num_job_polls()
+        cache.refresh('transfer', self.jobs)
+        # only the 15 active jobs are polled again
+        self.assertEqual(self.server.num_job_polls() - num_polls, 15)
+
+        cache.forget('transfer', self.jobs[5:])
+        self.assertEqual(cache.num_pending('transfer'), 0)
+
+    def test_concurrent(self):
+        # 20 jobs x 2 requests x 50 ms would take 2 s serially
+        t0 = time.time()
+        self.operation._status_cache.refresh('transfer', self.jobs)
+        self.assertLess(time.time() - t0, 1.)
+
+
+if __name__ == '__main__':
+    unittest.main()
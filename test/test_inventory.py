@@ -106,5 +106,60 @@ class TestDynamoInventory(unittest.TestCase):
         self.assertEqual(inv2.sites['SITE'].status, dataformat.Site.STAT_READY)
 
 
+class TestParallelLoad(unittest.TestCase):
+    # Loading blocks and replicas over multiple connections must give the same inventory as the serial load
+    def setUp(self):
+        self.inv = DynamoInventory(CONF.inventory)
+        self.inv.load()
+
+        group = self.inv.update(dataformat.Group('GROUP'))
+        sites = [self.inv.update(dataformat.Site('SITE%d' % isite)) for isite in range(3)]
+
+        for idataset in range(20):
+            dataset = self.inv.update(dataformat.Dataset('/Dataset%d/Test/RAW' % idataset))
+
+            for iblock in range(idataset % 4):
+                block = self.inv.update(dataformat.Block(dataformat.Block.to_internal_name('%08x-0000-0000-0000-000000000000' % iblock), dataset, size = 100 * (iblock + 1), num_files = iblock + 1))
+
+                for site in sites[:idataset % 3 + 1]:
+                    self.inv.update(dataformat.DatasetReplica(dataset, site))
+                    self.inv.update(dataformat.BlockReplica(block, site, group, size = block.size, last_update = idataset))
+
+    def tearDown(self):
+        dynamo_teardown.main(self.inv)
+
+    def _dump(self, inv):
+        content = []
+        for dataset in sorted(inv.datasets.itervalues(), key = lambda d: d.name):
+            blocks = sorted((b.full_name(), b.size, b.num_files, b.is_open, b.last_update) for b in dataset.blocks)
+
+            replicas = []
+            for replica in sorted(dataset.replicas, key = lambda r: r.site.name):
+                block_replicas = sorted((br.block.full_name(), br.group.name, br.is_custodial, br.size, br.last_update, br.file_ids) for br in replica.block_replicas)
+                replicas.append((replica.site.name, replica.growing, block_replicas))
+
+            content.append((dataset.name, blocks, replicas))
+
+        return content
+
+    def test_compare(self):
+        serial = DynamoInventory(CONF.inventory)
+        serial._store.load_concurrency = 1
+        serial.load()
+
+        parallel = DynamoInventory(CONF.inventory)
+        parallel._store.load_concurrency = 4
+        parallel._store.ranges_per_connection = 2
+        parallel.load()
+
+        self.assertEqual(len(serial.datasets), 20)
+        self.assertEqual(self._dump(serial), self._dump(parallel))
+
+        for site in serial.sites.itervalues():
+            psite = parallel.sites[site.name]
+            for partition, sitepartition in site.partitions.iteritems():
+                self.assertEqual(sitepartition.occupancy_fraction(), psite.partitions[parallel.partitions[partition.name]].occupancy_fraction())
+
+
 if __name__ == '__main__':
     unittest.main()
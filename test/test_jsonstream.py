@@ -0,0 +1,61 @@
+#! /usr/bin/env python
+
+import json
+import unittest
+
+from dynamo.web.jsonstream import iterencode
+
+
+def generate(records):
+    for record in records:
+        yield record
+
+
+class TestIterEncode(unittest.TestCase):
+    # Streamed responses must be byte-identical to json.dumps of the same content
+    OBJECTS = [
+        {},
+        [],
+        (),
+        {'empty_dict': {}, 'empty_list': [], 'nested': [{}, [], [[]]]},
+        {'a': {'b': {'c': [1, 2, {'d': None}]}}, 'e': [True, False, None]},
+        [1, -2, 3L, 1.5, -0.1, 1e-10, 1.7976931348623157e+308, 0.],
+        {u'\xe9t\xe9': u'caf\xe9', 'plain': '/store/data/file.root', u'\u4e2d': [u'\u6587', 'x\ty"z\\']},
+        {1: 'int key', 2.5: 'float key', None: 'null key', True: 'bool key'},
+        {'result': 'OK', 'message': '', 'data': [{'name': '/A/B-v1/AOD', 'size': 1000000000000, 'files': 5}] * 10}
+    ]
+
+    def test_equivalence(self):
+        for obj in TestIterEncode.OBJECTS:
+            self.assertEqual(''.join(iterencode(obj)), json.dumps(obj))
+            # a chunk per piece
+            self.assertEqual(''.join(iterencode(obj, chunk_size = 1)), json.dumps(obj))
+
+    def test_generators(self):
+        # generators anywhere in the structure are encoded as lists
+        records = [{'name': 'block%d' % i, 'replica': [{'node': 'T2_XX_Site%d' % j} for j in range(i)]} for i in range(5)]
+
+        self.assertEqual(''.join(iterencode(generate(records))), json.dumps(records))
+        self.assertEqual(''.join(iterencode(generate([]))), json.dumps([]))
+
+        obj = {'phedex': {'block': generate(records)}, 'data': [{'nested': generate([1, generate([2, 3])])}, generate([])]}
+        expected = {'phedex': {'block': records}, 'data': [{'nested': [1, [2, 3]]}, []]}
+        self.assertEqual(''.join(iterencode(obj)), json.dumps(expected))
+
+    def test_chunks(self):
+        records = [{'name': 'record%05d' % i} for i in range(2000)]
+
+        chunks = list(iterencode({'data': generate(records)}, chunk_size = 1000))
+
+        self.assertEqual(''.join(chunks), json.dumps({'data': records}))
+        # all chunks but the last reach the target size; none is much larger
+        for chunk in chunks[:-1]:
+            self.assertTrue(1000 <= len(chunk) < 1100)
+
+    def test_error(self):
+        # unencodable objects raise when they are reached
+        self.assertRaises(TypeError, lambda: ''.join(iterencode({'data': generate([1, object()])})))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,229 @@
+#! /usr/bin/env python
+
+import unittest
+import sqlite3
+
+from dynamo.dataformat import Configuration
+from dynamo.fileop.daemon.scheduler import LinkScheduler
+from dynamo.fileop.daemon.manager import PoolManager, StatefulPoolManager
+from dynamo.fileop.daemon.transfer import get_new_transfers
+
+
+class RecordingDispatcher(object):
+    # Stands in for the TaskDispatcher; PoolManagers only notify it
+    def __init__(self):
+        self.notified = []
+
+    def notify(self, manager):
+        self.notified.append(manager)
+
+
+class RecordingStatusBuffer(object):
+    # Stands in for the TaskStatusBuffer of the daemon
+    def __init__(self):
+        self.queued = []
+        self.statuses = []
+
+    def set_queued(self, optype, task_id):
+        self.queued.append(task_id)
+
+    def set_status(self, optype, task_id, status, exitcode, message, start_time, finish_time):
+        self.statuses.append((task_id, status))
+
+
+class SQLiteDB(object):
+    # Minimal handle with the query() interface of MySQL over an in-memory SQLite database
+    def __init__(self):
+        self.conn = sqlite3.connect(':memory:')
+
+    def query(self, sql, *args):
+        return self.conn.execute(sql, args).fetchall()
+
+
+LINK = ('transfer', 'T2_XX_Source', 'T2_XX_Dest')
+OTHER_LINK = ('transfer', 'T2_XX_Source', 'T2_XX_Other')
+DELETION_LINK = ('deletion', 'T2_XX_Dest', '')
+
+class TestSlots(unittest.TestCase):
+    # Adjustment of the worker slots of links from the completed tasks
+    def setUp(self):
+        config = Configuration(initial_slots = 4, min_slots = 1, max_slots = 8, max_total_slots = 0, max_error_rate = 0.5, min_window = 4)
+        self.scheduler = LinkScheduler(config)
+
+    def _complete(self, link, num_tasks, num_failed = 0, nbytes = 1000):
+        # one window of tasks; windows in this test are shorter than 1 s and are all evaluated over 1 s
+        for itask in range(num_tasks):
+            if itask < num_failed:
+                self.scheduler.record(link, 1, 0., 1., 0)
+            else:
+                self.scheduler.record(link, 0, 0., 1., nbytes)
+
+    def test_grow_while_queued(self):
+        # no tasks waiting -> no reason to grow
+        self.scheduler.set_load(LINK, 0, 4)
+        self._complete(LINK, 4)
+        self.assertEqual(self.scheduler.slots(LINK), 4)
+
+        self.scheduler.set_load(LINK, 10, 4)
+        for expected in [5, 6, 7, 8, 8]:
+            self._complete(LINK, expected - 1)
+            self.assertEqual(self.scheduler.slots(LINK), expected)
+
+    def test_window_size(self):
+        # slots are adjusted only once the window holds max(slots, min_window) tasks
+        self.scheduler.set_load(LINK, 10, 4)
+        self._complete(LINK, 3)
+        self.assertEqual(self.scheduler.slots(LINK), 4)
+        self._complete(LINK, 1)
+        self.assertEqual(self.scheduler.slots(LINK), 5)
+
+    def test_failures(self):
+        self.scheduler.set_load(LINK, 10, 4)
+        self._complete(LINK, 4, num_failed = 3)
+        self.assertEqual(self.scheduler.slots(LINK), 2)
+        self._complete(LINK, 4, num_failed = 4)
+        self.assertEqual(self.scheduler.slots(LINK), 1)
+        self._complete(LINK, 4, num_failed = 4)
+        self.assertEqual(self.scheduler.slots(LINK), 1)
+
+    def test_cancelled_ignored(self):
+        self.scheduler.set_load(LINK, 10, 4)
+        for _ in range(10):
+            self.scheduler.record(LINK, -1, None, None, 0)
+
+        self.assertEqual(self.scheduler.slots(LINK), 4)
+
+    def test_size_weighted_rate(self):
+        # the rate of transfer links is measured in bytes: the same number of tasks moving fewer bytes is a drop
+        self.scheduler.set_load(LINK, 10, 4)
+        self._complete(LINK, 4, nbytes = 1000)
+        self.assertEqual(self.scheduler.slots(LINK), 5)
+
+        self._complete(LINK, 5, nbytes = 400)
+        self.assertEqual(self.scheduler.slots(LINK), 4)
+
+        # a drop within the tolerance is not
+        self._complete(LINK, 4, nbytes = 480)
+        self.assertEqual(self.scheduler.slots(LINK), 5)
+
+    def test_task_rate_without_bytes(self):
+        # deletions carry no bytes; the rate is the number of successful tasks
+        self.scheduler.set_load(DELETION_LINK, 10, 4)
+        self._complete(DELETION_LINK, 4, nbytes = 0)
+        self.assertEqual(self.scheduler.slots(DELETION_LINK), 5)
+
+        self._complete(DELETION_LINK, 5, num_failed = 2, nbytes = 0)
+        self.assertEqual(self.scheduler.slots(DELETION_LINK), 4)
+
+    def test_unsaturated_drop(self):
+        # a lower rate while nothing is waiting is lack of demand and does not shrink the link
+        self.scheduler.set_load(LINK, 10, 4)
+        self._complete(LINK, 4, nbytes = 1000)
+        self.assertEqual(self.scheduler.slots(LINK), 5)
+
+        self.scheduler.set_load(LINK, 0, 5)
+        self._complete(LINK, 5, nbytes = 100)
+        self.assertEqual(self.scheduler.slots(LINK), 5)
+
+    def test_total_slots(self):
+        # links share max_total_slots; a busy link cannot grow into the share of the others
+        config = Configuration(initial_slots = 4, max_slots = 8, max_total_slots = 10, min_window = 4)
+        self.scheduler = LinkScheduler(config)
+
+        self.scheduler.set_load(OTHER_LINK, 0, 4)
+        self.scheduler.set_load(LINK, 10, 4)
+        for _ in range(5):
+            self._complete(LINK, self.scheduler.slots(LINK))
+
+        self.assertEqual(self.scheduler.slots(LINK), 6)
+        self.assertEqual(self.scheduler.slots(OTHER_LINK), 4)
+
+
+class TestManagerSlots(unittest.TestCase):
+    # PoolManagers hand out tasks up to the slots of their link and report their load
+    def setUp(self):
+        config = Configuration(initial_slots = 2, max_slots = 4, min_window = 2)
+        PoolManager.scheduler = LinkScheduler(config)
+        PoolManager.dispatcher = RecordingDispatcher()
+        PoolManager.status_buffer = RecordingStatusBuffer()
+        PoolManager.wakeup = None
+
+        self.manager = StatefulPoolManager('T2_XX_Source-T2_XX_Dest', 'transfer', '{0}', None, 2, '', link = LINK)
+
+    def tearDown(self):
+        PoolManager.scheduler = None
+        PoolManager.dispatcher = None
+        PoolManager.status_buffer = None
+
+    def test_next_task(self):
+        for tid in range(5):
+            self.manager.add_task(tid, 'pfn%d' % tid, size = 100)
+
+        self.assertEqual(len(PoolManager.dispatcher.notified), 5)
+        self.assertEqual(PoolManager.status_buffer.queued, range(5))
+
+        self.assertEqual(self.manager.next_task(), (0, ('pfn0',)))
+        self.assertEqual(self.manager.next_task(), (1, ('pfn1',)))
+        # link is full
+        self.assertIsNone(self.manager.next_task())
+
+        state = PoolManager.scheduler._links[LINK]
+        self.assertEqual((state.queued, state.in_flight), (3, 2))
+
+        # the link grows by one slot after a full window with tasks waiting
+        self.manager.task_done(0, (True, (0, 0., 1., '', '')))
+        self.manager.task_done(1, (True, (0, 0., 1., '', '')))
+        self.assertEqual(PoolManager.scheduler.slots(LINK), 3)
+        self.assertEqual(PoolManager.status_buffer.statuses, [(0, 'done'), (1, 'done')])
+
+        self.assertEqual(self.manager.next_task(), (2, ('pfn2',)))
+        self.assertEqual(self.manager.next_task(), (3, ('pfn3',)))
+        self.assertEqual(self.manager.next_task(), (4, ('pfn4',)))
+        self.assertIsNone(self.manager.next_task())
+        self.assertEqual(self.manager.num_tasks(), 3)
+
+
+class TestNewTransfers(unittest.TestCase):
+    # Selection of the transfer tasks to start
+    def setUp(self):
+        self.db = SQLiteDB()
+        for sql in [
+                'CREATE TABLE `standalone_transfer_tasks` (`id` INT, `source` TEXT, `destination` TEXT, `checksum_algo` TEXT, `checksum` TEXT, `status` TEXT)',
+                'CREATE TABLE `transfer_tasks` (`id` INT, `subscription_id` INT, `batch_id` INT)',
+                'CREATE TABLE `standalone_transfer_batches` (`batch_id` INT, `source_site` TEXT, `destination_site` TEXT, `mss_source` INT)',
+                'CREATE TABLE `file_subscriptions` (`id` INT, `file_id` INT)',
+                'CREATE TABLE `files` (`id` INT, `size` INT)']:
+            self.db.query(sql)
+
+        batches = [(1, 'T2_B', 'T2_Y', 0), (2, 'T2_A', 'T2_Z', 0), (3, 'T2_A', 'T2_Y', 0), (4, 'T1_T_MSS', 'T2_Y', 1)]
+        # (task id, batch id, status, file size or None if the file is not in the inventory)
+        tasks = [(10, 1, 'new', 100), (11, 2, 'new', 200), (12, 3, 'staged', 300), (13, 3, 'new', None), (14, 2, 'done', 400),
+            (15, 4, 'new', 500), (16, 4, 'staged', 600), (17, 1, 'queued', 700), (18, 3, 'new', 800)]
+
+        for batch in batches:
+            self.db.query('INSERT INTO `standalone_transfer_batches` VALUES (?, ?, ?, ?)', *batch)
+
+        for task_id, batch_id, status, size in tasks:
+            self.db.query('INSERT INTO `standalone_transfer_tasks` VALUES (?, ?, ?, ?, ?, ?)', task_id, 'src%d' % task_id, 'dst%d' % task_id, '', '', status)
+            self.db.query('INSERT INTO `transfer_tasks` VALUES (?, ?, ?)', task_id, task_id + 100, batch_id)
+            if size is not None:
+                self.db.query('INSERT INTO `file_subscriptions` VALUES (?, ?)', task_id + 100, task_id + 200)
+                self.db.query('INSERT INTO `files` VALUES (?, ?)', task_id + 200, size)
+
+    def test_selection(self):
+        rows = get_new_transfers(self.db)
+
+        # new tasks from disk sources and staged tasks, ordered by link and task id
+        self.assertEqual([(row[0], row[5], row[6]) for row in rows],
+            [(16, 'T1_T_MSS', 'T2_Y'), (12, 'T2_A', 'T2_Y'), (13, 'T2_A', 'T2_Y'), (18, 'T2_A', 'T2_Y'), (11, 'T2_A', 'T2_Z'), (10, 'T2_B', 'T2_Y')])
+
+    def test_sizes(self):
+        sizes = dict((row[0], row[7]) for row in get_new_transfers(self.db))
+
+        # task 13 has no file in the inventory and is still started
+        self.assertEqual(sizes, {10: 100, 11: 200, 12: 300, 13: 0, 16: 600, 18: 800})
+        self.assertEqual(get_new_transfers(self.db)[0][1:3], ('src16', 'dst16'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+#! /usr/bin/env python
+
+import re
+import random
+import fnmatch
+import unittest
+
+from dynamo.core.inventory import NameKeyDict
+
+
+class TestNameKeyDict(unittest.TestCase):
+    # Sorted name index of NameKeyDict must give the same results as a full scan with fnmatch
+    PATTERNS = ['*', '/A*', '/A1/*', '/A1*/R*/AOD', '/B?/*', '/[AB]2/*', '*/AOD', '/C3/R2017-v1/RAW', '/Z*', '/A1/R2018-v2/*SIM', '']
+
+    def setUp(self):
+        self.original_threshold = NameKeyDict.MERGE_THRESHOLD
+        # small threshold so that the tests go through the merges and compactions
+        NameKeyDict.MERGE_THRESHOLD = 5
+
+        random.seed(12345)
+        self.names = ['/%s%d/R%d-v%d/%s' % (p, i, y, v, t) for p in 'ABC' for i in range(4) for y in (2017, 2018) for v in (1, 2) for t in ('AOD', 'RAW', 'AODSIM')]
+
+        self.dict = NameKeyDict()
+        self.dict[None] = 'null'
+
+    def tearDown(self):
+        NameKeyDict.MERGE_THRESHOLD = self.original_threshold
+
+    def _check(self):
+        for pattern in TestNameKeyDict.PATTERNS:
+            regex = re.compile(fnmatch.translate(pattern))
+            expected = sorted(key for key in self.dict.iterkeys() if key is not None and regex.match(key))
+            self.assertEqual(self.dict.match(pattern), expected, pattern)
+
+    def test_build(self):
+        for name in self.names:
+            self.dict[name] = name
+
+        self.dict.build_index()
+        self._check()
+
+    def test_lazy_build(self):
+        # the index is built at the first search
+        for name in self.names:
+            self.dict.add(Named(name))
+
+        self._check()
+
+    def test_insert(self):
+        self.dict.build_index()
+
+        random.shuffle(self.names)
+        for iname, name in enumerate(self.names):
+            self.dict[name] = name
+            # searches between merges see the names collected since the last merge
+            if iname % 7 == 0:
+                self._check()
+
+        self._check()
+
+        # overwriting an existing key does not duplicate it in the index
+        for name in self.names[:20]:
+            self.dict[name] = 'new value'
+
+        self._check()
+
+    def test_delete(self):
+        for name in self.names:
+            self.dict[name] = name
+
+        self.dict.build_index()
+
+        random.shuffle(self.names)
+        for iname, name in enumerate(self.names[:100]):
+            if iname % 2 == 0:
+                del self.dict[name]
+            else:
+                self.dict.pop(name)
+
+            if iname % 9 == 0:
+                self._check()
+
+        self._check()
+
+        # removed names pile up in the index only until it is compacted
+        self.assertLess(self.dict._num_removed, 100)
+        self.assertEqual(len(self.dict._names), len(self.dict) - 1 + self.dict._num_removed)
+        self.assertEqual(self.dict.pop('/nonexistent', None), None)
+
+    def test_readd(self):
+        for name in self.names:
+            self.dict[name] = name
+
+        self.dict.build_index()
+
+        # names removed and added again appear once
+        for name in self.names[:10]:
+            del self.dict[name]
+        for name in self.names[:10]:
+            self.dict[name] = name
+
+        self._check()
+
+        for name in self.names[:10]:
+            del self.dict[name]
+
+        self._check()
+
+    def test_bulk(self):
+        # bulk modifications drop the index, which is rebuilt at the next search
+        self.dict.update((name, name) for name in self.names[:50])
+        self._check()
+
+        self.dict.update((name, name) for name in self.names[50:])
+        self._check()
+
+        self.dict.setdefault('/D1/R2019-v1/AOD', None)
+        self._check()
+
+        self.dict.popitem()
+        self._check()
+
+        self.dict.clear()
+        self.assertEqual(self.dict.match('*'), [])
+        self.dict['/A1/R2017-v1/AOD'] = None
+        self.assertEqual(self.dict.match('/A*'), ['/A1/R2017-v1/AOD'])
+
+    def test_plain_name(self):
+        for name in self.names:
+            self.dict[name] = name
+
+        self.assertEqual(self.dict.match('/A1/R2017-v1/AOD'), ['/A1/R2017-v1/AOD'])
+        self.assertEqual(self.dict.match('/A1/R2017-v1'), [])
+        # plain names do not need the index
+        self.assertFalse(hasattr(self.dict, '_names'))
+
+
+class Named(object):
+    def __init__(self, name):
+        self.name = name
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#! /usr/bin/env python
+
+import unittest
+
+import dynamo.dataformat as df
+import dynamo.dataformat.serialization as serialization
+from dynamo.dataformat import ObjectError
+
+CMD_UPDATE, CMD_DELETE = range(2)
+
+def make_objects():
+    group = df.Group('AnalysisOps', 'Dataset', gid = 1)
+    partition = df.Partition('Physics', None, pid = 3)
+    site = df.Site('T2_XX_Site1', host = 'se1.example.org', storage_type = df.Site.TYPE_DISK, status = df.Site.STAT_READY, sid = 1)
+    sitepartition = df.SitePartition(site, partition, 1.e+12)
+
+    dataset = df.Dataset('/Primary/Processed-v1/AODSIM', status = 'valid', data_type = 'production', last_update = 1500000000, did = 1)
+    block = df.Block(df.Block.to_internal_name('00000001-0000-0000-0000-000000000000'), dataset, size = 10000000000, num_files = 4, last_update = 1500000000, bid = 10)
+    lfile = df.File('/store/data/1/file0.root', block, size = 2500000000, checksum = (12345, '0a1b2c3d'), fid = 100)
+
+    replica = df.DatasetReplica(dataset, site, growing = True, group = group)
+    complete = df.BlockReplica(block, site, group, is_custodial = True, size = -1, last_update = 1500000001)
+    incomplete = df.BlockReplica(block, site, group, size = 5000000000, last_update = 1500000002, file_ids = (103L, 100L))
+
+    return [group, partition, site, sitepartition, dataset, block, lfile, replica, complete, incomplete]
+
+
+class TestRecords(unittest.TestCase):
+    # Binary records must give the same objects as the repr / eval path they replace
+    def test_round_trip(self):
+        for obj in make_objects():
+            clone = serialization.unpack(serialization.pack(obj))
+
+            self.assertIs(type(clone), type(obj))
+            self.assertEqual(clone, eval('df.' + repr(obj)))
+
+    def test_unknown(self):
+        self.assertRaises(ObjectError, serialization.pack, 'T2_XX_Site1')
+        self.assertRaises(ObjectError, serialization.unpack, (0, 'T2_XX_Site1'))
+        self.assertRaises(ObjectError, serialization.unpack, (100,))
+
+
+class TestFrames(unittest.TestCase):
+    def test_frames(self):
+        commands = [(CMD_UPDATE, serialization.pack(obj)) for obj in make_objects()]
+        commands.append((CMD_DELETE, commands[0][1]))
+
+        self.assertEqual(serialization.decode_frame(serialization.encode_frame(commands)), commands)
+        self.assertEqual(serialization.decode_frame(serialization.encode_frame([])), [])
+
+        received = []
+        for ichunk in range(0, len(commands), 3):
+            received.extend(serialization.decode_frame(serialization.encode_frame(commands[ichunk:ichunk + 3])))
+
+        self.assertEqual(received, commands)
+
+    def test_corrupt(self):
+        frame = serialization.encode_frame([(CMD_UPDATE, serialization.pack(df.Group('AnalysisOps', gid = 1)))])
+
+        self.assertRaises(ObjectError, serialization.decode_frame, frame[:5])
+        self.assertRaises(ObjectError, serialization.decode_frame, 'XXXX' + frame[4:])
+        # version byte follows the magic
+        self.assertRaises(ObjectError, serialization.decode_frame, frame[:4] + chr(serialization.FORMAT_VERSION + 1) + frame[5:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+#! /usr/bin/env python
+
+import unittest
+
+from dynamo import dataformat
+from dynamo.core.inventory import ObjectRepository
+
+
+class GroupCondition(object):
+    # Partition condition matching the block replicas owned by one group
+    def __init__(self, group_name):
+        self.group_name = group_name
+
+    def match(self, replica):
+        return replica.group.name == self.group_name
+
+
+class TestOccupancy(unittest.TestCase):
+    # Running occupancy totals of SitePartitions must agree with a full recount
+    def setUp(self):
+        self.inv = ObjectRepository()
+        # block updates copy the sizes without loading the files, as in the server-side inventory
+        self.inv.has_store = False
+
+        self.groups = [self.inv.update(dataformat.Group(name)) for name in ['GROUPA', 'GROUPB']]
+        self.site = self.inv.update(dataformat.Site('SITE'))
+
+        for group in self.groups:
+            self.inv.update(dataformat.Partition(group.name, GroupCondition(group.name)))
+
+        for site_partition in self.site.partitions.itervalues():
+            site_partition.set_quota(1000000)
+
+        self.dataset = self.inv.update(dataformat.Dataset('/Dataset/Test/RAW'))
+        self.blocks = []
+        for iblock in range(4):
+            name = dataformat.Block.to_internal_name('%08x-0000-0000-0000-000000000000' % iblock)
+            self.blocks.append(self.inv.update(dataformat.Block(name, self.dataset, size = 100 * (iblock + 1), num_files = iblock + 1, bid = iblock + 1)))
+
+        self.inv.update(dataformat.DatasetReplica(self.dataset, self.site))
+
+    def _add(self, block, group, size):
+        if size == block.size:
+            file_ids = None
+        else:
+            file_ids = range(block.id * 100, block.id * 100 + size / 100)
+
+        return self.inv.update(dataformat.BlockReplica(block, self.site, group, size = size, file_ids = file_ids))
+
+    def _entry(self, group):
+        site_partition = self.site.partitions[self.inv.partitions[group.name]]
+        return site_partition.replicas.get(self.dataset.find_replica(self.site), 'absent')
+
+    def _check(self):
+        for site_partition in self.site.partitions.itervalues():
+            site_partition.check_occupancy()
+
+            running = (site_partition.occupancy_fraction(True), site_partition.occupancy_fraction(False))
+            site_partition.reset_occupancy()
+            recount = (site_partition.occupancy_fraction(True), site_partition.occupancy_fraction(False))
+
+            self.assertEqual(running, recount)
+
+    def test_embed(self):
+        group_a, group_b = self.groups
+
+        for block in self.blocks[:3]:
+            self._add(block, group_a, block.size / 2 / 100 * 100)
+            self._check()
+
+        self.assertIsNone(self._entry(group_a))
+        self.assertEqual(self._entry(group_b), 'absent')
+
+        self._add(self.blocks[3], group_b, 0)
+        self._check()
+
+        self.assertEqual(self._entry(group_b), set([self.blocks[3].find_replica(self.site)]))
+
+    def test_split_contained(self):
+        group_a, group_b = self.groups
+
+        for block in self.blocks[:2]:
+            self._add(block, group_a, block.size)
+
+        # group A partition contains all block replicas of the dataset replica
+        self.assertIsNone(self._entry(group_a))
+        self._check()
+
+        # a block replica outside the partition splits the entry into an explicit set
+        self._add(self.blocks[2], group_b, self.blocks[2].size)
+        self.assertEqual(self._entry(group_a), set(self.blocks[i].find_replica(self.site) for i in range(2)))
+        self.assertEqual(self._entry(group_b), set([self.blocks[2].find_replica(self.site)]))
+        self._check()
+
+    def test_resize(self):
+        group_a, group_b = self.groups
+
+        for iblock, block in enumerate(self.blocks):
+            self._add(block, self.groups[iblock % 2], 0)
+
+        # block replica sizes grow
+        for block in self.blocks:
+            replica = block.find_replica(self.site)
+            self._add(block, replica.group, block.size)
+            self._check()
+
+        # block sizes change
+        for block in self.blocks:
+            self.inv.update(dataformat.Block(block.name, self.dataset, size = block.size + 50, num_files = block.num_files, bid = block.id))
+            self._check()
+
+        # change of group moves the block replica between partitions together with a size change
+        self._add(self.blocks[0], group_b, 100)
+        self._check()
+
+        self.assertEqual(self._entry(group_b), set(self.blocks[i].find_replica(self.site) for i in [0, 1, 3]))
+        self.assertEqual(self._entry(group_a), set([self.blocks[2].find_replica(self.site)]))
+
+    def test_delete(self):
+        group_a, group_b = self.groups
+
+        for iblock, block in enumerate(self.blocks):
+            self._add(block, self.groups[iblock % 2], block.size)
+
+        self.inv.delete(self.blocks[0].find_replica(self.site))
+        self._check()
+        self.assertEqual(self._entry(group_a), set([self.blocks[2].find_replica(self.site)]))
+
+        self.inv.delete(self.blocks[2].find_replica(self.site))
+        self._check()
+        self.assertEqual(self._entry(group_a), 'absent')
+
+        self.inv.delete(self.blocks[1].find_replica(self.site))
+        self._check()
+        self.assertEqual(self._entry(group_b), set([self.blocks[3].find_replica(self.site)]))
+
+        self.inv.delete(self.dataset.find_replica(self.site))
+        self._check()
+        self.assertEqual(self._entry(group_b), 'absent')
+
+
+if __name__ == '__main__':
+    unittest.main()
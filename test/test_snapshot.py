@@ -0,0 +1,134 @@
+#! /usr/bin/env python
+
+import random
+import shutil
+import tempfile
+import unittest
+
+import dynamo.dataformat as df
+from dynamo.core.inventory import ObjectRepository
+import dynamo.core.snapshot as snapshot
+
+
+class Partition(object):
+    def match(self, replica):
+        return True
+
+def make_repository(num_datasets, num_sites):
+    repository = ObjectRepository()
+
+    groups = [df.Group('AnalysisOps', 'Dataset', gid = 1), df.Group('DataOps', 'Block', gid = 2)]
+    for group in groups:
+        repository.groups.add(group)
+
+    partition = df.Partition('AnalysisOps', Partition())
+    repository.partitions.add(partition)
+
+    sites = []
+    for isite in xrange(num_sites):
+        site = df.Site('T2_XX_Site%d' % isite, status = df.Site.STAT_READY, sid = isite + 1)
+        repository.sites.add(site)
+        site.partitions[partition] = df.SitePartition(site, partition, 1.e+15)
+        sites.append(site)
+
+    for idataset in xrange(num_datasets):
+        dataset = df.Dataset('/Primary%d/Processed-v1/AODSIM' % idataset, status = df.Dataset.STAT_VALID, did = idataset + 1)
+        repository.datasets.add(dataset)
+
+        for iblock in xrange(random.randint(1, 8)):
+            block = df.Block('%08x-0000-0000-0000-%012x' % (idataset, iblock), dataset, size = random.randint(1, 100) * 1000000000, num_files = 10, bid = idataset * 20 + iblock + 1)
+            dataset.blocks.add(block)
+
+        for site in random.sample(sites, random.randint(0, 3)):
+            if random.random() < 0.5:
+                # only growing replicas carry a group
+                replica = df.DatasetReplica(dataset, site, growing = True, group = groups[0])
+            else:
+                replica = df.DatasetReplica(dataset, site)
+
+            for block in dataset.blocks:
+                if random.random() < 0.1:
+                    continue
+
+                group = groups[1] if random.random() < 0.2 else groups[0]
+                if random.random() < 0.2:
+                    size = block.size / 2
+                    file_ids = tuple(random.sample(xrange(block.id * 10, block.id * 10 + 10), 5))
+                else:
+                    size = -1
+                    file_ids = None
+
+                block_replica = df.BlockReplica(block, site, group, is_custodial = (random.random() < 0.1), size = size, last_update = random.randint(1400000000, 1500000000), file_ids = file_ids)
+                replica.block_replicas.add(block_replica)
+                block.replicas.add(block_replica)
+
+            dataset.replicas.add(replica)
+            site.add_dataset_replica(replica, add_block_replicas = True)
+
+    return repository
+
+def dump(inventory):
+    content = []
+    for dataset in sorted(inventory.datasets.itervalues(), key = lambda d: d.name):
+        blocks = sorted((b.name, b.size, b.num_files, b.is_open, b.last_update, b.id) for b in dataset.blocks)
+
+        replicas = []
+        for replica in sorted(dataset.replicas, key = lambda r: r.site.name):
+            block_replicas = []
+            for br in replica.block_replicas:
+                file_ids = None if br.file_ids is None else tuple(br.file_ids)
+                block_replicas.append((br.block.name, br.group.name, br.is_custodial, br.size, br.last_update, file_ids))
+
+            group_name = replica.group.name if replica.growing else None
+            replicas.append((replica.site.name, replica.growing, group_name, sorted(block_replicas)))
+
+        content.append((dataset.name, dataset.status, dataset.id, blocks, replicas))
+
+    for site in sorted(inventory.sites.itervalues(), key = lambda s: s.name):
+        for partition, sitepartition in sorted(site.partitions.iteritems(), key = lambda (p, sp): p.name):
+            content.append((site.name, partition.name, sitepartition.quota, sitepartition.occupancy_fraction()))
+
+    return content
+
+
+class TestSnapshot(unittest.TestCase):
+    # A snapshot written and loaded back restores the same inventory content
+    def setUp(self):
+        random.seed(12345)
+        self.workdir = tempfile.mkdtemp()
+        self.path = self.workdir + '/snapshot'
+
+        self.repository = make_repository(200, 8)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def _make_empty(self):
+        empty = ObjectRepository()
+        for partition in self.repository.partitions.itervalues():
+            empty.partitions.add(df.Partition(partition.name, partition._condition))
+
+        return empty
+
+    def test_round_trip(self):
+        snapshot.write(self.repository, self.path, 'version1')
+        self.assertEqual(snapshot.read_version(self.path), 'version1')
+
+        loaded = self._make_empty()
+        snapshot.load(loaded, self.path)
+
+        self.assertEqual(dump(loaded), dump(self.repository))
+        self.assertEqual(sorted(loaded.groups.keys()), sorted(self.repository.groups.keys()))
+
+    def test_empty(self):
+        snapshot.write(self._make_empty(), self.path, 'version1')
+
+        loaded = self._make_empty()
+        snapshot.load(loaded, self.path)
+
+        self.assertEqual(len(loaded.datasets), 0)
+        self.assertEqual(len(loaded.sites), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
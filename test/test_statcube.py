@@ -0,0 +1,97 @@
+#! /usr/bin/env python
+
+import random
+import unittest
+
+import dynamo.dataformat as df
+from dynamo.core.inventory import ObjectRepository
+from dynamo.core.statcube import InventoryStatCube
+from dynamo.web.modules.inventory.stats import TotalSizeListing, SiteUsageListing
+
+STATUSES = ['valid', 'production', 'invalid', 'deprecated']
+DATA_TYPES = ['mc', 'data', 'align', 'raw']
+VERSIONS = [('CMSSW_%d_%d_0' % (major, minor), '') for major in range(9, 11) for minor in range(3)]
+
+
+class TestStatCube(unittest.TestCase):
+    # The statistics listings answered from the cube must be those of the full inventory scan
+    REQUESTS = [
+        ('size', 'data_type', {}),
+        ('size', 'site', {'dataset_status': 'valid'}),
+        ('size', 'group', {'data_type': ['mc', 'data'], 'site': 'T2_XX_Site1.*'}),
+        ('size', 'dataset_software_version', {'group': 'AnalysisOps'}),
+        ('usage', 'dataset_status', {}),
+        ('usage', 'group', {'physical': 'n'})
+    ]
+
+    def setUp(self):
+        random.seed(12345)
+
+        self.inventory = ObjectRepository()
+
+        self.groups = [self.inventory.update(df.Group(name)) for name in ['AnalysisOps', 'DataOps', 'local']]
+        self.groups.append(self.inventory.groups[None])
+        self.sites = [self.inventory.update(df.Site('T2_XX_Site%d' % isite, status = df.Site.STAT_READY)) for isite in range(12)]
+
+        self.block_replicas = []
+        for idataset in range(300):
+            dataset = self.inventory.update(df.Dataset('/Primary%d/Processed-v1/AODSIM' % idataset, status = random.choice(STATUSES), data_type = random.choice(DATA_TYPES), software_version = random.choice(VERSIONS)))
+            replica_sites = random.sample(self.sites, random.randint(1, 3))
+            for site in replica_sites:
+                self.inventory.update(df.DatasetReplica(dataset, site))
+
+            for iblock in range(random.randint(1, 5)):
+                block = self.inventory.update(df.Block(df.Block.to_internal_name('%08x-0000-0000-0000-%012x' % (idataset, iblock)), dataset.name, random.randint(1, 100) * 1000000000, 10, False, 0, 0, False))
+                for site in replica_sites:
+                    self.block_replicas.append(self.inventory.update(df.BlockReplica(block, site, random.choice(self.groups), size = -1)))
+
+        self.cube = InventoryStatCube()
+        self.cube.build(self.inventory)
+
+    def _listing(self, statistic, list_by, constraints):
+        request = dict(constraints)
+        request['list_by'] = list_by
+
+        if statistic == 'size':
+            result = TotalSizeListing(None).run(None, request, self.inventory)
+            # compare in GB to ignore the summation order
+            return sorted((c['key'], round(c['size'] * 1.e+3, 3)) for c in result['content'] if c['size'] != 0.)
+        else:
+            result = SiteUsageListing(None).run(None, request, self.inventory)
+            return sorted((c['site'], sorted((u['key'], round(u['size'] * 1.e+3, 3)) for u in c['usage'])) for c in result['content'])
+
+    def _check_listings(self):
+        for statistic, list_by, constraints in TestStatCube.REQUESTS:
+            self.inventory.stat_cube = self.cube
+            with_cube = self._listing(statistic, list_by, constraints)
+
+            self.inventory.stat_cube = None
+            with_scan = self._listing(statistic, list_by, constraints)
+
+            self.assertEqual(with_cube, with_scan, (statistic, list_by))
+
+    def test_listings(self):
+        self._check_listings()
+
+    def test_incremental(self):
+        # updates and deletions through the inventory keep the cube equal to a rebuild
+        self.inventory.stat_cube = self.cube
+
+        for replica in random.sample(self.block_replicas, 300):
+            if random.random() < 0.5:
+                self.inventory.update(df.BlockReplica(replica.block, replica.site, random.choice(self.groups), size = -1))
+            else:
+                self.inventory.delete(replica)
+
+        for dataset in random.sample(list(self.inventory.datasets.values()), 50):
+            self.inventory.update(df.Dataset(dataset.name, status = random.choice(STATUSES), data_type = dataset.data_type, software_version = dataset.software_version))
+
+        reference = InventoryStatCube()
+        reference.build(self.inventory)
+
+        self.assertEqual(self.cube._cells, reference._cells)
+        self._check_listings()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+#! /usr/bin/env python
+
+import time
+import datetime
+import unittest
+
+from dynamo.fileop.daemon.statusbuffer import TaskStatusBuffer
+
+
+class RecordingDB(object):
+    # Records the statements TaskStatusBuffer issues and applies them to {optype: {task id: status}}
+    scratch_db = 'dynamo_tmp'
+
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self.statements = []
+        self.fail = False
+        self._tmp_rows = None
+
+    def execute_many(self, sql, key, pool, additional_conditions = []):
+        optype = sql.split('`')[1][len('standalone_'):-len('_tasks')]
+        self.statements.append(('queued', optype, list(pool)))
+        for task_id in pool:
+            if self.tasks[optype][task_id] in ('new', 'staged'):
+                self.tasks[optype][task_id] = 'queued'
+
+    def create_tmp_table(self, table, columns):
+        self._tmp_rows = []
+
+    def insert_many(self, table, fields, mapping, objects, do_update = True, db = ''):
+        if self.fail:
+            raise RuntimeError('Lost connection')
+
+        self._tmp_rows.extend(mapping(obj) for obj in objects)
+
+    def query(self, sql):
+        optype = sql.split('`')[1][len('standalone_'):-len('_tasks')]
+        self.statements.append(('update', optype, sorted(self._tmp_rows)))
+        for row in self._tmp_rows:
+            self.tasks[optype][row[0]] = row[1]
+
+    def drop_tmp_table(self, table):
+        self._tmp_rows = None
+
+
+class TestStatusBuffer(unittest.TestCase):
+    def setUp(self):
+        self.db = RecordingDB({'transfer': dict((tid, 'new') for tid in range(10)), 'deletion': dict((tid, 'new') for tid in range(10))})
+        # large size and interval: only explicit flushes write unless a test says otherwise
+        self.buffer = TaskStatusBuffer(self.db, flush_size = 1000, flush_interval = 3600000)
+
+    def test_buffered_until_flush(self):
+        self.buffer.set_queued('transfer', 1)
+        self.buffer.set_status('deletion', 2, 'done', 0, '', 100, 200)
+        self.assertEqual(self.db.statements, [])
+
+        self.buffer.flush()
+        self.assertEqual(self.db.tasks['transfer'][1], 'queued')
+        self.assertEqual(self.db.tasks['deletion'][2], 'done')
+
+        # nothing left to write
+        num_statements = len(self.db.statements)
+        self.buffer.flush()
+        self.assertEqual(len(self.db.statements), num_statements)
+
+    def test_coalesce(self):
+        # repeated final states of a task are written as one row with the latest state
+        self.buffer.set_status('transfer', 3, 'failed', 5, 'first attempt', 100, 110)
+        self.buffer.set_status('transfer', 3, 'done', 0, '', 120, 130)
+        self.buffer.set_status('transfer', 4, 'cancelled', -1)
+        self.buffer.flush()
+
+        self.assertEqual(self.db.statements, [('update', 'transfer', [
+            (3, 'done', 0, '', datetime.datetime.fromtimestamp(120), datetime.datetime.fromtimestamp(130)),
+            (4, 'cancelled', -1, None, None, None)
+        ])])
+
+    def test_cycle_end(self):
+        # the daemon main loop: tasks queued in one cycle must not be new any more when the next cycle selects
+        for tid in range(5):
+            self.buffer.set_queued('transfer', tid)
+
+        self.buffer.set_status('transfer', 0, 'done', 0, '', 100, 200)
+
+        # end of the cycle
+        self.buffer.flush()
+
+        new_tasks = sorted(tid for tid, status in self.db.tasks['transfer'].iteritems() if status == 'new')
+        self.assertEqual(new_tasks, range(5, 10))
+        self.assertEqual(self.db.tasks['transfer'][0], 'done')
+
+        # queued transitions are written before the final states of the same flush
+        self.assertEqual([s[0] for s in self.db.statements], ['queued', 'update'])
+
+    def test_queued_conditional(self):
+        # the queued transition does not overwrite tasks that moved on in the meantime
+        self.db.tasks['deletion'][5] = 'cancelled'
+        self.buffer.set_queued('deletion', 5)
+        self.buffer.set_queued('deletion', 6)
+        self.buffer.flush()
+
+        self.assertEqual(self.db.tasks['deletion'][5], 'cancelled')
+        self.assertEqual(self.db.tasks['deletion'][6], 'queued')
+
+    def test_failed_flush(self):
+        # transitions that could not be written are kept; newer states of the same task take precedence
+        self.buffer.set_status('transfer', 7, 'failed', 5, 'error', 100, 110)
+        self.db.fail = True
+        self.assertRaises(RuntimeError, self.buffer.flush)
+
+        self.buffer.set_status('transfer', 8, 'done', 0, '', 100, 110)
+        self.db.fail = False
+        self.buffer.flush()
+
+        self.assertEqual(self.db.tasks['transfer'][7], 'failed')
+        self.assertEqual(self.db.tasks['transfer'][8], 'done')
+
+        self.db.fail = True
+        self.buffer.set_status('transfer', 9, 'failed', 5, 'error', 100, 110)
+        self.assertRaises(RuntimeError, self.buffer.flush)
+        self.buffer.set_status('transfer', 9, 'done', 0, '', 120, 130)
+        self.db.fail = False
+        self.buffer.flush()
+
+        self.assertEqual(self.db.tasks['transfer'][9], 'done')
+
+    def test_flush_size(self):
+        # the flusher thread writes as soon as flush_size transitions are buffered
+        self.buffer = TaskStatusBuffer(self.db, flush_size = 3, flush_interval = 3600000)
+        self.buffer.start()
+
+        try:
+            self.buffer.set_queued('transfer', 0)
+            self.buffer.set_queued('transfer', 1)
+            time.sleep(0.2)
+            self.assertEqual(self.db.statements, [])
+
+            self.buffer.set_queued('transfer', 2)
+            for _ in range(50):
+                if len(self.db.statements) != 0:
+                    break
+                time.sleep(0.1)
+
+            self.assertEqual(self.db.statements, [('queued', 'transfer', [0, 1, 2])])
+
+        finally:
+            self.buffer.stop()
+
+    def test_stop(self):
+        # stop() writes out everything that is still buffered
+        self.buffer.start()
+        self.buffer.set_status('deletion', 1, 'done', 0, '', 100, 200)
+        self.buffer.stop()
+
+        self.assertEqual(self.db.tasks['deletion'][1], 'done')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+#! /usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import dynamo.dataformat as df
+import dynamo.dataformat.serialization as serialization
+from dynamo.core.inventory import ObjectRepository, DynamoInventory, ReadOnlyInventoryProxy
+from dynamo.core.components.persistency import InventoryStore
+from dynamo.web.journal import UpdateJournal
+
+
+class LocalInventory(ObjectRepository):
+    # In-memory inventory that hands out store handles like DynamoInventory
+    def new_store_handle(self):
+        return InventoryStore(None)
+
+
+def update_commands(objects):
+    return [(DynamoInventory.CMD_UPDATE, serialization.pack(obj)) for obj in objects]
+
+
+class TestJournal(unittest.TestCase):
+    # Web server processes bring their inventory images up to date from the journal
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.journal = UpdateJournal(self.workdir + '/journal')
+        self.journal.reset()
+
+        self.inventory = LocalInventory()
+        self.inventory.has_store = False
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_read(self):
+        self.assertEqual(self.journal.read(), [])
+
+        first = update_commands([df.Site('T2_XX_Site1', sid = 1)])
+        second = update_commands([df.Site('T2_XX_Site%d' % i, sid = i) for i in range(2, 25)])
+
+        self.journal.append(first)
+        self.journal.append(second, chunk_size = 10)
+
+        self.assertEqual(self.journal.read(), first + second)
+        # commands are read once per process
+        self.assertEqual(self.journal.read(), [])
+
+    def test_apply(self):
+        dataset = df.Dataset('/A/B-v1/AOD', status = 'valid', did = 1)
+        self.journal.append(update_commands([df.Site('T2_XX_Site1', sid = 1), dataset]))
+
+        self.assertEqual(self.journal.apply(self.inventory), 2)
+        self.assertEqual(self.journal.apply(self.inventory), 0)
+        self.assertEqual(self.inventory.datasets['/A/B-v1/AOD'].status, df.Dataset.STAT_VALID)
+
+        self.journal.append([(DynamoInventory.CMD_DELETE, serialization.pack(dataset))])
+        # deletion of an object that is already gone is ignored
+        self.journal.append([(DynamoInventory.CMD_DELETE, serialization.pack(dataset))])
+
+        self.assertEqual(self.journal.apply(self.inventory), 2)
+        self.assertNotIn('/A/B-v1/AOD', self.inventory.datasets)
+        self.assertIn('T2_XX_Site1', self.inventory.sites)
+
+    def test_apply_before_fork(self):
+        # updates applied by the WSGI master before forking are not replayed by the child
+        self.journal.append(update_commands([df.Site('T2_XX_Site%d' % i, sid = i) for i in range(1, 11)]))
+        self.journal.apply(self.inventory)
+
+        self.journal.append(update_commands([df.Site('T2_XX_Site11', sid = 11)]))
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                num_applied = self.journal.apply(self.inventory)
+                ok = (num_applied == 1 and len(self.inventory.sites) == 11)
+            except:
+                ok = False
+
+            os._exit(0 if ok else 1)
+
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+
+    def test_failed_apply(self):
+        # a failed update leaves the position where it was so that the next call replays the commands
+        group = df.Group('AnalysisOps', gid = 1)
+        site = df.Site('T2_XX_Site1', sid = 1)
+        dataset = df.Dataset('/A/B-v1/AOD', did = 1)
+        replica = df.DatasetReplica(dataset, site, group = group)
+
+        # the group is not in the inventory
+        self.journal.append(update_commands([site, dataset, replica]))
+        self.assertRaises(Exception, self.journal.apply, self.inventory)
+
+        ObjectRepository.update(self.inventory, group)
+        self.assertEqual(self.journal.apply(self.inventory), 3)
+        self.assertEqual(len(list(self.inventory.sites['T2_XX_Site1'].dataset_replicas())), 1)
+
+
+class TestReadOnlyProxy(unittest.TestCase):
+    # What the inventory proxy of modules that are not write-enabled guarantees
+    def setUp(self):
+        self.original_store = df.Block.inventory_store
+
+        self.inventory = LocalInventory()
+        self.inventory.has_store = False
+        self.inventory.stat_cube = None
+
+        ObjectRepository.update(self.inventory, df.Site('T2_XX_Site1', sid = 1))
+        ObjectRepository.update(self.inventory, df.Dataset('/A/B-v1/AOD', status = 'valid', did = 1))
+
+        self.proxy = ReadOnlyInventoryProxy(self.inventory)
+
+    def tearDown(self):
+        df.Block.inventory_store = self.original_store
+
+    def test_blocked(self):
+        self.assertRaises(RuntimeError, self.proxy.update, df.Site('T2_XX_Site2', sid = 2))
+        self.assertRaises(RuntimeError, self.proxy.delete, self.proxy.sites['T2_XX_Site1'])
+        self.assertRaises(RuntimeError, self.proxy.register_update, self.proxy.sites['T2_XX_Site1'])
+
+        self.assertEqual(sorted(self.inventory.sites.keys()), ['T2_XX_Site1'])
+
+    def test_direct_modification(self):
+        # Direct changes to the objects are not prevented and would be seen by the following requests of the process.
+        # The web server retires the process after modules not marked side_effect_free (see test_webmodules.py).
+        self.proxy.datasets['/A/B-v1/AOD'].status = df.Dataset.STAT_INVALID
+        self.assertEqual(self.inventory.datasets['/A/B-v1/AOD'].status, df.Dataset.STAT_INVALID)
+
+        proxy = ReadOnlyInventoryProxy(self.inventory)
+        self.assertEqual(proxy.datasets['/A/B-v1/AOD'].status, df.Dataset.STAT_INVALID)
+
+
+if __name__ == '__main__':
+    unittest.main()
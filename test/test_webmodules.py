@@ -0,0 +1,147 @@
+#! /usr/bin/env python
+
+import random
+import unittest
+
+import dynamo.dataformat as df
+from dynamo.dataformat import Configuration
+from dynamo.core.inventory import ObjectRepository, ReadOnlyInventoryProxy
+from dynamo.core.components.persistency import InventoryStore
+from dynamo.web.jsonstream import iterencode
+from dynamo.web.modules._base import WebModule
+from dynamo.web.modules.inventory.datasets import ListDatasets
+from dynamo.web.modules.inventory.sites import ListSites
+from dynamo.web.modules.inventory.groups import ListGroups
+from dynamo.web.modules.inventory.nodes import NodesList
+from dynamo.web.modules.inventory.data import ListData
+from dynamo.web.modules.inventory.blockreplicas import ListBlockReplicas
+from dynamo.web.modules.inventory.subscriptions import SubscriptionsList
+from dynamo.web.modules.inventory.lfn2pfn import Lfn2PfnModule
+from dynamo.web.modules.inventory.stats import TotalSizeListing, ReplicationFactorListing, SiteUsageListing
+
+BLOCK = '00000001-0000-0000-0000-000000000000'
+
+class Partition(object):
+    def match(self, replica):
+        return True
+
+class LocalInventory(ObjectRepository):
+    # In-memory inventory that hands out store handles like DynamoInventory
+    def new_store_handle(self):
+        return InventoryStore(None)
+
+def make_inventory():
+    inventory = LocalInventory()
+    inventory.stat_cube = None
+
+    groups = [df.Group('AnalysisOps', 'Dataset', gid = 1), df.Group('DataOps', 'Block', gid = 2)]
+    for group in groups:
+        inventory.groups.add(group)
+
+    partition = df.Partition('AnalysisOps', Partition())
+    inventory.partitions.add(partition)
+
+    sites = []
+    for isite in range(4):
+        site = df.Site('T2_XX_Site%d' % isite, host = 'se%d.example.org' % isite, status = df.Site.STAT_READY, sid = isite + 1)
+        inventory.sites.add(site)
+        site.partitions[partition] = df.SitePartition(site, partition, 1.e+15)
+        sites.append(site)
+
+    for idataset in range(20):
+        dataset = df.Dataset('/Primary%d/Processed-v1/AODSIM' % idataset, status = df.Dataset.STAT_VALID, data_type = 'mc', did = idataset + 1)
+        inventory.datasets.add(dataset)
+
+        for iblock in range(3):
+            block = df.Block(df.Block.to_internal_name('%08x-0000-0000-0000-%012x' % (idataset + 1, iblock)), dataset, size = 3000, num_files = 3, bid = idataset * 10 + iblock + 1)
+            block._files = set(df.File('/store/data/%d/%d/file%d.root' % (idataset, iblock, ifile), block, size = 1000, checksum = (ifile, '%08x' % ifile), fid = block.id * 10 + ifile) for ifile in range(3))
+            dataset.blocks.add(block)
+
+        for site in random.sample(sites, 2):
+            replica = df.DatasetReplica(dataset, site, growing = True, group = groups[0])
+            for block in dataset.blocks:
+                if random.random() < 0.3:
+                    file_ids = (block.id * 10,)
+                    size = 1000
+                else:
+                    file_ids = None
+                    size = -1
+
+                block_replica = df.BlockReplica(block, site, random.choice(groups), size = size, last_update = 1500000000, file_ids = file_ids)
+                replica.block_replicas.add(block_replica)
+                block.replicas.add(block_replica)
+
+            dataset.replicas.add(replica)
+            site.add_dataset_replica(replica, add_block_replicas = True)
+
+    return inventory
+
+def dump(inventory):
+    content = []
+    for group in sorted(inventory.groups.itervalues(), key = lambda g: g.name):
+        content.append(repr(group))
+
+    for site in sorted(inventory.sites.itervalues(), key = lambda s: s.name):
+        content.append(repr(site))
+        content.append(sorted(r.dataset.name for r in site.dataset_replicas()))
+        for partition, sitepartition in sorted(site.partitions.iteritems(), key = lambda (p, sp): p.name):
+            content.append((partition.name, sitepartition.quota, sitepartition.occupancy_fraction(), sitepartition.occupancy_fraction(physical = False)))
+
+    for dataset in sorted(inventory.datasets.itervalues(), key = lambda d: d.name):
+        content.append(repr(dataset))
+        for block in sorted(dataset.blocks, key = lambda b: b.name):
+            content.append((repr(block), sorted(f.lfn for f in block.files)))
+
+        for replica in sorted(dataset.replicas, key = lambda r: r.site.name):
+            content.append((repr(replica), sorted(repr(br) for br in replica.block_replicas)))
+
+    return content
+
+
+class TestSideEffectFree(unittest.TestCase):
+    # Web server processes keep serving requests after the modules marked side_effect_free;
+    # these must leave the inventory image unchanged.
+    REQUESTS = [
+        (ListDatasets, [{'dataset': '/Primary1*/*/*'}, {'dataset': '/Primary2/Processed-v1/AODSIM'}]),
+        (ListSites, [{}, {'site': 'T2_XX_Site1,T2_*', 'partition': 'Analysis*'}]),
+        (ListGroups, [{}, {'group': 'Data*'}]),
+        (NodesList, [{'node': 'T2_*'}, {'node': 'T2_XX_Site2'}]),
+        (ListData, [{'block': '/Primary1/Processed-v1/AODSIM#' + BLOCK}]),
+        (ListBlockReplicas, [{'dataset': '/Primary*/*/*'}, {'block': '/Primary0/Processed-v1/AODSIM#*', 'node': 'T2_*', 'complete': 'n', 'group': 'DataOps'}]),
+        (SubscriptionsList, [{'dataset': '/Primary1*/*/*'}, {'block': '/Primary2/Processed-v1/AODSIM#*', 'node': 'T2_XX_Site*'}]),
+        (Lfn2PfnModule, [{'protocol': 'gfal2', 'node': 'T2_*', 'lfn': '/store/data/file.root'}]),
+        (TotalSizeListing, [{'list_by': 'data_type'}, {'list_by': 'site', 'physical': 'n'}]),
+        (ReplicationFactorListing, [{'list_by': 'group'}]),
+        (SiteUsageListing, [{'list_by': 'group'}, {'list_by': 'dataset_status', 'site': 'T2_XX_Site1'}])
+    ]
+
+    def setUp(self):
+        random.seed(12345)
+        self.original_store = df.Block.inventory_store
+
+        self.inventory = make_inventory()
+
+    def tearDown(self):
+        df.Block.inventory_store = self.original_store
+
+    def test_unchanged(self):
+        reference = dump(self.inventory)
+
+        for cls, requests in TestSideEffectFree.REQUESTS:
+            module = cls(Configuration())
+            self.assertTrue(module.side_effect_free, cls.__name__)
+            self.assertFalse(module.write_enabled, cls.__name__)
+
+            for request in requests:
+                # responses are fully written out, consuming any generator
+                content = ''.join(iterencode(module.run(None, dict(request), ReadOnlyInventoryProxy(self.inventory))))
+                self.assertNotEqual(content, '')
+                self.assertEqual(dump(self.inventory), reference, (cls.__name__, request))
+
+    def test_default(self):
+        # modules are not side-effect-free unless marked
+        self.assertFalse(WebModule(Configuration()).side_effect_free)
+
+
+if __name__ == '__main__':
+    unittest.main()